@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# Purpose: 基准测试 10 万任务 DAG 解析后的节点内存占用（紧凑节点 vs 旧版 dict 节点）
+# Created: 2026-10-18
+#
+# 背景：TaskNode/StageNode 原为普通 dataclass（每实例一个 __dict__），
+# 文件 glob、验证命令每个任务各持一份字符串；执行时按描述遍历全部任务反查 stage_id。
+# 现在节点使用 __slots__，高重复字符串 intern，任务自带 stage_id，并建立全局索引。
+#
+# "旧版"一栏：把同一份解析结果复制成旧版结构（普通 dataclass、字符串不共享、无索引），
+# 与当前结构（含 (stage_id, task_id) 索引）对比每任务常驻内存。
+#
+# 用法：
+#   python _scratch/bench_node_memory.py            # 默认 100k 任务
+#   python _scratch/bench_node_memory.py 20000      # 自定义任务数
+
+import gc
+import sys
+import time
+import tempfile
+import tracemalloc
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from dag_parser import DAGParser
+from ref_resolver import RefResolver
+
+TASKS_PER_STAGE = 50
+
+
+@dataclass
+class LegacyTaskNode:
+    """旧版任务节点结构（普通 dataclass，无 stage_id）"""
+    task_id: int
+    description: str
+    files: List[str]
+    excludes: List[str]
+    verify_cmd: str
+    source_file: str = ""
+    line_start: int = 0
+    line_end: int = 0
+    refs: List[str] = field(default_factory=list)
+
+
+@dataclass
+class LegacyStageNode:
+    """旧版阶段节点结构"""
+    stage_id: int
+    name: str
+    mode: str
+    max_workers: int
+    tasks: List[LegacyTaskNode]
+    description: str = ""
+    source_file: str = ""
+    line_start: int = 0
+    line_end: int = 0
+    refs: List[str] = field(default_factory=list)
+
+
+def write_dag(path: Path, task_count: int):
+    """生成合成 DAG：每任务独立模块目录 + 公共类型文件、公共排除目录、统一验证命令"""
+    lines = ["# 内存基准 DAG", "", "> **项目宏观目标**：节点内存基准", ""]
+    for i in range(task_count):
+        if i % TASKS_PER_STAGE == 0:
+            stage = i // TASKS_PER_STAGE
+            lines.append(f'## STAGE ## name="stage-{stage}" mode="parallel" max_workers="4"')
+            lines.append(f"# 🎯 阶段目标：处理第 {stage} 组模块")
+            lines.append("")
+        lines.append("## TASK ##")
+        lines.append(f"重构模块 module_{i}")
+        lines.append(f"文件: src/modules/module_{i}/**/*.ts, src/common/types.ts")
+        lines.append("排除: src/common/legacy/")
+        lines.append("验证: npm test -- --silent")
+        lines.append("")
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+
+def _fresh(s: str) -> str:
+    """复制出一个不共享的字符串对象（模拟旧版每任务各持一份）"""
+    return s.encode("utf-8").decode("utf-8")
+
+
+def _fresh_int(n: int) -> int:
+    """复制出一个不共享的 int 对象（行号与解析结果一样各持一份）"""
+    return int(str(n))
+
+
+def to_legacy(stages) -> List[LegacyStageNode]:
+    return [
+        LegacyStageNode(
+            stage_id=stage.stage_id, name=stage.name, mode=stage.mode, max_workers=stage.max_workers,
+            tasks=[
+                LegacyTaskNode(
+                    task_id=task.task_id,
+                    description=_fresh(task.description),
+                    files=[_fresh(f) for f in task.files],
+                    excludes=[_fresh(e) for e in task.excludes],
+                    verify_cmd=_fresh(task.verify_cmd),
+                    source_file=task.source_file,
+                    line_start=_fresh_int(task.line_start),
+                    line_end=_fresh_int(task.line_end),
+                )
+                for task in stage.tasks
+            ],
+            description=stage.description, source_file=stage.source_file,
+            line_start=stage.line_start, line_end=stage.line_end,
+        )
+        for stage in stages
+    ]
+
+
+def measure(build) -> int:
+    """测量 build() 返回对象的常驻内存（字节）"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def main():
+    task_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with tempfile.TemporaryDirectory() as td:
+        path = Path(td) / "dag.md"
+        write_dag(path, task_count)
+        resolver = RefResolver()
+        resolver.read_lines(path.resolve())  # 预热：文件内容缓存不计入节点内存
+
+        def parse_current():
+            parser = DAGParser(str(path), resolver=resolver)
+            stages = parser.parse()
+            return stages, parser.task_index
+
+        stages, task_index = parse_current()
+        legacy_bytes = measure(lambda: to_legacy(stages))
+        current_bytes = measure(parse_current)
+
+        # 查找耗时：旧版按描述遍历全部任务反查 stage_id，新版读 task.stage_id 后查全局索引
+        sample = [t for s in stages for t in s.tasks][::max(1, task_count // 100)]
+        start = time.perf_counter()
+        for task in sample:
+            next(s.stage_id for s in stages for t in s.tasks
+                 if t.task_id == task.task_id and t.description == task.description)
+        legacy_lookup = (time.perf_counter() - start) / len(sample)
+        rounds = 1000
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for task in sample:
+                task_index[(task.stage_id, task.task_id)]
+        current_lookup = (time.perf_counter() - start) / (len(sample) * rounds)
+
+    print(f"任务数: {task_count}")
+    print(f"{'':>14} {'总内存(MiB)':>12} {'每任务(B)':>10}")
+    print("─" * 40)
+    print(f"{'旧版节点':>12} {legacy_bytes / 2**20:>12.1f} {legacy_bytes / task_count:>10.0f}")
+    print(f"{'紧凑节点+索引':>8} {current_bytes / 2**20:>12.1f} {current_bytes / task_count:>10.0f}")
+    print()
+    print(f"任务查找: 旧版 {legacy_lookup * 1e3:.2f} ms/次 → 新版 {current_lookup * 1e9:.0f} ns/次")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# Purpose: 基准测试 DAGParser.parse 的耗时随任务数线性增长
+# Created: 2026-10-18
+#
+# 背景：parse 改为单遍逐行扫描后，耗时应与任务数成正比（每任务耗时基本恒定）。
+# 旧实现对整段内容多次 re.split + 字符串切片，大 DAG 下开销明显。
+#
+# 用法：
+#   python _scratch/bench_parse_scaling.py                 # 默认 1k/5k/10k/50k 任务
+#   python _scratch/bench_parse_scaling.py 1000 20000      # 自定义任务数
+
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from dag_parser import DAGParser
+
+TASKS_PER_STAGE = 50
+REPEAT = 3
+
+
+def write_dag(path: Path, task_count: int):
+    """生成包含 task_count 个任务的合成 DAG 文件"""
+    lines = ["# 基准测试 DAG", "", "> **项目宏观目标**：解析器性能基准", ""]
+    for i in range(task_count):
+        if i % TASKS_PER_STAGE == 0:
+            stage = i // TASKS_PER_STAGE
+            lines.append(f'## STAGE ## name="stage-{stage}" mode="parallel" max_workers="4"')
+            lines.append(f"# 🎯 阶段目标：处理第 {stage} 组模块")
+            lines.append("")
+        lines.append("## TASK ##")
+        lines.append(f"重构模块 module_{i}")
+        lines.append("")
+        lines.append(f"**目标**：统一 module_{i} 的错误处理")
+        lines.append("")
+        lines.append(f"文件: src/modules/module_{i}/**/*.ts")
+        lines.append("排除: src/common/")
+        lines.append(f"验证: npm test -- module_{i}")
+        lines.append("")
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+
+def time_parse(path: Path) -> float:
+    """多次解析取最优耗时（秒）"""
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        DAGParser(str(path)).parse()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [1000, 5000, 10000, 50000]
+
+    print(f"{'任务数':>10} {'耗时(ms)':>12} {'每任务(µs)':>12} {'相对首行':>10}")
+    print("─" * 48)
+
+    base_per_task = None
+    with tempfile.TemporaryDirectory() as td:
+        for n in sizes:
+            path = Path(td) / f"dag-{n}.md"
+            write_dag(path, n)
+            elapsed = time_parse(path)
+            per_task = elapsed / n * 1e6
+            if base_per_task is None:
+                base_per_task = per_task
+            ratio = per_task / base_per_task
+            print(f"{n:>10} {elapsed * 1000:>12.1f} {per_task:>12.2f} {ratio:>9.2f}x")
+
+    print()
+    print("线性扩展：每任务耗时（µs）在各规模下应基本恒定（相对首行 ≈ 1.0x）")
+
+
+if __name__ == "__main__":
+    main()
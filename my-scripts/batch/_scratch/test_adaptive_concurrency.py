@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试自适应并发（--adaptive AIMD 并发上限 + --launch-rate 令牌桶启动限速）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) 加性增：成功且耗时稳定、并发用满时上限 +1；耗时突增或未用满时不增加
+#   (2) 乘性减：限流/过载输出时上限减半，同一轮只减一次，其他失败不影响
+#   (3) 令牌桶：突发容量用完后按速率等待，随时间补充
+#   (4) run_bounded：并发不超过控制器当前上限，限流后降速，启动限速生效
+#   (5) DAGScheduler / DAGExecutor：阶段上限与共享上限取小，--dry-run 与结束报告
+
+import asyncio
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from adaptive_concurrency import AdaptiveConcurrency, is_rate_limited
+from async_engine import run_bounded
+from batch_executor_base import TaskResult
+from dag_executor import DAGExecutor
+from dag_parser import DAGParser
+from dag_scheduler import DAGScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def finish(control: AdaptiveConcurrency, clock: FakeClock, duration: float, success: bool = True, error: str = "",
+           elapsed: float = None):
+    clock.now += duration if elapsed is None else elapsed
+    control.on_finish(success, duration, error)
+
+
+def run_test_increase(tmp_dir: Path):
+    """场景 1: 加性增"""
+    print("\n=== 测试 1: 加性增 ===")
+    clock = FakeClock()
+    control = AdaptiveConcurrency(clock=clock)
+    assert control.limit(1) == 1 and control.limit(8) == 2
+
+    # 上限 2 时每 2 个用满并发的稳定成功 +1，上限 3 时每 3 个
+    in_flight = [0]
+
+    def step(duration: float):
+        finish(control, clock, duration)
+        in_flight[0] -= 1
+        while in_flight[0] < control.limit(8):
+            control.on_launch()
+            in_flight[0] += 1
+
+    for _ in range(2):
+        control.on_launch()
+        in_flight[0] += 1
+    for _ in range(5):
+        step(10)
+    assert control.limit(8) == 4, control.history
+    assert [limit for _, limit, _ in control.history] == [2, 3, 4]
+
+    # 耗时突增（超过平均耗时 2 倍）不计入
+    for _ in range(2):
+        step(100)
+    assert control.limit(8) == 4
+
+    # 已达调用方（阶段）上限时不再增加
+    assert control.limit(4) == 4
+    for _ in range(8):
+        finish(control, clock, 10)
+        control.on_launch()
+    assert control.limit(8) == 4 and len(control.history) == 3
+
+    # 并发未用满：瓶颈不在并发，上限不增加
+    idle = AdaptiveConcurrency(clock=clock)
+    for _ in range(10):
+        idle.on_launch()
+        finish(idle, clock, 10)
+    assert idle.limit(8) == 2 and len(idle.history) == 1
+    print("  ✅ 并发用满且耗时稳定时每完成「上限」个任务 +1，耗时突增或并发未用满时保持")
+
+
+def run_test_decrease(tmp_dir: Path):
+    """场景 2: 乘性减"""
+    print("\n=== 测试 2: 乘性减 ===")
+    assert is_rate_limited("API Error: 429 Too Many Requests") and is_rate_limited("Overloaded")
+    assert is_rate_limited("error: rate_limit_error") and not is_rate_limited("AssertionError: 4290 行")
+    assert not is_rate_limited("") and not is_rate_limited("SyntaxError")
+
+    clock = FakeClock()
+    control = AdaptiveConcurrency(start=8, clock=clock)
+    for _ in range(8):
+        control.on_launch()
+    # 同一轮启动的 3 个任务依次限流：只减一次
+    for _ in range(3):
+        finish(control, clock, 5, success=False, error="HTTP 429: rate limit exceeded", elapsed=0.1)
+    assert control.limit(16) == 4 and control.rate_limited == 3
+    finish(control, clock, 5, success=False, error="测试失败", elapsed=0.1)
+    assert control.limit(16) == 4
+
+    # 降速之后启动的任务再限流：继续减半，最低为 1
+    for _ in range(3):
+        control.on_launch()
+        finish(control, clock, 1, success=False, error="529 overloaded_error")
+    assert control.limit(16) == 1
+    result = TaskResult(task_id=1, command="cc", success=False, duration=0.5, output="Claude AI usage limit reached")
+    control.on_launch()
+    clock.now += 1
+    control.record_result(result)
+    assert control.rate_limited == 7
+    assert [reason for _, _, reason in control.history] == ["起始", "限流", "限流", "限流"]
+    print("  ✅ 限流/过载（stderr 或 stdout）上限减半，同一轮只减一次，普通失败不影响，最低 1")
+
+
+def run_test_token_bucket(tmp_dir: Path):
+    """场景 3: 令牌桶"""
+    print("\n=== 测试 3: 令牌桶 ===")
+    clock = FakeClock()
+    control = AdaptiveConcurrency(launch_rate=60, adaptive=False, clock=clock)
+    assert control.limit(5) == 5  # 只限速时并发取调用方上限
+    delays = [control.on_launch() for _ in range(12)]
+    assert delays[:10] == [0.0] * 10 and delays[10:] == [1.0, 2.0], delays
+    clock.now += 5  # 补充 5 个令牌，抵掉 2 个欠账
+    assert [control.on_launch() for _ in range(4)] == [0.0, 0.0, 0.0, 1.0]
+    assert control.throttled == 3 and control.throttle_wait == 4.0
+    assert control.report() == ["⏱️  启动限速: 每分钟 60 次，共启动 16 次，等待 3 次共 4.0s"]
+    assert AdaptiveConcurrency(launch_rate=3, clock=clock).on_launch() == 0.0  # 容量至少 1
+    print("  ✅ 突发容量 10 秒配额，之后按速率排队等待，随时间补充")
+
+
+def run_test_engine(tmp_dir: Path):
+    """场景 4: run_bounded 按控制器并发"""
+    print("\n=== 测试 4: run_bounded ===")
+    control = AdaptiveConcurrency()
+    running, violations, peak = [0], [], [0]
+
+    def job(index: int, error: str = ""):
+        async def run():
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            if running[0] > control.limit(4):
+                violations.append((index, running[0]))
+            await asyncio.sleep(0.02)
+            running[0] -= 1
+            return TaskResult(task_id=index, command="", success=not error, duration=0.02, error_msg=error)
+        return run
+
+    def on_done(index, result, error):
+        control.record_result(result)
+
+    run_bounded([job(i) for i in range(30)], 4, on_done, limiter=control)
+    assert not violations and peak[0] == 4 and control.limit(4) == 4, (violations, peak, control.history)
+    assert [limit for _, limit, _ in control.history] == [2, 3, 4]
+
+    # 一批同时限流：只减半一次，之后的任务按新上限运行
+    peak[0] = 0
+    run_bounded([job(i, "429 Too Many Requests") for i in range(4)], 4, on_done, limiter=control)
+    assert control.limit(4) == 2 and not violations
+
+    limited = AdaptiveConcurrency(launch_rate=240, adaptive=False)
+    start = time.time()
+    run_bounded([job(i) for i in range(42)], 8, lambda *a: None, limiter=limited)
+    assert limited.throttled == 2 and time.time() - start >= 0.45 and limited.launches == 42
+    print("  ✅ 并发始终不超过控制器当前上限，逐步增至阶段上限，限流后减半；超出突发容量的启动按速率等待")
+
+
+DAG = """# 自适应
+
+## STAGE ## name="dev" mode="parallel" max_workers="3"
+
+{dev}
+## STAGE ## name="wide" mode="parallel" max_workers="6"
+
+{wide}"""
+
+
+def run_test_scheduler(tmp_dir: Path):
+    """场景 5: 调度器与执行器"""
+    print("\n=== 测试 5: DAGScheduler / DAGExecutor ===")
+    tasks = lambda count: "".join(f"## TASK ##\n任务 {i}\n文件: f{i}.py\n\n" for i in range(count))
+    Path("dag.md").write_text(DAG.format(dev=tasks(12), wide=tasks(40)), encoding="utf-8")
+    stages = DAGParser("dag.md").parse()
+
+    control = AdaptiveConcurrency(start=5)
+    lock, active, peaks = threading.Lock(), [0], {0: 0, 1: 0}
+
+    def runner(task):
+        stage_id = next(s.stage_id for s in stages if task in s.tasks)
+        with lock:
+            active[0] += 1
+            peaks[stage_id] = max(peaks[stage_id], active[0])
+        time.sleep(0.01 * (1 + task.task_id % 4))  # 错开完成时间
+        with lock:
+            active[0] -= 1
+        return TaskResult(task_id=task.task_id, command="", success=True, duration=0.02)
+
+    assert DAGScheduler(stages[:1], concurrency=control).run(runner)
+    assert peaks[0] == 3 and control.limit(6) == 5  # 阶段上限 3：并发未用满共享上限，不增加
+    assert DAGScheduler(stages[1:], concurrency=control).run(runner)
+    assert peaks[1] == 6 and control.limit(6) == 6, (peaks, control.history)
+
+    # 调度器把失败结果（含异常，耗时由调度器计时）交给控制器：同时运行的 3 个任务限流只减一次
+    def flaky(task):
+        raise RuntimeError("overloaded_error")
+    assert not DAGScheduler(stages[:1], concurrency=control).run(flaky)
+    assert control.limit(6) == 3 and control.rate_limited == 3, control.history
+
+    output = io.StringIO()
+    with redirect_stdout(output):
+        executor = DAGExecutor("dag.md", lambda t: True, use_state=False, use_plan_cache=False,
+                               barrier_free=True, concurrency=AdaptiveConcurrency(launch_rate=600))
+        executor.print_plan()
+        assert executor.execute(task_runner=lambda task, goal, context, refs: runner(task))
+    text = output.getvalue()
+    assert "并发控制: 自适应 AIMD（起始 2" in text and "每分钟最多启动 600 个 agent" in text, text
+    assert "📈 自适应并发: 起始 2 → 最终 6（范围 2-6）" in text and "   时间线: 0s=2, 0s=3" in text, text
+    assert "⏱️  启动限速: 每分钟 600 次，共启动 52 次，等待 0 次" in text, text
+    print("  ✅ 各阶段并发 = min(共享上限, max_workers)，上限跨阶段延续；--dry-run 显示并发控制，结束时输出时间线")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_increase(tmp_dir)
+            run_test_decrease(tmp_dir)
+            run_test_token_bucket(tmp_dir)
+            run_test_engine(tmp_dir)
+            run_test_scheduler(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
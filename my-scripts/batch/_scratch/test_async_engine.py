@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试异步执行引擎（一个事件循环并发运行 agent 子进程，替代 ProcessPoolExecutor）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) run_process：参数列表 / shell 字符串，成功与失败输出，大量输出不阻塞
+#   (2) 超时：保留已输出内容，连同子进程组一起终止
+#   (3) run_bounded：并发上限、完成回调在调用线程按完成顺序执行、job 异常转交回调
+#   (4) 回调中 KeyboardInterrupt：其余任务取消，子进程被终止
+#   (5) execute_dag_batch_parallel / execute_parallel 走真实子进程：TaskResult 契约与 per-task 状态落盘
+
+import asyncio
+import json
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+import async_engine
+import batchcc
+from async_engine import run_process, run_bounded
+from dag_parser import TaskNode, StageNode
+from state_manager import StateManager
+
+PY = sys.executable
+
+
+def alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # 已退出但未回收的僵尸进程同样视为已终止
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().split(") ")[1][0] != "Z"
+    except OSError:
+        return True
+
+
+class ScriptExecutor(batchcc.ClaudeCodeBatchExecutor):
+    """测试用子类：cc 命令替换为本地 Python 脚本（描述即脚本），其余流程不变"""
+
+    def process_command(self, command, automation_prefix=None):
+        if not command.startswith("cc '"):
+            return super().process_command(command, automation_prefix)
+        return [PY, "-c", command[4:-1]]
+
+    def _auto_commit_if_needed(self, task_description, task_id=None, task=None):
+        self.committed.append((task_id, threading.current_thread() is threading.main_thread()))
+
+
+def run_test_process(tmp_dir: Path):
+    """场景 1: run_process"""
+    print("\n=== 测试 1: run_process ===")
+    result = asyncio.run(run_process([PY, "-c", "import sys; print('out'); print('err', file=sys.stderr)"], "."))
+    assert (result.returncode, result.stdout, result.stderr, result.timed_out) == (0, "out\n", "err\n", False)
+    result = asyncio.run(run_process("echo 中文 && exit 3", str(tmp_dir)))
+    assert result.returncode == 3 and result.stdout == "中文\n"
+    result = asyncio.run(run_process([PY, "-c", "import sys; sys.stdout.write('x' * 3000000); "
+                                                "sys.stderr.write('y' * 3000000)"], ".", timeout=30))
+    assert len(result.stdout) == len(result.stderr) == 3000000
+    print("  ✅ 参数列表与 shell 字符串均可执行，stdout/stderr 各 3MB 同时输出不阻塞")
+
+
+def run_test_timeout(tmp_dir: Path):
+    """场景 2: 超时终止进程组"""
+    print("\n=== 测试 2: 超时 ===")
+    script = ("import subprocess, sys, time; p = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)']);"
+              "print(p.pid, flush=True); time.sleep(60)")
+    start = time.time()
+    result = asyncio.run(run_process([PY, "-c", script], ".", timeout=1))
+    assert result.timed_out and result.returncode is None and time.time() - start < 10
+    grandchild = int(result.stdout)
+    time.sleep(0.2)
+    assert not alive(grandchild), "agent 启动的子进程应随进程组一起终止"
+
+    original = async_engine.KILL_GRACE
+    async_engine.KILL_GRACE = 0.5
+    try:
+        ignore = "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); print('up', flush=True); time.sleep(60)"
+        result = asyncio.run(run_process([PY, "-c", ignore], ".", timeout=1))
+        assert result.timed_out and result.stdout == "up\n" and time.time() - start < 10
+    finally:
+        async_engine.KILL_GRACE = original
+    print("  ✅ 超时后 SIGTERM 进程组（孙进程一并结束），忽略 SIGTERM 时 SIGKILL，保留已输出内容")
+
+
+def run_test_bounded(tmp_dir: Path):
+    """场景 3: 并发上限与回调"""
+    print("\n=== 测试 3: run_bounded ===")
+    running, peak, events = [0], [0], []
+
+    def job(index: int):
+        async def run():
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await run_process([PY, "-c", f"import time; time.sleep({0.3 - index * 0.03})"], ".")
+            running[0] -= 1
+            if index == 5:
+                raise RuntimeError("boom")
+            return index * 10
+        return run
+
+    def on_done(index, result, error):
+        assert threading.current_thread() is threading.main_thread()
+        events.append((index, result, str(error) if error else None))
+
+    start = time.time()
+    run_bounded([job(i) for i in range(8)], 3, on_done)
+    assert peak[0] == 3 and len(events) == 8, (peak, events)
+    assert (5, None, "boom") in events and (7, 70, None) in events
+    assert time.time() - start < 2.5
+    run_bounded([], 3, on_done)
+    print(f"  ✅ 8 个子进程至多 3 个同时运行，主线程按完成顺序回调，job 异常转交回调")
+
+
+def run_test_interrupt(tmp_dir: Path):
+    """场景 4: 回调中断"""
+    print("\n=== 测试 4: 中断 ===")
+    pid_file = tmp_dir / "pids"
+    script = f"import os, time; open({str(pid_file)!r}, 'a').write(f'{{os.getpid()}}\\n'); time.sleep(60)"
+
+    async def first():
+        while len(pid_file.read_text().split()) < 2:
+            await asyncio.sleep(0.05)  # 等其余子进程都已启动
+        return 0
+
+    def job(index: int):
+        return first if index == 0 else lambda: run_process([PY, "-c", script], ".")
+
+    def on_done(index, result, error):
+        raise KeyboardInterrupt()
+
+    pid_file.write_text("")
+    start = time.time()
+    try:
+        run_bounded([job(i) for i in range(5)], 3, on_done)
+    except KeyboardInterrupt:
+        pass
+    else:
+        raise AssertionError("应抛出 KeyboardInterrupt")
+    pids = [int(pid) for pid in pid_file.read_text().split()]
+    assert len(pids) == 2 and not any(alive(pid) for pid in pids) and time.time() - start < 10, pids
+
+    # Ctrl+C：batchcc 的信号处理器在事件循环中抛出 KeyboardInterrupt
+    pid_file.write_text("")
+    timer = threading.Timer(1.0, os.kill, (os.getpid(), signal.SIGINT))
+    timer.start()
+    start = time.time()
+    try:
+        run_bounded([lambda: run_process([PY, "-c", script], ".") for _ in range(4)], 2, lambda *a: None)
+    except KeyboardInterrupt:
+        pass
+    else:
+        raise AssertionError("应抛出 KeyboardInterrupt")
+    finally:
+        batchcc._interrupted = False
+    pids = [int(pid) for pid in pid_file.read_text().split()]
+    assert len(pids) == 2 and not any(alive(pid) for pid in pids) and time.time() - start < 10, pids
+    print("  ✅ KeyboardInterrupt（回调或 Ctrl+C）取消排队中的任务，运行中的子进程全部终止，异常抛给调用方")
+
+
+def run_test_executor(tmp_dir: Path):
+    """场景 5: 执行器集成"""
+    print("\n=== 测试 5: execute_dag_batch_parallel / execute_parallel ===")
+    task_file = tmp_dir / "dag.md"
+    task_file.write_text("# 引擎\n", encoding="utf-8")
+    scripts = ['print("一")', 'import sys; sys.exit("失败了")', 'import time; time.sleep(0.2); print("三")']
+    tasks = [TaskNode(task_id=i, description=script, files=[], excludes=[], verify_cmd="")
+             for i, script in enumerate(scripts, 1)]
+    sm = StateManager(str(task_file))
+    sm.init_stages([StageNode(stage_id=0, name="s", mode="parallel", max_workers=3, tasks=tasks)])
+
+    executor = ScriptExecutor()
+    executor.committed = []
+    executor.set_state_manager(sm, stage_id=0)
+    results = executor.execute_dag_batch_parallel(tasks, max_workers=3)
+    assert [(r.task_id, r.success, r.output, r.error_msg) for r in results] == [
+        (1, True, "一\n", ""), (2, False, "", "失败了\n"), (3, True, "三\n", "")]
+    assert all(r.duration > 0 and r.command.startswith("cc '") for r in results)
+    assert executor.committed == [(1, True), (3, True)]
+    with open(sm.state_file) as f:
+        states = {t["task_id"]: t for t in json.load(f)["stages"][0]["tasks"]}
+    assert [states[i]["status"] for i in (1, 2, 3)] == ["completed", "failed", "completed"], states
+    assert "失败了" in states[2]["error"]
+
+    results = executor.execute_parallel([f"echo {i}" for i in range(5)], str(tmp_dir), 2)
+    assert [(r.task_id, r.output) for r in results] == [(i + 1, f"{i}\n") for i in range(5)]
+    result = executor.execute_command_parallel((9, executor.build_command("print(9)"), str(tmp_dir)))
+    assert result.success and result.output == "9\n"
+    print("  ✅ TaskResult 字段与原进程池一致，完成即落盘 + 主线程提交；简单模式和同步调用同样可用")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_process(tmp_dir)
+            run_test_timeout(tmp_dir)
+            run_test_bounded(tmp_dir)
+            run_test_interrupt(tmp_dir)
+            run_test_executor(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试并行阶段的无批次屏障执行（--no-barrier：文件范围锁 + 调度器）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) 下一批次的任务在与它冲突的任务结束后立即启动，不等待本批次的慢任务
+#   (2) 冲突任务从不同时运行（随机冲突图），并发不超过 max_workers 且能跑满
+#   (3) 状态落盘：失败即停止，续跑时跳过已完成任务
+#   (4) 未提供 task_runner 时退回分批执行
+
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import threading
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from dag_parser import StageNode, TaskNode
+from dag_scheduler import DAGScheduler, PathLocks
+from dag_executor import DAGExecutor
+from batch_executor_base import TaskResult
+
+
+DAG_CONTENT = """# 无屏障测试
+
+## STAGE ## name="dev" mode="parallel" max_workers="2"
+
+## TASK ##
+慢任务
+文件: src/a/**
+
+## TASK ##
+快任务
+文件: src/b/**
+
+## TASK ##
+依赖快任务的文件
+文件: src/b/util.py
+
+## STAGE ## name="review" mode="serial"
+
+## TASK ##
+审视
+文件: src/**
+"""
+
+
+def write(path: str, content: str):
+    Path(path).write_text(content, encoding="utf-8")
+
+
+class Runner:
+    """记录启动/结束顺序与并发峰值的假 task_runner"""
+
+    def __init__(self, durations=None, fail=()):
+        self.durations = durations or {}
+        self.fail = set(fail)
+        self.events = []
+        self.running = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def serial(self, task):
+        """串行阶段的 task_executor"""
+        self.events.append(("start", task.description))
+        return True
+
+    def __call__(self, task, global_goal, stage_context, context_refs):
+        with self.lock:
+            self.events.append(("start", task.description))
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(self.durations.get(task.description, 0.01))
+        with self.lock:
+            self.running -= 1
+            self.events.append(("end", task.description))
+        return TaskResult(task_id=task.task_id, command="", success=task.description not in self.fail, duration=0)
+
+
+def run_test_no_barrier(tmp_dir: Path):
+    """场景 1: 不等待本批次的慢任务"""
+    print("\n=== 测试 1: 无批次屏障 ===")
+    write("dag.md", DAG_CONTENT)
+    runner = Runner({"慢任务": 0.6, "快任务": 0.05})
+    executor = DAGExecutor("dag.md", runner.serial, use_state=False, use_plan_cache=False, barrier_free=True)
+    executor.parse()
+    assert len(executor._get_stage_layout(executor.stages[0])[1]) == 2
+
+    assert executor.execute(task_runner=runner)
+    events = runner.events
+    assert events.index(("start", "依赖快任务的文件")) > events.index(("end", "快任务"))
+    assert events.index(("start", "依赖快任务的文件")) < events.index(("end", "慢任务")), events
+    assert events.index(("start", "审视")) > events.index(("end", "慢任务")), events  # 阶段之间仍有屏障
+    print("  ✅ 冲突任务结束即启动下一任务，慢任务不再拖住整个批次")
+
+
+def run_test_locks(tmp_dir: Path):
+    """场景 2: 冲突任务不同时运行，并发用满"""
+    print("\n=== 测试 2: 文件范围锁 ===")
+    rng = random.Random(16)
+    for _ in range(20):
+        count = rng.randint(4, 14)
+        tasks = [TaskNode(task_id=i, description=f"Task {i}", files=[f"f{i}"], excludes=[], verify_cmd="",
+                          stage_id=0) for i in range(1, count + 1)]
+        conflicts = {}
+        for a in range(1, count + 1):
+            later = [b for b in range(a + 1, count + 1) if rng.random() < 0.25]
+            if later:
+                conflicts[a] = later
+        stage = StageNode(stage_id=0, name="s", mode="parallel", max_workers=3, tasks=tasks)
+        running, overlaps, peak, lock = set(), [], [0], threading.Lock()
+
+        def runner(task):
+            with lock:
+                overlaps.extend((task.task_id, other) for other in running
+                                if other in conflicts.get(task.task_id, []) or task.task_id in conflicts.get(other, []))
+                running.add(task.task_id)
+                peak[0] = max(peak[0], len(running))
+            time.sleep(rng.random() * 0.005)
+            with lock:
+                running.discard(task.task_id)
+            return True
+
+        scheduler = DAGScheduler([stage], max_total_workers=3, locks=PathLocks({0: conflicts}))
+        assert scheduler.run(runner) and not overlaps, overlaps
+        assert peak[0] <= 3
+
+    stage = StageNode(stage_id=0, name="s", mode="parallel", max_workers=3, tasks=[
+        TaskNode(task_id=i, description=f"Task {i}", files=[], excludes=[], verify_cmd="", stage_id=0)
+        for i in range(1, 7)])
+    peak, running, lock = [0], [0], threading.Lock()
+
+    def busy(task):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return True
+
+    assert DAGScheduler([stage], max_total_workers=3, locks=PathLocks({})).run(busy) and peak[0] == 3
+    print("  ✅ 20 组随机冲突图中冲突任务从未同时运行，无冲突时并发跑满 max_workers")
+
+
+def run_test_state(tmp_dir: Path):
+    """场景 3: 状态落盘与续跑"""
+    print("\n=== 测试 3: 状态持久化与续跑 ===")
+    write("dag.md", DAG_CONTENT)
+    runner = Runner(fail={"依赖快任务的文件"})
+    assert not DAGExecutor("dag.md", runner.serial, use_plan_cache=False, barrier_free=True).execute(
+        task_runner=runner)
+    state = json.loads(Path("dag.md.state.json").read_text(encoding="utf-8"))
+    statuses = [[t["status"] for t in s["tasks"]] for s in state["stages"]]
+    assert statuses == [["completed", "completed", "failed"], ["pending"]], statuses
+
+    runner = Runner()
+    assert DAGExecutor("dag.md", runner.serial, use_plan_cache=False, barrier_free=True).execute(
+        task_runner=runner)
+    started = [name for kind, name in runner.events if kind == "start"]
+    assert started == ["依赖快任务的文件", "审视"], started
+    print("  ✅ 任务状态落盘，续跑只执行未完成任务")
+
+
+def run_test_fallback(tmp_dir: Path):
+    """场景 4: 没有 task_runner 时按批次执行"""
+    print("\n=== 测试 4: 退回分批执行 ===")
+    write("dag.md", DAG_CONTENT)
+    calls = []
+    executor = DAGExecutor("dag.md", lambda t: calls.append(t.description) or True, use_state=False,
+                           use_plan_cache=False, barrier_free=True)
+    assert executor.execute()
+    assert calls == ["慢任务", "快任务", "依赖快任务的文件", "审视"], calls
+    print("  ✅ 未提供 task_runner 时仍按批次逐个执行")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_no_barrier(tmp_dir)
+            run_test_locks(tmp_dir)
+            run_test_state(tmp_dir)
+            run_test_fallback(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试 create_batches 的冲突图着色（最少批次 + 均衡 + 确定性）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) 合法性：批次内任务两两不冲突，每个任务恰好出现一次
+#   (2) 最少批次：小图与穷举求得的色数一致（含首次适配贪心会多用批次的皇冠图）
+#   (3) 均衡：批次数相同的前提下按任务数/权重均衡
+#   (4) 确定性：不同 PYTHONHASHSEED 下结果相同
+#   (5) 规模：2000 任务、大团 + 稀疏冲突时快速完成
+#   (6) DAGExecutor：有运行历史或 --critical-path 耗时估计时按预计耗时均衡批次
+
+import itertools
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from dag_parser import ConflictDetector, TaskNode
+from dag_executor import DAGExecutor
+from conflict_coloring import color_batches
+from run_history import RunHistory
+
+
+def make_tasks(count: int):
+    return [TaskNode(task_id=i, description=f"Task {i}", files=[], excludes=[], verify_cmd="")
+            for i in range(1, count + 1)]
+
+
+def check_valid(task_ids, conflicts, batches):
+    flat = [task_id for batch in batches for task_id in batch]
+    assert sorted(flat) == sorted(task_ids), batches
+    for batch in batches:
+        members = set(batch)
+        for task_id in batch:
+            assert not members.intersection(conflicts.get(task_id, [])), (task_id, batch)
+
+
+def chromatic_number(count: int, edges) -> int:
+    for colors in range(1, count + 1):
+        for assignment in itertools.product(range(colors), repeat=count):
+            if all(assignment[a - 1] != assignment[b - 1] for a, b in edges):
+                return colors
+    return count
+
+
+def to_conflicts(edges):
+    conflicts = {}
+    for a, b in edges:
+        conflicts.setdefault(min(a, b), []).append(max(a, b))
+    return conflicts
+
+
+def run_test_optimal(tmp_dir: Path):
+    """场景 1/2: 合法且批次最少"""
+    print("\n=== 测试 1: 最少批次 ===")
+    # 皇冠图：i 与 j' 冲突（i != j），按 1,1',2,2',... 顺序首次适配需要 4 批，最优为 2 批
+    crown = [(2 * i + 1, 2 * j + 2) for i in range(4) for j in range(4) if i != j]
+    batches = color_batches(list(range(1, 9)), to_conflicts(crown))
+    check_valid(list(range(1, 9)), to_conflicts(crown), batches)
+    assert batches == [[1, 3, 5, 7], [2, 4, 6, 8]], batches
+
+    rng = random.Random(15)
+    for _ in range(150):
+        count = rng.randint(2, 7)
+        edges = [pair for pair in itertools.combinations(range(1, count + 1), 2) if rng.random() < 0.5]
+        conflicts = to_conflicts(edges)
+        batches = color_batches(list(range(1, count + 1)), conflicts)
+        check_valid(list(range(1, count + 1)), conflicts, batches)
+        assert len(batches) == chromatic_number(count, edges), (edges, batches)
+    print("  ✅ 皇冠图 2 批；150 个随机小图的批次数等于色数")
+
+
+def run_test_balance(tmp_dir: Path):
+    """场景 3: 均衡"""
+    print("\n=== 测试 3: 均衡 ===")
+    tasks = make_tasks(8)
+    batches = ConflictDetector.create_batches(tasks, {1: [2]})
+    assert [[t.task_id for t in batch] for batch in batches] == [[1, 3, 5, 7], [2, 4, 6, 8]], batches
+
+    weights = {1: 10.0, 2: 1.0, 3: 1.0, 4: 1.0, 5: 1.0, 6: 1.0, 7: 1.0, 8: 1.0}
+    batches = color_batches(list(range(1, 9)), {1: [2]}, weights)
+    assert batches == [[1], [2, 3, 4, 5, 6, 7, 8]], batches
+    assert ConflictDetector.create_batches(tasks, {}) == [tasks]
+    print("  ✅ 无权重时按任务数均衡，有权重时按权重均衡")
+
+
+def run_test_deterministic(tmp_dir: Path):
+    """场景 4: 与哈希顺序无关"""
+    print("\n=== 测试 4: 确定性 ===")
+    script = ("import sys, random; sys.path.insert(0, %r)\n"
+              "from conflict_coloring import color_batches\n"
+              "rng = random.Random(4)\n"
+              "ids = [f'task-{i}' for i in range(60)]\n"
+              "conflicts = {a: [b for b in ids if b != a and rng.random() < 0.1] for a in ids}\n"
+              "print(color_batches(ids, conflicts))\n") % str(BATCH_DIR)
+    outputs = {subprocess.run([sys.executable, "-c", script], capture_output=True, text=True,
+                              env={**os.environ, "PYTHONHASHSEED": seed}).stdout for seed in ("1", "2", "3")}
+    assert len(outputs) == 1 and outputs.pop().startswith("[["), outputs
+    print("  ✅ 3 个哈希种子下批次完全相同")
+
+
+def run_test_scale(tmp_dir: Path):
+    """场景 5: 规模"""
+    print("\n=== 测试 5: 2000 任务 ===")
+    rng = random.Random(5)
+    ids = list(range(1, 2001))
+    conflicts = {i: [j for j in range(i + 1, 31)] for i in range(1, 31)}  # 30 个任务的团
+    for i in range(31, 2001):
+        conflicts.setdefault(i, []).extend(rng.sample(range(i + 1, 2002), 2) if i < 1990 else [])
+    conflicts = {k: [j for j in v if j <= 2000] for k, v in conflicts.items()}
+    start = time.perf_counter()
+    batches = color_batches(ids, conflicts)
+    elapsed = time.perf_counter() - start
+    check_valid(ids, conflicts, batches)
+    assert len(batches) == 30 and elapsed < 5, (len(batches), elapsed)
+    sizes = [len(batch) for batch in batches]
+    assert max(sizes) - min(sizes) <= 2, sizes
+    print(f"  ✅ 团大小 30 → 30 批，批次大小 {min(sizes)}~{max(sizes)}，耗时 {elapsed * 1000:.0f}ms")
+
+
+def run_test_executor_weights(tmp_dir: Path):
+    """场景 6: 执行器按预计耗时分批"""
+    print("\n=== 测试 6: DAGExecutor 按预计耗时均衡 ===")
+    task_dir = tmp_dir / ".task-weights"
+    task_dir.mkdir()
+    dag = "# 权重\n\n## STAGE ## name=\"dev\" mode=\"parallel\" max_workers=\"8\"\n"
+    for i in range(1, 9):
+        dag += f"\n## TASK ##\n任务 {i}\n文件: {'shared.py' if i <= 2 else f'f{i}.py'}\n"
+    (task_dir / "dag.md").write_text(dag, encoding="utf-8")
+    entry = str(task_dir / "dag.md")
+
+    def layout(**kwargs):
+        executor = DAGExecutor(entry, lambda t: True, use_state=False, use_plan_cache=False, **kwargs)
+        executor.parse()
+        return [[task.task_id for task in batch] for batch in executor._get_stage_layout(executor.stages[0])[1]]
+
+    assert layout() == [[1, 3, 5, 7], [2, 4, 6, 8]]
+    history = RunHistory(path=str(tmp_dir / "history.jsonl"))
+    assert layout(run_history=history) == [[1, 3, 5, 7], [2, 4, 6, 8]], "没有记录时按任务数均衡"
+
+    parsed = DAGExecutor(entry, lambda t: True, use_state=False, use_plan_cache=False)
+    parsed.parse()
+    for task in parsed.stages[0].tasks:
+        history.record(task, "dev", "completed", 1000 if task.task_id == 1 else 10)
+    assert layout(run_history=history) == [[1], [2, 3, 4, 5, 6, 7, 8]]
+    assert layout(run_history=history, critical_path=True) == [[1], [2, 3, 4, 5, 6, 7, 8]]
+    print("  ✅ 任务 1 历史耗时 1000s：单独一批，其余任务集中到另一批（默认按任务数 4+4）")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_optimal(tmp_dir)
+            run_test_balance(tmp_dir)
+            run_test_deterministic(tmp_dir)
+            run_test_scale(tmp_dir)
+            run_test_executor_weights(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试 ConflictDetector 路径前缀树实现与逐对比较结果一致
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) 典型用例：同目录通配、父子目录、相似前缀（src/user vs src/user-profile）、精确路径、排除
+#   (2) 随机用例：与逐对调用 _has_conflict 的结果逐字节一致（含空目录、绝对路径、尾部 /、// 等边界）
+#   (3) 规模：2000 任务的阶段无需两两比较，耗时远低于逐对比较
+
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from dag_parser import ConflictDetector, TaskNode
+
+
+def make_task(task_id: int, files, excludes=()) -> TaskNode:
+    return TaskNode(task_id=task_id, description=f"Task {task_id}", files=list(files), excludes=list(excludes),
+                    verify_cmd="")
+
+
+def pairwise(tasks):
+    """原实现：任务两两比较"""
+    conflicts = {}
+    for i, task_a in enumerate(tasks):
+        conflicting = [task_b.task_id for j, task_b in enumerate(tasks)
+                       if i < j and ConflictDetector._has_conflict(task_a, task_b)]
+        if conflicting:
+            conflicts[task_a.task_id] = conflicting
+    return conflicts
+
+
+def run_test_cases(tmp_dir: Path):
+    """场景 1: 典型用例"""
+    print("\n=== 测试 1: 典型用例 ===")
+    tasks = [
+        make_task(1, ["src/modules/**/*.ts"]),
+        make_task(2, ["src/modules/**/*.js"]),  # 同目录通配 → 与 1 冲突
+        make_task(3, ["src/modules/user/index.ts"]),  # 在 1/2 的目录下 → 冲突
+        make_task(4, ["src/user/**"]),
+        make_task(5, ["src/user-profile/**"]),  # 相似前缀 → 不冲突
+        make_task(6, ["docs/a.md"]),
+        make_task(7, ["docs/a.md", "docs/b.md"]),  # 相同精确路径 → 与 6 冲突
+        make_task(8, ["docs/a.md/"]),  # 字面不同的精确路径 → 不冲突
+        make_task(9, ["src/**"], excludes=["src/"]),  # 全部被排除 → 不冲突
+        make_task(10, ["src/user/**", "src/user-profile/**"], excludes=["src/user"]),  # 只剩 user-profile
+    ]
+    expected = {1: [2, 3], 2: [3], 5: [10], 6: [7]}
+    assert ConflictDetector.detect_conflicts(tasks) == expected == pairwise(tasks), \
+        ConflictDetector.detect_conflicts(tasks)
+    assert ConflictDetector.detect_conflicts([]) == {}
+    print("  ✅ 通配/父子目录/相似前缀/精确路径/排除规则与原实现一致")
+
+
+def random_pattern(rng: random.Random) -> str:
+    parts = [rng.choice(["src", "lib", "a", "a-b", ""]) for _ in range(rng.randint(0, 3))]
+    path = "/".join(parts)
+    tail = rng.choice(["", "/", "/**", "/*.ts", "*", "**/*.py", "/x.ts", "/x.ts/"])
+    return rng.choice(["", "/"]) + path + tail
+
+
+def run_test_random(tmp_dir: Path):
+    """场景 2: 随机用例与原实现一致"""
+    print("\n=== 测试 2: 随机用例 ===")
+    rng = random.Random(13)
+    for _ in range(400):
+        tasks = [make_task(i, [random_pattern(rng) for _ in range(rng.randint(0, 3))],
+                           [random_pattern(rng) for _ in range(rng.randint(0, 1))])
+                 for i in range(1, rng.randint(2, 25))]
+        rng.shuffle(tasks)  # 任务序号不必与顺序一致
+        expected = pairwise(tasks)
+        actual = ConflictDetector.detect_conflicts(tasks)
+        assert actual == expected and list(actual) == list(expected), ([t.files for t in tasks], actual, expected)
+    print("  ✅ 400 组随机任务（含边界路径）结果与键顺序完全一致")
+
+
+def run_test_scale(tmp_dir: Path):
+    """场景 3: 大阶段不做两两比较"""
+    print("\n=== 测试 3: 2000 任务阶段 ===")
+    tasks = [make_task(i, [f"src/mod_{i}/**/*.ts", f"tests/mod_{i}/case.spec.ts"] +
+                       (["src/common/shared.ts"] if i % 10 == 0 else []))
+             for i in range(1, 2001)]
+    start = time.perf_counter()
+    conflicts = ConflictDetector.detect_conflicts(tasks)
+    trie_time = time.perf_counter() - start
+    assert len(conflicts) == 199 and conflicts[10][:2] == [20, 30], len(conflicts)
+
+    sample = tasks[:400]
+    start = time.perf_counter()
+    assert pairwise(sample) == ConflictDetector.detect_conflicts(sample)
+    pairwise_time = time.perf_counter() - start
+    assert trie_time < pairwise_time, (trie_time, pairwise_time)
+    print(f"  ✅ 2000 任务 {trie_time * 1000:.1f}ms（逐对比较 400 任务已需 {pairwise_time * 1000:.1f}ms）")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_cases(tmp_dir)
+            run_test_random(tmp_dir)
+            run_test_scale(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试 DAGBuilder 编程构建接口（不经过 markdown 解析）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) 构建结果与解析同等内容的 dag.md 完全一致（阶段、任务、文件范围、depends_on、矩阵模板）
+#   (2) 流式添加：从生成器逐个消费任务，支持描述字符串和参数 dict
+#   (3) 错误：未调用 stage() 添加任务、mode/max_workers 不合法、depends_on 引用不存在、循环依赖
+#   (4) DAGExecutor.from_builder + StateManager：失败后重新构建同样的计划，已完成任务跳过
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from dag_builder import DAGBuilder
+from dag_parser import DAGParser
+from dag_executor import DAGExecutor
+from state_manager import StateManager
+
+
+DAG = """# 迁移服务
+
+## STAGE ## name="init" mode="serial"
+
+## TASK ## id="scaffold"
+生成脚手架
+文件: tools/**, Makefile
+验证: make check
+
+## STAGE ## name="port" mode="parallel" max_workers="4"
+
+## TASK ## depends_on="init.scaffold"
+迁移 auth
+文件: services/auth/**
+排除: services/auth/vendor/
+
+## TASK ## id="billing" depends_on="init.scaffold"
+迁移 billing
+文件: services/billing/**
+
+## TASK ## matrix="lang=go,py" depends_on="billing"
+生成 {lang} 客户端
+文件: clients/{lang}/**
+"""
+
+
+def build_plan() -> DAGBuilder:
+    builder = DAGBuilder(goal="迁移服务")
+    builder.stage("init", "serial").task("生成脚手架", files="tools/**, Makefile", verify="make check", id="scaffold")
+    builder.stage("port", "parallel", max_workers=4)
+    builder.task("迁移 auth", files=["services/auth/**"], excludes=["services/auth/vendor/"],
+                 depends_on="init.scaffold")
+    builder.task("迁移 billing", files=["services/billing/**"], id="billing", depends_on=["init.scaffold"])
+    builder.task("生成 {lang} 客户端", files=["clients/{lang}/**"], matrix="lang=go,py", depends_on="billing")
+    return builder
+
+
+def comparable(stages):
+    """去掉只有解析器才有的来源位置"""
+    result = []
+    for stage in stages:
+        data = stage.to_dict()
+        for node in [data] + data["tasks"]:
+            for key in ("source_file", "line_start", "line_end"):
+                node.pop(key)
+        result.append(data)
+    return result
+
+
+def run_test_equivalent(tmp_dir: Path):
+    """场景 1: 与解析 dag.md 的结果一致"""
+    print("\n=== 测试 1: 与 markdown 解析结果一致 ===")
+    Path("dag.md").write_text(DAG, encoding="utf-8")
+    parser = DAGParser("dag.md")
+    parsed = parser.parse()
+    builder = build_plan()
+    built = builder.build()
+
+    assert builder.global_goal == parser.global_goal
+    assert comparable(built) == comparable(parsed), (comparable(built), comparable(parsed))
+    port = built[1]
+    assert len(port.tasks) == 4 and [t.description for t in port.tasks][2:] == ["生成 go 客户端", "生成 py 客户端"]
+    assert port.tasks[3].depends_on == [(1, 2)] and port.tasks[0].depends_on == [(0, 1)]
+    assert built[0].tasks[0].files == ["tools/**", "Makefile"]
+    print("  ✅ 阶段、任务、depends_on、矩阵展开与解析结果一致")
+
+
+def run_test_streaming(tmp_dir: Path):
+    """场景 2: 从生成器流式添加"""
+    print("\n=== 测试 2: 流式添加 ===")
+    consumed = []
+
+    def generate():
+        for i in range(1, 1001):
+            consumed.append(i)
+            yield {"description": f"处理模块 {i}", "files": f"pkg/m{i}/**"} if i % 2 else f"检查模块 {i}"
+
+    builder = DAGBuilder().stage("bulk", max_workers=8)
+    builder.tasks(generate())
+    builder.stage("after", "sequential").tasks(["汇总"])
+    stages = builder.build()
+
+    assert consumed == list(range(1, 1001))
+    assert len(stages[0].tasks) == 1000 and stages[0].tasks[-1].task_id == 1000
+    assert stages[0].tasks[0].files == ["pkg/m1/**"] and stages[0].tasks[1].description == "检查模块 2"
+    assert stages[1].mode == "serial" and stages[1].tasks[0].stage_id == 1
+    print("  ✅ 1000 个任务逐个消费，字符串与 dict 均可，sequential 归一为 serial")
+
+
+def run_test_errors(tmp_dir: Path):
+    """场景 3: 构建错误"""
+    print("\n=== 测试 3: 构建错误 ===")
+    cases = [
+        (lambda: DAGBuilder().task("孤儿任务"), "需要先调用 stage()"),
+        (lambda: DAGBuilder().stage("x", "fanout"), "mode 必须是"),
+        (lambda: DAGBuilder().stage("x", max_workers=0), "max_workers 必须是正整数"),
+        (lambda: DAGBuilder().build(), "未找到任何 STAGE 定义"),
+        (lambda: DAGBuilder().stage("x").task("a", depends_on="ghost").build(), "ghost"),
+        (lambda: DAGBuilder().stage("x").task("a", id="a", depends_on="b").task("b", id="b", depends_on="a").build(),
+         "循环依赖"),
+        (lambda: DAGBuilder().stage("x").task("a", matrix="lang"), "matrix"),
+    ]
+    for build, fragment in cases:
+        try:
+            build()
+            raise AssertionError(f"未报错: {fragment}")
+        except ValueError as e:
+            assert fragment in str(e), e
+    print("  ✅ 缺少 stage、参数不合法、引用不存在、循环依赖、矩阵格式错误均报错")
+
+
+def run_test_execute_resume(tmp_dir: Path):
+    """场景 4: from_builder + StateManager 断点续传"""
+    print("\n=== 测试 4: 执行与断点续传 ===")
+    task_file = str(tmp_dir / ".task-build" / "dag.md")
+    executed = []
+
+    def run(fail_on: str):
+        state = StateManager(task_file)
+
+        def task_executor(task):
+            executed.append(task.description)
+            success = task.description != fail_on
+            state.complete_task(task.stage_id, task.task_id, success)
+            return success
+
+        executor = DAGExecutor.from_builder(build_plan(), task_executor, state_manager=state)
+        assert executor.state_manager is state and executor.use_state
+        return executor.execute()
+
+    assert not run(fail_on="生成 py 客户端")
+    assert Path(task_file).parent.joinpath("state.json").exists()
+    first = list(executed)
+    executed.clear()
+    assert run(fail_on="")
+    assert executed == ["生成 py 客户端"], (first, executed)
+    assert not Path(task_file).parent.exists()  # 成功后清理任务目录
+    print("  ✅ 不需要 dag.md，重新构建后只执行未完成任务，成功后清理")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_equivalent(tmp_dir)
+            run_test_streaming(tmp_dir)
+            run_test_errors(tmp_dir)
+            run_test_execute_resume(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试 DAGParser 单遍逐行解析（字段提取、@文件引用展开、来源位置）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) STAGE/TASK 字段、描述、宏观目标提取与旧版多次 split 实现一致
+#   (2) @文件引用 中的 TASK 记录引用文件自身的文件名和行号
+#   (3) 参数缺失时报错信息带 file:line
+#   (4) 任务回填 stage_id，(stage_id, task_id) 全局索引
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from dag_parser import DAGParser
+
+
+DAG_CONTENT = """# 测试项目
+
+> **项目宏观目标**：验证解析器
+
+## STAGE ## name="init" mode="sequential"
+# 🎯 阶段目标：初始化
+
+## TASK ##
+创建目录
+文件: src/a/**/*.ts, src/b.ts
+排除: src/a/x/
+验证: npm test
+
+## TASK ##:
+@spec.md
+
+## STAGE ##
+name="dev" mode="parallel" max_workers="3"
+
+## TASK ## 内联描述
+文件: src/c/**
+"""
+
+SPEC_CONTENT = """引用的任务描述
+文件: docs/**
+
+## TASK ##
+引用文件里的任务
+"""
+
+
+def run_test_fields(tmp_dir: Path):
+    """场景 1: 字段、描述、宏观目标提取"""
+    print("\n=== 测试 1: 字段提取 ===")
+    parser = DAGParser("dag.md")
+    stages = parser.parse()
+
+    assert parser.global_goal == "测试项目\n> **项目宏观目标**：验证解析器", parser.global_goal
+    assert [s.name for s in stages] == ["init", "dev"]
+    assert stages[0].mode == "serial", "sequential 应转换为 serial"
+    assert stages[0].description == "🎯 阶段目标：初始化"
+    assert stages[1].max_workers == 3
+
+    task = stages[0].tasks[0]
+    assert task.description == "创建目录"
+    assert task.files == ["src/a/**/*.ts", "src/b.ts"]
+    assert task.excludes == ["src/a/x/"]
+    assert task.verify_cmd == "npm test"
+
+    assert [t.description for t in stages[0].tasks] == ["创建目录", "引用的任务描述", "引用文件里的任务"]
+    assert stages[0].tasks[1].files == ["docs/**"]
+    assert stages[1].tasks[0].description == "内联描述"
+
+    # stage_id 回填 + 全局索引
+    assert [t.stage_id for s in stages for t in s.tasks] == [0, 0, 0, 1]
+    assert parser.task_index[(1, 1)] is stages[1].tasks[0]
+    assert len(parser.task_index) == 4
+    print("  ✅ 字段提取正确")
+
+
+def run_test_locations(tmp_dir: Path):
+    """场景 2: 来源文件和行号"""
+    print("\n=== 测试 2: 来源位置 ===")
+    stages = DAGParser("dag.md").parse()
+
+    assert stages[0].location == "dag.md:5-15", stages[0].location
+    assert stages[0].tasks[0].location == "dag.md:8-12", stages[0].tasks[0].location
+    # TASK 标记在 dag.md，正文来自 spec.md：行范围只统计同一文件
+    assert stages[0].tasks[1].location == "dag.md:14-15", stages[0].tasks[1].location
+    # 引用文件中的 TASK 记录引用文件自身位置
+    assert stages[0].tasks[2].location == "spec.md:4-5", stages[0].tasks[2].location
+    assert stages[1].tasks[0].location == "dag.md:20-21", stages[1].tasks[0].location
+    print("  ✅ 来源位置正确")
+
+
+def run_test_error_location(tmp_dir: Path):
+    """场景 3: 报错信息带位置"""
+    print("\n=== 测试 3: 报错位置 ===")
+    Path("bad.md").write_text('\n## STAGE ## mode="serial"\n## TASK ##\nx\n', encoding="utf-8")
+    try:
+        DAGParser("bad.md").parse()
+    except ValueError as e:
+        assert str(e) == "bad.md:2: 缺少必需参数: name", str(e)
+    else:
+        raise AssertionError("期望 ValueError")
+    print("  ✅ 报错信息包含 file:line")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        Path("dag.md").write_text(DAG_CONTENT, encoding="utf-8")
+        Path("spec.md").write_text(SPEC_CONTENT, encoding="utf-8")
+        try:
+            run_test_fields(tmp_dir)
+            run_test_locations(tmp_dir)
+            run_test_error_location(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试任务级依赖（id/depends_on 解析、就绪队列调度、并发与冲突约束、断点续传）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) depends_on 按 阶段名/序号 + 任务 id/序号 解析，引用错误和循环依赖报错
+#   (2) 下游任务在自己的前置任务完成后立即启动，不等待上一阶段的慢任务
+#   (3) 阶段 max_workers 和文件冲突规则在调度器中仍然生效
+#   (4) 失败即停止：失败任务的下游不再启动
+#   (5) DAGExecutor + task_runner：状态落盘，已完成任务续跑时跳过
+
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from dag_parser import DAGParser
+from dag_scheduler import DAGScheduler
+from dag_executor import DAGExecutor
+from batch_executor_base import TaskResult
+
+
+DAG_CONTENT = """# 依赖测试
+
+## STAGE ## name="build" mode="parallel" max_workers="2"
+
+## TASK ## id="fast"
+快任务
+文件: src/a/**
+
+## TASK ## id="slow"
+慢任务
+文件: src/b/**
+
+## STAGE ## name="use" mode="parallel" max_workers="2"
+
+## TASK ## depends_on="build.fast"
+依赖快任务
+文件: src/c/**
+
+## TASK ##
+无依赖声明（等待 build 整体完成）
+文件: src/d/**
+"""
+
+
+def write(path: str, content: str):
+    Path(path).write_text(content, encoding="utf-8")
+
+
+class Recorder:
+    """记录任务启动/结束顺序与并发峰值的假执行器"""
+
+    def __init__(self, durations=None, fail=()):
+        self.durations = durations or {}
+        self.fail = set(fail)
+        self.events = []
+        self.running = {}
+        self.peak = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, task):
+        with self.lock:
+            self.events.append(("start", task.description))
+            self.running[task.stage_id] = self.running.get(task.stage_id, 0) + 1
+            self.peak[task.stage_id] = max(self.peak.get(task.stage_id, 0), self.running[task.stage_id])
+        time.sleep(self.durations.get(task.description, 0.01))
+        with self.lock:
+            self.running[task.stage_id] -= 1
+            self.events.append(("end", task.description))
+        return task.description not in self.fail
+
+
+def run_test_parse(tmp_dir: Path):
+    """场景 1: depends_on 解析与报错"""
+    print("\n=== 测试 1: depends_on 解析 ===")
+    write("dag.md", DAG_CONTENT)
+    stages = DAGParser("dag.md").parse()
+    assert stages[0].tasks[0].id == "fast"
+    assert stages[0].tasks[0].description == "快任务", "标记行参数不应进入描述"
+    assert stages[1].tasks[0].depends_on == [(0, 1)], stages[1].tasks[0].depends_on
+    assert stages[1].tasks[1].depends_on == []
+
+    write("num.md", '## STAGE ## name="a" mode="serial"\n## TASK ##\nx\n'
+                    '## STAGE ## name="b" mode="parallel"\n## TASK ## depends_on="1.1, 2" 内联\n## TASK ##\ny\n')
+    stages = DAGParser("num.md").parse()
+    assert stages[1].tasks[0].depends_on == [(0, 1), (1, 2)], stages[1].tasks[0].depends_on
+    assert stages[1].tasks[0].description == "内联"
+
+    cases = [
+        ('## STAGE ## name="a" mode="serial"\n## TASK ## depends_on="a.nope"\nx\n', "depends_on 引用的任务不存在: a.nope"),
+        ('## STAGE ## name="a" mode="parallel"\n## TASK ## id="x" depends_on="x"\nx\n', "depends_on 不能依赖自身: x"),
+        ('## STAGE ## name="a" mode="parallel"\n## TASK ## id="x" depends_on="b.y"\nx\n'
+         '## STAGE ## name="b" mode="parallel"\n## TASK ## id="y"\ny\n', "depends_on 存在循环依赖"),
+    ]
+    for content, expected in cases:
+        write("bad.md", content)
+        try:
+            DAGParser("bad.md").parse()
+        except ValueError as e:
+            assert expected in str(e), str(e)
+        else:
+            raise AssertionError(f"期望 ValueError: {expected}")
+    print("  ✅ 解析正确，引用错误/自依赖/循环依赖均报错")
+
+
+def run_test_early_start(tmp_dir: Path):
+    """场景 2: 下游任务不等待上一阶段的慢任务"""
+    print("\n=== 测试 2: 依赖满足即启动 ===")
+    write("dag.md", DAG_CONTENT)
+    stages = DAGParser("dag.md").parse()
+    recorder = Recorder(durations={"慢任务": 0.3})
+    assert DAGScheduler(stages).run(recorder)
+
+    order = recorder.events
+    assert order.index(("start", "依赖快任务")) < order.index(("end", "慢任务")), order
+    assert order.index(("start", "无依赖声明（等待 build 整体完成）")) > order.index(("end", "慢任务")), order
+    print("  ✅ depends_on 任务提前启动，未声明依赖的任务仍等待阶段完成")
+
+
+def run_test_limits(tmp_dir: Path):
+    """场景 3: max_workers 和文件冲突"""
+    print("\n=== 测试 3: 并发与冲突约束 ===")
+    tasks = "".join(f"## TASK ##\nt{i}\n文件: src/m{i}/**\n" for i in range(6))
+    write("limit.md", '## STAGE ## name="root" mode="serial"\n## TASK ## id="r"\nroot\n'
+                      f'## STAGE ## name="p" mode="parallel" max_workers="2"\n{tasks}'
+                      '## STAGE ## name="q" mode="parallel" max_workers="4"\n'
+                      '## TASK ## depends_on="root.r"\nq1\n文件: src/shared.ts\n'
+                      '## TASK ## depends_on="root.r"\nq2\n文件: src/shared.ts\n')
+    stages = DAGParser("limit.md").parse()
+    recorder = Recorder(durations={f"t{i}": 0.05 for i in range(6)} | {"q1": 0.05, "q2": 0.05})
+    assert DAGScheduler(stages).run(recorder)
+
+    assert recorder.peak[1] == 2, recorder.peak
+    q_events = [e for e in recorder.events if e[1] in ("q1", "q2")]
+    assert q_events[1][0] == "end", f"q1/q2 文件冲突，不应同时运行: {q_events}"
+    print("  ✅ 阶段并发不超过 max_workers，冲突任务不同时运行")
+
+
+def run_test_failure(tmp_dir: Path):
+    """场景 4: 失败即停止"""
+    print("\n=== 测试 4: 失败即停止 ===")
+    write("dag.md", DAG_CONTENT)
+    stages = DAGParser("dag.md").parse()
+    recorder = Recorder(fail={"快任务"})
+    assert not DAGScheduler(stages).run(recorder)
+    started = {name for kind, name in recorder.events if kind == "start"}
+    assert "依赖快任务" not in started, recorder.events
+    print("  ✅ 失败后下游任务不再启动")
+
+
+def run_test_executor_resume(tmp_dir: Path):
+    """场景 5: DAGExecutor + task_runner 状态持久化与续跑"""
+    print("\n=== 测试 5: 状态持久化与续跑 ===")
+    write("dag.md", DAG_CONTENT)
+    calls = []
+
+    def task_runner(task, global_goal, stage_context, context_refs):
+        calls.append(task.description)
+        assert stage_context.startswith(f"Stage: {['build', 'use'][task.stage_id]}"), stage_context
+        ok = task.description != "无依赖声明（等待 build 整体完成）" or len(calls) > 4
+        return TaskResult(task_id=task.task_id, command="", success=ok, duration=0)
+
+    executor = DAGExecutor("dag.md", lambda t: True, use_state=True, use_plan_cache=False)
+    assert not executor.execute(task_runner=task_runner)
+    state = json.loads(Path("dag.md.state.json").read_text(encoding="utf-8"))
+    statuses = [[t["status"] for t in s["tasks"]] for s in state["stages"]]
+    assert statuses == [["completed", "completed"], ["completed", "failed"]], statuses
+
+    calls.clear()
+    executor = DAGExecutor("dag.md", lambda t: True, use_state=True, use_plan_cache=False)
+    calls.extend(["占位"] * 4)  # 让第二次运行的失败任务成功
+    assert executor.execute(task_runner=task_runner)
+    assert calls[4:] == ["无依赖声明（等待 build 整体完成）"], calls
+    print("  ✅ 任务状态在主线程落盘，续跑只执行未完成任务")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_parse(tmp_dir)
+            run_test_early_start(tmp_dir)
+            run_test_limits(tmp_dir)
+            run_test_failure(tmp_dir)
+            run_test_executor_resume(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试精确冲突检测（--precise-conflicts：仓库文件索引 + 位集）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) glob 展开：**、*、?、[...]、目录路径、排除；结果为排序后文件下标的位集
+#   (2) 精确冲突：src/**/*.ts 与 src/**/*.py 不再冲突；共享文件、排除规则；与逐对求交集的参考实现一致
+#   (3) 索引中不存在的路径（新建文件）按启发式规则比较，不漏报
+#   (4) 文件索引缓存：HEAD 和 .git/index 不变时不再调用 git ls-files，暂存新文件后失效
+#   (5) DAGExecutor(precise_conflicts=True)：批次更少，执行计划缓存 key 随文件索引变化
+
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+import file_index as file_index_module
+from file_index import FileIndex, CACHE_FILE_NAME
+from dag_parser import ConflictDetector, TaskNode
+from dag_executor import DAGExecutor
+
+FILES = [
+    "src/api/handler.ts", "src/api/handler.py", "src/api/schema.ts", "src/core/util.ts", "src/core/util.py",
+    "src/core/deep/x.ts", "src/common/shared.ts", "docs/a.md", "docs/b.md", "Makefile",
+]
+
+DAG = """# 精确冲突
+
+## STAGE ## name="dev" mode="parallel" max_workers="4"
+
+## TASK ##
+迁移 TypeScript
+文件: src/**/*.ts
+排除: src/common/
+
+## TASK ##
+迁移 Python
+文件: src/**/*.py
+
+## TASK ##
+改公共模块
+文件: src/common/**
+
+## TASK ##
+改文档
+文件: docs/**
+"""
+
+
+def git(*args):
+    subprocess.run(["git", "-c", "user.name=t", "-c", "user.email=t@t", *args], check=True, capture_output=True)
+
+
+def make_task(task_id: int, files, excludes=()) -> TaskNode:
+    return TaskNode(task_id=task_id, description=f"Task {task_id}", files=list(files), excludes=list(excludes),
+                    verify_cmd="")
+
+
+def decode(index: FileIndex, bits: int):
+    return [path for i, path in enumerate(index.files) if bits >> i & 1]
+
+
+def run_test_glob(tmp_dir: Path):
+    """场景 1: glob 展开"""
+    print("\n=== 测试 1: glob 展开 ===")
+    for path in FILES:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text("x", encoding="utf-8")
+    git("init", "-q")
+    git("add", ".")
+    git("commit", "-q", "-m", "init")
+
+    index = FileIndex()
+    assert index.files == sorted(FILES) and index.signature
+    cases = {
+        "src/**/*.ts": ["src/api/handler.ts", "src/api/schema.ts", "src/common/shared.ts", "src/core/deep/x.ts",
+                        "src/core/util.ts"],
+        "src/*/util.*": ["src/core/util.py", "src/core/util.ts"],
+        "src/api/handler.?s": ["src/api/handler.ts"],
+        "src/api/[hs]*.ts": ["src/api/handler.ts", "src/api/schema.ts"],
+        "src/core/": ["src/core/deep/x.ts", "src/core/util.py", "src/core/util.ts"],
+        "./Makefile": ["Makefile"],
+        "**/*.md": ["docs/a.md", "docs/b.md"],
+        "src/*": [f for f in sorted(FILES) if f.startswith("src/")],  # 匹配到目录时包含其下所有文件
+        "src/core/util": [],
+    }
+    for pattern, expected in cases.items():
+        bits, resolved = index.pattern_bits(pattern)
+        assert decode(index, bits) == expected and resolved == bool(expected), (pattern, decode(index, bits))
+    bits, unresolved = index.task_bits(["src/core/**", "src/new.ts"], ["src/core/deep/"])
+    assert decode(index, bits) == ["src/core/util.py", "src/core/util.ts"] and unresolved == ["src/new.ts"]
+    print("  ✅ **、*、?、[...]、目录、排除展开正确，未匹配的模式单独返回")
+
+
+def run_test_precise(tmp_dir: Path):
+    """场景 2/3: 精确冲突"""
+    print("\n=== 测试 2: 精确冲突 ===")
+    index = FileIndex()
+    tasks = [
+        make_task(1, ["src/**/*.ts"]),
+        make_task(2, ["src/**/*.py"]),  # 与 1 不相交
+        make_task(3, ["src/common/shared.ts"]),  # 与 1 相交
+        make_task(4, ["src/api/**"], excludes=["src/api/handler.ts", "src/api/schema.ts"]),  # 只剩 handler.py
+        make_task(5, ["docs/**"]),
+        make_task(6, ["docs/c.md"]),  # 新建文件：启发式规则下与 docs/** 冲突
+        make_task(7, ["lib/new/**"]),  # 新目录：与所有人都不冲突
+    ]
+    assert ConflictDetector.detect_conflicts(tasks) == {1: [2, 3, 4], 2: [3, 4], 5: [6]}
+    assert ConflictDetector.detect_conflicts(tasks, index) == {1: [3], 2: [4], 5: [6]}
+    assert not ConflictDetector._has_conflict(tasks[0], tasks[1], index)
+    assert ConflictDetector._has_conflict(tasks[5], tasks[4], index)
+
+    rng = random.Random(14)
+    patterns = ["src/**", "src/**/*.ts", "src/**/*.py", "src/api/", "src/core/*.ts", "docs/*.md", "Makefile",
+                "src/common/shared.ts", "**/x.ts", "src/*/util.py"]
+    for _ in range(200):
+        sample = [make_task(i, rng.sample(patterns, rng.randint(1, 3)), rng.sample(patterns, rng.randint(0, 1)))
+                  for i in range(1, rng.randint(2, 15))]
+        expected = {}
+        for i, a in enumerate(sample):
+            bits_a = index.task_bits(a.files, a.excludes)[0]
+            later = [b.task_id for b in sample[i + 1:] if bits_a & index.task_bits(b.files, b.excludes)[0]]
+            if later:
+                expected[a.task_id] = later
+        assert ConflictDetector.detect_conflicts(sample, index) == expected
+    print("  ✅ 不相交的 glob 不再冲突；200 组随机任务与逐对求交集结果一致；新建文件按启发式规则不漏报")
+
+
+def run_test_cache(tmp_dir: Path):
+    """场景 4: 文件索引缓存"""
+    print("\n=== 测试 4: 文件索引缓存 ===")
+    calls = []
+    real_git = file_index_module._git
+
+    def counting_git(cwd, *args):
+        calls.append(args[0])
+        return real_git(cwd, *args)
+
+    file_index_module._git = counting_git
+    try:
+        first = FileIndex()
+        assert first.files and "ls-files" not in calls and Path(".git", CACHE_FILE_NAME).exists()
+
+        Path("src/new.ts").write_text("x", encoding="utf-8")
+        git("add", "src/new.ts")
+        second = FileIndex()
+        assert second.signature != first.signature
+        assert "src/new.ts" in second.files and calls.count("ls-files") == 1
+    finally:
+        file_index_module._git = real_git
+    print("  ✅ HEAD/暂存区不变时复用缓存，git add 后重新列出文件")
+
+
+def run_test_executor(tmp_dir: Path):
+    """场景 5: 执行器集成"""
+    print("\n=== 测试 5: DAGExecutor 精确模式 ===")
+    task_dir = tmp_dir / ".task-precise"
+    task_dir.mkdir()
+    (task_dir / "dag.md").write_text(DAG, encoding="utf-8")
+    entry = str(task_dir / "dag.md")
+
+    default = DAGExecutor(entry, lambda t: True, use_state=False, use_plan_cache=False)
+    precise = DAGExecutor(entry, lambda t: True, use_state=False, precise_conflicts=True)
+    default.parse()
+    precise.parse()
+    default_batches = default._get_stage_layout(default.stages[0])[1]
+    precise_batches = precise._get_stage_layout(precise.stages[0])[1]
+    assert len(default_batches) == 3 and len(precise_batches) == 1, (default_batches, precise_batches)
+
+    key = precise.plan_cache.compute_key([entry])
+    assert key != DAGExecutor(entry, lambda t: True, use_state=False).plan_cache.compute_key([entry])
+    git("commit", "-q", "-m", "more")
+    assert DAGExecutor(entry, lambda t: True, use_state=False, precise_conflicts=True).plan_cache.compute_key(
+        [entry]) != key
+    print("  ✅ 精确模式下 4 个任务一批并行（默认 3 批），文件索引变化时执行计划缓存失效")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_glob(tmp_dir)
+            run_test_precise(tmp_dir)
+            run_test_cache(tmp_dir)
+            run_test_executor(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
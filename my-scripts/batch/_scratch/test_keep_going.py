@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试 --keep-going（任务失败后继续执行不受影响的任务，下游标记为 skipped）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) DAGScheduler keep_going：独立任务继续执行，下游（depends_on / 串行后继 / 等待阶段完成）报告阻塞它的失败任务
+#   (2) 阶段屏障：并行阶段跑完其余批次，串行阶段后继和之后的阶段跳过，状态文件记录 skipped + 原因
+#   (3) 断点续传：只重跑失败和被跳过的任务
+#   (4) 任务级依赖（DAGExecutor + task_runner）与无批次屏障阶段同样继续执行
+#   (5) 默认（不加 --keep-going）仍失败即停止
+
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+from contextlib import redirect_stdout
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from batch_executor_base import TaskResult
+from dag_executor import DAGExecutor
+from dag_parser import DAGParser
+from dag_scheduler import DAGScheduler
+from state_manager import StateManager
+
+BARRIER_DAG = """# 继续执行
+
+## STAGE ## name="batch" mode="parallel" max_workers="2"
+
+## TASK ##
+任务 A
+文件: a.py
+
+## TASK ##
+任务 B（失败）
+文件: b.py
+
+## TASK ##
+任务 C（与 B 冲突，下一批次）
+文件: b.py
+
+## TASK ##
+任务 D
+文件: d.py
+
+## STAGE ## name="chain" mode="serial"
+
+## TASK ##
+串行 1
+
+## TASK ##
+串行 2
+"""
+
+SERIAL_DAG = """# 串行
+
+## STAGE ## name="chain" mode="serial"
+
+## TASK ##
+串行 1
+
+## TASK ##
+串行 2（失败）
+
+## TASK ##
+串行 3
+
+## TASK ##
+串行 4
+"""
+
+DEPENDS_DAG = """# 依赖
+
+## STAGE ## name="build" mode="parallel" max_workers="4"
+
+## TASK ## id="api"
+构建 api（失败）
+
+## TASK ## id="web"
+构建 web
+
+## STAGE ## name="use" mode="parallel" max_workers="4"
+
+## TASK ## depends_on="build.api"
+测试 api
+
+## TASK ## depends_on="build.web"
+测试 web
+
+## TASK ##
+等待 build 整体完成
+
+## STAGE ## name="docs" mode="serial"
+
+## TASK ## depends_on="build.api"
+文档 1
+
+## TASK ##
+文档 2
+"""
+
+
+class FakeExecutor:
+    """按描述决定成败的假执行器：实现 batchcc 执行器的状态契约（set_state_manager / 自管状态）"""
+
+    def __init__(self, fail=("失败",)):
+        self.fail = fail
+        self.ran = []
+        self.state_manager = None
+        self.current_stage_id = None
+        self.lock = threading.Lock()
+
+    def set_state_manager(self, state_manager, stage_id):
+        self.state_manager, self.current_stage_id = state_manager, stage_id
+
+    def _run(self, task) -> bool:
+        with self.lock:
+            self.ran.append(task.description)
+        return not any(word in task.description for word in self.fail)
+
+    def execute_dag_task(self, task) -> bool:
+        if self.state_manager:
+            self.state_manager.start_task(self.current_stage_id, task.task_id)
+        success = self._run(task)
+        if self.state_manager:
+            self.state_manager.complete_task(self.current_stage_id, task.task_id, success,
+                                             None if success else "任务执行失败")
+        return success
+
+    def execute_dag_batch_parallel(self, tasks, max_workers):
+        results = []
+        for task in tasks:
+            success = self._run(task)
+            if self.state_manager:
+                self.state_manager.complete_task(self.current_stage_id, task.task_id, success,
+                                                 None if success else "失败")
+            results.append(TaskResult(task_id=task.task_id, command="", success=success, duration=0,
+                                      error_msg="" if success else "失败"))
+        return results
+
+    def run_dag_task(self, task, global_goal="", stage_context="", context_refs=None):
+        success = self._run(task)
+        return TaskResult(task_id=task.task_id, command="", success=success, duration=0,
+                          error_msg="" if success else "失败")
+
+
+def write(path: str, content: str):
+    Path(path).write_text(content, encoding="utf-8")
+
+
+def run_dag(path: str, fake: FakeExecutor, keep_going: bool = True, **kwargs) -> (bool, str):
+    executor = DAGExecutor(path, fake.execute_dag_task, use_plan_cache=False, keep_going=keep_going, **kwargs)
+    output = io.StringIO()
+    with redirect_stdout(output):
+        success = executor.execute(fake.execute_dag_batch_parallel,
+                                   task_runner=fake.run_dag_task if kwargs.get('barrier_free') else None)
+    return success, output.getvalue()
+
+
+def task_states(path: str):
+    with open(StateManager(path).state_file, encoding="utf-8") as f:
+        stages = json.load(f)["stages"]
+    return {(s["stage_id"] + 1, t["task_id"]): (t["status"], t.get("skip_reason")) for s in stages for t in s["tasks"]}
+
+
+def run_test_scheduler(tmp_dir: Path):
+    """场景 1: 调度器"""
+    print("\n=== 测试 1: DAGScheduler keep_going ===")
+    write("deps.md", DEPENDS_DAG)
+    stages = DAGParser("deps.md").parse()
+    ran, skipped = [], []
+
+    def runner(task):
+        ran.append(task.description)
+        return "失败" not in task.description
+
+    scheduler = DAGScheduler(stages, keep_going=True)
+    assert not scheduler.run(runner, on_skip=lambda task, blocker: skipped.append((task.description, blocker.description)))
+    assert sorted(ran) == sorted(["构建 api（失败）", "构建 web", "测试 web"]), ran
+    assert skipped == [(description, "构建 api（失败）") for description in
+                       ("测试 api", "等待 build 整体完成", "文档 1", "文档 2")], skipped
+
+    # 默认：失败即停止，不报告跳过
+    ran.clear()
+    assert not DAGScheduler(stages, max_total_workers=1).run(runner, on_skip=lambda *a: skipped.append(a))
+    assert ran == ["构建 api（失败）"] and len(skipped) == 4
+    print("  ✅ 独立任务继续执行；依赖链、串行后继、等待阶段完成的任务都报告为被失败任务阻塞")
+
+
+def run_test_barrier(tmp_dir: Path):
+    """场景 2 / 3: 阶段屏障 + 断点续传"""
+    print("\n=== 测试 2: 阶段屏障 ===")
+    os.makedirs(".task-kg", exist_ok=True)
+    entry = ".task-kg/dag.md"
+    write(entry, BARRIER_DAG)
+    fake = FakeExecutor()
+    success, output = run_dag(entry, fake)
+    assert not success
+    assert sorted(fake.ran) == sorted(["任务 A", "任务 B（失败）", "任务 C（与 B 冲突，下一批次）", "任务 D"]), fake.ran
+    assert fake.ran.index("任务 C（与 B 冲突，下一批次）") > fake.ran.index("任务 B（失败）")
+    states = task_states(entry)
+    assert states[(1, 2)] == ("failed", None) and states[(1, 3)][0] == "completed"
+    assert states[(2, 1)] == states[(2, 2)] == ("skipped", "依赖的 Stage 1 Task 2 失败"), states
+    assert "1 个任务失败，2 个任务因依赖失败任务被跳过" in output and "再次运行将只重新执行失败和被跳过的任务" in output
+    assert "⛔ 停止执行" not in output
+
+    print("\n=== 测试 3: 断点续传 ===")
+    fake = FakeExecutor(fail=())
+    success, output = run_dag(entry, fake)
+    assert success and fake.ran == ["任务 B（失败）", "串行 1", "串行 2"], fake.ran
+
+    os.makedirs(".task-serial", exist_ok=True)
+    entry = ".task-serial/dag.md"
+    write(entry, SERIAL_DAG)
+    fake = FakeExecutor()
+    run_dag(entry, fake)
+    states = task_states(entry)
+    assert [states[(1, i)][0] for i in (1, 2, 3, 4)] == ["completed", "failed", "skipped", "skipped"], states
+    assert states[(1, 4)][1] == "依赖的 Stage 1 Task 2 失败"
+    fake = FakeExecutor(fail=())
+    assert run_dag(entry, fake)[0] and fake.ran == ["串行 2（失败）", "串行 3", "串行 4"], fake.ran
+    print("  ✅ 并行阶段跑完其余批次，串行后继与后续阶段记为 skipped（含原因）；续跑只执行失败和被跳过的任务")
+
+
+def run_test_scheduled_executor(tmp_dir: Path):
+    """场景 4: 任务级依赖 / 无批次屏障"""
+    print("\n=== 测试 4: 任务级依赖与无批次屏障 ===")
+    os.makedirs(".task-deps", exist_ok=True)
+    entry = ".task-deps/dag.md"
+    write(entry, DEPENDS_DAG)
+    fake = FakeExecutor()
+    executor = DAGExecutor(entry, fake.execute_dag_task, use_plan_cache=False, keep_going=True)
+    output = io.StringIO()
+    with redirect_stdout(output):
+        assert not executor.execute(task_runner=fake.run_dag_task)
+    assert sorted(fake.ran) == sorted(["构建 api（失败）", "构建 web", "测试 web"]), fake.ran
+    states = task_states(entry)
+    assert {key: status for key, (status, _) in states.items()} == {
+        (1, 1): "failed", (1, 2): "completed", (2, 1): "skipped", (2, 2): "completed", (2, 3): "skipped",
+        (3, 1): "skipped", (3, 2): "skipped"}, states
+    assert "4 个任务因依赖失败任务被跳过" in output.getvalue()
+
+    fake = FakeExecutor(fail=())
+    executor = DAGExecutor(entry, fake.execute_dag_task, use_plan_cache=False, keep_going=True)
+    with redirect_stdout(io.StringIO()):
+        assert executor.execute(task_runner=fake.run_dag_task)
+    assert sorted(fake.ran) == sorted(["构建 api（失败）", "测试 api", "等待 build 整体完成", "文档 1", "文档 2"]), fake.ran
+
+    os.makedirs(".task-free", exist_ok=True)
+    write(".task-free/dag.md", BARRIER_DAG)
+    fake = FakeExecutor()
+    success, output = run_dag(".task-free/dag.md", fake, barrier_free=True)
+    assert not success and sorted(fake.ran) == sorted(["任务 A", "任务 B（失败）", "任务 C（与 B 冲突，下一批次）", "任务 D"])
+    assert task_states(".task-free/dag.md")[(2, 1)] == ("skipped", "依赖的 Stage 1 Task 2 失败")
+    print("  ✅ 任务级依赖只跳过失败任务的下游，续跑补齐；无批次屏障阶段同样跑完其余任务")
+
+
+def run_test_default(tmp_dir: Path):
+    """场景 5: 默认失败即停止"""
+    print("\n=== 测试 5: 默认失败即停止 ===")
+    os.makedirs(".task-stop", exist_ok=True)
+    write(".task-stop/dag.md", SERIAL_DAG)
+    fake = FakeExecutor()
+    success, output = run_dag(".task-stop/dag.md", fake, keep_going=False)
+    assert not success and fake.ran == ["串行 1", "串行 2（失败）"] and "⛔ 停止执行（失败即停止策略）" in output
+    states = task_states(".task-stop/dag.md")
+    assert states[(1, 3)][0] == "pending" and "被跳过" not in output
+    print("  ✅ 不加 --keep-going 时行为不变")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_scheduler(tmp_dir)
+            run_test_barrier(tmp_dir)
+            run_test_scheduled_executor(tmp_dir)
+            run_test_default(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
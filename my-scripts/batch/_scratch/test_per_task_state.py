@@ -4,7 +4,7 @@
 #
 # 验证修复的 bug: 并行批次中 Ctrl+C 后，已完成任务状态丢失，恢复时全部重跑
 #
-# 测试策略：monkey-patch execute_command_parallel 替换 claude CLI 调用为本地
+# 测试策略：override execute_command_async 替换 claude CLI 调用为本地
 # 模拟逻辑，然后：
 #   (1) 正常跑完：验证状态文件中所有任务 = completed
 #   (2) 部分完成后抛 KeyboardInterrupt：验证已完成的任务 = completed，
@@ -13,7 +13,7 @@
 import os
 import sys
 import json
-import time
+import asyncio
 from pathlib import Path
 
 # 插入 batch 目录到 path
@@ -25,21 +25,13 @@ from dag_parser import TaskNode
 from state_manager import StateManager
 import batchcc
 
-# 测试时用 ThreadPoolExecutor 替换 ProcessPoolExecutor，避免跨进程 pickle 限制
-# （test 中的 closure hook 无法跨进程序列化）
-from concurrent.futures import ThreadPoolExecutor
-batchcc.ProcessPoolExecutor = ThreadPoolExecutor
-
 
 class FakeExecutor(batchcc.ClaudeCodeBatchExecutor):
-    """测试用子类：override execute_command_parallel 避免实际调 claude CLI。
-    必须用 class-level override 才能跨 ProcessPoolExecutor 的 pickle 边界。
-    实例属性 lambda 在 ProcessPoolExecutor 跨进程时无法 pickle。
-    """
+    """测试用子类：override execute_command_async 避免实际调 claude CLI。"""
 
-    def execute_command_parallel(self, args):
+    async def execute_command_async(self, args, automation_prefix=None):
         task_id, cmd, wd = args
-        time.sleep(0.02 * task_id)
+        await asyncio.sleep(0.02 * task_id)
         return TaskResult(
             task_id=task_id,
             command=cmd,
@@ -48,7 +40,7 @@ class FakeExecutor(batchcc.ClaudeCodeBatchExecutor):
             output="ok",
         )
 
-    def _auto_commit_if_needed(self, task_description, task_id=None):
+    def _auto_commit_if_needed(self, task_description, task_id=None, task=None):
         # 测试时禁用 git commit，避免污染测试目录或误提交开发中的 batchcc.py
         pass
 
@@ -155,8 +147,8 @@ def run_test_interrupt_mid_batch(tmp_dir: Path):
 
     original_complete = sm.complete_task
 
-    def hooked_complete_task(stage_id, task_id, success, error=None):
-        original_complete(stage_id, task_id, success, error)
+    def hooked_complete_task(stage_id, task_id, success, error=None, duration=None):
+        original_complete(stage_id, task_id, success, error, duration)
         call_count["n"] += 1
         if call_count["n"] == 2:
             # 模拟：2 个任务完成后用户按 Ctrl+C
@@ -217,7 +209,7 @@ def run_test_no_in_progress_predefine(tmp_dir: Path):
 
     original_complete = sm.complete_task
 
-    def hooked_complete_task(stage_id, task_id, success, error=None):
+    def hooked_complete_task(stage_id, task_id, success, error=None, duration=None):
         if not checked["done"]:
             # 检查状态文件里其他任务的状态（应该是 pending，不是 in_progress）
             with open(sm.state_file) as f:
@@ -227,7 +219,7 @@ def run_test_no_in_progress_predefine(tmp_dir: Path):
                 assert t["status"] in ("pending", "completed"), \
                     f"其他任务状态应该是 pending/completed，实际 {t['status']}（旧 bug）"
             checked["done"] = True
-        original_complete(stage_id, task_id, success, error)
+        original_complete(stage_id, task_id, success, error, duration)
 
     sm.complete_task = hooked_complete_task
     executor.set_state_manager(sm, stage_id=0)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试执行计划导出/导入（--emit-plan json|binary / --from-plan）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) MessagePack 编码与规范字节一致，各类型往返无损
+#   (2) 导出内容：阶段 mode/max_workers、任务文件范围/排除/验证命令、冲突映射、批次；矩阵子任务展开
+#   (3) --from-plan：不读取 markdown、不做冲突检测，按导出的批次执行；json 与 binary 结果一致
+#   (4) 损坏文件、非计划文件、版本不匹配报错
+#   (5) 命令行：--emit-plan 写出文件后退出，--from-plan --dry-run 不需要 dag.md
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+import dag_parser
+from dag_executor import DAGExecutor
+from batch_executor_base import TaskResult
+from plan_export import packb, unpackb, export_plan, load_plan_export, default_export_path, PLAN_EXPORT_VERSION
+
+
+DAG = """# 导出测试
+
+## STAGE ## name="dev" mode="parallel" max_workers="3"
+
+## TASK ##
+改 API
+文件: src/api/**
+排除: src/api/generated/
+验证: npm test -- api
+
+## TASK ##
+改 API 文档
+文件: src/api/README.md
+
+## TASK ## matrix="module=auth,billing"
+迁移 {module}
+文件: src/{module}/**
+
+## STAGE ## name="review" mode="serial"
+
+## TASK ##
+全局审视
+"""
+
+
+def run_test_msgpack(tmp_dir: Path):
+    """场景 1: MessagePack 编码"""
+    print("\n=== 测试 1: MessagePack 编码 ===")
+    assert packb({"a": 1}) == b'\x81\xa1a\x01'
+    assert packb([None, True, False]) == b'\x93\xc0\xc3\xc2'
+    assert packb(-1) == b'\xff' and packb(-33) == b'\xd0\xdf' and packb(200) == b'\xcc\xc8'
+    assert packb(1 << 32) == b'\xcf\x00\x00\x00\x01\x00\x00\x00\x00'
+    assert packb(1.5) == b'\xcb\x3f\xf8\x00\x00\x00\x00\x00\x00'
+    assert packb("x" * 40)[:2] == b'\xd9\x28'
+
+    values = [0, 127, 128, 255, 256, 65535, 65536, (1 << 32) - 1, (1 << 64) - 1, -32, -129, -(1 << 31) - 1,
+              -(1 << 63), 0.25, "", "中文", "x" * 300, "y" * 70000, list(range(20)), list(range(70000)),
+              {str(i): i for i in range(20)}, {"nested": [{"k": [1, [2, None]]}]}]
+    for value in values:
+        assert unpackb(packb(value)) == value, value
+    assert unpackb(packb((1, 2))) == [1, 2]
+
+    for broken in (b'\x92\x01', b'\xd9\x05ab', b'\xc1'):
+        try:
+            unpackb(broken)
+            raise AssertionError(f"未报错: {broken!r}")
+        except ValueError:
+            pass
+    print("  ✅ 编码与 MessagePack 规范一致，往返无损，截断/未知类型报错")
+
+
+def run_test_export(tmp_dir: Path):
+    """场景 2: 导出内容"""
+    print("\n=== 测试 2: 导出内容 ===")
+    Path("dag.md").write_text(DAG, encoding="utf-8")
+    executor = DAGExecutor("dag.md", lambda t: True, use_state=False, use_plan_cache=False)
+    plan = executor.compile_plan()
+
+    size = export_plan(plan, "dag.md", "plan.json", "json")
+    assert size == os.path.getsize("plan.json")
+    document = json.loads(Path("plan.json").read_text(encoding="utf-8"))
+    assert document["format"] == "batch-plan" and document["version"] == PLAN_EXPORT_VERSION
+    stages = document["plan"]["stages"]
+    assert [(s["name"], s["mode"], s["max_workers"]) for s in stages] == [("dev", "parallel", 3), ("review", "serial", 2)]
+    first = stages[0]["tasks"][0]
+    assert (first["files"], first["excludes"], first["verify_cmd"]) == (
+        ["src/api/**"], ["src/api/generated/"], "npm test -- api"), first
+    assert [t["files"] for t in stages[0]["tasks"][2:]] == [["src/auth/**"], ["src/billing/**"]]
+    assert all(t["matrix"] is None for t in stages[0]["tasks"])
+    assert document["plan"]["conflicts"] == {"0": {"1": [2]}}, document["plan"]["conflicts"]
+    assert document["plan"]["batches"]["0"] == [[1, 3], [2, 4]], document["plan"]["batches"]
+
+    binary_size = export_plan(plan, "dag.md", "plan.msgpack", "binary")
+    assert binary_size < size, (binary_size, size)
+    assert unpackb(Path("plan.msgpack").read_bytes()) == document
+    assert default_export_path(".task-x/dag.md", "binary") == os.path.join(".task-x", "plan.export.msgpack")
+    assert default_export_path("task.md", "json") == "task.md.plan.export.json"
+    print(f"  ✅ 阶段、任务、冲突、批次完整导出（json {size} 字节，binary {binary_size} 字节）")
+
+
+def run_test_from_plan(tmp_dir: Path):
+    """场景 3: 从导出的计划执行"""
+    print("\n=== 测试 3: --from-plan ===")
+    os.remove("dag.md")
+    real_detect = dag_parser.ConflictDetector.detect_conflicts
+
+    def forbidden(tasks):
+        raise AssertionError("--from-plan 不应重新检测冲突")
+
+    dag_parser.ConflictDetector.detect_conflicts = staticmethod(forbidden)
+    try:
+        results = {}
+        for path in ("plan.json", "plan.msgpack"):
+            exported = load_plan_export(path)
+            executed = []
+            executor = DAGExecutor(exported.task_file, lambda t: executed.append(t.description) or True,
+                                   use_state=False, watch=True, plan=exported.plan)
+            assert executor.plan_cache is None and not executor.watch
+            batches = []
+
+            def run_batch(tasks, max_workers):
+                batches.append([t.task_id for t in tasks])
+                return [TaskResult(task_id=t.task_id, command="", success=executor.task_executor(t), duration=0)
+                        for t in tasks]
+
+            assert executor.execute(run_batch)
+            results[exported.format] = (executed, batches)
+    finally:
+        dag_parser.ConflictDetector.detect_conflicts = real_detect
+
+    assert results["json"] == results["binary"], results
+    executed, batches = results["json"]
+    assert batches == [[1, 3], [2, 4]], batches
+    assert executed == ["改 API", "迁移 auth", "改 API 文档", "迁移 billing", "全局审视"], executed
+    print("  ✅ 不解析 markdown、不检测冲突，按导出批次执行；两种格式结果一致")
+
+
+def run_test_errors(tmp_dir: Path):
+    """场景 4: 错误文件"""
+    print("\n=== 测试 4: 错误文件 ===")
+    Path("other.json").write_text('{"stages": []}', encoding="utf-8")
+    Path("old.msgpack").write_bytes(packb({"format": "batch-plan", "version": 0, "plan": {}}))
+    Path("broken.msgpack").write_bytes(Path("plan.msgpack").read_bytes()[:-10])
+    for path, fragment in (("missing.json", "读取执行计划失败"), ("other.json", "不是导出的执行计划文件"),
+                           ("old.msgpack", "执行计划版本不匹配"), ("broken.msgpack", "无法识别的执行计划文件")):
+        try:
+            load_plan_export(path)
+            raise AssertionError(f"未报错: {path}")
+        except ValueError as e:
+            assert fragment in str(e), e
+    print("  ✅ 缺失、非计划文件、旧版本、截断文件均报错")
+
+
+def run_test_cli(tmp_dir: Path):
+    """场景 5: 命令行"""
+    print("\n=== 测试 5: 命令行 ===")
+    task_dir = tmp_dir / ".task-cli"
+    task_dir.mkdir()
+    (task_dir / "dag.md").write_text(DAG, encoding="utf-8")
+    script = str(BATCH_DIR / "batchcc.py")
+
+    result = subprocess.run([sys.executable, script, "task-cli", "--emit-plan", "binary"],
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
+    output = task_dir / "plan.export.msgpack"
+    assert output.exists() and "📦 已导出执行计划" in result.stdout, result.stdout
+    assert not (task_dir / "state.json").exists()
+
+    os.rename(output, "cli.msgpack")
+    (task_dir / "dag.md").unlink()
+    result = subprocess.run([sys.executable, script, "--from-plan", "cli.msgpack", "--dry-run"],
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "跳过解析" in result.stdout and "迁移 billing" in result.stdout, result.stdout
+    print("  ✅ --emit-plan 导出后退出，--from-plan --dry-run 无需 dag.md")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_msgpack(tmp_dir)
+            run_test_export(tmp_dir)
+            run_test_from_plan(tmp_dir)
+            run_test_errors(tmp_dir)
+            run_test_cli(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
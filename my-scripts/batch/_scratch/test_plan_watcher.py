@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试监视模式（执行期间修改 dag.md，安全的修改合并进正在执行的计划）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) merge_plan：追加任务/新增阶段/未开始任务的修改被应用；
+#       已开始任务的修改、删除任务、向已结束阶段追加任务只报告不应用
+#   (2) 阶段屏障执行：串行阶段执行中追加的任务和新增阶段被执行，修改后的未开始任务按新内容执行
+#   (3) 并行阶段：批次之间追加的任务重新检测冲突后执行；状态文件同步新增任务
+#   (4) 任务级调度（depends_on）：执行中新增的阶段被调度器接收
+#   (5) 重新解析失败时保持原计划继续执行
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from dag_parser import DAGParser
+from dag_executor import DAGExecutor
+from plan_watcher import merge_plan
+from ref_resolver import RefResolver
+from batch_executor_base import TaskResult
+
+
+SERIAL_DAG = """# 监视测试
+
+## STAGE ## name="prepare" mode="serial"
+
+## TASK ##
+第一步
+
+## TASK ##
+第二步
+"""
+
+NEW_STAGE = """
+## STAGE ## name="extra" mode="serial"
+
+## TASK ##
+新增阶段的任务
+"""
+
+
+def write(path: str, content: str):
+    Path(path).write_text(content, encoding="utf-8")
+
+
+def parse(path: str = "dag.md"):
+    return DAGParser(path, resolver=RefResolver()).parse()
+
+
+def run_test_merge(tmp_dir: Path):
+    """场景 1: merge_plan 的应用/拒绝规则"""
+    print("\n=== 测试 1: merge_plan ===")
+    write("dag.md", SERIAL_DAG + NEW_STAGE)
+    stages = parse()
+
+    edited = (SERIAL_DAG.replace("第一步", "第一步（改）").replace("第二步", "第二步（改）")
+              + "\n## TASK ##\n第三步\n" + NEW_STAGE + NEW_STAGE.replace("extra", "extra2"))
+    write("dag.md", edited)
+    merge = merge_plan(stages, parse(), started={(0, 1)}, closed_stages=set())
+    descriptions = [[t.description for t in s.tasks] for s in stages]
+    assert descriptions == [["第一步", "第二步（改）", "第三步"], ["新增阶段的任务"], ["新增阶段的任务"]], descriptions
+    assert merge.changed_stages == {0, 2}, merge.changed_stages
+    assert any("Task 1 已开始或已完成" in m for m in merge.rejected), merge.rejected
+    assert stages[2].name == "extra2" and stages[2].tasks[0].stage_id == 2
+
+    write("dag.md", SERIAL_DAG.replace("第二步", "第二步（改）"))
+    merge = merge_plan(stages, parse(), started={(0, 1)}, closed_stages={0})
+    assert len(stages[0].tasks) == 3 and len(stages) == 3 and not merge.changed_stages
+    assert any("删除了 1 个任务" in m for m in merge.rejected), merge.rejected
+    assert any("已从文件中删除" in m for m in merge.rejected), merge.rejected
+
+    write("dag.md", SERIAL_DAG + "\n## TASK ##\n第三步\n## TASK ##\n第四步\n" + NEW_STAGE)
+    merge = merge_plan(stages, parse(), started={(0, 1), (0, 2), (0, 3)}, closed_stages={0})
+    assert any("已结束，新增的 1 个任务未应用" in m for m in merge.rejected), merge.rejected
+    print("  ✅ 安全修改被应用，冲突修改只报告")
+
+
+def run_test_serial_watch(tmp_dir: Path):
+    """场景 2: 阶段屏障执行中追加任务、修改未开始任务、新增阶段"""
+    print("\n=== 测试 2: 串行阶段热更新 ===")
+    write("dag.md", SERIAL_DAG)
+    executed = []
+
+    def task_executor(task):
+        executed.append(task.description)
+        if task.description == "第一步":
+            write("dag.md", SERIAL_DAG.replace("第二步", "第二步（改）") + "\n## TASK ##\n追加的任务\n" + NEW_STAGE)
+        return True
+
+    executor = DAGExecutor("dag.md", task_executor, use_state=False, use_plan_cache=False,
+                           watch=True, watch_interval=0)
+    assert executor.execute()
+    assert executed == ["第一步", "第二步（改）", "追加的任务", "新增阶段的任务"], executed
+    print("  ✅ 追加任务、新增阶段被执行，未开始任务按新内容执行")
+
+
+def run_test_parallel_watch(tmp_dir: Path):
+    """场景 3: 并行阶段批次之间追加任务，状态文件同步"""
+    print("\n=== 测试 3: 并行阶段热更新 ===")
+    dag = ('## STAGE ## name="p" mode="parallel" max_workers="2"\n\n'
+           '## TASK ##\n甲\n文件: src/a.ts\n\n## TASK ##\n乙\n文件: src/a.ts\n')
+    write("dag.md", dag)
+    executed = []
+
+    def task_executor(task):
+        executed.append(task.description)
+        if task.description == "甲":
+            write("dag.md", dag + "\n## TASK ##\n丙\n文件: src/a.ts\n")
+        return True
+
+    executor = DAGExecutor("dag.md", task_executor, use_state=True, use_plan_cache=False,
+                           watch=True, watch_interval=0)
+    real_complete = executor.state_manager.complete_all
+    seen_tasks = []
+    executor.state_manager.complete_all = lambda success: (
+        seen_tasks.extend(t["description"] for t in executor.state_manager.state["stages"][0]["tasks"]),
+        real_complete(success))
+    assert executor.execute()
+    assert executed == ["甲", "乙", "丙"], executed
+    assert seen_tasks == ["甲", "乙", "丙"], seen_tasks
+    print("  ✅ 批次间追加的任务重新分批执行，状态文件包含新增任务")
+
+
+def run_test_scheduler_watch(tmp_dir: Path):
+    """场景 4: depends_on 调度中新增阶段"""
+    print("\n=== 测试 4: 任务级调度热更新 ===")
+    dag = ('## STAGE ## name="a" mode="parallel" max_workers="2"\n\n'
+           '## TASK ## id="x"\n任务 x\n文件: src/x/**\n\n'
+           '## TASK ## depends_on="x"\n任务 y\n文件: src/y/**\n')
+    write("dag.md", dag)
+    executed = []
+
+    def task_runner(task, global_goal, stage_context, context_refs):
+        executed.append(task.description)
+        if task.description == "任务 x":
+            write("dag.md", dag + '\n## STAGE ## name="b" mode="serial"\n\n## TASK ## depends_on="a.x"\n任务 z\n')
+        return TaskResult(task_id=task.task_id, command="", success=True, duration=0)
+
+    executor = DAGExecutor("dag.md", lambda t: True, use_state=False, use_plan_cache=False,
+                           watch=True, watch_interval=0)
+    assert executor.execute(task_runner=task_runner)
+    assert sorted(executed) == ["任务 x", "任务 y", "任务 z"], executed
+    assert executed[0] == "任务 x"
+    print("  ✅ 调度器按合并后的计划重建依赖图")
+
+
+def run_test_parse_error(tmp_dir: Path):
+    """场景 5: 重新解析失败时保持原计划"""
+    print("\n=== 测试 5: 解析失败 ===")
+    write("dag.md", SERIAL_DAG)
+    executed = []
+
+    def task_executor(task):
+        executed.append(task.description)
+        if task.description == "第一步":
+            write("dag.md", "没有阶段了\n")
+        return True
+
+    executor = DAGExecutor("dag.md", task_executor, use_state=False, use_plan_cache=False,
+                           watch=True, watch_interval=0)
+    assert executor.execute()
+    assert executed == ["第一步", "第二步"], executed
+    print("  ✅ 解析失败不影响当前执行")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_merge(tmp_dir)
+            run_test_serial_watch(tmp_dir)
+            run_test_parallel_watch(tmp_dir)
+            run_test_scheduler_watch(tmp_dir)
+            run_test_parse_error(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试 @文件引用 解析（菱形引用、循环引用、跨解析缓存、mmap 读取、延迟引用）
+# Created: 2026-10-18
+#
+# 验证修复的 bug: 旧实现用全局 visited 集合做循环检测，同一文件被两处引用
+# （菱形引用）时第二处被误判为"循环引用"丢弃；且每次解析都重新读盘。
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from dag_parser import DAGParser
+import ref_resolver
+from ref_resolver import RefResolver
+
+
+def write(path: str, content: str):
+    Path(path).write_text(content, encoding="utf-8")
+
+
+def run_test_diamond(tmp_dir: Path):
+    """场景 1: A → B、A → C、B → D、C → D，D 两处都展开但只读盘一次"""
+    print("\n=== 测试 1: 菱形引用 ===")
+    write("dag.md", '## STAGE ## name="s" mode="parallel"\n@b.md\n@c.md\n')
+    write("b.md", "## TASK ##\nB 任务\n@d.md\n")
+    write("c.md", "## TASK ##\nC 任务\n@d.md\n")
+    write("d.md", "文件: shared/**\n")
+
+    resolver = RefResolver()
+    stages = DAGParser("dag.md", resolver=resolver).parse()
+    tasks = stages[0].tasks
+
+    assert [t.description for t in tasks] == ["B 任务", "C 任务"]
+    assert tasks[0].files == ["shared/**"] and tasks[1].files == ["shared/**"], "d.md 应在两处都展开"
+    assert resolver.disk_reads == 4, f"dag/b/c/d 各读一次，实际 {resolver.disk_reads}"
+    print("  ✅ 菱形引用两处都展开，d.md 只读一次")
+
+
+def run_test_cycle(tmp_dir: Path):
+    """场景 2: 真正的循环引用仍被拦截"""
+    print("\n=== 测试 2: 循环引用 ===")
+    write("dag.md", '## STAGE ## name="s" mode="serial"\n## TASK ##\n循环\n@x.md\n')
+    write("x.md", "文件: x/**\n@y.md\n")
+    write("y.md", "文件: y/**\n@x.md\n")
+
+    stages = DAGParser("dag.md", resolver=RefResolver()).parse()
+    task = stages[0].tasks[0]
+    assert task.files == ["x/**", "y/**"], task.files
+    print("  ✅ 循环引用被拦截，不会无限展开")
+
+
+def run_test_cache_across_parses(tmp_dir: Path):
+    """场景 3: 跨多次解析复用缓存，文件变化后自动失效"""
+    print("\n=== 测试 3: 跨解析缓存 ===")
+    write("dag.md", '## STAGE ## name="s" mode="serial"\n## TASK ##\n任务\n@spec.md\n')
+    write("spec.md", "文件: v1/**\n")
+
+    resolver = RefResolver()
+    DAGParser("dag.md", resolver=resolver).parse()
+    DAGParser("dag.md", resolver=resolver).parse()
+    assert resolver.disk_reads == 2, f"第二次解析应全部命中缓存，实际读盘 {resolver.disk_reads}"
+
+    write("spec.md", "文件: v2/**, extra/**\n")
+    stages = DAGParser("dag.md", resolver=resolver).parse()
+    assert stages[0].tasks[0].files == ["v2/**", "extra/**"], stages[0].tasks[0].files
+    print("  ✅ 缓存命中，文件修改后重新读取")
+
+
+def run_test_mmap(tmp_dir: Path):
+    """场景 4: 大文件走 mmap 读取，结果与普通读取一致（含 CRLF 换行）"""
+    print("\n=== 测试 4: mmap 读取 ===")
+    write("dag.md", '## STAGE ## name="s" mode="serial"\n## TASK ##\n大文件\n@big.md\n')
+    Path("big.md").write_bytes("文件: big/**\r\n".encode("utf-8") + b"x" * 4096 + b"\r\n")
+
+    stages = DAGParser("dag.md", resolver=RefResolver(mmap_threshold=1024)).parse()
+    assert stages[0].tasks[0].files == ["big/**"], stages[0].tasks[0].files
+
+    # 直接读取阈值以上的文件：确实经过 mmap，多字节字符解码与普通读取一致，映射正常关闭
+    content = ("中文行\r\n" * 2000).encode("utf-8")
+    Path("wide.md").write_bytes(content)
+    mapped = []
+    original = ref_resolver.mmap.mmap
+
+    def spy(*args, **kwargs):
+        mm = original(*args, **kwargs)
+        mapped.append(mm)
+        return mm
+
+    ref_resolver.mmap.mmap = spy
+    try:
+        lines = RefResolver(mmap_threshold=1024)._read_from_disk("wide.md", len(content))
+    finally:
+        ref_resolver.mmap.mmap = original
+    assert len(mapped) == 1 and mapped[0].closed, "应经 mmap 读取并关闭映射"
+    assert lines == RefResolver()._read_from_disk("wide.md", len(content)) == ["中文行"] * 2000 + [""]
+    print("  ✅ mmap 读取正确")
+
+
+def run_test_lazy_refs(tmp_dir: Path):
+    """场景 5: 延迟引用只记录句柄，构建 prompt 时才展开"""
+    print("\n=== 测试 5: 延迟引用 ===")
+    write("dag.md", "# 项目\n@goal.md\n"
+                    '## STAGE ## name="s" mode="parallel"\n@design.md\n'
+                    "## TASK ##\n实现接口\n@spec.md\n文件: api/**\n")
+    write("goal.md", "宏观目标说明\n")
+    write("design.md", "设计文档\n")
+    write("spec.md", "## TASK ##\n规格正文\n@detail.md\n@spec.md\n")
+    write("detail.md", "细节\n")
+
+    resolver = RefResolver()
+    parser = DAGParser("dag.md", resolver=resolver, lazy_refs=True)
+    stages = parser.parse()
+    assert resolver.disk_reads == 1, f"解析时只应读取 dag.md，实际读盘 {resolver.disk_reads}"
+    assert parser.sources == [str(Path("dag.md").resolve())], parser.sources
+
+    task = stages[0].tasks[0]
+    assert len(stages[0].tasks) == 1, "被引用文件中的 TASK 不参与解析"
+    assert task.files == ["api/**"], task.files
+    assert parser.global_refs == [str(Path.cwd() / "goal.md")], parser.global_refs
+    assert stages[0].refs == [str(Path.cwd() / "design.md")], stages[0].refs
+    assert task.refs == [str(Path.cwd() / "spec.md")], task.refs
+
+    text = resolver.expand(task.refs[0])
+    assert text.split("\n")[:4] == ["## TASK ##", "规格正文", "细节", ""], text
+    assert "# ⚠️ 跳过循环引用: spec.md" in text, text
+    print("  ✅ 解析只读 dag.md，句柄按归属记录，展开时处理嵌套/循环引用")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_diamond(tmp_dir)
+            run_test_cycle(tmp_dir)
+            run_test_cache_across_parses(tmp_dir)
+            run_test_mmap(tmp_dir)
+            run_test_lazy_refs(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
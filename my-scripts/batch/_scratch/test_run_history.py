@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试运行历史（~/.claude/batch-history/：任务耗时与结果、预计剩余时间、查询最慢/最不稳定的任务）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) RunHistory：只追加记录（多个实例写同一文件）、损坏行跳过、最近 MAX_SAMPLES 次的中位数/P90、无记录任务的估计补齐；
+#       文件超过 MAX_RECORDS + TRIM_SLACK 条时裁剪到最近 MAX_RECORDS 条
+#   (2) ProgressMonitor：按历史耗时显示预计剩余时间（运行中的任务扣除已运行时间）
+#   (3) DAGExecutor：阶段结束时记录本次运行的任务（阶段名、后端、结果、重试次数），清理状态文件后记录仍在；
+#       再次运行时开始执行、阶段标题和 --dry-run 显示预计耗时
+#   (4) 集成：--critical-path 的耗时估计优先用运行历史，--hedge 样本不足时按任务自身的历史 P90 对冲
+#   (5) 查询 CLI：最慢的任务按中位数排序，最不稳定的任务按失败/重试占比排序
+#   (6) 真实执行器：并行批次（不写 start_time）的任务按执行结果的耗时记入状态文件和运行历史，串行任务不取整到秒
+
+import asyncio
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+import batchcc
+import run_history
+from batch_executor_base import ProgressMonitor, TaskResult
+from dag_executor import DAGExecutor
+from dag_parser import DAGParser, TaskNode
+from run_history import MAX_SAMPLES, RunHistory, expected_span, format_range, main
+from task_hedge import HedgePolicy
+from task_priority import DurationEstimator
+from write_sets import task_fingerprint
+
+DAG = """# 历史
+
+## STAGE ## name="build" mode="parallel" max_workers="2"
+
+## TASK ##
+编译模块 A
+文件: a.py
+
+## TASK ##
+编译模块 B
+文件: b.py
+
+## STAGE ## name="check" mode="serial"
+
+## TASK ##
+检查结果
+"""
+
+
+def write(path: str, content: str):
+    Path(path).write_text(content, encoding="utf-8")
+
+
+def make_task(description: str, files=("src/",)) -> TaskNode:
+    return TaskNode(task_id=1, description=description, files=list(files), excludes=[], verify_cmd="")
+
+
+class FakeExecutor:
+    """模拟 batchcc 的 DAG 任务执行：自行管理任务状态，可指定失败和重试"""
+
+    def __init__(self, fail=(), retried=()):
+        self.fail = set(fail)
+        self.retried = set(retried)
+        self.state_manager = None
+        self.stage_id = None
+        self.run_history = None
+
+    def set_state_manager(self, state_manager, stage_id):
+        self.state_manager, self.stage_id = state_manager, stage_id
+
+    def set_context(self, global_goal, stage_context, context_refs=None):
+        pass
+
+    def execute_dag_task(self, task: TaskNode) -> bool:
+        self.state_manager.start_task(self.stage_id, task.task_id)
+        if task.description in self.retried:
+            self.state_manager.record_attempt(self.stage_id, task.task_id, 1, "限流", "429", 0.0)
+        success = task.description not in self.fail
+        self.state_manager.complete_task(self.stage_id, task.task_id, success, None if success else "失败")
+        return success
+
+
+def run_test_store(tmp_dir: Path):
+    """场景 1: 记录与统计"""
+    print("\n=== 测试 1: RunHistory ===")
+    path = str(tmp_dir / "history" / "tasks.jsonl")
+    task, other = make_task("重构解析器"), make_task("写文档")
+    first = RunHistory(path, backend="batchcc")
+    for seconds in (100, 300, 200):
+        first.record(task, "build", "completed", seconds)
+    first.record(task, "build", "failed", 5, retries=2)
+    RunHistory(path, backend="batchcx").record(other, "docs", "completed", 60, retries=1)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"fingerprint": "broken"\n')
+
+    lines = Path(path).read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 6, "每条记录追加一行，多个实例写同一文件互不覆盖"
+    record = json.loads(lines[3])
+    assert record["fingerprint"] == task_fingerprint(task) and record["stage"] == "build"
+    assert record["backend"] == "batchcc" and record["outcome"] == "failed" and record["retries"] == 2
+    assert json.loads(lines[4])["backend"] == "batchcx"
+
+    history = RunHistory(path)
+    assert history.duration_range(task) == (200, 300), "失败记录不参与耗时统计"
+    assert history.p90(other) == 60 and history.p90(make_task("新任务")) is None
+    assert history.durations() == {task_fingerprint(task): [100, 300, 200], task_fingerprint(other): [60]}
+    ranges, known = history.estimates([task, make_task("新任务")])
+    assert known == 1 and ranges == [(200, 300), (200, 300)], "无记录的任务按有记录任务的中位数补齐"
+    assert history.estimates([make_task("新任务")]) == ([], 0)
+
+    window = RunHistory(str(tmp_dir / "window.jsonl"))
+    for seconds in range(MAX_SAMPLES + 10):
+        window.record(task, "build", "completed", 1000 if seconds < 10 else 10)
+    assert RunHistory(window.path).duration_range(task) == (10, 10), "只统计最近 MAX_SAMPLES 次"
+
+    # 文件上限：超出 TRIM_SLACK 条后只保留最近 MAX_RECORDS 条
+    limits = run_history.MAX_RECORDS, run_history.TRIM_SLACK
+    run_history.MAX_RECORDS, run_history.TRIM_SLACK = 5, 2
+    try:
+        capped = RunHistory(str(tmp_dir / "capped.jsonl"))
+        for seconds in range(1, 8):
+            capped.record(task, "build", "completed", seconds)
+        assert len(Path(capped.path).read_text(encoding="utf-8").splitlines()) == 7, "未超出 TRIM_SLACK 时不重写"
+        capped.record(task, "build", "completed", 8)
+        assert [json.loads(line)["duration"] for line in Path(capped.path).read_text(encoding="utf-8").splitlines()] \
+            == [4, 5, 6, 7, 8], "只保留最近的记录"
+        assert capped.durations() == {task_fingerprint(task): [4, 5, 6, 7, 8]}
+        capped.record(task, "build", "completed", 9)
+        assert len(Path(capped.path).read_text(encoding="utf-8").splitlines()) == 6
+        assert not list(tmp_dir.glob("capped.jsonl.*.tmp"))
+    finally:
+        run_history.MAX_RECORDS, run_history.TRIM_SLACK = limits
+
+    assert expected_span([(10, 20), (10, 20), (10, 20), (10, 20)], 2) == (20, 40)
+    assert expected_span([(100, 200), (10, 20)], 4) == (100, 200), "不短于最长的任务"
+    assert expected_span([], 3) == (0, 0) and format_range((90, 150)) == "1m30s（P90 2m30s）"
+    print("  ✅ 只追加、损坏行跳过、最近记录的中位数/P90、无记录任务补齐、文件上限裁剪、并发摊分")
+
+
+def run_test_monitor(tmp_dir: Path):
+    """场景 2: 进度行的预计剩余时间"""
+    print("\n=== 测试 2: ProgressMonitor ===")
+    monitor = ProgressMonitor(3, {1: (100, 200), 2: (100, 200), 3: (50, 60)}, workers=2)
+    assert monitor.remaining() == (125, 230)
+    output = io.StringIO()
+    with redirect_stdout(output):
+        monitor.start_task(1, "cmd")
+        monitor.started[1] -= 40  # 已运行 40s
+        monitor.complete_task(3, True)
+    assert "预计剩余:" in output.getvalue(), output.getvalue()
+    median, p90 = monitor.remaining()
+    assert 99 <= median <= 100 and 199 <= p90 <= 200, (median, p90)
+
+    output = io.StringIO()
+    with redirect_stdout(output):
+        plain = ProgressMonitor(1)
+        plain.start_task(1, "cmd")
+    assert plain.remaining() is None and "预计剩余" not in output.getvalue()
+    print("  ✅ 未开始的任务按完整估计、运行中的任务扣除已运行时间；没有估计时不显示")
+
+
+def run_test_executor(tmp_dir: Path):
+    """场景 3: DAGExecutor 记录与阶段标题"""
+    print("\n=== 测试 3: DAGExecutor ===")
+    history = RunHistory(str(tmp_dir / "dag-history.jsonl"), backend="batchcc")
+
+    def run(fake: FakeExecutor, **kwargs):
+        os.makedirs(".task-hist", exist_ok=True)
+        write(".task-hist/dag.md", DAG)
+        executor = DAGExecutor(".task-hist/dag.md", fake.execute_dag_task, use_plan_cache=False,
+                               run_history=history, **kwargs)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            success = executor.execute()
+        return success, output.getvalue(), executor
+
+    success, output, _ = run(FakeExecutor(retried={"编译模块 B"}))
+    assert success and not os.path.exists(".task-hist"), "成功后任务目录照常清理"
+    records = [json.loads(line) for line in Path(history.path).read_text(encoding="utf-8").splitlines()]
+    assert [(r["description"], r["stage"], r["outcome"], r["retries"]) for r in records] == [
+        ("编译模块 A", "build", "completed", 0), ("编译模块 B", "build", "completed", 1),
+        ("检查结果", "check", "completed", 0)], records
+    assert "📝 运行历史: 记录 3 个任务" in output and "⏱️" not in output, "首次运行没有历史，不显示预计"
+
+    # 用历史估计：build 两个任务并行（max_workers=2），check 串行
+    stages = DAGParser(DAG_PATH).parse()
+    for task, seconds in zip([*stages[0].tasks, *stages[1].tasks], (600, 300, 120)):
+        for _ in range(3):
+            history.record(task, "seed", "completed", seconds)
+    success, output, _ = run(FakeExecutor(fail={"检查结果"}))
+    assert not success
+    assert "⏱️  预计耗时: 12m（P90 12m）（3/3 个剩余任务有历史耗时）" in output, output
+    assert "⏱️  预计: 本阶段 10m（P90 10m），整个运行剩余 12m（P90 12m）" in output, output
+    assert "⏱️  预计: 本阶段 2m（P90 2m），整个运行剩余 2m（P90 2m）" in output, output
+    last = json.loads(Path(history.path).read_text(encoding="utf-8").splitlines()[-1])
+    assert last["description"] == "检查结果" and last["outcome"] == "failed", "失败任务在保留状态文件前也被记录"
+
+    # 断点续传：已完成的任务不再记录、不计入预计
+    count = len(Path(history.path).read_text(encoding="utf-8").splitlines())
+    plan = io.StringIO()
+    with redirect_stdout(plan):
+        DAGExecutor(".task-hist/dag.md", lambda task: True, use_plan_cache=False, run_history=history).print_plan()
+    assert "预计耗时: 12m（P90 12m）（3/3 个剩余任务有历史耗时）" in plan.getvalue(), "--dry-run 估计整个计划"
+    success, output, _ = run(FakeExecutor())
+    assert success and len(Path(history.path).read_text(encoding="utf-8").splitlines()) == count + 1
+    assert "⏱️  预计耗时: 2m（P90 2m）（1/1 个剩余任务有历史耗时）" in output, output
+    assert "📝 运行历史: 记录 1 个任务" in output
+
+    # 没有运行历史时不记录也不显示
+    os.makedirs(".task-hist", exist_ok=True)
+    write(".task-hist/dag.md", DAG)
+    fake = FakeExecutor()
+    output = io.StringIO()
+    with redirect_stdout(output):
+        assert DAGExecutor(".task-hist/dag.md", fake.execute_dag_task, use_plan_cache=False).execute()
+    assert "📝" not in output.getvalue() and "⏱️" not in output.getvalue()
+    print("  ✅ 每个阶段结束时记录（含失败和重试次数），清理后记录仍在；开始执行、阶段标题、--dry-run 显示预计")
+
+
+def run_test_integration(tmp_dir: Path):
+    """场景 4: --critical-path / --hedge 使用运行历史"""
+    print("\n=== 测试 4: 集成 ===")
+    history = RunHistory(str(tmp_dir / "integration.jsonl"))
+    task = make_task("迁移数据库")
+    for seconds in (400, 500, 600):
+        history.record(task, "db", "completed", seconds)
+
+    os.makedirs(".task-stale", exist_ok=True)
+    write(".task-stale/state.json", json.dumps({"stages": [{"tasks": [
+        {"status": "completed", "duration": 9999, "fingerprint": task_fingerprint(task)},
+        {"status": "completed", "duration": 42, "fingerprint": task_fingerprint(make_task("只在状态文件中"))}]}]}))
+    estimator = DurationEstimator.from_state_files(history=history.durations())
+    assert estimator.history(task) == 500, "运行历史优先于状态文件"
+    assert estimator.history(make_task("只在状态文件中")) == 42, "状态文件补充运行历史中没有的任务"
+
+    policy = HedgePolicy(min_peers=3, min_runtime=0, estimate=history.p90)
+    assert policy.threshold(task, [1]) == 600, "同批次样本不足时按自身历史 P90"
+    assert policy.threshold(make_task("没有历史"), [1]) is None
+    print("  ✅ 耗时估计优先取运行历史，对冲阈值回退到任务自身的历史 P90")
+
+
+def run_test_cli(tmp_dir: Path):
+    """场景 5: 查询最慢 / 最不稳定的任务"""
+    print("\n=== 测试 5: 查询 CLI ===")
+    path = str(tmp_dir / "cli.jsonl")
+    history = RunHistory(path, backend="batchcc")
+    for seconds in (50, 60, 70):
+        history.record(make_task("快任务"), "s", "completed", seconds)
+    history.record(make_task("慢任务"), "s", "completed", 3600)
+    history.record(make_task("慢任务"), "s", "completed", 3000, retries=1)
+    history.record(make_task("常失败"), "s", "failed", 10)
+    history.record(make_task("常失败"), "s", "completed", 100)
+    RunHistory(path, backend="batchcx").record(make_task("另一后端"), "s", "failed", 10)
+
+    output = io.StringIO()
+    with redirect_stdout(output):
+        assert main(["--path", path, "-n", "2"]) == 0
+    text = output.getvalue()
+    slow, flaky = text.split("🐢")[1].split("🎲")
+    assert slow.index("慢任务") < slow.index("常失败") and "快任务" not in slow, "只列出最慢的 2 个"
+    assert flaky.index("另一后端") < flaky.index("常失败"), "失败占比 100% 排在 50% 之前"
+    assert "失败 1/2" in flaky and "4 个任务" in text, text
+
+    output = io.StringIO()
+    with redirect_stdout(output):
+        main(["--path", path, "--backend", "batchcx"])
+    assert "另一后端" in output.getvalue() and "慢任务" not in output.getvalue()
+    output = io.StringIO()
+    with redirect_stdout(output):
+        main(["--path", str(tmp_dir / "missing.jsonl")])
+    assert "0 个任务" in output.getvalue()
+    print("  ✅ 最慢按中位数、最不稳定按失败/重试占比排序，可按后端过滤")
+
+
+class BatchExecutor(batchcc.ClaudeCodeBatchExecutor):
+    """真实的 batchcc 执行器，只替换子进程调用：并行任务返回指定耗时，串行任务失败（保留状态文件）"""
+
+    DURATIONS = {1: 12.3, 2: 7.6}
+
+    async def execute_command_async(self, args, automation_prefix=None):
+        task_id, command, _ = args
+        await asyncio.sleep(0.01)
+        return TaskResult(task_id=task_id, command=command, success=True, duration=self.DURATIONS[task_id])
+
+    def execute_command_serial(self, command, working_dir, task_id):
+        time.sleep(0.05)
+        return False
+
+    def _auto_commit_if_needed(self, task_description, task_id=None, task=None):
+        pass
+
+
+def run_test_batch_executor(tmp_dir: Path):
+    """场景 6: 并行批次经真实执行器记录耗时"""
+    print("\n=== 测试 6: 并行批次的耗时 ===")
+    history = RunHistory(str(tmp_dir / "batch-history.jsonl"), backend="batchcc")
+    os.makedirs(".task-batch", exist_ok=True)
+    write(".task-batch/dag.md", DAG)
+    executor = BatchExecutor()
+    dag = DAGExecutor(".task-batch/dag.md", executor.execute_dag_task, use_plan_cache=False, run_history=history)
+    output = io.StringIO()
+    with redirect_stdout(output):
+        assert not dag.execute(executor.execute_dag_batch_parallel)
+    assert "📝 运行历史: 记录 3 个任务" in output.getvalue(), output.getvalue()
+    records = {r["description"]: r for r in map(json.loads, Path(history.path).read_text(encoding="utf-8").splitlines())}
+    assert records["编译模块 A"]["duration"] == 12.3 and records["编译模块 B"]["duration"] == 7.6, records
+    assert 0 < records["检查结果"]["duration"] < 1, "串行任务按单调时钟计时，不取整到秒"
+
+    state = json.loads(Path(".task-batch/state.json").read_text(encoding="utf-8"))
+    assert [task.get("start_time") for task in state["stages"][0]["tasks"]] == [None, None], "并行批次不预写 in_progress"
+    assert [task["duration"] for task in state["stages"][0]["tasks"]] == [12.3, 7.6]
+    shutil.rmtree(".task-batch")
+    print("  ✅ 并行批次的任务全部记入运行历史，耗时取执行结果；串行任务按单调时钟计时")
+
+
+DAG_PATH = "dag.md"
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        write(DAG_PATH, DAG)
+        try:
+            run_test_store(tmp_dir)
+            run_test_monitor(tmp_dir)
+            run_test_executor(tmp_dir)
+            run_test_integration(tmp_dir)
+            run_test_cli(tmp_dir)
+            run_test_batch_executor(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试多文件布局（.task-xxx/stages/*.md 并发解析、合并、逐文件缓存）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) dag.md（项目目标）+ stages/*.md 按文件名自然排序合并，阶段重新编号，跨文件 depends_on 正常解析
+#   (2) 合并结果与把所有阶段写在一个 dag.md 中的解析结果一致；报错位置指向阶段文件
+#   (3) 没有 dag.md 时入口解析、DAG 格式判断仍然成立，项目目标取第一个阶段文件
+#   (4) 逐文件解析缓存：未修改的文件命中缓存，只重新解析被修改的文件；删除的文件从缓存中清除
+#   (5) 新增阶段文件使执行计划缓存失效，监视模式合并新增的阶段文件
+
+import os
+import sys
+import shutil
+import tempfile
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from dag_parser import DAGParser, FragmentCache, find_stage_files
+from dag_executor import DAGExecutor
+from plan_cache import PlanCache
+from plan_watcher import PlanWatcher
+from ref_resolver import RefResolver
+from batchcc import resolve_task_entry, is_dag_format
+
+
+STAGE_FILES = {
+    "01-init.md": """# 初始化
+
+## STAGE ## name="init" mode="parallel" max_workers="2"
+
+## TASK ## id="schema"
+建表
+文件: db/schema.sql
+
+## TASK ##
+静态资源
+文件: assets/**
+""",
+    "2-dev.md": """## STAGE ## name="dev" mode="parallel" max_workers="4"
+开发阶段
+
+## TASK ## depends_on="init.schema"
+实现 API
+文件: src/api/**
+""",
+    "10-review.md": """## STAGE ## name="review" mode="serial"
+
+## TASK ##
+全局审视
+""",
+}
+
+
+def write_layout(task_dir: Path, with_dag: bool = True):
+    if task_dir.exists():
+        shutil.rmtree(task_dir)
+    (task_dir / "stages").mkdir(parents=True)
+    if with_dag:
+        (task_dir / "dag.md").write_text("# 多文件布局测试\n\n> **项目宏观目标**：拆分阶段文件\n", encoding="utf-8")
+    for name, content in STAGE_FILES.items():
+        (task_dir / "stages" / name).write_text(content, encoding="utf-8")
+
+
+def summary(stages):
+    return [(s.stage_id, s.name, s.mode, s.max_workers, s.description,
+             [(t.task_id, t.stage_id, t.description, t.files, t.id, t.depends_on) for t in s.tasks])
+            for s in stages]
+
+
+def run_test_merge(tmp_dir: Path):
+    """场景 1/2: 合并顺序、依赖解析、与单文件一致"""
+    print("\n=== 测试 1: 多文件合并 ===")
+    task_dir = tmp_dir / ".task-demo"
+    write_layout(task_dir)
+    entry = ".task-demo/dag.md"
+    assert [p.name for p in find_stage_files(entry)] == ["01-init.md", "2-dev.md", "10-review.md"]
+
+    parser = DAGParser(entry, resolver=RefResolver())
+    stages = parser.parse()
+    assert [s.name for s in stages] == ["init", "dev", "review"]
+    assert "拆分阶段文件" in parser.global_goal, parser.global_goal
+    assert stages[1].tasks[0].depends_on == [(0, 1)], stages[1].tasks[0].depends_on
+    assert stages[1].tasks[0].location == ".task-demo/stages/2-dev.md:4-6", stages[1].tasks[0].location
+    assert parser.task_index[(2, 1)].description == "全局审视"
+    assert str(task_dir.resolve() / "stages") in parser.sources
+
+    single = tmp_dir / "single.md"
+    single.write_text("# 多文件布局测试\n\n> **项目宏观目标**：拆分阶段文件\n\n"
+                      + "\n".join(STAGE_FILES.values()), encoding="utf-8")
+    expected = DAGParser(str(single), resolver=RefResolver()).parse()
+    assert summary(stages) == summary(expected)
+    print("  ✅ 按文件名自然排序合并，跨文件 depends_on 解析，结果与单文件一致")
+
+    (task_dir / "stages" / "2-dev.md").write_text(
+        STAGE_FILES["2-dev.md"].replace("init.schema", "init.missing"), encoding="utf-8")
+    try:
+        DAGParser(entry, resolver=RefResolver()).parse()
+        raise AssertionError("缺失的 depends_on 未报错")
+    except ValueError as e:
+        assert ".task-demo/stages/2-dev.md:4" in str(e), e
+    print("  ✅ 报错位置指向阶段文件")
+
+
+def run_test_without_dag(tmp_dir: Path):
+    """场景 3: 只有 stages/ 没有 dag.md"""
+    print("\n=== 测试 2: 没有 dag.md ===")
+    task_dir = tmp_dir / ".task-nodag"
+    write_layout(task_dir, with_dag=False)
+    entry = resolve_task_entry("task-nodag")
+    assert entry == Path(".task-nodag/dag.md"), entry
+    assert resolve_task_entry(".task-nodag") == entry
+    assert is_dag_format(str(entry))
+
+    parser = DAGParser(str(entry), resolver=RefResolver())
+    assert [s.name for s in parser.parse()] == ["init", "dev", "review"]
+    assert parser.global_goal == "初始化", parser.global_goal
+    print("  ✅ 入口解析到 .task-xxx/dag.md，目标取第一个阶段文件")
+
+
+def run_test_fragment_cache(tmp_dir: Path):
+    """场景 4: 逐文件解析缓存"""
+    print("\n=== 测试 3: 逐文件解析缓存 ===")
+    task_dir = tmp_dir / ".task-cache"
+    write_layout(task_dir)
+    entry = ".task-cache/dag.md"
+    cache = FragmentCache()
+
+    parser = DAGParser(entry, resolver=RefResolver(), fragment_cache=cache)
+    first = parser.parse()
+    assert (parser.fragment_files, parser.fragment_hits) == (4, 0)
+
+    parser = DAGParser(entry, resolver=RefResolver(), fragment_cache=cache)
+    second = parser.parse()
+    assert parser.fragment_hits == 4, parser.fragment_hits
+    assert summary(second) == summary(first)
+    assert second[1].tasks[0] is not first[1].tasks[0]  # 命中时返回副本
+
+    dev = task_dir / "stages" / "2-dev.md"
+    dev.write_text(STAGE_FILES["2-dev.md"].replace("实现 API", "实现 API v2"), encoding="utf-8")
+    parser = DAGParser(entry, resolver=RefResolver(), fragment_cache=cache)
+    stages = parser.parse()
+    assert parser.fragment_hits == 3, parser.fragment_hits
+    assert stages[1].tasks[0].description == "实现 API v2"
+    assert stages[1].tasks[0].depends_on == [(0, 1)]
+
+    (task_dir / "stages" / "10-review.md").unlink()
+    parser = DAGParser(entry, resolver=RefResolver(), fragment_cache=cache)
+    assert [s.name for s in parser.parse()] == ["init", "dev"]
+    assert parser.fragment_hits == 3, parser.fragment_hits
+    assert not any(path.endswith("10-review.md") for path in cache._entries), list(cache._entries)
+    print("  ✅ 只重新解析被修改的文件，删除的文件从缓存中清除")
+
+
+def run_test_plan_cache(tmp_dir: Path):
+    """场景 5: 新增阶段文件使执行计划缓存失效、触发监视模式重新解析"""
+    print("\n=== 测试 4: 执行计划缓存与监视模式 ===")
+    task_dir = tmp_dir / ".task-plan"
+    write_layout(task_dir)
+    entry = ".task-plan/dag.md"
+
+    executor = DAGExecutor(entry, lambda t: True, use_state=False)
+    executor.parse()
+    assert PlanCache(entry).load() is not None
+    executor.watcher = PlanWatcher(executor.sources, interval=0)
+
+    (task_dir / "stages" / "20-extra.md").write_text(
+        '## STAGE ## name="extra" mode="serial"\n\n## TASK ##\n追加阶段\n', encoding="utf-8")
+    assert PlanCache(entry).load() is None
+    assert executor._poll_reload() == {3}
+    assert [s.name for s in executor.stages] == ["init", "dev", "review", "extra"]
+
+    executor = DAGExecutor(entry, lambda t: True, use_state=False)
+    assert [s.name for s in executor.parse()] == ["init", "dev", "review", "extra"]
+    print("  ✅ 新增阶段文件后执行计划缓存失效，监视模式合并新阶段")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_merge(tmp_dir)
+            run_test_without_dag(tmp_dir)
+            run_test_fragment_cache(tmp_dir)
+            run_test_plan_cache(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
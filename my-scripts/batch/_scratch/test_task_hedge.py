@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试对冲执行（--hedge：慢任务在独立工作副本中再启动一份，先成功者胜出）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) HedgePolicy：同批次百分位阈值、样本不足时用历史估计、未声明 文件: 不对冲、统计报告
+#   (2) run_bounded：超过阈值且有空闲槽位时启动副本，副本胜出时取消原任务，settle 先于 on_done；有排队任务时不对冲
+#   (3) 原任务先成功时取消副本；双方都失败时按原任务的结果处理
+#   (4) WorktreeHedger：真实 git 仓库中副本胜出，声明范围内的文件同步为副本版本（原任务的半成品被删除），
+#       范围外的改动不合并，工作副本被删除
+#   (5) 原任务写了声明范围外的文件后落败：独占运行时还原为基准版本；有其他任务同时运行、无法确定归属时
+#       不采用副本，按原任务的结果处理
+
+import asyncio
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+from types import SimpleNamespace
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from async_engine import run_bounded, run_process
+from batch_executor_base import TaskResult
+from dag_parser import TaskNode
+from task_hedge import HedgePolicy, WorktreeHedger, percentile
+from write_sets import WriteTracker
+
+
+def make_task(task_id: int, files=("src/",)) -> TaskNode:
+    return TaskNode(task_id=task_id, description=f"任务 {task_id}", files=list(files), excludes=[], verify_cmd="")
+
+
+def sleeper(task_id: int, seconds: float, success: bool = True, log=None):
+    async def job():
+        try:
+            await asyncio.sleep(seconds)
+        except asyncio.CancelledError:
+            if log is not None:
+                log.append(("cancelled", task_id))
+            raise
+        return TaskResult(task_id=task_id, command="", success=success, duration=seconds)
+    return job
+
+
+class FakeHedge:
+    """内存中的对冲实现：副本按 copies 中的 (耗时, 成败) 运行"""
+
+    def __init__(self, copies, limit=0.5):
+        self.copies = copies
+        self.limit = limit
+        self.events = []
+        self.log = []
+        self.closed = False
+
+    def threshold(self, index, durations):
+        return self.limit if len(durations) >= 1 else None
+
+    async def run(self, index, elapsed):
+        self.events.append(("launch", index))
+        seconds, success = self.copies[index]
+        return await sleeper(100 + index, seconds, success, self.log)()
+
+    def accept(self, index):
+        return True
+
+    def settle(self, index, winner, result):
+        self.events.append(("settle", index, winner))
+        return result
+
+    def close(self):
+        self.closed = True
+
+
+def run_test_policy(tmp_dir: Path):
+    """场景 1: 阈值与统计"""
+    print("\n=== 测试 1: HedgePolicy ===")
+    assert percentile([1, 2, 3, 4, 5, 6, 7, 8, 9, 10], 90) == 9
+    assert percentile([5], 90) == 5 and percentile([3, 1, 2], 50) == 2
+    policy = HedgePolicy(percentile=90, min_peers=3, min_runtime=60)
+    task = make_task(1)
+    assert policy.threshold(task, [100, 200]) is None, "样本不足且没有历史估计时不对冲"
+    assert policy.threshold(task, [100, 200, 300]) == 300
+    assert policy.threshold(task, [10, 20, 30]) == 60, "阈值不低于 min_runtime"
+    assert policy.threshold(make_task(2, files=()), [100, 200, 300]) is None, "未声明 文件: 的任务不对冲"
+    history = HedgePolicy(min_peers=3, min_runtime=0, estimate=lambda t: 42.0 if t.task_id == 1 else None)
+    assert history.threshold(task, [1]) == 42.0 and history.threshold(make_task(2), [1]) is None
+    try:
+        HedgePolicy(percentile=0)
+        assert False, "百分位 0 应报错"
+    except ValueError:
+        pass
+
+    assert policy.report() == []
+    policy.record_launch(), policy.record_launch(), policy.record_launch()
+    policy.record('hedge', 30), policy.record('original', 15), policy.record(None, 15)
+    assert policy.report() == ["🏁 对冲执行: 启动 3 个副本，副本胜出 1 次，原任务胜出 1 次，双方都失败 1 次（副本共运行 1m）"], \
+        policy.report()
+    assert "P90" in policy.describe()
+    print("  ✅ 百分位阈值、历史估计回退、资格判断与统计报告正确")
+
+
+def run_test_hedge_wins(tmp_dir: Path):
+    """场景 2: 副本胜出 / 有排队任务时不对冲"""
+    print("\n=== 测试 2: 副本胜出 ===")
+    hedge = FakeHedge({1: (0.2, True)})
+    done = []
+    jobs = [sleeper(0, 0.1), sleeper(1, 30, log=hedge.log)]
+    start = time.time()
+    run_bounded(jobs, 3, lambda i, r, e: (done.append((i, r.task_id, r.success)), hedge.events.append(("done", i))),
+                hedge=hedge)
+    assert time.time() - start < 5, "副本胜出后不应等待原任务"
+    assert done == [(0, 0, True), (1, 101, True)], done
+    assert hedge.events[-3:] == [("launch", 1), ("settle", 1, "hedge"), ("done", 1)], hedge.events
+    assert ("cancelled", 1) in hedge.log and hedge.closed
+
+    # 槽位全被占用时不对冲
+    hedge = FakeHedge({1: (0.1, True)})
+    done = []
+    run_bounded([sleeper(0, 0.1), sleeper(1, 1.6)], 1, lambda i, r, e: done.append(r.task_id), hedge=hedge)
+    assert hedge.events == [] and done == [0, 1], (hedge.events, done)
+    print("  ✅ 超过阈值启动副本，副本先成功时原任务被取消；没有空闲槽位时不对冲")
+
+
+def run_test_original_wins(tmp_dir: Path):
+    """场景 3: 原任务胜出 / 双方都失败"""
+    print("\n=== 测试 3: 原任务胜出 / 都失败 ===")
+    hedge = FakeHedge({1: (30, True)})
+    done = []
+    run_bounded([sleeper(0, 0.1), sleeper(1, 1.8)], 3, lambda i, r, e: done.append((r.task_id, r.success)), hedge=hedge)
+    assert done == [(0, True), (1, True)], done
+    assert ("settle", 1, "original") in hedge.events and ("cancelled", 101) in hedge.log
+
+    hedge = FakeHedge({1: (0.1, False)})
+    done = []
+    run_bounded([sleeper(0, 0.1), sleeper(1, 1.8, success=False)], 3,
+                lambda i, r, e: done.append((r.task_id, r.success)), hedge=hedge)
+    assert done == [(0, True), (1, False)], "都失败时交给 on_done 的是原任务的结果"
+    assert ("settle", 1, None) in hedge.events
+
+    # 副本失败不影响原任务随后成功
+    hedge = FakeHedge({1: (0.1, False)})
+    done = []
+    run_bounded([sleeper(0, 0.1), sleeper(1, 1.8)], 3, lambda i, r, e: done.append((r.task_id, r.success)), hedge=hedge)
+    assert done == [(0, True), (1, True)] and ("settle", 1, "original") in hedge.events, (done, hedge.events)
+    print("  ✅ 原任务先成功时取消副本；副本失败时等待原任务；都失败按原任务结果处理")
+
+
+def git(cwd, *args) -> str:
+    return subprocess.run(['git', *args], cwd=cwd, check=True, capture_output=True, text=True).stdout
+
+
+def run_test_worktree(tmp_dir: Path):
+    """场景 4: 真实 git 工作副本"""
+    print("\n=== 测试 4: WorktreeHedger ===")
+    repo = tmp_dir / "repo"
+    (repo / "src").mkdir(parents=True)
+    (repo / "src" / "main.txt").write_text("v0\n")
+    (repo / "src" / "gone.txt").write_text("keep?\n")
+    (repo / "docs.txt").write_text("docs\n")
+    git(repo, 'init', '-q')
+    git(repo, '-c', 'user.name=t', '-c', 'user.email=t@t', 'add', '-A')
+    git(repo, '-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '-q', '-m', 'init')
+
+    commands = {
+        0: "echo peer > peer.txt",
+        # 原任务：写下半成品后卡住
+        1: "echo partial > src/partial.txt && echo half > src/main.txt && sleep 30",
+    }
+    # 副本：最终版本 + 删除文件 + 一个范围外的改动
+    hedge_command = "echo final > src/main.txt && rm src/gone.txt && echo new > src/new.txt && echo out >> docs.txt"
+
+    async def run_in(index, cwd, command=None):
+        output = await run_process(command or commands[index], cwd)
+        return TaskResult(task_id=index, command="", success=output.returncode == 0, duration=0)
+
+    tasks = [make_task(0, files=("peer.txt",)), make_task(1, files=("src/",))]
+    policy = HedgePolicy(min_peers=1, min_runtime=0)
+    hedger = WorktreeHedger(policy, tasks, lambda i, cwd: run_in(i, cwd, hedge_command), cwd=str(repo))
+    snapshots = {}
+
+    def on_done(index, result, error):
+        assert error is None and result.success
+        snapshots[index] = sorted(p.name for p in (repo / "src").iterdir())
+
+    jobs = [lambda i=i: run_in(i, str(repo)) for i in (0, 1)]
+    output = io.StringIO()
+    start = time.time()
+    with redirect_stdout(output):
+        run_bounded(jobs, 3, on_done, hedge=hedger)
+    assert time.time() - start < 15, "原任务应被终止"
+    assert snapshots[1] == ["main.txt", "new.txt"], snapshots
+    assert (repo / "src" / "main.txt").read_text() == "final\n"
+    assert (repo / "docs.txt").read_text() == "docs\n", "范围外的改动不合并"
+    assert (repo / "peer.txt").exists()
+    assert "副本先完成" in output.getvalue() and "docs.txt" in output.getvalue(), output.getvalue()
+    assert len(git(repo, 'worktree', 'list').splitlines()) == 1, "工作副本应已删除"
+    assert policy.hedge_won == 1 and policy.launched == 1
+
+    # 不在 git 仓库中：不对冲
+    plain = tmp_dir / "plain"
+    plain.mkdir()
+    assert WorktreeHedger(policy, tasks, run_in, cwd=str(plain)).threshold(1, [1.0]) is None
+    print("  ✅ 副本胜出后范围内文件与副本一致，半成品被清除，范围外改动未合并，工作副本已删除")
+
+
+def run_test_stray_writes(tmp_dir: Path):
+    """场景 5: 原任务的范围外改动"""
+    print("\n=== 测试 5: 落败原任务的范围外改动 ===")
+    repo = tmp_dir / "stray"
+    (repo / "src").mkdir(parents=True)
+    (repo / "src" / "main.txt").write_text("v0\n")
+    (repo / "docs.txt").write_text("docs\n")
+    git(repo, 'init', '-q')
+    git(repo, '-c', 'user.name=t', '-c', 'user.email=t@t', 'add', '-A')
+    git(repo, '-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '-q', '-m', 'init')
+
+    async def run_in(cwd, command):
+        output = await run_process(command, cwd)
+        return TaskResult(task_id=1, command="", success=output.returncode == 0, duration=0)
+
+    # 原任务改了范围外的 docs.txt、新建 notes.txt 后卡住；副本只改范围内的文件
+    original = "echo stray >> docs.txt && echo note > notes.txt && echo half > src/main.txt && sleep 30"
+    task = make_task(1, files=("src/",))
+    tracker = WriteTracker(cwd=str(repo))
+    policy = HedgePolicy(min_peers=1, min_runtime=0, estimate=lambda t: 0.5)
+    hedger = WorktreeHedger(policy, [task], lambda i, cwd: run_in(cwd, "echo final > src/main.txt"), cwd=str(repo),
+                            writes=lambda i: tracker.peek(i))
+    done = []
+    output = io.StringIO()
+    start = time.time()
+    with redirect_stdout(output):
+        run_bounded([lambda: run_in(str(repo), original)], 2, lambda i, r, e: done.append(r.success),
+                    on_start=tracker.start, hedge=hedger)
+    assert time.time() - start < 15 and done == [True] and policy.hedge_won == 1, output.getvalue()
+    assert (repo / "src" / "main.txt").read_text() == "final\n"
+    assert (repo / "docs.txt").read_text() == "docs\n" and not (repo / "notes.txt").exists(), "范围外改动应还原"
+    assert "已还原: docs.txt, notes.txt" in output.getvalue(), output.getvalue()
+
+    # 有其他任务同时运行（无快照钩子）：范围外的 notes.txt 无法确定归属，不采用副本
+    git(repo, 'checkout', '-q', '--', '.')
+    peer = make_task(0, files=("peer.txt",))
+    original = "echo note > notes.txt && echo done > src/main.txt && sleep 1.5"
+    policy = HedgePolicy(min_peers=1, min_runtime=0)
+    hedger = WorktreeHedger(policy, [peer, task], lambda i, cwd: run_in(cwd, "echo final > src/main.txt"),
+                            cwd=str(repo))
+    done = []
+    output = io.StringIO()
+    with redirect_stdout(output):
+        run_bounded([lambda: run_in(str(repo), "echo peer > peer.txt"), lambda: run_in(str(repo), original)], 3,
+                    lambda i, r, e: done.append((i, r.success)), hedge=hedger)
+    assert sorted(done) == [(0, True), (1, True)] and policy.original_won == 1, (done, output.getvalue())
+    assert "不采用副本" in output.getvalue(), output.getvalue()
+    assert (repo / "src" / "main.txt").read_text() == "done\n" and (repo / "notes.txt").exists()
+    assert len(git(repo, 'worktree', 'list').splitlines()) == 1
+    print("  ✅ 独占运行时原任务的范围外改动还原为基准版本；无法确定归属时不采用副本，按原任务的结果处理")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_policy(tmp_dir)
+            run_test_hedge_wins(tmp_dir)
+            run_test_original_wins(tmp_dir)
+            run_test_worktree(tmp_dir)
+            run_test_stray_writes(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
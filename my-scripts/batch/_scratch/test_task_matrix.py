@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试矩阵任务（matrix= / matrix_file= 参数化 TASK 按需展开）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) matrix= 笛卡尔积展开：子任务序号、占位符替换、后续任务顺延；模板只存一份
+#   (2) matrix_file= 行展开（键值行 / 单值行绑定 {item}），与 matrix= 组合；格式错误带位置报错
+#   (3) depends_on：引用模板 id = 依赖全部子任务；模板的 depends_on 由子任务继承；序号引用单个子任务
+#   (4) 冲突检测按子任务替换后的 文件: 进行
+#   (5) 1 万组合：执行计划缓存和状态文件紧凑（不按子任务重复保存描述），执行全部子任务
+#   (6) 监视模式：未开始阶段的矩阵修改整体替换；matrix_file 修改使执行计划缓存失效
+
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from dag_parser import DAGParser, ConflictDetector, TaskList, task_entries
+from dag_executor import DAGExecutor
+from plan_cache import PlanCache
+from plan_watcher import merge_plan
+from ref_resolver import RefResolver
+
+
+MATRIX_DAG = """# 矩阵测试
+
+## STAGE ## name="migrate" mode="parallel" max_workers="4"
+
+## TASK ## id="prep"
+准备
+文件: tools/**
+
+## TASK ## id="port" matrix="module=auth,billing,search;lang=ts,py" depends_on="prep"
+把 {module} 模块迁移到 {lang}
+文件: src/{module}/{lang}/**
+验证: make test-{module}-{lang}
+
+## TASK ## depends_on="port"
+汇总
+"""
+
+
+def write(path: str, content: str):
+    Path(path).write_text(content, encoding="utf-8")
+
+
+def parse(path: str = "dag.md"):
+    parser = DAGParser(path, resolver=RefResolver())
+    return parser, parser.parse()
+
+
+def expect_error(content: str, fragment: str):
+    write("bad.md", content)
+    try:
+        parse("bad.md")
+        raise AssertionError(f"未报错: {fragment}")
+    except ValueError as e:
+        assert fragment in str(e), e
+
+
+def run_test_inline(tmp_dir: Path):
+    """场景 1: matrix= 展开"""
+    print("\n=== 测试 1: matrix= 展开 ===")
+    write("dag.md", MATRIX_DAG)
+    parser, stages = parse()
+    tasks = stages[0].tasks
+    assert isinstance(tasks, TaskList) and len(task_entries(tasks)) == 3
+    assert len(tasks) == 8, len(tasks)
+    assert [t.task_id for t in tasks] == list(range(1, 9))
+
+    first, last = tasks[1], tasks[6]
+    assert first.description == "把 auth 模块迁移到 ts", first.description
+    assert first.files == ["src/auth/ts/**"] and first.verify_cmd == "make test-auth-ts"
+    assert first.params == "module=auth, lang=ts", first.params
+    assert last.description == "把 search 模块迁移到 py"
+    assert tasks[-1].description == "汇总" and tasks[-1].task_id == 8
+    assert first.location == last.location == "dag.md:9-12"
+
+    assert (0, 2) not in parser.task_index and (0, 8) in parser.task_index
+    executor = DAGExecutor("dag.md", lambda t: True, use_state=False, use_plan_cache=False)
+    executor.parse()
+    assert executor.get_task(0, 4).description == "把 billing 模块迁移到 ts"
+
+    write("plain.md", MATRIX_DAG.replace("把 {module} 模块迁移到 {lang}", "迁移"))
+    assert parse("plain.md")[1][0].tasks[2].description == "迁移（module=auth, lang=py）"
+    print("  ✅ 笛卡尔积按需展开，占位符替换，后续任务序号顺延")
+
+
+def run_test_matrix_file(tmp_dir: Path):
+    """场景 2: matrix_file= 与格式错误"""
+    print("\n=== 测试 2: matrix_file= ===")
+    write("modules.txt", "# 模块列表\nmodule=auth;owner=alice\n\nmodule=billing;owner=bob\n")
+    write("items.txt", "core\nweb\n")
+    write("dag.md", '## STAGE ## name="s" mode="serial"\n\n'
+                    '## TASK ## matrix_file="modules.txt" matrix="lang=ts,py"\n'
+                    '{owner} 迁移 {module} 到 {lang}\n\n'
+                    '## TASK ## matrix_file="items.txt"\n检查 {item}\n文件: pkg/{item}/**\n')
+    parser, stages = parse()
+    assert [t.description for t in stages[0].tasks] == [
+        "alice 迁移 auth 到 ts", "alice 迁移 auth 到 py", "bob 迁移 billing 到 ts", "bob 迁移 billing 到 py",
+        "检查 core", "检查 web"], [t.description for t in stages[0].tasks]
+    assert stages[0].tasks[5].files == ["pkg/web/**"]
+    assert str(tmp_dir.resolve() / "modules.txt") in parser.sources
+
+    expect_error('## STAGE ## name="s" mode="serial"\n## TASK ## matrix_file="missing.txt"\nx\n',
+                 "bad.md:2: matrix_file 不存在: missing.txt")
+    expect_error('## STAGE ## name="s" mode="serial"\n## TASK ## matrix="module"\nx\n',
+                 "bad.md:2: matrix 维度格式应为")
+    expect_error('## STAGE ## name="s" mode="serial"\n## TASK ## matrix="a=1;a=2"\nx\n',
+                 "matrix 参数名重复: a")
+    write("broken.txt", "module=a\nbad row=x\n")
+    expect_error('## STAGE ## name="s" mode="serial"\n## TASK ## matrix_file="broken.txt"\nx\n',
+                 "broken.txt:2: matrix_file 行格式")
+    write("empty.txt", "# 只有注释\n")
+    expect_error('## STAGE ## name="s" mode="serial"\n## TASK ## matrix_file="empty.txt"\nx\n',
+                 "bad.md:2: matrix 展开后没有任何子任务")
+    print("  ✅ 文件行展开、与 matrix= 组合，格式错误带位置")
+
+
+def run_test_dependencies(tmp_dir: Path):
+    """场景 3: depends_on 与矩阵模板"""
+    print("\n=== 测试 3: depends_on ===")
+    write("dag.md", MATRIX_DAG + '\n## STAGE ## name="review" mode="serial"\n\n## TASK ## depends_on="migrate.3"\n复查\n')
+    _, stages = parse()
+    tasks = stages[0].tasks
+    assert all(t.depends_on == [(0, 1)] for t in tasks[1:7])
+    assert tasks[7].depends_on == [(0, i) for i in range(2, 8)], tasks[7].depends_on
+    assert stages[1].tasks[0].depends_on == [(0, 3)]
+
+    expect_error('## STAGE ## name="s" mode="parallel"\n## TASK ## id="m" matrix="a=1,2" depends_on="m"\nx\n',
+                 "depends_on 不能依赖自身")
+    print("  ✅ 引用模板依赖全部子任务，子任务继承模板依赖")
+
+
+def run_test_conflicts(tmp_dir: Path):
+    """场景 4: 冲突检测按子任务的文件"""
+    print("\n=== 测试 4: 冲突检测 ===")
+    write("dag.md", '## STAGE ## name="p" mode="parallel" max_workers="4"\n\n'
+                    '## TASK ## matrix="module=a,b,c"\n改 {module}\n文件: src/{module}/**\n\n'
+                    '## TASK ##\n改公共配置\n文件: src/b/config.ts\n')
+    _, stages = parse()
+    conflicts = ConflictDetector.detect_conflicts(stages[0].tasks)
+    assert conflicts == {2: [4]}, conflicts
+    batches = ConflictDetector.create_batches(stages[0].tasks, conflicts)
+    assert sorted(len(batch) for batch in batches) == [2, 2], batches
+    print("  ✅ 子任务按替换后的文件范围检测冲突")
+
+
+def run_test_large_matrix(tmp_dir: Path):
+    """场景 5: 1 万组合的计划缓存、状态文件和执行"""
+    print("\n=== 测试 5: 1 万组合 ===")
+    task_dir = tmp_dir / ".task-big"
+    task_dir.mkdir()
+    write(str(task_dir / "dag.md"),
+          '## STAGE ## name="big" mode="serial"\n\n'
+          '## TASK ## matrix="a=' + ','.join(map(str, range(100))) + ';b=' + ','.join(map(str, range(100))) + '"\n'
+          '处理分片 {a}-{b}：' + '这是一段很长的任务说明。' * 20 + '\n文件: data/{a}/{b}.json\n')
+    entry = str(task_dir / "dag.md")
+
+    executed = []
+    executor = DAGExecutor(entry, lambda t: executed.append(t.params) or True, use_state=True)
+    stages = executor.parse()
+    assert len(stages[0].tasks) == 10000 and len(task_entries(stages[0].tasks)) == 1
+    assert os.path.getsize(task_dir / "plan.json") < 5000, os.path.getsize(task_dir / "plan.json")
+    assert len(PlanCache(entry).load().stages[0].tasks) == 10000
+
+    real_complete = executor.state_manager.complete_all
+    state_sizes = []
+
+    def complete_all(success):
+        state = executor.state_manager.state
+        task_states = state["stages"][0]["tasks"]
+        assert task_states[42] == {k: task_states[42][k] for k in ("task_id", "status", "params", "start_time",
+                                                                    "end_time", "duration") if k in task_states[42]}
+        state_sizes.append(len(json.dumps(state, ensure_ascii=False)))
+        real_complete(success)
+
+    executor.state_manager.complete_all = complete_all
+    executor.state_manager.save_state = lambda: None  # 每个任务都落盘太慢，只检查内存中的状态
+    with contextlib.redirect_stdout(io.StringIO()):  # 1 万个任务的进度输出
+        assert executor.execute()
+    assert len(executed) == 10000 and executed[-1] == "a=99, b=99", executed[-1]
+    # 描述约 250 字，按子任务重复保存时状态文件会超过 2.5MB
+    assert state_sizes[0] < 2_000_000, state_sizes
+    print(f"  ✅ 执行计划缓存 <5KB，状态 {state_sizes[0] // 1024}KB，执行全部 1 万个子任务")
+
+
+def run_test_watch(tmp_dir: Path):
+    """场景 6: 监视模式合并与执行计划缓存失效"""
+    print("\n=== 测试 6: 监视模式与缓存 ===")
+    write("dag.md", MATRIX_DAG)
+    _, stages = parse()
+    write("dag.md", MATRIX_DAG.replace("search;", "search,infra;"))
+    merge = merge_plan(stages, parse()[1], started=set(), closed_stages=set())
+    assert len(stages[0].tasks) == 10 and merge.changed_stages == {0}, merge
+    write("dag.md", MATRIX_DAG)
+    merge = merge_plan(stages, parse()[1], started={(0, 1)}, closed_stages=set())
+    assert len(stages[0].tasks) == 10 and any("矩阵任务所在阶段的修改未应用" in m for m in merge.rejected), merge
+
+    write("list.txt", "a\nb\n")
+    write("cached.md", '## STAGE ## name="s" mode="serial"\n\n## TASK ## matrix_file="list.txt"\n处理 {item}\n')
+    DAGExecutor("cached.md", lambda t: True, use_state=False).parse()
+    assert PlanCache("cached.md").load() is not None
+    write("list.txt", "a\nb\nc\n")
+    assert PlanCache("cached.md").load() is None
+    assert len(DAGExecutor("cached.md", lambda t: True, use_state=False).parse()[0].tasks) == 3
+    print("  ✅ 未开始阶段整体替换、已开始只报告；matrix_file 修改使缓存失效")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_inline(tmp_dir)
+            run_test_matrix_file(tmp_dir)
+            run_test_dependencies(tmp_dir)
+            run_test_conflicts(tmp_dir)
+            run_test_large_matrix(tmp_dir)
+            run_test_watch(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
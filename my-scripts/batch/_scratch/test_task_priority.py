@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试关键路径优先（--critical-path）与 TASK 标记行 priority="N"
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) priority= 解析（解析器 / DAGBuilder，非法取值带位置报错）与启发式估计（描述长度、文件范围宽度）
+#   (2) 耗时估计：以往状态文件中已完成任务的耗时按指纹匹配取中位数，状态文件记录指纹
+#   (3) critical_path：depends_on、串行阶段链和阶段整体完成都计入剩余关键路径
+#   (4) DAGScheduler：就绪任务按 priority= 和剩余关键路径启动；未传入 priority 时保持任务顺序
+#   (5) DAGExecutor 批次执行：提交顺序按排序键，--dry-run 显示排序依据；默认不改变顺序
+#   (6) 并行批次（batchcc 真实执行器）写下的状态文件含耗时，耗时估计与关键路径排序能用上
+
+import asyncio
+import io
+import os
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+import batchcc
+from batch_executor_base import TaskResult
+from dag_builder import DAGBuilder
+from dag_executor import DAGExecutor
+from dag_parser import DAGParser, TaskNode
+from dag_scheduler import DAGScheduler
+from state_manager import StateManager
+from task_priority import (DurationEstimator, TaskPriority, critical_path, heuristic_duration, load_durations,
+                           scope_breadth)
+from write_sets import task_fingerprint
+
+DAG = """# 排序
+
+## STAGE ## name="build" mode="parallel" max_workers="1"
+
+## TASK ## id="short"
+短任务
+文件: a.py
+
+## TASK ## id="long"
+长任务
+文件: b.py
+
+## TASK ## priority="5"
+紧急任务
+文件: c.py
+
+## STAGE ## name="use" mode="serial"
+
+## TASK ## depends_on="build.long"
+长任务之后
+"""
+
+
+def write(path: str, content: str):
+    Path(path).write_text(content, encoding="utf-8")
+
+
+def make_task(task_id: int, description: str, files=()) -> TaskNode:
+    return TaskNode(task_id=task_id, description=description, files=list(files), excludes=[], verify_cmd="")
+
+
+def run_test_params(tmp_dir: Path):
+    """场景 1: priority= 与启发式估计"""
+    print("\n=== 测试 1: priority= 解析与启发式估计 ===")
+    write("dag.md", DAG)
+    stages = DAGParser("dag.md").parse()
+    assert [task.priority for task in stages[0].tasks] == [0, 0, 5]
+    write("bad.md", '## STAGE ## name="s" mode="parallel"\n\n## TASK ## priority="high"\n任务\n')
+    try:
+        DAGParser("bad.md").parse()
+        assert False, "priority 非整数应报错"
+    except ValueError as e:
+        assert "bad.md:3" in str(e) and "priority" in str(e), e
+    builder = DAGBuilder().stage("s").task("任务", priority=-2)
+    assert builder.build()[0].tasks[0].priority == -2
+    try:
+        DAGBuilder().stage("s").task("任务", priority="x")
+        assert False
+    except ValueError as e:
+        assert "Stage 1 Task 1" in str(e), e
+
+    narrow = make_task(1, "改一个文件", ["src/a.py"])
+    broad = make_task(2, "改一个文件", ["src/**"])
+    assert scope_breadth(narrow) == 1 and scope_breadth(broad) == 8 and scope_breadth(make_task(3, "x")) == 3
+    assert heuristic_duration(broad) > heuristic_duration(narrow)
+    assert heuristic_duration(make_task(4, "改" * 200, ["src/a.py"])) > heuristic_duration(narrow)
+    print("  ✅ priority= 解析（非法取值带位置），范围越宽 / 描述越长估计越久")
+
+
+def run_test_estimator(tmp_dir: Path):
+    """场景 2: 以往状态文件中的耗时"""
+    print("\n=== 测试 2: 耗时估计 ===")
+    os.makedirs(".task-old", exist_ok=True)
+    write(".task-old/dag.md", DAG)
+    stages = DAGParser(".task-old/dag.md").parse()
+    state = StateManager(".task-old/dag.md")
+    state.init_stages(stages)
+    tasks = state.state["stages"][0]["tasks"]
+    assert tasks[1]["fingerprint"] == task_fingerprint(stages[0].tasks[1]), "状态文件记录任务指纹"
+    tasks[0].update(status="completed", duration=30.0)
+    tasks[1].update(status="completed", duration=900.0)
+    tasks[2].update(status="failed", duration=5000.0)
+    state.save_state()
+    # 另一次运行的同一个任务
+    os.makedirs(".task-older", exist_ok=True)
+    write(".task-older/state.json", '{"stages": [{"tasks": [{"status": "completed", "duration": 1100, "fingerprint": "%s"},'
+          ' {"status": "completed", "duration": 1000, "fingerprint": "%s"}]}]}'
+          % (tasks[1]["fingerprint"], tasks[1]["fingerprint"]))
+    write("broken.state.json", "{")
+
+    estimator = DurationEstimator.from_state_files()
+    assert estimator.history(stages[0].tasks[0]) == 30.0
+    assert estimator.history(stages[0].tasks[1]) == 1000.0, "取中位数（900 / 1000 / 1100）"
+    assert estimator.history(stages[0].tasks[2]) is None, "失败任务的耗时不参与估计"
+    assert estimator.estimate(stages[0].tasks[2]) == heuristic_duration(stages[0].tasks[2])
+    assert load_durations(["missing.json"]) == {}
+    print("  ✅ 已完成任务的耗时按指纹匹配（跨多个状态文件取中位数），失败和损坏的记录被忽略")
+    return estimator
+
+
+def run_test_critical_path(tmp_dir: Path):
+    """场景 3: 剩余关键路径"""
+    print("\n=== 测试 3: critical_path ===")
+    builder = DAGBuilder()
+    builder.stage("a", "parallel", max_workers=4)
+    builder.task("x", id="x").task("y", id="y")
+    builder.stage("b", "serial")
+    builder.task("x 之后", depends_on="a.x").task("串行第二个")
+    builder.stage("c", "parallel")
+    builder.task("最后")
+    weights = {"x": 10, "y": 100, "x 之后": 50, "串行第二个": 5, "最后": 1}
+    ranks = critical_path(builder.build(), lambda task: weights[task.description])
+    # 阶段 c 等待阶段 b 整体完成，阶段 b 整体完成又等待阶段 a 整体完成
+    assert ranks == {(0, 1): 10 + 50 + 5 + 1, (0, 2): 100 + 1, (1, 1): 50 + 5 + 1, (1, 2): 5 + 1, (2, 1): 1}, ranks
+
+    # 万级串行链不递归
+    big = DAGBuilder().stage("chain", "serial")
+    for i in range(20000):
+        big.task(f"t{i}")
+    ranks = critical_path(big.build(), lambda task: 1.0)
+    assert ranks[(0, 1)] == 20000 and ranks[(0, 20000)] == 1
+    print("  ✅ depends_on、串行链、阶段整体完成都计入；2 万任务的串行链正常计算")
+
+
+def run_test_scheduler(tmp_dir: Path, estimator: DurationEstimator):
+    """场景 4: 调度器启动顺序"""
+    print("\n=== 测试 4: DAGScheduler ===")
+    stages = DAGParser("dag.md").parse()
+
+    def run(priority):
+        ran = []
+        DAGScheduler(stages, max_total_workers=1, priority=priority).run(lambda task: ran.append(task.description) or True)
+        return ran
+
+    assert run(None) == ["短任务", "长任务", "紧急任务", "长任务之后"]
+    assert run(TaskPriority()) == ["紧急任务", "短任务", "长任务", "长任务之后"], "priority= 不开启关键路径时也生效"
+    assert run(TaskPriority(estimator)) == ["紧急任务", "长任务", "长任务之后", "短任务"], run(TaskPriority(estimator))
+    print("  ✅ priority= 最先，其次剩余关键路径最长的任务（长任务之后的下游随即启动）；默认顺序不变")
+
+
+def run_test_executor(tmp_dir: Path):
+    """场景 5: 批次提交顺序与 --dry-run"""
+    print("\n=== 测试 5: DAGExecutor 批次执行 ===")
+    batch_dag = DAG.replace('## TASK ## depends_on="build.long"', '## TASK ##')
+    submitted = []
+
+    def parallel(tasks, max_workers):
+        submitted.append([task.description for task in tasks])
+        return [TaskResult(task_id=task.task_id, command="", success=True, duration=0) for task in tasks]
+
+    def run(critical: bool):
+        # 成功后任务目录被清理，每次重新生成
+        os.makedirs(".task-order", exist_ok=True)
+        write(".task-order/dag.md", batch_dag)
+        submitted.clear()
+        executor = DAGExecutor(".task-order/dag.md", lambda task: True, use_state=False, use_plan_cache=False,
+                               critical_path=critical)
+        with redirect_stdout(io.StringIO()):
+            assert executor.execute(parallel)
+        return submitted[0]
+
+    assert run(False) == ["紧急任务", "短任务", "长任务"]
+    assert run(True) == ["紧急任务", "长任务", "短任务"], "长任务有历史记录（约 1000s）"
+
+    plan = io.StringIO()
+    with redirect_stdout(plan):
+        DAGExecutor(".task-old/dag.md", lambda task: True, use_state=False, use_plan_cache=False,
+                    critical_path=True).print_plan()
+    output = plan.getvalue()
+    assert "任务排序: 关键路径优先（priority= 覆盖；2/4 个任务有历史耗时" in output, output
+    assert "Stage 1 Task 3: priority=5" in output and "（历史 16m40s）" in output, output
+
+    plan = io.StringIO()
+    with redirect_stdout(plan):
+        DAGExecutor(".task-old/dag.md", lambda task: True, use_state=False, use_plan_cache=False).print_plan()
+    assert "任务排序: priority= 较大的任务先启动" in plan.getvalue()
+    print("  ✅ 批次按排序键提交，--dry-run 显示排在最前的任务及估计来源")
+
+
+class BatchExecutor(batchcc.ClaudeCodeBatchExecutor):
+    """真实的 batchcc 执行器，只替换子进程调用：按描述返回指定耗时"""
+
+    DURATIONS = {"短任务": 30.5, "长任务": 900.25}
+
+    async def execute_command_async(self, args, automation_prefix=None):
+        task_id, command, _ = args
+        await asyncio.sleep(0.01)
+        return TaskResult(task_id=task_id, command=command, success=True, duration=self.durations[task_id])
+
+    def _auto_commit_if_needed(self, task_description, task_id=None, task=None):
+        pass
+
+
+def run_test_parallel_state(tmp_dir: Path):
+    """场景 6: 并行批次写下的耗时"""
+    print("\n=== 测试 6: 并行批次的状态文件 ===")
+    os.makedirs("parallel/.task-par", exist_ok=True)
+    write("parallel/.task-par/dag.md", DAG)
+    stages = DAGParser("parallel/.task-par/dag.md").parse()
+    state = StateManager("parallel/.task-par/dag.md")
+    state.init_stages(stages)
+    batch = stages[0].tasks[:2]
+    executor = BatchExecutor()
+    executor.durations = {task.task_id: BatchExecutor.DURATIONS[task.description] for task in batch}
+    executor.set_state_manager(state, 0)
+    with redirect_stdout(io.StringIO()):
+        assert all(result.success for result in executor.execute_dag_batch_parallel(batch, 2))
+
+    estimator = DurationEstimator.from_state_files([state.state_file])
+    assert [estimator.history(task) for task in batch] == [30.5, 900.25], "并行批次的任务也有耗时"
+    priority = TaskPriority(estimator)
+    assert [task.description for task in priority.sort(batch, priority.order(stages))] == ["长任务", "短任务"]
+    print("  ✅ 并行批次写下的耗时可供 --critical-path 估计，长任务先启动")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_params(tmp_dir)
+            estimator = run_test_estimator(tmp_dir)
+            run_test_critical_path(tmp_dir)
+            run_test_scheduler(tmp_dir, estimator)
+            run_test_executor(tmp_dir)
+            run_test_parallel_state(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
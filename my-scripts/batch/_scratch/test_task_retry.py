@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试瞬时失败重试（stderr/退出码分类 + 任务级 retries/backoff + 指数退避不占并发槽位 + 状态文件记录）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) 分类与策略：限流/网络/5xx/超时/被终止为瞬时失败，普通失败不重试；退避指数增长、抖动、封顶，任务级覆盖；默认不重试
+#   (2) 解析：TASK 标记行 retries= / backoff=（矩阵子任务继承，非法取值报 file:line），DAGBuilder 同名参数
+#   (3) run_bounded：退避期间释放槽位，其他任务照常运行，on_done 只收到最终结果；真实子进程的 stderr 被识别
+#   (4) DAGScheduler：瞬时失败退避后重新排队（不再回调 on_start / on_finish），永久失败不重试，用完重试按失败处理
+#   (5) DAGExecutor：重试记入 state.json 的 attempts，阶段不进入失败流程；--dry-run 与结束统计；StderrTail
+
+import asyncio
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from async_engine import run_bounded
+from batch_executor_base import BaseBatchExecutor, StderrTail, TaskResult
+from dag_builder import DAGBuilder
+from dag_executor import DAGExecutor
+from dag_parser import DAGParser
+from dag_scheduler import DAGScheduler
+from state_manager import StateManager
+from task_retry import RetryPolicy, classify, classify_result, parse_backoff
+
+DAG = """# 重试
+
+## STAGE ## name="build" mode="parallel" max_workers="2"
+
+## TASK ## id="api" retries="1"
+构建 api（限流一次）
+文件: api/
+
+## TASK ## backoff="0.05s..0.1s"
+构建 web（网络两次）
+文件: web/
+
+## TASK ##
+构建 docs
+文件: docs/
+
+## STAGE ## name="check" mode="serial"
+
+## TASK ## depends_on="build.api"
+检查 api
+"""
+
+
+def failure(error: str = "", **kwargs) -> TaskResult:
+    return TaskResult(task_id=1, command="", success=False, duration=0.01, error_msg=error, **kwargs)
+
+
+def run_test_policy(tmp_dir: Path):
+    """场景 1: 分类与策略"""
+    print("\n=== 测试 1: 分类与退避策略 ===")
+    assert classify("API Error: 429 Too Many Requests") == "限流"
+    assert classify("Error: read ECONNRESET") == "网络" and classify("socket hang up") == "网络"
+    assert classify("API Error: 500 Internal Server Error") == "服务端错误" and classify("HTTP 503") == "服务端错误"
+    assert classify("AssertionError: 500 != 499") is None and classify("SyntaxError: invalid syntax") is None
+    assert classify("", exit_code=137) == "被终止" and classify("", exit_code=1) is None
+    assert classify_result(failure(timed_out=True)) == "超时"
+    assert classify_result(TaskResult(task_id=1, command="", success=False, duration=0,
+                                      output="..." * 2000 + "\nAPI Error: 529 overloaded")) == "限流"
+    assert classify_result(ConnectionResetError("Connection reset by peer")) == "网络"
+    assert classify_result(False) is None and classify_result(TaskResult(1, "", True, 0)) is None
+    assert parse_backoff("30s") == (30, 600) and parse_backoff("1m..1h") == (60, 3600)
+    for bad in ("abc", "10m..1m", "5x"):
+        try:
+            parse_backoff(bad)
+            assert False, bad
+        except ValueError:
+            pass
+
+    policy = RetryPolicy(retries=3, backoff="10s..25s", rng=lambda: 0.99999)
+    delays = [round(policy.next_retry(n, failure("429"))[1]) for n in (1, 2, 3)]
+    assert delays == [10, 20, 25], delays  # 指数增长，最大值封顶
+    assert policy.next_retry(4, failure("429")) is None and policy.exhausted == 1
+    assert policy.next_retry(1, failure("测试失败")) is None  # 永久失败不重试，也不计入用完
+    low = RetryPolicy(retries=1, backoff="10s", rng=lambda: 0.0)
+    assert low.next_retry(1, failure("ETIMEDOUT")) == ("网络", 5.0)  # 抖动下限为一半
+
+    class Task:
+        retries, backoff = 0, ""
+    assert policy.next_retry(1, failure("429"), Task()) is None
+    Task.retries, Task.backoff = 5, "1m"
+    assert policy.limits(Task()) == (5, 60, 1200)
+    assert policy.report() == ["🔁 瞬时失败重试: 3 次（限流 3），1 个任务重试用完仍失败"]
+
+    default = RetryPolicy()  # 默认不重试，需 --retries N 或任务级 retries="N" 开启
+    assert default.next_retry(1, failure("429")) is None and "不重试" in default.describe()
+    assert default.next_retry(1, failure("429"), Task())[0] == "限流"
+    print("  ✅ 限流/网络/5xx/超时/被终止识别为瞬时失败；退避指数增长、抖动、封顶；任务级参数覆盖默认值；默认不重试")
+
+
+def run_test_parse(tmp_dir: Path):
+    """场景 2: 解析"""
+    print("\n=== 测试 2: 解析 retries= / backoff= ===")
+    Path("dag.md").write_text(DAG + '\n## STAGE ## name="m" mode="parallel"\n\n'
+                              '## TASK ## matrix="x=a,b" retries="4"\n处理 {x}\n', encoding="utf-8")
+    stages = DAGParser("dag.md").parse()
+    api, web, docs = stages[0].tasks
+    assert (api.retries, api.backoff) == (1, "") and (web.retries, web.backoff) == (None, "0.05s..0.1s")
+    assert docs.retries is None and [t.retries for t in stages[2].tasks] == [4, 4]
+
+    for marker, message in (('retries="-1"', "重试次数应为非负整数"), ('backoff="soon"', "时长格式")):
+        Path("bad.md").write_text(f'# x\n\n## STAGE ## name="s" mode="serial"\n\n## TASK ## {marker}\n任务\n',
+                                  encoding="utf-8")
+        try:
+            DAGParser("bad.md").parse()
+            assert False, marker
+        except ValueError as e:
+            assert "bad.md:5" in str(e) and message in str(e), e
+
+    builder = DAGBuilder().stage("s", mode="parallel").task("a", retries=3, backoff="1m..5m").task("b")
+    a, b = builder.build()[0].tasks
+    assert (a.retries, a.backoff, b.retries) == (3, "1m..5m", None)
+    try:
+        DAGBuilder().stage("s").task("a", backoff="5m..1m")
+        assert False
+    except ValueError as e:
+        assert "Stage 1 Task 1" in str(e)
+    print("  ✅ 标记行参数写入 TaskNode（矩阵子任务继承），非法取值带位置报错；DAGBuilder 同样支持")
+
+
+def run_test_engine(tmp_dir: Path):
+    """场景 3: run_bounded"""
+    print("\n=== 测试 3: run_bounded 退避不占槽位 ===")
+    policy = RetryPolicy(retries=2, backoff="0.2s..0.2s", rng=lambda: 0.99999)
+    calls, events, done = {}, [], []
+    running, peak = [0], [0]
+
+    def job(index: int, failures: int):
+        async def run():
+            calls[index] = calls.get(index, 0) + 1
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            events.append(("start", index, time.monotonic()))
+            await asyncio.sleep(0.05)
+            running[0] -= 1
+            ok = calls[index] > failures
+            return TaskResult(task_id=index, command="", success=ok, duration=0.05,
+                              error_msg="" if ok else "API Error: 529 overloaded")
+        return run
+
+    retries = []
+
+    def retry(index, result, error, attempt):
+        decision = policy.next_retry(attempt, result if error is None else error)
+        if decision:
+            retries.append((index, attempt))
+            return decision[1]
+        return None
+
+    # 槽位 1：任务 0 失败后退避 0.2s，期间任务 1、2 依次运行
+    run_bounded([job(0, 1), job(1, 0), job(2, 0)], 1, lambda i, r, e: done.append((i, r.success)), retry=retry)
+    assert peak[0] == 1 and retries == [(0, 1)] and calls == {0: 2, 1: 1, 2: 1}
+    assert sorted(done) == [(0, True), (1, True), (2, True)] and done[-1] == (0, True), done
+    starts = [index for kind, index, _ in events if kind == "start"]
+    assert starts == [0, 1, 2, 0], starts
+
+    # 重试用完：on_done 收到最后一次失败
+    done.clear()
+    run_bounded([job(3, 5)], 2, lambda i, r, e: done.append((i, r.success)), retry=retry)
+    assert calls[3] == 3 and done == [(0, False)], (calls, done)
+
+    # 真实子进程：第一次 stderr 输出 529，第二次成功
+    class ShellExecutor(BaseBatchExecutor):
+        def build_command(self, task_description: str) -> str:
+            return task_description
+
+    executor = ShellExecutor("test")
+    executor.retry_policy = RetryPolicy(retries=1, backoff="0.05s")
+    script = ('if [ -f {0}.seen ]; then echo ok; else touch {0}.seen; '
+              'echo "API Error: 529 overloaded" >&2; exit 1; fi')
+    output = io.StringIO()
+    with redirect_stdout(output):
+        results = executor.execute_parallel([script.format("x"), script.format("y"), "echo bad >&2; exit 2"],
+                                            str(tmp_dir), 2)
+    assert [r.success for r in results] == [True, True, False], results
+    assert results[2].exit_code == 2 and "🔁 [1] 限流（第 1 次执行失败）" in output.getvalue()
+    assert executor.retry_policy.reasons == {"限流": 2}
+    print("  ✅ 退避期间其他任务占用槽位，到期后重新排队；只回调最终结果；子进程 stderr 与退出码参与分类")
+
+
+def run_test_scheduler(tmp_dir: Path):
+    """场景 4: DAGScheduler"""
+    print("\n=== 测试 4: DAGScheduler 重新排队 ===")
+    Path("dag.md").write_text(DAG, encoding="utf-8")
+    stages = DAGParser("dag.md").parse()
+    lock, calls, started, finished, retried = threading.Lock(), {}, [], [], []
+    plans = {"构建 api（限流一次）": ["429"], "构建 web（网络两次）": ["ECONNRESET", "socket hang up"],
+             "构建 docs": [], "检查 api": []}
+
+    def runner(task):
+        with lock:
+            count = calls[task.description] = calls.get(task.description, 0) + 1
+        errors = plans[task.description]
+        ok = count > len(errors)
+        return TaskResult(task_id=task.task_id, command="", success=ok, duration=0.01,
+                          error_msg="" if ok else errors[count - 1])
+
+    policy = RetryPolicy(retries=2, backoff="0.05s..0.1s")
+    scheduler = DAGScheduler(stages, retry=policy)
+    assert scheduler.run(runner, on_start=lambda t: started.append(t.description),
+                         on_finish=lambda t, ok, r: finished.append((t.description, ok)),
+                         on_retry=lambda t, n, reason, delay, r: retried.append((t.description, n, reason)))
+    assert calls == {"构建 api（限流一次）": 2, "构建 web（网络两次）": 3, "构建 docs": 1, "检查 api": 1}, calls
+    assert sorted(started) == sorted(plans) and all(ok for _, ok in finished) and len(finished) == 4
+    assert sorted(retried) == [("构建 api（限流一次）", 1, "限流"), ("构建 web（网络两次）", 1, "网络"),
+                               ("构建 web（网络两次）", 2, "网络")], retried
+
+    # 任务级 retries="1"：第二次仍限流即失败；永久失败不重试
+    calls.clear()
+    plans["构建 api（限流一次）"] = ["429", "429", "429"]
+    plans["构建 docs"] = ["SyntaxError"]
+    finished.clear()
+    assert not DAGScheduler(stages, retry=policy, keep_going=True).run(
+        runner, on_finish=lambda t, ok, r: finished.append((t.description, ok)))
+    assert calls["构建 api（限流一次）"] == 2 and calls["构建 docs"] == 1 and "检查 api" not in calls, calls
+    assert ("构建 web（网络两次）", True) in finished
+
+    # 失败即停止：退避中的任务不再重试，按最近一次失败结束
+    calls.clear()
+    plans["构建 api（限流一次）"] = []
+    plans["构建 web（网络两次）"] = ["ECONNRESET"]
+    plans["构建 docs"] = ["致命错误"]
+    finished.clear()
+    slow = RetryPolicy(retries=2, backoff="5s")
+    start = time.monotonic()
+    assert not DAGScheduler(stages, max_total_workers=1, retry=slow).run(
+        runner, on_finish=lambda t, ok, r: finished.append((t.description, ok)))
+    assert time.monotonic() - start < 2 and calls["构建 web（网络两次）"] == 1, calls
+    assert finished == [("构建 api（限流一次）", True), ("构建 docs", False), ("构建 web（网络两次）", False)], finished
+    print("  ✅ 瞬时失败退避后重新排队，依赖它的任务等重试成功；任务级 retries 生效，永久失败直接失败")
+
+
+class FakeRunner:
+    """depends_on 调度的 task_runner：前 N 次返回限流"""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, task, global_goal="", stage_context="", context_refs=None):
+        with self.lock:
+            count = self.calls[task.description] = self.calls.get(task.description, 0) + 1
+        ok = count > self.failures.get(task.description, 0)
+        return TaskResult(task_id=task.task_id, command="", success=ok, duration=0.01,
+                          error_msg="" if ok else "API Error: 429 rate_limit_error", exit_code=None if ok else 1)
+
+
+def run_test_executor(tmp_dir: Path):
+    """场景 5: DAGExecutor + 状态文件"""
+    print("\n=== 测试 5: DAGExecutor 与状态文件 ===")
+    os.makedirs(".task-retry", exist_ok=True)
+    entry = ".task-retry/dag.md"
+    Path(entry).write_text(DAG, encoding="utf-8")
+    runner = FakeRunner({"构建 api（限流一次）": 1, "构建 web（网络两次）": 2})
+    policy = RetryPolicy(retries=2, backoff="0.05s..0.1s")
+    executor = DAGExecutor(entry, lambda task: True, use_plan_cache=False, retry_policy=policy)
+    output = io.StringIO()
+    with redirect_stdout(output):
+        executor.print_plan()
+        assert executor.execute(task_runner=runner)
+    text = output.getvalue()
+    assert "失败重试: 瞬时失败（限流/网络/服务端错误/超时）最多重试 2 次" in text
+    assert "Stage 1 Task 1: 重试 1 次" in text and "Stage 1 Task 2: 重试 2 次，退避 0.05s..0.1s" in text
+    assert "🔁 Stage 1 Task 1 限流（第 1 次执行失败）" in text and "❌" not in text, text
+    assert "🔁 瞬时失败重试: 3 次（限流 3）" in text
+
+    stages = executor.state_manager.state["stages"]  # 全部成功后任务目录已清理，检查内存中的状态
+    api, web, docs = stages[0]["tasks"]
+    assert api["status"] == "completed" and [a["attempt"] for a in api["attempts"]] == [1]
+    assert [a["reason"] for a in web["attempts"]] == ["限流", "限流"] and "attempts" not in docs
+    assert "rate_limit_error" in web["attempts"][0]["error"] and web["attempts"][0]["backoff"] <= 0.1
+    assert stages[0]["status"] == "completed"
+
+    # 重试用完：记为失败，attempts 保留在状态文件中
+    os.makedirs(".task-retry", exist_ok=True)
+    Path(entry).write_text(DAG, encoding="utf-8")
+    runner = FakeRunner({"构建 api（限流一次）": 9})
+    with redirect_stdout(io.StringIO()):
+        assert not DAGExecutor(entry, lambda task: True, use_plan_cache=False, retry_policy=policy).execute(
+            task_runner=runner)
+    state = StateManager(entry)
+    state.load_state()
+    api = state.state["stages"][0]["tasks"][0]
+    assert api["status"] == "failed" and len(api["attempts"]) == 1 and runner.calls["构建 api（限流一次）"] == 2
+    output = io.StringIO()
+    with redirect_stdout(output):
+        state.print_resume_info()
+    assert "已重试: 1 次（限流）" in output.getvalue()
+
+    # 串行执行的 stderr 转发并保留末尾
+    process = subprocess.Popen("echo 进度; echo 'Error: ECONNRESET' >&2; exit 1", shell=True, text=True,
+                               stderr=subprocess.PIPE, stdout=subprocess.DEVNULL)
+    stderr = io.StringIO()
+    real, sys.stderr = sys.stderr, stderr
+    try:
+        tail = StderrTail(process.stderr)
+        code = process.wait()
+        text = tail.text()
+    finally:
+        sys.stderr = real
+    assert code == 1 and text == "Error: ECONNRESET\n" == stderr.getvalue() and classify(text, code) == "网络"
+    print("  ✅ 重试记入 attempts，阶段照常完成；用完重试才失败；--dry-run 显示策略，结束输出统计")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_policy(tmp_dir)
+            run_test_parse(tmp_dir)
+            run_test_engine(tmp_dir)
+            run_test_scheduler(tmp_dir)
+            run_test_executor(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
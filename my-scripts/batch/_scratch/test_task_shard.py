@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试分片任务（shard="dir|file|N" 按仓库文件把大范围任务拆成并行子任务）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) plan_shards：dir / file / N 分组，N 按字节或文件数均衡，目录下文件全在组内时收窄为 目录/
+#   (2) 解析：子任务 文件: 互不重叠、无冲突、同一批并行；未展开的路径归入第一个分片；错误带位置报错
+#   (3) prompt 附加分片范围；DAGBuilder 与解析结果一致；--dry-run 显示分片
+#   (4) git add 新文件后执行计划缓存失效，重新分片
+
+import io
+import os
+import subprocess
+import sys
+import tempfile
+from contextlib import redirect_stdout
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+import batchcc
+from dag_builder import DAGBuilder
+from dag_executor import DAGExecutor
+from dag_parser import DAGParser, ConflictDetector
+from file_index import FileIndex
+from plan_cache import PlanCache
+from task_shard import plan_shards, MAX_SHARDS
+
+FILES = {
+    "src/api/a.py": 100,
+    "src/api/b.py": 100,
+    "src/core/x.py": 1000,
+    "src/core/y.py": 1000,
+    "src/core/deep/z.py": 50,
+    "src/main.py": 10,
+    "src/vendor/v.py": 5000,
+    "README.md": 10,
+}
+
+SHARD_DAG = """# 分片
+
+## STAGE ## name="dev" mode="parallel" max_workers="4"
+
+## TASK ## id="typing" shard="{shard}"
+补充类型注解
+文件: src/**, src/new_module.py
+排除: src/vendor/
+验证: make typecheck
+
+## TASK ## depends_on="typing"
+汇总
+"""
+
+
+def git(*args):
+    return subprocess.run(["git", "-c", "user.name=t", "-c", "user.email=t@t", *args], check=True,
+                          capture_output=True, text=True).stdout
+
+
+def write(path: str, content: str):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_text(content, encoding="utf-8")
+
+
+def expect_error(shard: str, fragment: str, content: str = SHARD_DAG):
+    write("bad.md", content.replace("{shard}", shard))
+    try:
+        DAGParser("bad.md").parse()
+    except ValueError as e:
+        assert "bad.md:5" in str(e) and fragment in str(e), e
+    else:
+        raise AssertionError(f"应报错: {fragment}")
+
+
+def run_test_plan(tmp_dir: Path):
+    """场景 1: 分组"""
+    print("\n=== 测试 1: plan_shards 分组 ===")
+    git("init", "-q")
+    for path, size in FILES.items():
+        write(path, "x" * size)
+    git("add", ".")
+    git("commit", "-q", "-m", "init")
+
+    index = FileIndex()
+    files, excludes = ["src/**"], ["src/vendor/"]
+    assert plan_shards(index, files, excludes, 'dir', "t") == [["src/api/"], ["src/core/"], ["src/main.py"]]
+    assert len(plan_shards(index, files, excludes, 'file', "t")) == 6
+    # 字节：src/core/ 超过平均值被拆开，两个大文件分到不同分组
+    assert plan_shards(index, files, excludes, 2, "t") == [
+        ["src/api/", "src/core/x.py"], ["src/core/deep/", "src/core/y.py", "src/main.py"]]
+    # 文件数：src/core/（3 个文件）不超过平均值，整体保留
+    assert plan_shards(index, files, excludes, 2, "t", by='files') == [["src/api/", "src/main.py"], ["src/core/"]]
+    assert plan_shards(index, ["src/api/**"], [], 5, "t") == [["src/api/a.py"], ["src/api/b.py"]]
+    assert plan_shards(index, files, excludes, 1, "t") == [["src/api/", "src/core/", "src/main.py"]]
+
+    for shards in (plan_shards(index, files, excludes, mode, "t") for mode in ('dir', 'file', 2, 3)):
+        bits = [index.task_bits(group, [])[0] for group in shards]
+        assert sum(bin(b).count('1') for b in bits) == 6 and all(a & b == 0 for a in bits for b in bits if a is not b)
+    print("  ✅ dir / file / N 分组互不重叠且覆盖全部文件，N 按字节或文件数均衡，整目录收窄为 目录/")
+
+
+def run_test_parse(tmp_dir: Path):
+    """场景 2: 解析与冲突检测"""
+    print("\n=== 测试 2: 解析 ===")
+    write("dag.md", SHARD_DAG.replace("{shard}", "dir"))
+    stages = DAGParser("dag.md").parse()
+    tasks = list(stages[0].tasks)
+    assert len(tasks) == 4 and [t.params for t in tasks[:3]] == ["shard=1/3", "shard=2/3", "shard=3/3"]
+    assert tasks[0].files == ["src/api/", "src/new_module.py"]  # 仓库中还没有的文件归入第一个分片
+    assert tasks[1].files == ["src/core/"] and tasks[1].verify_cmd == "make typecheck"
+    assert tasks[2].description == "补充类型注解（shard=3/3）"
+    assert tasks[3].depends_on == [(0, 1), (0, 2), (0, 3)]
+    assert ConflictDetector.detect_conflicts(tasks[:3]) == {}
+    assert ConflictDetector.detect_conflicts(tasks[:3], file_index=FileIndex()) == {}
+
+    executor = DAGExecutor("dag.md", lambda t: True, use_state=False, use_plan_cache=False)
+    executor.parse()
+    conflicts, batches = executor._get_stage_layout(executor.stages[0])
+    assert conflicts == {} and len(batches) == 1
+
+    expect_error("auto", 'shard 应为 dir、file 或正整数')
+    expect_error("dir", 'shard 不能与 matrix', SHARD_DAG.replace('id="typing"', 'matrix="a=1,2"'))
+    expect_error("dir", '没有匹配的文件', SHARD_DAG.replace("src/**, src/new_module.py", "lib/**"))
+    expect_error("dir", 'shard 需要 文件: 范围', SHARD_DAG.replace("文件: src/**, src/new_module.py\n", ""))
+    expect_error("dir", 'shard_by 应为 bytes 或 files', SHARD_DAG.replace('id="typing"', 'shard_by="lines"'))
+    for i in range(MAX_SHARDS + 1):
+        write(f"gen/{i}.txt", "x")
+    git("add", "gen/")
+    expect_error("file", f'超过上限 {MAX_SHARDS}', SHARD_DAG.replace("src/**, src/new_module.py", "gen/**"))
+    print("  ✅ 子任务文件范围不冲突、同一批并行，依赖模板 id 即依赖全部分片；取值错误带位置报错")
+
+
+def run_test_prompt(tmp_dir: Path):
+    """场景 3: prompt / DAGBuilder / --dry-run"""
+    print("\n=== 测试 3: prompt 与构建 ===")
+    write("dag.md", SHARD_DAG.replace("{shard}", "2"))
+    stages = DAGParser("dag.md").parse()
+    executor = batchcc.ClaudeCodeBatchExecutor()
+    prompt = executor._task_prompt(stages[0].tasks[1])
+    assert "## 分片范围（shard=2/2）" in prompt and "- src/core/y.py" in prompt and "src/api/" not in prompt
+    assert "分片范围" not in executor._task_prompt(stages[0].tasks[2])
+
+    builder = DAGBuilder("分片").stage("dev", mode="parallel", max_workers=4)
+    builder.task("补充类型注解", files="src/**, src/new_module.py", excludes="src/vendor/", verify="make typecheck",
+                 id="typing", shard=2)
+    built = builder.task("汇总", depends_on="typing").build()
+    assert [(t.files, t.params) for t in built[0].tasks] == [(t.files, t.params) for t in stages[0].tasks]
+    try:
+        DAGBuilder().stage("s").task("x", files="src/**", shard="dir", matrix="a=1,2")
+    except ValueError as e:
+        assert "shard 不能与 matrix" in str(e), e
+    else:
+        raise AssertionError("shard 与 matrix 同时使用应报错")
+
+    output = io.StringIO()
+    with redirect_stdout(output):
+        DAGExecutor("dag.md", lambda t: True, use_state=False, use_plan_cache=False).print_plan()
+    assert "分片: Task 1-2 由模板展开（shard=2，2 个子任务）" in output.getvalue(), output.getvalue()
+    print("  ✅ 分片子任务 prompt 附加范围说明，DAGBuilder 结果与解析一致，--dry-run 显示分片")
+
+
+def run_test_plan_cache(tmp_dir: Path):
+    """场景 4: 执行计划缓存"""
+    print("\n=== 测试 4: 执行计划缓存 ===")
+    task_dir = tmp_dir / ".task-shard"
+    write(str(task_dir / "dag.md"), SHARD_DAG.replace("{shard}", "file"))
+    entry = str(task_dir / "dag.md")
+    assert len(DAGExecutor(entry, lambda t: True, use_state=False).parse()[0].tasks) == 7
+    assert PlanCache(entry).load() is not None
+
+    write("src/api/c.py", "x")
+    git("add", "src/api/c.py")
+    assert PlanCache(entry).load() is None
+    assert len(DAGExecutor(entry, lambda t: True, use_state=False).parse()[0].tasks) == 8
+
+    write(str(tmp_dir / "plain.md"), '## STAGE ## name="s" mode="serial"\n\n## TASK ##\n整理\n文件: src/**\n')
+    DAGExecutor(str(tmp_dir / "plain.md"), lambda t: True, use_state=False).parse()
+    write("docs/new.md", "x")
+    git("add", "docs/new.md")
+    assert PlanCache(str(tmp_dir / "plain.md")).load() is not None  # 不含分片的计划与文件列表无关
+    print("  ✅ 文件列表变化后含分片的执行计划缓存失效并重新分片，不含分片的计划照常复用")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_plan(tmp_dir)
+            run_test_parse(tmp_dir)
+            run_test_prompt(tmp_dir)
+            run_test_plan_cache(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# Purpose: 回归测试任务写集合学习（自动提交时记录实际修改的文件，--learned-conflicts 按写集合检测冲突）
+# Created: 2026-10-18
+#
+# 覆盖：
+#   (1) 声明范围判断：文件/排除、目录、glob；未声明 文件: 的任务不受限制；指纹随描述和文件范围变化
+#   (2) _auto_commit_if_needed 记录暂存区文件，超出声明范围时提示；写集合取最近 MAX_RUNS 次的并集
+#   (2b) 并行任务：先提交的任务带走了邻居的文件，邻居仍按开始时的快照学到自己的写集合；同时运行时不提示越界
+#   (3) ConflictDetector / DAGScheduler 按写集合放宽误报冲突，无记录的任务仍按声明范围
+#   (4) DAGExecutor(learned_conflicts=True)：批次更少，执行计划缓存随历史变化失效，--dry-run 显示写集合
+
+import io
+import os
+import sys
+import subprocess
+import tempfile
+from contextlib import redirect_stdout
+from pathlib import Path
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+import batchcc
+from dag_parser import ConflictDetector, TaskNode, StageNode
+from dag_scheduler import DAGScheduler
+from dag_executor import DAGExecutor
+from write_sets import WriteSetHistory, MAX_RUNS, HISTORY_FILE_NAME, outside_scope, task_fingerprint
+
+DAG = """# 写集合
+
+## STAGE ## name="dev" mode="parallel" max_workers="3"
+
+## TASK ##
+改 API
+文件: src/**
+
+## TASK ##
+改模型
+文件: src/**
+
+## TASK ##
+改工具
+文件: src/**
+"""
+
+
+def git(*args):
+    return subprocess.run(["git", "-c", "user.name=t", "-c", "user.email=t@t", *args], check=True,
+                          capture_output=True, text=True).stdout
+
+
+def make_task(task_id: int, description: str, files, excludes=()) -> TaskNode:
+    return TaskNode(task_id=task_id, description=description, files=list(files), excludes=list(excludes),
+                    verify_cmd="")
+
+
+def run_test_scope(tmp_dir: Path):
+    """场景 1: 声明范围与指纹"""
+    print("\n=== 测试 1: 声明范围 ===")
+    task = make_task(1, "改 API", ["src/api/", "docs/*.md"], ["src/api/gen/"])
+    paths = ["src/api/handler.py", "src/api/gen/client.py", "docs/api.md", "docs/deep/x.md", "README.md"]
+    assert outside_scope(task, paths) == ["src/api/gen/client.py", "docs/deep/x.md", "README.md"]
+    assert outside_scope(make_task(2, "整理", []), paths) == []
+
+    same = make_task(9, "改 API", ["src/api/", "docs/*.md"], ["src/api/gen/"])
+    assert task_fingerprint(task) == task_fingerprint(same)
+    assert task_fingerprint(task) != task_fingerprint(make_task(1, "改 API", ["src/api/"], ["src/api/gen/"]))
+    assert task_fingerprint(task) != task_fingerprint(make_task(1, "改 API!", task.files, task.excludes))
+    print("  ✅ 排除、目录、glob 范围判断正确；指纹与序号无关，描述或文件范围变化即为新任务")
+
+
+def run_test_record(tmp_dir: Path):
+    """场景 2: 自动提交时记录"""
+    print("\n=== 测试 2: 自动提交时记录写集合 ===")
+    git("init", "-q")
+    Path("src").mkdir()
+    Path("docs").mkdir()
+    Path("README.md").write_text("x", encoding="utf-8")
+    git("add", ".")
+    git("commit", "-q", "-m", "init")
+    os.environ.update(GIT_AUTHOR_NAME="t", GIT_AUTHOR_EMAIL="t@t", GIT_COMMITTER_NAME="t", GIT_COMMITTER_EMAIL="t@t")
+
+    executor = batchcc.ClaudeCodeBatchExecutor()
+    task = make_task(1, "改 API", ["src/**"])
+    Path("src/api.py").write_text("x", encoding="utf-8")
+    Path("docs/api.md").write_text("x", encoding="utf-8")
+    Path(".task-demo").mkdir()
+    Path(".task-demo/state.json").write_text("{}", encoding="utf-8")
+    output = io.StringIO()
+    with redirect_stdout(output):
+        executor._auto_commit_if_needed(task.description, task.task_id, task)
+    assert "声明范围外的文件: docs/api.md" in output.getvalue(), output.getvalue()
+    assert git("log", "-1", "--name-only", "--format=").split() == ["docs/api.md", "src/api.py"]
+
+    history = WriteSetHistory()
+    assert Path(history.path).name == HISTORY_FILE_NAME and Path(history.path).parent.name == ".git"
+    assert history.learned(task) == ["docs/api.md", "src/api.py"]  # 任务过程文件不计入
+    assert history.learned(make_task(1, "改模型", ["src/**"])) is None
+
+    for i in range(MAX_RUNS):
+        history.record(task, [f"src/run{i}.py"])
+    assert history.learned(task) == [f"src/run{i}.py" for i in range(MAX_RUNS)]
+    assert WriteSetHistory().learned(task) == history.learned(task)  # 已落盘
+    print(f"  ✅ 暂存区文件按任务指纹落盘到 .git/{HISTORY_FILE_NAME}，越界文件有提示，只保留最近 {MAX_RUNS} 次")
+
+
+def run_test_concurrent(tmp_dir: Path):
+    """场景 2b: 并行任务各自的写集合"""
+    print("\n=== 测试 2b: 并行任务按快照记录写集合 ===")
+    executor = batchcc.ClaudeCodeBatchExecutor()
+    api = make_task(1, "并行改 API", ["src/**"])
+    model = make_task(2, "并行改模型", ["lib/**"])
+    Path("src/api.py").write_text("before", encoding="utf-8")  # 开始前已有的未提交修改不计入
+    executor.write_tracker.start((api.stage_id, api.task_id))
+    executor.write_tracker.start((model.stage_id, model.task_id))
+    Path("src/api.py").write_text("v2", encoding="utf-8")
+    Path("lib").mkdir()
+    Path("lib/model.py").write_text("x", encoding="utf-8")
+    Path("README.md").write_text("model", encoding="utf-8")
+
+    output = io.StringIO()
+    with redirect_stdout(output):
+        executor._auto_commit_if_needed(api.description, api.task_id, api)  # 一并提交了 lib/model.py
+        executor._auto_commit_if_needed(model.description, model.task_id, model)  # 暂存区已空
+    assert "lib/model.py" in git("log", "-1", "--name-only", "--format=")
+    assert "声明范围外" not in output.getvalue(), output.getvalue()  # 同时运行：写集合可能偏大，不提示
+
+    history = WriteSetHistory()
+    assert history.learned(model) == ["README.md", "lib/model.py", "src/api.py"]  # 偏大但不漏
+    assert set(history.learned(api)) >= {"src/api.py"}
+    assert executor.write_tracker.finish((model.stage_id, model.task_id)) == (None, False)
+
+    executor.write_tracker.start((model.stage_id, model.task_id))
+    Path("README.md").write_text("alone", encoding="utf-8")
+    output = io.StringIO()
+    with redirect_stdout(output):
+        executor._auto_commit_if_needed(model.description, model.task_id, model)
+    assert "声明范围外的文件: README.md" in output.getvalue(), output.getvalue()
+    print("  ✅ 先提交的任务带走邻居文件后，邻居仍学到自己的写集合（只会偏大）；单独运行时才提示越界")
+
+
+def run_test_conflicts(tmp_dir: Path):
+    """场景 3: 按写集合检测冲突"""
+    print("\n=== 测试 3: 冲突检测 ===")
+    history = WriteSetHistory(path=str(tmp_dir / "history.json"))
+    api, model, tool = (make_task(i, name, ["src/**"]) for i, name in enumerate(["改 API", "改模型", "改工具"], 1))
+    history.record(api, ["src/api.py"])
+    history.record(model, ["src/model.py", "README.md"])
+
+    assert ConflictDetector.detect_conflicts([api, model, tool]) == {1: [2, 3], 2: [3]}
+    assert ConflictDetector.detect_conflicts([api, model, tool], write_sets=history) == {1: [3], 2: [3]}
+    assert not ConflictDetector._has_conflict(api, model, write_sets=history)
+    assert ConflictDetector._has_conflict(api, tool, write_sets=history)  # 无记录：仍按 src/** 比较
+
+    docs = make_task(4, "改文档", ["docs/**"])
+    assert not ConflictDetector._has_conflict(model, docs)
+    history.record(docs, ["README.md"])
+    assert ConflictDetector._has_conflict(model, docs, write_sets=history)  # 实际都改了 README.md
+
+    scheduler = DAGScheduler([StageNode(stage_id=0, name="s", mode="parallel", max_workers=3, tasks=[])],
+                             write_sets=history)
+    scheduler.tasks = {(0, 1): api, (0, 2): model}
+    assert not scheduler._conflicts_with_running((0, 2), {None: (0, 1)})
+    print("  ✅ 写集合不相交的任务不再冲突，无记录的任务仍按声明范围，越界写入反而能补上漏报的冲突")
+
+
+def run_test_executor(tmp_dir: Path):
+    """场景 4: 执行器集成"""
+    print("\n=== 测试 4: DAGExecutor 写集合模式 ===")
+    task_dir = tmp_dir / ".task-learned"
+    task_dir.mkdir()
+    (task_dir / "dag.md").write_text(DAG, encoding="utf-8")
+    entry = str(task_dir / "dag.md")
+
+    default = DAGExecutor(entry, lambda t: True, use_state=False, use_plan_cache=False)
+    default.parse()
+    assert len(default._get_stage_layout(default.stages[0])[1]) == 3
+
+    history = WriteSetHistory()
+    for task in default.stages[0].tasks:
+        history.record(task, [f"src/{task.task_id}.py"] + (["lib/x.py"] if task.task_id == 1 else []))
+    learned = DAGExecutor(entry, lambda t: True, use_state=False, learned_conflicts=True)
+    learned.parse()
+    assert len(learned._get_stage_layout(learned.stages[0])[1]) == 1
+    key = learned.plan_cache.compute_key([entry])
+    assert key != DAGExecutor(entry, lambda t: True, use_state=False).plan_cache.compute_key([entry])
+
+    output = io.StringIO()
+    with redirect_stdout(output):
+        learned.print_plan()
+    assert "冲突检测: 按学到的写集合（3/3 个任务有历史记录）" in output.getvalue()
+    assert "实际写入: lib/x.py, src/1.py" in output.getvalue()
+    assert "超出声明范围: lib/x.py" in output.getvalue()
+
+    history.record(learned.stages[0].tasks[2], ["src/1.py"])
+    relearned = DAGExecutor(entry, lambda t: True, use_state=False, learned_conflicts=True)
+    assert relearned.plan_cache.compute_key([entry]) != key
+    relearned.parse()
+    assert len(relearned._get_stage_layout(relearned.stages[0])[1]) == 2
+    print("  ✅ 按写集合 3 个任务一批并行（默认 3 批），历史变化后执行计划缓存失效并重新分批")
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as td:
+        tmp_dir = Path(td)
+        os.chdir(tmp_dir)
+        try:
+            run_test_scope(tmp_dir)
+            run_test_record(tmp_dir)
+            run_test_concurrent(tmp_dir)
+            run_test_conflicts(tmp_dir)
+            run_test_executor(tmp_dir)
+            print("\n✅ 所有回归测试通过")
+        except AssertionError as e:
+            print(f"\n❌ 测试失败: {e}")
+            import traceback
+            traceback.print_exc()
+            sys.exit(1)
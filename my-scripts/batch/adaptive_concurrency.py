@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+自适应并发控制 - AIMD 并发上限 + 令牌桶启动限速（--adaptive / --launch-rate）
+
+agent CLI 调用受网络和服务端限流约束，与本机 CPU 核数无关：固定的 max_workers 要么太保守，
+要么在服务端开始限流时让所有并发任务同时失败。一次运行共享一个控制器（批次、阶段、调度器之间延续）：
+
+- 加性增：任务成功且耗时稳定（不超过平均耗时的 LATENCY_TOLERANCE 倍）时，
+  每完成约「当前上限」个任务上限 +1；只有上限被用满时才增加（未用满说明瓶颈不在并发）
+- 乘性减：失败任务的 stderr 含限流/过载特征（RATE_LIMIT_RE）时上限乘以 DECREASE_FACTOR；
+  同一轮（降速前已启动的任务）的多个限流失败只降一次
+- 令牌桶：设置每分钟启动次数后，每次启动 agent 消耗一个令牌，令牌不足时等待（桶容量为 10 秒的配额）
+- 各阶段的 max_workers 是该阶段的并发上限：实际并发 = min(自适应上限, max_workers)
+
+上限的每次变化记录在 history 中，运行结束时 report() 输出变化时间线。
+"""
+
+import re
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+# 起始并发上限
+DEFAULT_START = 2
+# 乘性减系数
+DECREASE_FACTOR = 0.5
+# 耗时稳定：不超过平均耗时（指数移动平均）的倍数
+LATENCY_TOLERANCE = 2.0
+# 平均耗时的平滑系数
+LATENCY_ALPHA = 0.2
+# 限流/过载特征（Anthropic / OpenAI CLI 常见输出）
+RATE_LIMIT_RE = re.compile(
+    r'rate[ _-]?limit|too many requests|\b429\b|overloaded|\b529\b|quota exceeded|'
+    r'resource[ _]exhausted|usage limit|try again later', re.IGNORECASE)
+
+
+def is_rate_limited(text: str) -> bool:
+    """输出中是否有限流/过载特征"""
+    return bool(text) and RATE_LIMIT_RE.search(text) is not None
+
+
+class AdaptiveConcurrency:
+    """AIMD 并发上限 + 令牌桶启动限速（整个运行共享，线程安全）"""
+
+    def __init__(self, start: int = DEFAULT_START, launch_rate: float = 0, adaptive: bool = True,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Args:
+            start: 起始并发上限
+            launch_rate: 每分钟最多启动的 agent 数（0 不限制）
+            adaptive: 是否按 AIMD 调整上限（False 时只做启动限速，并发取各阶段 max_workers）
+            clock: 时钟（测试注入）
+        """
+        self.adaptive = adaptive
+        self.start = max(1, start)
+        self.launch_rate = max(0.0, launch_rate)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._limit = self.start if adaptive else 0
+        self._credit = 0.0  # 加性增累计：每个稳定成功 +1/上限，满 1 时上限 +1
+        self._latency: Optional[float] = None  # 成功任务耗时的指数移动平均
+        self._last_cut = float('-inf')  # 上次降速时间（之前启动的任务再限流不重复降速）
+        self._in_flight = 0
+        self._ceiling = 0  # 最近一次查询的调用方上限（已达到时不再增加）
+        # 令牌桶
+        self._capacity = max(1.0, self.launch_rate / 6)
+        self._tokens = self._capacity
+        self._refilled = clock()
+        # 统计
+        self._started = clock()
+        self.history: List[Tuple[float, int, str]] = [(0.0, self._limit, "起始")] if adaptive else []
+        self.launches = 0
+        self.throttled = 0  # 因令牌不足等待的启动次数
+        self.throttle_wait = 0.0
+        self.rate_limited = 0  # 检测到限流的失败任务数
+
+    @property
+    def enabled(self) -> bool:
+        return self.adaptive or self.launch_rate > 0
+
+    def limit(self, cap: int) -> int:
+        """
+        当前允许的并发数
+
+        Args:
+            cap: 阶段（或调用方）的并发上限 max_workers
+        """
+        cap = max(1, cap)
+        if not self.adaptive:
+            return cap
+        with self._lock:
+            self._ceiling = cap
+            return max(1, min(self._limit, cap))
+
+    def on_launch(self) -> float:
+        """
+        启动一个 agent 前调用：计入运行中并消耗一个令牌
+
+        Returns:
+            启动前需要等待的秒数（令牌不足时；调用方负责等待）
+        """
+        with self._lock:
+            self._in_flight += 1
+            self.launches += 1
+            if not self.launch_rate:
+                return 0.0
+            now = self._clock()
+            self._tokens = min(self._capacity, self._tokens + (now - self._refilled) * self.launch_rate / 60)
+            self._refilled = now
+            # 允许欠账：排在后面的启动依次等待更久，顺序与调用顺序一致
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            delay = -self._tokens * 60 / self.launch_rate
+            self.throttled += 1
+            self.throttle_wait += delay
+            return delay
+
+    def on_finish(self, success: bool, duration: Optional[float] = None, error: str = ""):
+        """
+        agent 结束后调用：按结果调整并发上限
+
+        Args:
+            success: 是否成功
+            duration: 耗时（秒；未知时为 None，视为稳定）
+            error: 失败时的 stderr / 错误信息（检测限流特征）
+        """
+        with self._lock:
+            in_flight = self._in_flight
+            self._in_flight = max(0, self._in_flight - 1)
+            if success:
+                self._on_success(duration, in_flight)
+            elif is_rate_limited(error):
+                self.rate_limited += 1
+                started = self._clock() - (duration or 0)
+                if self.adaptive and started >= self._last_cut:
+                    self._set_limit(max(1, int(self._limit * DECREASE_FACTOR)), "限流")
+                    self._last_cut = self._clock()
+
+    def record_result(self, result, duration: Optional[float] = None):
+        """on_finish 的便捷形式：result 为 TaskResult、bool 或异常对象"""
+        if isinstance(result, bool):
+            self.on_finish(result, duration)
+            return
+        if isinstance(result, Exception):
+            self.on_finish(False, duration, str(result))
+            return
+        success = bool(getattr(result, 'success', False))
+        # CLI 的限流提示可能输出在 stdout 或 stderr
+        error = "" if success else "\n".join(
+            text for text in (getattr(result, 'error_msg', None), getattr(result, 'output', None)) if text)
+        self.on_finish(success, getattr(result, 'duration', duration), error)
+
+    def report(self) -> List[str]:
+        """运行结束时的报告：上限变化时间线和启动限速统计"""
+        lines = []
+        if self.adaptive:
+            limits = [limit for _, limit, _ in self.history]
+            cuts = sum(1 for _, _, reason in self.history if reason == "限流")
+            lines.append(f"📈 自适应并发: 起始 {self.start} → 最终 {self._limit}（范围 {min(limits)}-{max(limits)}），"
+                         f"调整 {len(self.history) - 1} 次，限流降速 {cuts} 次（限流失败 {self.rate_limited} 个任务）")
+            timeline = [f"{elapsed:.0f}s={limit}{'↓' if reason == '限流' else ''}"
+                        for elapsed, limit, reason in self.history]
+            if len(timeline) > 20:
+                timeline = timeline[:10] + ["…"] + timeline[-9:]
+            lines.append(f"   时间线: {', '.join(timeline)}")
+        if self.launch_rate:
+            lines.append(f"⏱️  启动限速: 每分钟 {self.launch_rate:g} 次，共启动 {self.launches} 次，"
+                         f"等待 {self.throttled} 次共 {self.throttle_wait:.1f}s")
+        return lines
+
+    def describe(self) -> str:
+        """--dry-run 显示的控制方式"""
+        parts = []
+        if self.adaptive:
+            parts.append(f"自适应 AIMD（起始 {self.start}，成功且耗时稳定时 +1，限流时 ×{DECREASE_FACTOR:g}，"
+                         f"不超过各阶段 max_workers）")
+        if self.launch_rate:
+            parts.append(f"每分钟最多启动 {self.launch_rate:g} 个 agent")
+        return "；".join(parts)
+
+    def _on_success(self, duration: Optional[float], in_flight: int):
+        stable = duration is None or self._latency is None or duration <= self._latency * LATENCY_TOLERANCE
+        if duration is not None:
+            self._latency = duration if self._latency is None else (
+                LATENCY_ALPHA * duration + (1 - LATENCY_ALPHA) * self._latency)
+        # 上限未用满时不增加：瓶颈不在并发，增加的上限未经验证；已达阶段上限时同样不增加
+        if not self.adaptive or not stable or in_flight < self._limit or self._limit >= self._ceiling:
+            return
+        self._credit += 1 / self._limit
+        if self._credit >= 1:
+            self._credit = 0.0
+            self._set_limit(self._limit + 1, "稳定")
+
+    def _set_limit(self, limit: int, reason: str):
+        if limit == self._limit:
+            return
+        self._limit = limit
+        self._credit = 0.0
+        self.history.append((self._clock() - self._started, limit, reason))
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+异步执行引擎 - 一个事件循环并发运行多个 agent 子进程
+
+并行执行（execute_parallel / execute_dag_batch_parallel）原先为每个并发槽位 fork 一个 Python 工作进程，
+每次提交都要 pickle 整个执行器，每个批次新建一个进程池，而工作进程只是阻塞在 subprocess.run 上。
+这里改为在调用线程中运行一个 asyncio 事件循环，用 create_subprocess_exec 直接启动 claude/codex：
+
+- run_process：启动子进程并持续读取 stdout/stderr（不会因管道写满而阻塞，超时时保留已输出的内容）；
+  超时或被取消时先 SIGTERM 整个进程组，KILL_GRACE 秒后仍未退出再 SIGKILL
+- run_bounded：至多 max_workers 个任务同时运行，每完成一个就在调用线程中回调 on_done
+  （状态落盘、git commit 仍在单线程中串行进行）；回调或信号处理器抛出 KeyboardInterrupt 时
+  事件循环取消其余任务并终止它们的子进程，异常再抛给调用方。
+  传入 limiter（AdaptiveConcurrency）时并发数随其上限变化，启动前按其令牌桶等待；
+  传入 retry（瞬时失败重试，见 task_retry.py）时失败的任务释放槽位、退避等待后重新排队执行；
+  传入 hedge（对冲执行，见 task_hedge.py）时运行时间超过阈值的任务在有空闲槽位时再启动一份副本，
+  先成功的一方胜出，另一方被取消（子进程终止）
+"""
+
+import asyncio
+import contextlib
+import os
+import signal
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional, Sequence, Union
+
+# 单个命令的默认超时（秒）
+DEFAULT_TIMEOUT = 1800
+# 终止子进程时 SIGTERM 后等待退出的秒数，超时则 SIGKILL
+KILL_GRACE = 5
+# 每次从管道读取的字节数
+READ_CHUNK = 64 * 1024
+# 对冲执行检查运行中任务的间隔（秒）
+HEDGE_POLL = 1.0
+
+
+@dataclass
+class ProcessOutput:
+    """子进程运行结果"""
+    returncode: Optional[int]  # 超时被终止时为 None
+    stdout: str
+    stderr: str
+    timed_out: bool = False
+
+
+async def run_process(command: Union[str, Sequence[str]], cwd: str,
+                      timeout: Optional[float] = DEFAULT_TIMEOUT) -> ProcessOutput:
+    """
+    运行一个子进程并收集输出
+
+    Args:
+        command: 参数列表（直接 exec），或字符串（经 shell 执行，兼容模板中的原始命令）
+        cwd: 工作目录
+        timeout: 超时秒数（None 不限制）
+
+    Returns:
+        ProcessOutput；超时时 timed_out=True，stdout/stderr 为终止前已输出的内容
+
+    Raises:
+        asyncio.CancelledError: 被取消（子进程已终止）
+        OSError: 无法启动子进程
+    """
+    if isinstance(command, str):
+        command = ['/bin/sh', '-c', command]
+    # 独立进程组：终止时连同 agent 启动的子进程一起结束；Ctrl+C 由主进程统一处理
+    spawn = asyncio.ensure_future(asyncio.create_subprocess_exec(
+        *command, cwd=cwd, stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        start_new_session=(os.name == 'posix')))
+    try:
+        process = await asyncio.shield(spawn)
+    except BaseException:
+        # 启动过程中被取消/中断：等管道连接完成再终止
+        # （直接取消 create_subprocess_exec 时，未连接的管道永远不会关闭，等待子进程退出会一直挂起）
+        with contextlib.suppress(Exception):
+            await _terminate(await spawn)
+        raise
+
+    stdout: List[bytes] = []
+    stderr: List[bytes] = []
+    timed_out = False
+    try:
+        await asyncio.wait_for(_communicate(process, stdout, stderr), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        await _terminate(process)
+    except BaseException:
+        # 被取消，或信号处理器在本协程中抛出 KeyboardInterrupt
+        await _terminate(process)
+        raise
+
+    return ProcessOutput(
+        returncode=None if timed_out else process.returncode,
+        stdout=b''.join(stdout).decode('utf-8', errors='replace'),
+        stderr=b''.join(stderr).decode('utf-8', errors='replace'),
+        timed_out=timed_out
+    )
+
+
+def run_bounded(jobs: Sequence[Callable[[], Awaitable]], max_workers: int,
+                on_done: Callable[[int, object, Optional[Exception]], None],
+                on_start: Callable[[int], None] = None, limiter=None,
+                retry: Callable[[int, object, Optional[Exception], int], Optional[float]] = None,
+                hedge=None):
+    """
+    在一个事件循环中并发运行 jobs，至多 max_workers 个同时运行
+
+    Args:
+        jobs: 协程工厂列表（按需创建协程，排队中的任务不占用子进程）
+        max_workers: 最大并发数
+        on_done: 完成回调 (序号, 结果, 异常)，按完成顺序在调用线程中执行；job 抛出异常时结果为 None
+        on_start: 开始回调 (序号)，取得并发槽位时执行
+        limiter: 自适应并发控制器（None 时固定 max_workers）；结果由调用方在 on_done 中交给它
+        retry: 重试判断 (序号, 结果, 异常, 第几次执行) → 等待秒数，None 表示不再重试；
+               返回等待秒数时不调用 on_done（该次结果由 retry 自行处理），任务释放槽位，等待后重新排队
+        hedge: 对冲执行（task_hedge.WorktreeHedger）：提供 threshold(序号, 已完成耗时) → 秒数或 None、
+               run(序号, 已运行秒数) → 副本协程、accept(序号) → 副本先成功时能否采用、
+               settle(序号, 胜出方, 结果) → 结果、close()；
+               任务运行超过阈值、有空闲槽位且没有排队任务时启动副本，settle 在 on_done 之前调用；
+               accept 返回 False 时丢弃副本的结果，继续等待原任务
+
+    Raises:
+        KeyboardInterrupt: 中断（未完成的任务已取消，子进程已终止）
+    """
+    if not jobs:
+        return
+    # 不用 asyncio.run：它在中断后会直接取消所有任务（包括正在启动的子进程），
+    # 这里只取消主任务，由它取消各个任务，run_process 负责终止各自的子进程
+    loop = asyncio.new_event_loop()
+    main = loop.create_task(_run_bounded(jobs, max_workers, on_done, on_start, limiter, retry, hedge))
+    try:
+        loop.run_until_complete(main)
+    except BaseException:
+        # 信号处理器在事件循环中抛出的 KeyboardInterrupt：主任务仍在等待
+        if not main.done():
+            main.cancel()
+            with contextlib.suppress(BaseException):
+                loop.run_until_complete(main)
+        raise
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+async def _run_bounded(jobs, max_workers, on_done, on_start, limiter, retry, hedge):
+    # 并发上限可能在运行中变化（limiter），用条件变量代替 Semaphore
+    slots = asyncio.Condition()
+    running = [0]
+    queued = [0]  # 等待槽位的任务数（有排队任务时不对冲）
+    loop = asyncio.get_event_loop()
+    # 对冲：运行中的执行 {序号: (开始时间, 副本已启动事件)}、已启动的副本、本批次成功执行的耗时
+    active = {}
+    duplicates = {}
+    durations: List[float] = []
+
+    def capacity() -> int:
+        return limiter.limit(max_workers) if limiter else max(1, max_workers)
+
+    async def duplicate(index: int, elapsed: float):
+        try:
+            return await hedge.run(index, elapsed)
+        finally:
+            async with slots:
+                running[0] -= 1
+                slots.notify_all()
+
+    async def watch_stragglers():
+        """定期检查运行中的任务：超过阈值、有空闲槽位且没有排队任务时启动副本"""
+        while True:
+            await asyncio.sleep(HEDGE_POLL)
+            now = loop.time()
+            for index, (started, launched) in list(active.items()):
+                if queued[0] or running[0] >= capacity():
+                    break
+                limit = None if launched.is_set() else hedge.threshold(index, durations)
+                if limit is None or now - started < limit:
+                    continue
+                # 检查与占用槽位之间没有 await，不会与等待槽位的任务竞争
+                running[0] += 1
+                duplicates[index] = asyncio.ensure_future(duplicate(index, now - started))
+                launched.set()
+
+    async def execute(index: int, job: Callable[[], Awaitable]):
+        """执行一次 job；对冲时与副本竞争，返回胜出方的结果（都失败时为原任务的结果或异常）"""
+        if hedge is None:
+            return await job()
+        started = loop.time()
+        launched = asyncio.Event()
+        original = asyncio.ensure_future(job())
+        copy = None
+        active[index] = (started, launched)
+        signal_wait = asyncio.ensure_future(launched.wait())
+        try:
+            await asyncio.wait({original, signal_wait}, return_when=asyncio.FIRST_COMPLETED)
+            # 之后不再为这次执行启动副本
+            del active[index]
+            copy = duplicates.pop(index, None)
+            if copy is not None:
+                winner, result = await _race(original, copy, lambda: hedge.accept(index))
+                result = hedge.settle(index, winner, result)
+                if winner is None:
+                    result = original.result()
+            else:
+                result = original.result()
+        except BaseException:
+            # 被取消或中断：终止双方的子进程
+            for future in (original, copy):
+                if future is not None:
+                    future.cancel()
+            await asyncio.gather(*(f for f in (original, copy) if f is not None), return_exceptions=True)
+            raise
+        finally:
+            signal_wait.cancel()
+            active.pop(index, None)
+        if getattr(result, 'success', False):
+            durations.append(loop.time() - started)
+        return result
+
+    async def run(index: int, job: Callable[[], Awaitable]):
+        attempt = 1
+        while True:
+            async with slots:
+                queued[0] += 1
+                try:
+                    await slots.wait_for(lambda: running[0] < capacity())
+                finally:
+                    queued[0] -= 1
+                running[0] += 1
+            try:
+                delay = limiter.on_launch() if limiter else 0
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if on_start and attempt == 1:
+                    on_start(index)
+                try:
+                    result, error = await execute(index, job), None
+                except Exception as e:
+                    result, error = None, e
+                backoff = retry(index, result, error, attempt) if retry else None
+                if backoff is None:
+                    # 释放并发槽位前回调：下一个任务开始时上一个的状态已落盘
+                    on_done(index, result, error)
+            finally:
+                async with slots:
+                    running[0] -= 1
+                    # 上限可能已被 on_done 调整，唤醒全部等待者重新判断
+                    slots.notify_all()
+            if backoff is None:
+                return
+            # 退避期间不占用槽位
+            await asyncio.sleep(backoff)
+            attempt += 1
+
+    futures = [asyncio.ensure_future(run(index, job)) for index, job in enumerate(jobs)]
+    watcher = asyncio.ensure_future(watch_stragglers()) if hedge is not None else None
+    try:
+        await asyncio.gather(*futures)
+    finally:
+        # 回调抛出异常或主任务被取消：取消其余任务并等待子进程终止
+        for future in futures:
+            future.cancel()
+        await asyncio.gather(*futures, return_exceptions=True)
+        if watcher is not None:
+            watcher.cancel()
+            await asyncio.gather(watcher, return_exceptions=True)
+            hedge.close()
+
+
+async def _race(original: asyncio.Future, copy: asyncio.Future, accept: Callable[[], bool] = None):
+    """
+    原任务与副本竞争：先成功的一方胜出，取消另一方
+
+    Args:
+        original: 原任务
+        copy: 副本
+        accept: 副本先成功时调用，返回 False 时不采用副本（不取消原任务，继续等待它的结果）
+
+    Returns:
+        (胜出方 'original' / 'hedge', 结果)；都失败时为 (None, None)
+    """
+    contenders = {original: 'original', copy: 'hedge'}
+    pending = set(contenders)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None and getattr(future.result(), 'success', False):
+                if future is copy and accept is not None and not accept():
+                    continue
+                for other in pending:
+                    other.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                return contenders[future], future.result()
+    return None, None
+
+
+async def _communicate(process: asyncio.subprocess.Process, stdout: List[bytes], stderr: List[bytes]):
+    await asyncio.gather(_drain(process.stdout, stdout), _drain(process.stderr, stderr))
+    await process.wait()
+
+
+async def _drain(stream: asyncio.StreamReader, chunks: List[bytes]):
+    while True:
+        chunk = await stream.read(READ_CHUNK)
+        if not chunk:
+            return
+        chunks.append(chunk)
+
+
+async def _terminate(process: asyncio.subprocess.Process):
+    """SIGTERM 进程组，KILL_GRACE 秒后仍未退出则 SIGKILL"""
+    if process.returncode is not None:
+        return
+    _signal_group(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), KILL_GRACE)
+    except asyncio.TimeoutError:
+        _signal_group(process, signal.SIGKILL if os.name == 'posix' else signal.SIGTERM)
+        await process.wait()
+
+
+def _signal_group(process: asyncio.subprocess.Process, sig: int):
+    try:
+        if os.name == 'posix':
+            os.killpg(process.pid, sig)
+        else:
+            process.send_signal(sig)
+    except (ProcessLookupError, PermissionError):
+        pass
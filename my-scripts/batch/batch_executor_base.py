@@ -1,20 +1,27 @@
 #!/usr/bin/env python3
 """
 批量命令执行器基类 - 通用逻辑抽象
-提供串行和并行执行能力的基础框架
+提供串行和并行执行能力的基础框架（并行执行见 async_engine.py）
 """
 
+import asyncio
 import os
 import subprocess
+import sys
 import time
 import threading
-import multiprocessing as mp
 from abc import ABC, abstractmethod
+from collections import deque
+from functools import partial
 from pathlib import Path
-from typing import List, Tuple, Dict
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Tuple, Dict, Optional, Sequence, Union
 from dataclasses import dataclass
 
+from async_engine import run_process, run_bounded, DEFAULT_TIMEOUT
+from task_shard import is_shard, shard_prompt
+from task_retry import format_duration
+from run_history import DurationRange, expected_span, format_range
+
 
 @dataclass
 class TaskResult:
@@ -25,22 +32,36 @@ class TaskResult:
     duration: float
     output: str = ""
     error_msg: str = ""
+    exit_code: Optional[int] = None  # 进程退出码（未能启动或超时被终止时为 None）
+    timed_out: bool = False  # 超时被终止（瞬时失败，见 task_retry.classify）
 
 
 class ProgressMonitor:
     """进度监控器"""
 
-    def __init__(self, total_tasks: int):
+    def __init__(self, total_tasks: int, estimates: Dict[int, DurationRange] = None, workers: int = 1):
+        """
+        Args:
+            total_tasks: 任务总数
+            estimates: 各任务的预计耗时 {task_id: (中位数, P90)}（运行历史，见 run_history.py）；
+                       提供时状态行显示预计剩余时间
+            workers: 并发数（估计剩余时间用）
+        """
         self.total_tasks = total_tasks
         self.completed_tasks = 0
         self.running_tasks: Dict[int, str] = {}
         self.lock = threading.Lock()
         self.start_time = time.time()
+        self.estimates = estimates or {}
+        self.workers = workers
+        self.started: Dict[int, float] = {}  # task_id → 开始时间（估计剩余时间用）
+        self.finished: set = set()
 
     def start_task(self, task_id: int, command: str):
         """开始任务"""
         with self.lock:
             self.running_tasks[task_id] = command
+            self.started.setdefault(task_id, time.time())
             self._print_status()
 
     def complete_task(self, task_id: int, success: bool):
@@ -49,27 +70,160 @@ class ProgressMonitor:
         with self.lock:
             if task_id in self.running_tasks:
                 del self.running_tasks[task_id]
+            self.finished.add(task_id)
             self.completed_tasks += 1
             self._print_status()
 
+    def remaining(self) -> Optional[DurationRange]:
+        """预计剩余时间：未开始的任务按完整估计，运行中的任务扣除已运行时间；没有估计时返回 None"""
+        if not self.estimates:
+            return None
+        now = time.time()
+        ranges = []
+        for task_id, (median, p90) in self.estimates.items():
+            if task_id in self.finished:
+                continue
+            elapsed = now - self.started[task_id] if task_id in self.started else 0.0
+            ranges.append((max(0.0, median - elapsed), max(0.0, p90 - elapsed)))
+        return expected_span(ranges, self.workers)
+
     def _print_status(self):
         """打印当前状态"""
         elapsed = time.time() - self.start_time
         progress = (self.completed_tasks / self.total_tasks) * 100
         running_count = len(self.running_tasks)
+        remaining = self.remaining()
+        eta = f" | 预计剩余: {format_range(remaining)}" if remaining and self.completed_tasks < self.total_tasks else ""
 
         print(f"\r🚀 进度: {self.completed_tasks}/{self.total_tasks} ({progress:.1f}%) | "
-              f"运行中: {running_count} | 耗时: {elapsed:.1f}s", end="", flush=True)
+              f"运行中: {running_count} | 耗时: {elapsed:.1f}s{eta}", end="", flush=True)
 
         if self.completed_tasks == self.total_tasks:
             print()  # 完成后换行
 
 
+class StderrTail:
+    """串行执行时实时转发子进程的 stderr，同时保留末尾部分（识别瞬时失败）"""
+
+    LIMIT = 8 * 1024  # 保留的字符数
+
+    def __init__(self, stream):
+        self._chunks = deque()
+        self._size = 0
+        self._thread = threading.Thread(target=self._pump, args=(stream,), daemon=True)
+        self._thread.start()
+
+    def _pump(self, stream):
+        for line in iter(stream.readline, ''):
+            sys.stderr.write(line)
+            sys.stderr.flush()
+            self._chunks.append(line)
+            self._size += len(line)
+            while self._size > self.LIMIT and len(self._chunks) > 1:
+                self._size -= len(self._chunks.popleft())
+
+    def text(self) -> str:
+        """子进程结束后调用：等待转发完成，返回 stderr 末尾"""
+        self._thread.join(timeout=5)
+        return ''.join(self._chunks)
+
+
 class BaseBatchExecutor(ABC):
     """批量命令执行器基类"""
 
+    # 延迟引用（--lazy-refs）内联到 prompt 的总字节上限：
+    # 超出后只给出文件路径让 agent 自行读取，避免命令行参数过长（ARG_MAX）
+    REF_INLINE_BUDGET = 64 * 1024
+
     def __init__(self, script_name: str):
         self.script_name = script_name
+        # 自适应并发控制器（--adaptive / --launch-rate，整个运行共享；None 时固定 max_workers）
+        self.concurrency = None
+        # 瞬时失败重试策略（--retries / --backoff，见 task_retry.py；None 时不重试）
+        self.retry_policy = None
+        # 慢任务对冲策略（--hedge，见 task_hedge.py；None 时不对冲，仅用于 DAG 并行批次）
+        self.hedge_policy = None
+        # 运行历史（见 run_history.py，由 DAGExecutor 注入；并行批次按它显示预计剩余时间，None 时不显示）
+        self.run_history = None
+
+    def _retry_backoff(self, task_id: int, attempt: int, result, task=None,
+                       record_concurrency: bool = False) -> Optional[float]:
+        """
+        瞬时失败重试判断（run_bounded 的 retry 回调和串行执行共用）
+
+        Args:
+            task_id: 任务ID
+            attempt: 刚结束的是第几次执行（从1开始）
+            result: 执行结果（TaskResult）或异常对象
+            task: 任务节点（任务级 retries / backoff；简单模式为 None）
+            record_concurrency: 重试的这次结果交给自适应并发控制器（run_bounded 不会为它调用 on_done）
+
+        Returns:
+            退避秒数；成功、永久失败或重试次数已用完时返回 None（按原有流程处理结果）
+        """
+        if self.retry_policy is None or getattr(result, 'success', False):
+            return None
+        decision = self.retry_policy.next_retry(attempt, result, task)
+        if decision is None:
+            return None
+        reason, delay = decision
+        if record_concurrency and self.concurrency:
+            self.concurrency.record_result(result)
+        error = str(result) if isinstance(result, Exception) else (result.error_msg or "")
+        print(f"\n🔁 [{task_id}] {reason}（第 {attempt} 次执行失败），{format_duration(delay)} 后重试", flush=True)
+        self._record_attempt(task_id, attempt, reason, error, delay)
+        return delay
+
+    def _record_attempt(self, task_id: int, attempt: int, reason: str, error: str, delay: float):
+        """记录一次瞬时失败重试（有状态管理的子类重写，写入状态文件）"""
+        _ = task_id, attempt, reason, error, delay  # 基类不记录状态
+
+    def _render_refs(self, refs: List[str]) -> str:
+        """
+        展开延迟引用句柄为 prompt 文本（只在构建任务 prompt 时调用）
+
+        Args:
+            refs: 被引用文件的路径列表（TaskNode.refs / StageNode.refs）
+
+        Returns:
+            参考文档文本；在预算内的文件内联全文，超出预算的只列出路径
+        """
+        from ref_resolver import get_shared_resolver
+
+        resolver = get_shared_resolver()
+        sections = []
+        used = 0
+        for path in refs:
+            display = os.path.relpath(path) if os.path.isabs(path) else path
+            try:
+                content = resolver.expand(path)
+            except Exception as e:
+                reason = "文件不存在" if isinstance(e, FileNotFoundError) else f"错误: {e}"
+                sections.append(f"# ⚠️ 文件引用失败: {display} ({reason})")
+                continue
+
+            size = len(content.encode('utf-8'))
+            if used + size > self.REF_INLINE_BUDGET:
+                sections.append(f"📄 {display}（内容较大，请直接读取该文件）")
+                continue
+            used += size
+            sections.append(f"📄 {display}:\n{content.strip()}")
+        return "\n\n".join(sections)
+
+    def _task_prompt(self, task) -> str:
+        """
+        DAG 任务的 prompt 正文：任务描述 + 分片范围（分片子任务）+ 展开的任务级延迟引用
+
+        Args:
+            task: TaskNode
+        """
+        sections = [task.description]
+        if is_shard(task):
+            sections.append(shard_prompt(task))
+        refs = getattr(task, 'refs', None)
+        if refs:
+            sections.append(self._render_refs(refs))
+        return "\n\n".join(sections)
 
     def extract_tasks(self, template_file: str) -> List[str]:
         """
@@ -141,62 +295,83 @@ class BaseBatchExecutor(ABC):
         """
         pass
 
-    def execute_command_parallel(self, args: Tuple[int, str, str]) -> TaskResult:
+    def process_command(self, command: str, automation_prefix: str = None) -> Union[str, Sequence[str]]:
+        """
+        并行执行时实际启动的命令（子类重写以把 cc/codex 命令转换为 CLI 参数列表）
+
+        Args:
+            command: 要执行的命令
+            automation_prefix: 自动化执行指示前缀（为 None 时按实例上下文生成）
+
+        Returns:
+            参数列表（直接 exec），或字符串（经 shell 执行）
         """
-        并行执行单个命令的包装函数
+        _ = automation_prefix  # 基类直接执行原命令
+        return command
+
+    async def execute_command_async(self, args: Tuple[int, str, str], automation_prefix: str = None) -> TaskResult:
+        """
+        异步执行单个命令（并行执行的基本单元，由 async_engine 的事件循环调度）
 
         Args:
             args: (task_id, command, working_dir) 元组
+            automation_prefix: 自动化执行指示前缀（为 None 时按实例上下文生成）
 
         Returns:
             TaskResult: 任务执行结果
         """
         task_id, command, working_dir = args
-        start_time = time.time()
+        start_time = time.monotonic()
 
         try:
-            result = subprocess.run(
-                command,
-                shell=True,
-                cwd=working_dir,
-                capture_output=True,  # 并行时捕获输出
-                text=True,
-                timeout=1800  # 30分钟超时
-            )
-
-            duration = time.time() - start_time
-            success = result.returncode == 0
-            output = result.stdout if success else ""
-            error_msg = result.stderr if not success else ""
-
-            return TaskResult(
-                task_id=task_id,
-                command=command,
-                success=success,
-                duration=duration,
-                output=output,
-                error_msg=error_msg
-            )
-
-        except subprocess.TimeoutExpired:
-            duration = time.time() - start_time
+            result = await run_process(self.process_command(command, automation_prefix), working_dir,
+                                       timeout=DEFAULT_TIMEOUT)
+        except Exception as e:
             return TaskResult(
                 task_id=task_id,
                 command=command,
                 success=False,
-                duration=duration,
-                error_msg="命令执行超时 (30分钟)"
+                duration=time.monotonic() - start_time,
+                error_msg=str(e)
             )
-        except Exception as e:
-            duration = time.time() - start_time
+
+        duration = time.monotonic() - start_time
+        if result.timed_out:
             return TaskResult(
                 task_id=task_id,
                 command=command,
                 success=False,
                 duration=duration,
-                error_msg=str(e)
+                output=result.stdout,
+                error_msg=f"命令执行超时 ({DEFAULT_TIMEOUT // 60}分钟)",
+                timed_out=True
             )
 
+        success = result.returncode == 0
+        return TaskResult(
+            task_id=task_id,
+            command=command,
+            success=success,
+            duration=duration,
+            # 失败时同样保留 stdout：CLI 的限流/服务端错误提示可能输出在 stdout（瞬时失败识别）
+            output=result.stdout,
+            error_msg=result.stderr if not success else "",
+            exit_code=result.returncode
+        )
+
+    def execute_command_parallel(self, args: Tuple[int, str, str], automation_prefix: str = None) -> TaskResult:
+        """
+        同步执行单个命令（供 DAG 调度器的工作线程调用，每次调用运行一个独立的事件循环）
+
+        Args:
+            args: (task_id, command, working_dir) 元组
+            automation_prefix: 自动化执行指示前缀（为 None 时按实例上下文生成）
+
+        Returns:
+            TaskResult: 任务执行结果
+        """
+        return asyncio.run(self.execute_command_async(args, automation_prefix))
+
     def execute_command_serial(self, command: str, working_dir: str, task_id: int) -> bool:
         """
         串行执行单个命令 (保持原有输出格式)
@@ -241,7 +416,7 @@ class BaseBatchExecutor(ABC):
         Args:
             commands: 命令列表
             working_dir: 工作目录
-            max_workers: 最大并行工作线程数
+            max_workers: 最大并发数
 
         Returns:
             任务结果列表
@@ -250,42 +425,28 @@ class BaseBatchExecutor(ABC):
 
         # 创建进度监控器
         monitor = ProgressMonitor(len(commands))
-
-        # 准备任务参数
-        tasks = [(i + 1, cmd, working_dir) for i, cmd in enumerate(commands)]
-
-        results = []
-
-        # 使用进程池并行执行
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有任务
-            future_to_task = {executor.submit(self.execute_command_parallel, task): task for task in tasks}
-
-            # 启动任务监控
-            for task in tasks:
-                task_id, command, _ = task
-                monitor.start_task(task_id, command)
-
-            # 收集结果
-            for future in as_completed(future_to_task):
-                task = future_to_task[future]
-                task_id = task[0]
-
-                try:
-                    result = future.result()
-                    results.append(result)
-                    monitor.complete_task(task_id, result.success)
-                except Exception as e:
-                    # 创建失败结果
-                    failed_result = TaskResult(
-                        task_id=task_id,
-                        command=task[1],
-                        success=False,
-                        duration=0,
-                        error_msg=f"任务执行异常: {e}"
-                    )
-                    results.append(failed_result)
-                    monitor.complete_task(task_id, False)
+        results: List[TaskResult] = []
+
+        def on_done(index: int, result: Optional[TaskResult], error: Optional[Exception]):
+            if error is not None:
+                result = TaskResult(
+                    task_id=index + 1,
+                    command=commands[index],
+                    success=False,
+                    duration=0,
+                    error_msg=f"任务执行异常: {error}"
+                )
+            results.append(result)
+            if self.concurrency:
+                self.concurrency.record_result(result)
+            monitor.complete_task(index + 1, result.success)
+
+        # 一个事件循环并发运行全部子进程
+        jobs = [partial(self.execute_command_async, (i + 1, cmd, working_dir)) for i, cmd in enumerate(commands)]
+        run_bounded(jobs, max_workers, on_done, on_start=lambda index: monitor.start_task(index + 1, commands[index]),
+                    limiter=self.concurrency,
+                    retry=lambda index, result, error, attempt: self._retry_backoff(
+                        index + 1, attempt, result if error is None else error, record_concurrency=True))
 
         # 按task_id排序结果
         results.sort(key=lambda x: x.task_id)
@@ -407,7 +568,8 @@ class BaseBatchExecutor(ABC):
             max_workers = 1
             is_parallel = False
         else:
-            max_workers = min(parallel, max_parallel, mp.cpu_count())
+            # agent 调用受网络/服务端限流约束，不按 CPU 核数限制
+            max_workers = min(parallel, max_parallel)
             is_parallel = max_workers > 1
 
         print(f"{self.script_name.title()} 批量执行脚本 - 增强版")
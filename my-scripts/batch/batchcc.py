@@ -28,6 +28,38 @@ python batchcc.py --dry-run
 
 # 重新开始（清空状态文件）
 python batchcc.py --restart
+
+# 导出执行计划（json 或 binary），之后直接从计划启动、不再解析 markdown
+python batchcc.py task-xxx --emit-plan binary --plan-output plan.msgpack
+python batchcc.py --from-plan plan.msgpack
+
+# 精确冲突检测（glob 展开到仓库文件，触及同一文件才串行）
+python batchcc.py task-xxx --precise-conflicts
+
+# 并行阶段不分批：冲突任务不同时运行，其余任务有空闲并发即启动
+python batchcc.py task-xxx --no-barrier
+
+# 冲突检测按任务历史运行中实际修改的文件（无记录的任务仍按 文件: 声明）
+python batchcc.py task-xxx --learned-conflicts
+
+# 自适应并发（限流时自动降速）+ 每分钟最多启动 20 个 agent
+python batchcc.py task-xxx --adaptive --launch-rate 20
+
+# 任务失败后继续执行其余任务（只跳过依赖失败任务的任务）
+python batchcc.py task-xxx --keep-going
+
+# 瞬时失败（限流/网络/5xx/超时）最多重试 3 次，退避 1 分钟起、最长 15 分钟（默认 2 次，30s..10m）
+python batchcc.py task-xxx --retries 3 --backoff 1m..15m
+
+# 慢任务对冲：运行时间超过同批任务 P90 时在独立 git worktree 中再跑一份，先成功者胜出
+python batchcc.py task-xxx --hedge
+
+# 关键路径优先：按以往运行的耗时（无记录时按描述长度和文件范围估计），剩余关键路径最长的任务先启动
+python batchcc.py task-xxx --critical-path
+
+# 每次 DAG 运行的任务耗时/结果记入 ~/.claude/batch-history/，阶段标题和进度行据此显示预计剩余时间
+python run_history.py            # 列出最慢和最不稳定的任务
+python batchcc.py task-xxx --no-history   # 本次运行不读写运行历史
 ```
 
 ## 文档参考
@@ -36,23 +68,33 @@ python batchcc.py --restart
 """
 
 import sys
-import time
 import subprocess
 import argparse
 import os
 import signal
 import shutil
-from typing import Tuple, List, Optional
+import threading
+import time
+from typing import List, Optional, Sequence, Union
 from pathlib import Path
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from batch_executor_base import BaseBatchExecutor, TaskResult, ProgressMonitor
-from dag_parser import DAGParser, TaskNode
+from functools import partial
+from batch_executor_base import BaseBatchExecutor, TaskResult, ProgressMonitor, StderrTail
+from async_engine import run_bounded
+from adaptive_concurrency import AdaptiveConcurrency
+from task_retry import DEFAULT_BACKOFF, DEFAULT_RETRIES, RetryPolicy
+from task_hedge import DEFAULT_PERCENTILE, HedgePolicy, WorktreeHedger
+from run_history import MAX_RECORDS, RunHistory
+from dag_parser import DAGParser, TaskNode, find_stage_files
 from dag_executor import DAGExecutor
+from plan_export import EXPORT_FORMATS, default_export_path, export_plan, load_plan_export
+from write_sets import WriteSetHistory, WriteTracker, staged_paths
 
 
 # 全局变量：跟踪当前运行的子进程
 _current_process: subprocess.Popen = None
 _interrupted = False
+# DAG 调度器并发执行任务时，串行化 git commit（避免 index.lock 竞态）
+_commit_lock = threading.Lock()
 
 
 def _signal_handler(signum, frame):
@@ -105,6 +147,13 @@ class ClaudeCodeBatchExecutor(BaseBatchExecutor):
         self.global_goal = ""  # 项目宏观目标
         self.stage_context = ""  # 当前阶段上下文
         self.current_verify_cmd = ""  # 当前任务的验证命令
+        self.current_task: Optional[TaskNode] = None  # 当前串行执行的 DAG 任务（自动提交时记录写集合）
+        self.last_failure: Optional[TaskResult] = None  # 最近一次串行执行失败的 stderr 末尾和退出码（重试判断）
+        self.write_sets: Optional[WriteSetHistory] = None  # 任务写集合历史（首次记录时创建）
+        # 任务开始时的工作区快照（写集合按快照比较，不受并行任务先行提交影响）
+        self.write_tracker = WriteTracker(pathspecs=self._TASK_ARTIFACT_EXCLUDES)
+        self.context_refs: List[str] = []  # 项目/阶段级延迟引用句柄（--lazy-refs）
+        self._context_refs_text: Optional[str] = None  # 展开后的参考文档（首次构建 prompt 时生成）
 
     def set_state_manager(self, state_manager, stage_id: int = None):
         """
@@ -117,16 +166,24 @@ class ClaudeCodeBatchExecutor(BaseBatchExecutor):
         self.state_manager = state_manager
         self.current_stage_id = stage_id
 
-    def set_context(self, global_goal: str, stage_context: str):
+    def _record_attempt(self, task_id: int, attempt: int, reason: str, error: str, delay: float):
+        """瞬时失败重试记入状态文件（任务仍为 in_progress）"""
+        if self.state_manager and self.current_stage_id is not None:
+            self.state_manager.record_attempt(self.current_stage_id, task_id, attempt, reason, error, delay)
+
+    def set_context(self, global_goal: str, stage_context: str, context_refs: List[str] = None):
         """
         注入上下文信息
 
         Args:
             global_goal: 项目宏观目标
             stage_context: 当前阶段上下文
+            context_refs: 项目/阶段级延迟引用句柄（仅 --lazy-refs 模式，构建 prompt 时才展开）
         """
         self.global_goal = global_goal
         self.stage_context = stage_context
+        self.context_refs = context_refs or []
+        self._context_refs_text = None
 
     # 任务过程/进度产物的 pathspec 排除规则
     # 这些文件是 batchcc 或 DAG 命令运行时的编排/状态/中间结果，本质是过程文件，
@@ -148,7 +205,7 @@ class ClaudeCodeBatchExecutor(BaseBatchExecutor):
         ":(exclude,glob)**/*.state.json",       # 跨目录匹配：xxx.state.json
     ]
 
-    def _auto_commit_if_needed(self, task_description: str, task_id: int = None):
+    def _auto_commit_if_needed(self, task_description: str, task_id: int = None, task: TaskNode = None):
         """
         任务执行成功后自动执行 git commit
 
@@ -163,6 +220,7 @@ class ClaudeCodeBatchExecutor(BaseBatchExecutor):
         Args:
             task_description: 任务描述
             task_id: 任务ID（可选）
+            task: DAG 任务节点（可选）：提供时记录任务实际修改的文件（写集合学习，见 write_sets.py）
         """
         try:
             # 1. add 业务文件，显式排除 batchcc 任务过程产物
@@ -175,6 +233,8 @@ class ClaudeCodeBatchExecutor(BaseBatchExecutor):
                 err = add_result.stderr.strip()[:200]
                 print(f"⚠️ git add 失败（{err}），跳过自动提交")
                 return
+            if task is not None:
+                self._record_write_set(task)
 
             # 2. 检查暂存区：只有业务变更才 commit
             diff_result = subprocess.run(
@@ -213,36 +273,81 @@ class ClaudeCodeBatchExecutor(BaseBatchExecutor):
         except Exception as e:
             print(f"⚠️ 自动提交异常: {e}")
 
-    def _get_automation_prefix(self) -> str:
+    def _record_write_set(self, task: TaskNode):
+        """
+        记录任务实际修改的文件，供 --learned-conflicts 细化冲突检测；超出声明范围时提示
+
+        按任务开始时的工作区快照比较（WriteTracker）：暂存区可能缺少并行任务已先行提交的文件，
+        也可能含其他任务正在写的文件。运行期间有其他任务同时运行时写集合可能偏大，不提示越界；
+        没有快照（未经任务执行流程直接调用）时按暂存区记录。
+        """
+        paths, alone = self.write_tracker.finish((task.stage_id, task.task_id))
+        if paths is None:
+            paths, alone = staged_paths(), True
+        if paths is None:
+            return
+        if self.write_sets is None:
+            self.write_sets = WriteSetHistory()
+        outside = self.write_sets.record(task, paths)
+        if outside and alone:
+            more = f" 等 {len(outside)} 个文件" if len(outside) > 5 else ""
+            print(f"⚠️ Task {task.task_id} 修改了声明范围外的文件: {', '.join(outside[:5])}{more}")
+
+    def _get_automation_prefix(self, global_goal: str = None, stage_context: str = None,
+                               verify_cmd: str = None, context_refs: List[str] = None) -> str:
         """
         获取 DAG 自动化执行指示前缀
 
         这个前缀会被自动注入到每个 DAG 任务的描述前，
         包含三层上下文：项目目标 → 阶段目标 → 当前任务
 
+        Args:
+            global_goal / stage_context / verify_cmd / context_refs:
+                显式传入的上下文（DAG 调度器并发执行不同阶段的任务时使用）；
+                为 None 时使用 set_context 注入的实例状态
+
         Returns:
             自动化执行指示文本
         """
+        if global_goal is None:
+            global_goal = self.global_goal
+        if stage_context is None:
+            stage_context = self.stage_context
+        if verify_cmd is None:
+            verify_cmd = self.current_verify_cmd
+
         # 构建上下文部分
         context_section = ""
 
-        if self.global_goal:
+        if global_goal:
             context_section += f"""🎯 **项目宏观目标** (The Big Picture):
-{self.global_goal}
+{global_goal}
 
 """
 
-        if self.stage_context:
+        if stage_context:
             context_section += f"""📍 **当前阶段目标** (Stage Context):
-{self.stage_context}
+{stage_context}
+
+"""
+
+        if context_refs is None and self.context_refs:
+            if self._context_refs_text is None:
+                self._context_refs_text = self._render_refs(self.context_refs)
+            refs_text = self._context_refs_text
+        else:
+            refs_text = self._render_refs(context_refs) if context_refs else ""
+        if refs_text:
+            context_section += f"""📎 **参考文档** (References):
+{refs_text}
 
 """
 
         # 构建验证命令部分
         verify_section = ""
-        if self.current_verify_cmd:
+        if verify_cmd:
             verify_section = f"""
-🧪 **验证命令**：任务完成后必须执行 `{self.current_verify_cmd}` 确保无报错
+🧪 **验证命令**：任务完成后必须执行 `{verify_cmd}` 确保无报错
 """
 
         return f"""⚠️ DAG 自动化任务执行模式
@@ -276,87 +381,33 @@ class ClaudeCodeBatchExecutor(BaseBatchExecutor):
         escaped_description = task_description.replace("'", "\\'")
         return f"cc '{escaped_description}'"
 
-    def execute_command_parallel(self, args: Tuple[int, str, str]) -> TaskResult:
+    def process_command(self, command: str, automation_prefix: str = None) -> Union[str, Sequence[str]]:
         """
-        并行执行单个cc命令（重写以支持Claude命令转换）
+        并行执行时实际启动的命令（重写以支持Claude命令转换）
 
         Args:
-            args: (task_id, command, working_dir) 元组
+            command: 要执行的cc命令
+            automation_prefix: 自动化执行指示前缀（为 None 时按实例上下文生成）
 
         Returns:
-            TaskResult: 任务执行结果
+            claude 参数列表；不是cc命令时原样返回（经 shell 执行）
         """
-        task_id, command, working_dir = args
-        start_time = time.time()
-
-        try:
-            # 提取cc命令中的内容并转换为claude命令
-            if command.startswith("cc '") and command.endswith("'"):
-                content = command[4:-1]  # 移除 cc ' 和 '
-
-                # 添加自动化执行指示前缀
-                automation_prefix = self._get_automation_prefix()
-                enhanced_content = automation_prefix + content
-
-                # 构建claude命令
-                claude_cmd = [
-                    self.claude_bin,
-                    "-p", enhanced_content,
-                    "--allowedTools", "*",
-                    "--permission-mode", "bypassPermissions"
-                ]
-
-                # 执行claude命令
-                result = subprocess.run(
-                    claude_cmd,
-                    cwd=working_dir,
-                    capture_output=True,  # 并行时捕获输出
-                    text=True,
-                    timeout=1800  # 30分钟超时
-                )
-            else:
-                # 直接执行原命令
-                result = subprocess.run(
-                    command,
-                    shell=True,
-                    cwd=working_dir,
-                    capture_output=True,
-                    text=True,
-                    timeout=1800
-                )
-
-            duration = time.time() - start_time
-            success = result.returncode == 0
-            output = result.stdout if success else ""
-            error_msg = result.stderr if not success else ""
-
-            return TaskResult(
-                task_id=task_id,
-                command=command,
-                success=success,
-                duration=duration,
-                output=output,
-                error_msg=error_msg
-            )
-
-        except subprocess.TimeoutExpired:
-            duration = time.time() - start_time
-            return TaskResult(
-                task_id=task_id,
-                command=command,
-                success=False,
-                duration=duration,
-                error_msg="命令执行超时 (30分钟)"
-            )
-        except Exception as e:
-            duration = time.time() - start_time
-            return TaskResult(
-                task_id=task_id,
-                command=command,
-                success=False,
-                duration=duration,
-                error_msg=str(e)
-            )
+        # 提取cc命令中的内容并转换为claude命令
+        if not (command.startswith("cc '") and command.endswith("'")):
+            return command
+        content = command[4:-1]  # 移除 cc ' 和 '
+
+        # 添加自动化执行指示前缀
+        if automation_prefix is None:
+            automation_prefix = self._get_automation_prefix()
+        enhanced_content = automation_prefix + content
+
+        return [
+            self.claude_bin,
+            "-p", enhanced_content,
+            "--allowedTools", "*",
+            "--permission-mode", "bypassPermissions"
+        ]
 
     def execute_command_serial(self, command: str, working_dir: str, task_id: int) -> bool:
         """
@@ -403,8 +454,10 @@ class ClaudeCodeBatchExecutor(BaseBatchExecutor):
                 _current_process = subprocess.Popen(
                     claude_cmd,
                     cwd=working_dir,
-                    text=True
+                    text=True,
+                    stderr=subprocess.PIPE
                 )
+                stderr = StderrTail(_current_process.stderr)
                 returncode = _current_process.wait()
                 _current_process = None
             else:
@@ -413,21 +466,28 @@ class ClaudeCodeBatchExecutor(BaseBatchExecutor):
                     command,
                     shell=True,
                     cwd=working_dir,
-                    text=True
+                    text=True,
+                    stderr=subprocess.PIPE
                 )
+                stderr = StderrTail(_current_process.stderr)
                 returncode = _current_process.wait()
                 _current_process = None
 
             if _interrupted:
                 return False
 
+            if returncode != 0:
+                # 瞬时失败识别：stderr 末尾 + 退出码
+                self.last_failure = TaskResult(task_id=task_id, command=command, success=False, duration=0,
+                                               error_msg=stderr.text(), exit_code=returncode)
+
             if returncode == 0:
                 print("✅ 命令执行成功")
 
                 # 自动提交（如果启用）
                 if command.startswith("cc '") and command.endswith("'"):
                     content = command[4:-1]  # 移除 cc ' 和 '
-                    self._auto_commit_if_needed(content, task_id)
+                    self._auto_commit_if_needed(content, task_id, self.current_task)
 
                 return True
             else:
@@ -437,6 +497,8 @@ class ClaudeCodeBatchExecutor(BaseBatchExecutor):
         except Exception as e:
             _current_process = None
             print(f"❌ 执行命令时发生异常: {e}")
+            self.last_failure = TaskResult(task_id=task_id, command=command, success=False, duration=0,
+                                           error_msg=str(e))
             return False
 
     def execute_dag_task(self, task: TaskNode) -> bool:
@@ -445,7 +507,7 @@ class ClaudeCodeBatchExecutor(BaseBatchExecutor):
 
         这个方法封装了完整的任务执行流程：
         1. 自动标记任务开始
-        2. 执行任务
+        2. 执行任务（瞬时失败时退避重试，每次重试记入状态文件）
         3. 自动标记任务完成
 
         Args:
@@ -461,82 +523,149 @@ class ClaudeCodeBatchExecutor(BaseBatchExecutor):
         if self.state_manager and self.current_stage_id is not None:
             self.state_manager.start_task(self.current_stage_id, task.task_id)
 
-        # 2. 构建命令并执行
-        command = self.build_command(task.description)
+        # 2. 构建命令并执行（瞬时失败按重试策略退避后重新执行）
+        command = self.build_command(self._task_prompt(task))
         working_dir = os.getcwd()
-        success = self.execute_command_serial(command, working_dir, task.task_id)
+        self.current_task = task
+        self.write_tracker.start((task.stage_id, task.task_id))
+        started = time.monotonic()
+        attempt = 1
+        try:
+            while True:
+                self.last_failure = None
+                success = self.execute_command_serial(command, working_dir, task.task_id)
+                if success or _interrupted or self.last_failure is None:
+                    break
+                delay = self._retry_backoff(task.task_id, attempt, self.last_failure, task)
+                if delay is None:
+                    break
+                time.sleep(delay)
+                attempt += 1
+        finally:
+            self.current_task = None
+            self.write_tracker.discard((task.stage_id, task.task_id))
 
         # 3. 自动标记任务完成
         if self.state_manager and self.current_stage_id is not None:
             error_msg = None if success else "任务执行失败"
-            self.state_manager.complete_task(self.current_stage_id, task.task_id, success, error_msg)
+            self.state_manager.complete_task(self.current_stage_id, task.task_id, success, error_msg,
+                                             duration=time.monotonic() - started)
 
         return success
 
+    def run_dag_task(self, task: TaskNode, global_goal: str = "", stage_context: str = "",
+                     context_refs: List[str] = None) -> TaskResult:
+        """
+        执行单个 DAG 任务（线程安全，供 depends_on 任务级调度器调用）
+
+        不同阶段的任务可能同时运行，上下文全部通过参数传入，不读写实例上的当前任务状态；
+        任务状态由 DAGExecutor 在主线程持久化。
+
+        Args:
+            task: 任务节点
+            global_goal: 项目宏观目标
+            stage_context: 任务所属阶段的上下文
+            context_refs: 项目/阶段级延迟引用句柄
+
+        Returns:
+            TaskResult: 任务执行结果
+        """
+        automation_prefix = self._get_automation_prefix(
+            global_goal=global_goal,
+            stage_context=stage_context,
+            verify_cmd=task.verify_cmd,
+            context_refs=context_refs or []
+        )
+        command = self.build_command(self._task_prompt(task))
+        self.write_tracker.start((task.stage_id, task.task_id))
+        result = self.execute_command_parallel((task.task_id, command, os.getcwd()), automation_prefix)
+
+        if result.success:
+            with _commit_lock:
+                self._auto_commit_if_needed(task.description, task.task_id, task)
+        self.write_tracker.discard((task.stage_id, task.task_id))
+        return result
+
     def execute_dag_batch_parallel(self, tasks: List[TaskNode], max_workers: int) -> List[TaskResult]:
         """
         并行执行一批 DAG 任务（per-task 状态持久化）
 
         设计要点：
         - 不预写 in_progress：只在拿到 result 那一刻才 complete_task
-        - ProcessPoolExecutor 在主线程单线程收 future 结果，git commit 天然无竞态
+        - 一个事件循环并发运行全部子进程（async_engine），完成回调在主线程串行执行，git commit 天然无竞态
         - Ctrl+C 时 already-completed 的任务状态已落盘，不会丢失
-        - 捕获 KeyboardInterrupt 后 cancel_futures 并 re-raise 给顶层 main
+        - KeyboardInterrupt 时事件循环取消未完成的任务并终止其子进程，再 re-raise 给顶层 main
+        - 瞬时失败的任务释放槽位、退避后重新排队（retry_policy），重试用完才作为失败结果返回
+        - 慢任务在独立工作副本中对冲执行（hedge_policy），先成功的一方胜出，胜出方的改动才进入主工作区和自动提交
+        - 有运行历史（run_history）时进度行显示按历史耗时估计的剩余时间
         """
         working_dir = os.getcwd()
-        commands = [self.build_command(task.description) for task in tasks]
+        commands = [self.build_command(self._task_prompt(task)) for task in tasks]
         total = len(tasks)
 
         print(f"\n🚀 并行执行 {total} 个任务 (最大 {max_workers} 并发)\n")
 
-        monitor = ProgressMonitor(total)
+        # 有运行历史时状态行显示预计剩余时间
+        estimates = {}
+        if self.run_history is not None:
+            ranges, _ = self.run_history.estimates(tasks)
+            estimates = {task.task_id: span for task, span in zip(tasks, ranges)}
+        monitor = ProgressMonitor(total, estimates, max_workers)
         results: List[Optional[TaskResult]] = [None] * total
-        executor = ProcessPoolExecutor(max_workers=max_workers)
-        shutdown_done = False
 
-        try:
-            future_to_index = {}
-            for idx, (task, cmd) in enumerate(zip(tasks, commands)):
-                args = (task.task_id, cmd, working_dir)
-                future = executor.submit(self.execute_command_parallel, args)
-                future_to_index[future] = idx
-                monitor.start_task(task.task_id, cmd)
-
-            for future in as_completed(future_to_index):
-                idx = future_to_index[future]
-                task = tasks[idx]
-                try:
-                    result = future.result()
-                except Exception as e:
-                    result = TaskResult(
-                        task_id=task.task_id,
-                        command=commands[idx],
-                        success=False,
-                        duration=0,
-                        error_msg=f"任务执行异常: {e}"
-                    )
-
-                results[idx] = result
-                monitor.complete_task(task.task_id, result.success)
-
-                # 立即持久化 + 单任务 commit（主线程串行，无 git lock 竞态）
-                if self.state_manager and self.current_stage_id is not None:
-                    err = result.error_msg if not result.success else None
-                    self.state_manager.complete_task(
-                        self.current_stage_id, task.task_id, result.success, err
-                    )
-                if result.success:
-                    self._auto_commit_if_needed(task.description, task.task_id)
+        def on_done(idx: int, result: Optional[TaskResult], error: Optional[Exception]):
+            task = tasks[idx]
+            if error is not None:
+                result = TaskResult(
+                    task_id=task.task_id,
+                    command=commands[idx],
+                    success=False,
+                    duration=0,
+                    error_msg=f"任务执行异常: {error}"
+                )
 
+            results[idx] = result
+            if self.concurrency:
+                self.concurrency.record_result(result)
+            monitor.complete_task(task.task_id, result.success)
+
+            # 立即持久化 + 单任务 commit（主线程串行，无 git lock 竞态）
+            if self.state_manager and self.current_stage_id is not None:
+                err = result.error_msg if not result.success else None
+                # 并行批次不预写 in_progress（没有 start_time），耗时取执行结果
+                self.state_manager.complete_task(
+                    self.current_stage_id, task.task_id, result.success, err,
+                    duration=result.duration if error is None else None
+                )
+            if result.success:
+                self._auto_commit_if_needed(task.description, task.task_id, task)
+            self.write_tracker.discard((task.stage_id, task.task_id))
+
+        def on_start(idx: int):
+            self.write_tracker.start((tasks[idx].stage_id, tasks[idx].task_id))
+            monitor.start_task(tasks[idx].task_id, commands[idx])
+
+        jobs = [partial(self.execute_command_async, (task.task_id, cmd, working_dir))
+                for task, cmd in zip(tasks, commands)]
+        hedge = None
+        if self.hedge_policy is not None:
+            hedge = WorktreeHedger(
+                self.hedge_policy, tasks,
+                lambda idx, cwd: self.execute_command_async((tasks[idx].task_id, commands[idx], cwd)),
+                working_dir,
+                writes=lambda idx: self.write_tracker.peek((tasks[idx].stage_id, tasks[idx].task_id)))
+        try:
+            run_bounded(jobs, max_workers, on_done,
+                        on_start=on_start,
+                        limiter=self.concurrency,
+                        retry=lambda idx, result, error, attempt: self._retry_backoff(
+                            tasks[idx].task_id, attempt, result if error is None else error, tasks[idx],
+                            record_concurrency=True),
+                        hedge=hedge)
         except KeyboardInterrupt:
             done = sum(1 for r in results if r is not None)
             print(f"\n⚠️  批次被中断：已持久化 {done}/{total} 任务的状态", flush=True)
-            executor.shutdown(wait=False, cancel_futures=True)
-            shutdown_done = True
             raise
-        finally:
-            if not shutdown_done:
-                executor.shutdown(wait=True)
 
         return [r for r in results if r is not None]
 
@@ -546,6 +675,8 @@ def resolve_task_entry(arg: str) -> Optional[Path]:
     解析任务入口，支持以下写法（按优先级）：
 
     1. `batchcc task-xxx`          → 查找 `.task-xxx/dag.md`（新格式主路径）
+                                   只有 `.task-xxx/stages/*.md`（多文件布局）时同样返回
+                                   `.task-xxx/dag.md`，由解析器合并各阶段文件
     2. `batchcc .task-xxx`         → 等价于 1
     3. `batchcc .task-xxx/dag.md`  → 直接使用
     4. `batchcc some-file.md`      → 简单 TASK 格式（向后兼容）
@@ -556,10 +687,10 @@ def resolve_task_entry(arg: str) -> Optional[Path]:
     """
     p = Path(arg)
 
-    # 1. 传入目录：找 dag.md
+    # 1. 传入目录：找 dag.md（或多文件布局的 stages/）
     if p.is_dir():
         entry = p / "dag.md"
-        if entry.exists():
+        if entry.exists() or find_stage_files(entry):
             return entry
         return None
 
@@ -568,11 +699,11 @@ def resolve_task_entry(arg: str) -> Optional[Path]:
         hidden_dir = p.parent / f".{p.name}"
         if hidden_dir.is_dir():
             entry = hidden_dir / "dag.md"
-            if entry.exists():
+            if entry.exists() or find_stage_files(entry):
                 return entry
 
-    # 3/4. 直接文件存在
-    if p.exists() and p.is_file():
+    # 3/4. 直接文件存在（多文件布局下 .task-xxx/dag.md 可以不存在）
+    if (p.exists() and p.is_file()) or (p.name == "dag.md" and find_stage_files(p)):
         return p
 
     # 5. 补 .md 后缀
@@ -593,15 +724,22 @@ def is_dag_format(file_path: str) -> bool:
     Returns:
         是否是 DAG 格式
     """
+    if find_stage_files(file_path):
+        # 多文件布局：.task-xxx/stages/*.md（dag.md 可以不存在）
+        return True
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
             # 检查 DAG 格式标记（兼容多种写法）
             # 标准: ## STAGE ## name="xxx"
             # 变体: ## STAGE 1 或 ## STAGE: name
-            has_stage = '## STAGE' in content and '##' in content
-            has_task = '## TASK' in content
-            return has_stage and has_task
+            # 逐行扫描，两种标记都出现即返回，不读完整个文件
+            has_stage = has_task = False
+            for line in f:
+                has_stage = has_stage or '## STAGE' in line
+                has_task = has_task or '## TASK' in line
+                if has_stage and has_task:
+                    return True
+            return False
     except:
         return False
 
@@ -620,11 +758,88 @@ def main():
                        help='仅显示执行计划，不实际执行')
     parser.add_argument('--restart', action='store_true',
                        help='清空状态文件，从头开始')
+    parser.add_argument('--lazy-refs', action='store_true',
+                       help='延迟展开 @文件引用：解析时只记录路径，构建任务 prompt 时才读取')
+    parser.add_argument('--watch', action='store_true',
+                       help='监视模式：执行期间轮询 DAG 文件及引用文件，新增任务/阶段和未开始任务的修改合并进当前执行')
+    parser.add_argument('--watch-interval', type=float, default=2.0,
+                       help='监视模式的轮询间隔秒数 (默认: 2)')
+    parser.add_argument('--emit-plan', choices=EXPORT_FORMATS,
+                       help='导出解析后的完整执行计划（阶段、任务、冲突映射、批次）后退出，不执行')
+    parser.add_argument('--plan-output',
+                       help='--emit-plan 的输出路径 (默认: .task-xxx/plan.export.json|.msgpack)')
+    parser.add_argument('--from-plan', metavar='PLAN',
+                       help='从 --emit-plan 导出的执行计划直接启动，不解析 markdown')
+    parser.add_argument('--precise-conflicts', action='store_true',
+                       help='精确冲突检测：glob 展开到仓库文件列表（git ls-files），触及同一文件才串行')
+    parser.add_argument('--learned-conflicts', action='store_true',
+                       help='按学到的写集合检测冲突：任务以往运行实际修改的文件（.git/batch-write-sets.json）代替 文件: 声明')
+    parser.add_argument('--no-barrier', action='store_true',
+                       help='并行阶段不按批次等待：任务锁住自己的文件范围，有空闲并发且不与运行中任务冲突即启动')
+    parser.add_argument('--adaptive', action='store_true',
+                       help='自适应并发：从 2 开始，任务成功且耗时稳定时 +1，输出限流/过载时减半（不超过阶段 max_workers 或 -p）')
+    parser.add_argument('--launch-rate', type=float, default=0, metavar='N',
+                       help='每分钟最多启动 N 个 agent（令牌桶，整个运行共享；默认不限制）')
+    parser.add_argument('--keep-going', action='store_true',
+                       help='任务失败后继续执行不依赖它的任务，被阻塞的任务标记为跳过（再次运行时与失败任务一起重跑）')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES, metavar='N',
+                       help=f'瞬时失败（限流/网络/服务端错误/超时）的重试次数，任务可用 retries="N" 覆盖 '
+                            f'(默认: {DEFAULT_RETRIES}，不重试；开启后失败的任务会被重新执行，注意任务已产生的副作用)')
+    parser.add_argument('--backoff', default=DEFAULT_BACKOFF, metavar='BASE[..MAX]',
+                       help=f'重试的指数退避（带抖动），任务可用 backoff="..." 覆盖 (默认: {DEFAULT_BACKOFF})')
+    parser.add_argument('--hedge', action='store_true',
+                       help='对冲执行：并行批次中运行时间远超同批任务的任务在独立 git worktree 中再启动一份，先成功者胜出（仅声明了 文件: 的任务）')
+    parser.add_argument('--hedge-percentile', type=float, default=DEFAULT_PERCENTILE, metavar='P',
+                       help=f'对冲阈值：运行时间超过同批已完成任务耗时的第 P 百分位 (默认: {DEFAULT_PERCENTILE})')
+    parser.add_argument('--critical-path', action='store_true',
+                       help='关键路径优先：就绪任务按预计剩余关键路径从长到短启动（耗时取以往状态文件，按任务指纹匹配）；priority="N" 始终优先')
+    parser.add_argument('--no-history', action='store_true',
+                       help='不读写运行历史（默认 DAG 模式每次运行都追加到 ~/.claude/batch-history/tasks.jsonl：'
+                            f'任务描述摘要、工作目录、耗时与结果，保留最近 {MAX_RECORDS} 条；'
+                            '用于预计剩余时间、--critical-path 和 --hedge 的估计）')
 
     args = parser.parse_args()
 
+    # 自适应并发 / 启动限速：整个运行共享一个控制器
+    concurrency = None
+    if args.adaptive or args.launch_rate > 0:
+        concurrency = AdaptiveConcurrency(launch_rate=args.launch_rate, adaptive=args.adaptive)
+
+    # 瞬时失败重试策略（运行级默认值）
+    try:
+        retry_policy = RetryPolicy(retries=args.retries, backoff=args.backoff)
+    except ValueError as e:
+        print(f"❌ --backoff: {e}")
+        return 1
+
+    # 运行历史（DAG 模式记录任务耗时与结果，整个运行共享）
+    run_history = None if args.no_history else RunHistory(backend="batchcc")
+
+    # 慢任务对冲策略（仅 DAG 并行批次；同批次样本不足时按任务自身的历史 P90 对冲）
+    hedge_policy = None
+    if args.hedge:
+        try:
+            hedge_policy = HedgePolicy(percentile=args.hedge_percentile,
+                                       estimate=run_history.p90 if run_history else None)
+        except ValueError as e:
+            print(f"❌ --hedge-percentile: {e}")
+            return 1
+
     # 创建执行器
     executor = ClaudeCodeBatchExecutor()
+    executor.concurrency = concurrency
+    executor.retry_policy = retry_policy
+    executor.hedge_policy = hedge_policy
+    executor.run_history = run_history
+
+    # 预先生成的执行计划（任务文件取导出时记录的路径，决定状态文件位置）
+    exported = None
+    if args.from_plan:
+        try:
+            exported = load_plan_export(args.from_plan)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
 
     # 解析入口（支持 .task-xxx/ 目录入口 + 旧版裸文件）
     if args.template:
@@ -638,6 +853,8 @@ def main():
             print("  batchcc some-file.md        # 简单 TASK 格式")
             return 1
         template_file = resolved
+    elif exported is not None:
+        template_file = Path(exported.task_file)
     else:
         template_file = executor.get_default_template_path()
         if not template_file.exists():
@@ -645,10 +862,16 @@ def main():
             return 1
 
     # 检查是否是 DAG 格式
-    if is_dag_format(str(template_file)):
+    if exported is not None or is_dag_format(str(template_file)):
         print(f"batchcc.py - DAG 模式")
         print(f"模板文件: {template_file}")
         print(f"当前工作目录: {os.getcwd()}")
+        if exported is not None:
+            print(f"执行计划: {args.from_plan}（{exported.format}，跳过解析）")
+            if exported.base_dir and exported.base_dir != os.getcwd():
+                print(f"⚠️  执行计划导出时的工作目录为 {exported.base_dir}，文件范围和 @引用 都相对于该目录")
+            if args.watch:
+                print("⚠️  --from-plan 不解析 markdown，--watch 已忽略")
         print()
 
         try:
@@ -663,9 +886,28 @@ def main():
             dag_executor = DAGExecutor(
                 str(template_file),
                 executor.execute_dag_task,
-                use_state=True
+                use_state=True,
+                lazy_refs=args.lazy_refs,
+                watch=args.watch,
+                watch_interval=args.watch_interval,
+                plan=exported.plan if exported is not None else None,
+                precise_conflicts=args.precise_conflicts,
+                barrier_free=args.no_barrier,
+                learned_conflicts=args.learned_conflicts,
+                concurrency=concurrency,
+                keep_going=args.keep_going,
+                retry_policy=retry_policy,
+                hedge_policy=hedge_policy,
+                critical_path=args.critical_path,
+                run_history=run_history
             )
 
+            if args.emit_plan:
+                output = args.plan_output or default_export_path(str(template_file), args.emit_plan)
+                size = export_plan(dag_executor.compile_plan(), str(template_file), output, args.emit_plan)
+                print(f"📦 已导出执行计划: {output} ({args.emit_plan}, {size} 字节)")
+                return 0
+
             if args.dry_run:
                 # 显示执行计划
                 dag_executor.print_plan()
@@ -673,7 +915,8 @@ def main():
             else:
                 # 执行任务
                 success = dag_executor.execute(
-                    lambda tasks, max_workers: executor.execute_dag_batch_parallel(tasks, max_workers)
+                    lambda tasks, max_workers: executor.execute_dag_batch_parallel(tasks, max_workers),
+                    task_runner=executor.run_dag_task
                 )
                 return 0 if success else 1
 
@@ -698,13 +941,17 @@ def main():
             max_workers = 1
             is_parallel = False
         else:
-            import multiprocessing as mp
-            max_workers = min(args.parallel, args.max_parallel, mp.cpu_count())
+            # agent 调用受网络/服务端限流约束，不按 CPU 核数限制
+            max_workers = min(args.parallel, args.max_parallel)
             is_parallel = max_workers > 1
 
         print(f"执行模式: {'串行' if args.single else '并行'}")
         if is_parallel:
             print(f"并发数: {max_workers}")
+        if concurrency:
+            print(f"并发控制: {concurrency.describe()}")
+        if is_parallel:
+            print(f"失败重试: {retry_policy.describe()}")
         print()
 
         # 提取命令
@@ -732,6 +979,11 @@ def main():
 
             executor.print_parallel_results(results)
             success_count = sum(1 for r in results if r.success)
+            if concurrency:
+                for line in concurrency.report():
+                    print(line)
+            for line in retry_policy.report():
+                print(line)
         else:
             # 串行执行
             success_count, _ = executor.execute_serial_batch(commands, os.getcwd())
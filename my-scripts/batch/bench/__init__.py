@@ -0,0 +1,11 @@
+"""
+DAG 规划器基准测试套件
+
+- generator: 合成 DAG 文件生成器（阶段数、每阶段任务数、glob 密度、冲突比例、@引用深度可配）
+- run: 计时 DAGParser.parse / detect_conflicts / create_batches / print_plan，输出 JSON 结果
+- compare: 对比两次结果（如两个 commit），超过阈值的回退以非零退出码报告
+
+用法（在 my-scripts/batch 目录下）：
+    python -m bench.run --json results/HEAD.json
+    python -m bench.compare results/base.json results/HEAD.json
+"""
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+对比两次基准测试结果
+
+按 (任务数, 阶段) 对齐两份 bench.run 输出的 JSON，打印耗时比值；
+任一项变慢超过阈值（默认 10%）时退出码为 1，可用于提交前检查。
+
+用法（在 my-scripts/batch 目录下）：
+    python -m bench.compare results/base.json results/HEAD.json
+    python -m bench.compare base.json head.json --threshold 0.2
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Dict, Tuple
+
+PHASES = ["parse", "detect_conflicts", "create_batches", "print_plan"]
+# 低于该耗时的项计时噪声占比过大，不参与回退判断
+MIN_SECONDS = 0.001
+
+
+def load(path: str) -> Tuple[Dict, Dict]:
+    """读取结果文件，返回 ({任务数: 结果}, 完整报告)"""
+    data = json.loads(Path(path).read_text(encoding="utf-8"))
+    return {result["tasks"]: result for result in data["results"]}, data
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='对比两次 DAG 规划器基准测试结果')
+    parser.add_argument('base', help='基准结果 JSON')
+    parser.add_argument('head', help='新结果 JSON')
+    parser.add_argument('--threshold', type=float, default=0.1, help='判定回退的变慢比例 (默认: 0.1)')
+    args = parser.parse_args()
+
+    base, base_meta = load(args.base)
+    head, head_meta = load(args.head)
+    print(f"基准: {base_meta.get('commit') or args.base}  →  新: {head_meta.get('commit') or args.head}")
+    print()
+    print(f"{'任务数':>8} " + " ".join(f"{phase:>17}" for phase in PHASES))
+    print("─" * 80)
+
+    regressions = []
+    mismatched = []
+    for tasks in sorted(set(base) & set(head)):
+        if base[tasks].get("spec") != head[tasks].get("spec"):
+            # 生成参数不同（如 include_depth、overlap_ratio），耗时不可比
+            mismatched.append(tasks)
+            continue
+        cells = []
+        for phase in PHASES:
+            old = base[tasks]["seconds"][phase]
+            new = head[tasks]["seconds"][phase]
+            ratio = new / old if old > 0 else float("inf")
+            mark = ""
+            if ratio > 1 + args.threshold and new >= MIN_SECONDS:
+                mark = " ⚠️"
+                regressions.append((tasks, phase, ratio))
+            cells.append(f"{ratio:>15.2f}x{mark}")
+        print(f"{tasks:>8} " + " ".join(cells))
+
+    if mismatched:
+        print(f"\n⚠️  生成参数不同的规模（未对比）: {mismatched}")
+    missing = sorted(set(base) ^ set(head))
+    if missing:
+        print(f"\n⚠️  只在一份结果中出现的规模（未对比）: {missing}")
+
+    print()
+    if regressions:
+        print(f"❌ {len(regressions)} 项变慢超过 {args.threshold:.0%}:")
+        for tasks, phase, ratio in regressions:
+            print(f"   {tasks} 任务 {phase}: {ratio:.2f}x")
+        return 1
+    print(f"✅ 无超过 {args.threshold:.0%} 的回退")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+合成 DAG 文件生成器
+
+生成结构与 DAG 命令产出一致的任务文件（STAGE/TASK/文件:/排除:/验证:），
+可配置规模和冲突特征，用固定随机种子保证同一参数生成的文件完全相同（跨 commit 可比）。
+"""
+
+import random
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, List
+
+
+@dataclass
+class DAGSpec:
+    """合成 DAG 参数"""
+    stages: int = 10  # 阶段数
+    tasks_per_stage: int = 50  # 每阶段任务数
+    globs_per_task: int = 2  # 每个任务的 文件: 条目数（glob 密度）
+    overlap_ratio: float = 0.1  # 引用公共文件的任务比例（制造阶段内冲突）
+    include_depth: int = 0  # 每个阶段通过几层 @文件引用 嵌套引入（0 = 全部内联在 dag.md）
+    parallel_ratio: float = 0.8  # 并行阶段比例（其余为串行）
+    seed: int = 42
+
+    @property
+    def total_tasks(self) -> int:
+        return self.stages * self.tasks_per_stage
+
+    @classmethod
+    def for_task_count(cls, task_count: int, **overrides) -> 'DAGSpec':
+        """按总任务数生成参数（每阶段任务数不变，阶段数随规模增长）"""
+        spec = cls(**overrides)
+        spec.tasks_per_stage = min(spec.tasks_per_stage, task_count)
+        spec.stages = max(1, task_count // spec.tasks_per_stage)
+        return spec
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+# 公共文件池：overlap 任务从中挑选，池越小冲突越密集
+_SHARED_FILES = [f"src/common/shared_{i}.ts" for i in range(4)]
+
+
+def _task_lines(spec: DAGSpec, rng: random.Random, stage: int, task: int) -> List[str]:
+    module = f"mod_{stage}_{task}"
+    files = [f"src/{module}/**/*.ts"]
+    for extra in range(1, spec.globs_per_task):
+        files.append(f"src/{module}/part_{extra}/index.ts" if extra % 2 else f"tests/{module}/case_{extra}.spec.ts")
+    if rng.random() < spec.overlap_ratio:
+        files.append(rng.choice(_SHARED_FILES))
+
+    return [
+        "## TASK ##",
+        f"重构模块 {module}",
+        "",
+        f"**目标**：统一 {module} 的错误处理和日志格式",
+        "",
+        f"文件: {', '.join(files)}",
+        f"排除: src/{module}/generated/",
+        f"验证: npm test -- {module}",
+        "",
+    ]
+
+
+def _stage_lines(spec: DAGSpec, rng: random.Random, stage: int) -> List[str]:
+    mode = "parallel" if rng.random() < spec.parallel_ratio else "serial"
+    lines = [
+        f'## STAGE ## name="stage-{stage}" mode="{mode}" max_workers="4"',
+        f"# 🎯 阶段目标：处理第 {stage} 组模块",
+        "",
+    ]
+    for task in range(spec.tasks_per_stage):
+        lines.extend(_task_lines(spec, rng, stage, task))
+    return lines
+
+
+def write_dag(spec: DAGSpec, out_dir: Path) -> Path:
+    """
+    生成合成 DAG
+
+    @文件引用 的路径相对当前工作目录解析（与 batchcc 一致），
+    解析生成的文件前需先 chdir 到 out_dir。
+
+    Args:
+        spec: 生成参数
+        out_dir: 输出目录
+
+    Returns:
+        入口文件路径（out_dir/dag.md）
+    """
+    rng = random.Random(spec.seed)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    lines = ["# 合成基准 DAG", "", "> **项目宏观目标**：规划器性能基准", ""]
+
+    for stage in range(spec.stages):
+        stage_lines = _stage_lines(spec, rng, stage)
+        if spec.include_depth <= 0:
+            lines.extend(stage_lines)
+            continue
+
+        # dag.md → inc/s{stage}_1.md → ... → inc/s{stage}_{depth}.md（最后一层是阶段内容）
+        inc_dir = out_dir / "inc"
+        inc_dir.mkdir(exist_ok=True)
+        lines.append(f"@inc/s{stage}_1.md")
+        for level in range(1, spec.include_depth):
+            (inc_dir / f"s{stage}_{level}.md").write_text(
+                f"<!-- 第 {level} 层引用 -->\n@s{stage}_{level + 1}.md\n", encoding="utf-8")
+        (inc_dir / f"s{stage}_{spec.include_depth}.md").write_text("\n".join(stage_lines), encoding="utf-8")
+
+    entry = out_dir / "dag.md"
+    entry.write_text("\n".join(lines), encoding="utf-8")
+    return entry
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='生成合成 DAG 文件')
+    parser.add_argument('out_dir', help='输出目录')
+    parser.add_argument('--tasks', type=int, default=1000, help='总任务数 (默认: 1000)')
+    parser.add_argument('--tasks-per-stage', type=int, default=50)
+    parser.add_argument('--globs-per-task', type=int, default=2)
+    parser.add_argument('--overlap-ratio', type=float, default=0.1)
+    parser.add_argument('--include-depth', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    spec = DAGSpec.for_task_count(
+        args.tasks,
+        tasks_per_stage=args.tasks_per_stage,
+        globs_per_task=args.globs_per_task,
+        overlap_ratio=args.overlap_ratio,
+        include_depth=args.include_depth,
+        seed=args.seed,
+    )
+    entry = write_dag(spec, Path(args.out_dir))
+    print(f"✅ 已生成 {spec.total_tasks} 个任务（{spec.stages} 个阶段）: {entry}")
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+规划器基准测试
+
+对每个规模生成合成 DAG，分别计时：
+- parse: DAGParser.parse（每次使用新的 RefResolver，包含读盘和 @引用 展开）
+- detect_conflicts: 所有并行阶段的 ConflictDetector.detect_conflicts 之和
+- create_batches: 所有并行阶段的 ConflictDetector.create_batches 之和
+- print_plan: DAGExecutor.print_plan 渲染（冲突和批次已预先计算，输出丢弃）
+
+每项取多次运行的最优值，结果可写入 JSON（含 commit、Python 版本、生成参数），
+用 bench.compare 跨 commit 对比。
+
+用法（在 my-scripts/batch 目录下）：
+    python -m bench.run                                  # 默认 10 ~ 100k 任务
+    python -m bench.run --sizes 100 1000 --repeat 5
+    python -m bench.run --include-depth 3 --json results/HEAD.json
+    python -m bench.run --sizes 500 2000 8000 --tasks-per-stage 8000   # 单阶段规模增长（冲突检测的扩展性）
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+BATCH_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BATCH_DIR))
+
+from bench.generator import DAGSpec, write_dag
+from dag_parser import DAGParser, ConflictDetector
+from dag_executor import DAGExecutor
+from ref_resolver import RefResolver
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+PHASES = ["parse", "detect_conflicts", "create_batches", "print_plan"]
+RESULT_FORMAT_VERSION = 1
+
+
+def best_of(repeat: int, func: Callable[[], None]) -> float:
+    """多次运行取最优耗时（秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_size(spec: DAGSpec, repeat: int) -> Dict:
+    """生成一个规模的 DAG 并计时各阶段"""
+    with tempfile.TemporaryDirectory() as td:
+        out_dir = Path(td)
+        old_cwd = os.getcwd()
+        os.chdir(out_dir)  # @文件引用 相对当前工作目录解析
+        try:
+            entry = write_dag(spec, out_dir)
+            timings: Dict[str, float] = {}
+
+            timings["parse"] = best_of(repeat, lambda: DAGParser(str(entry), resolver=RefResolver()).parse())
+
+            parser = DAGParser(str(entry), resolver=RefResolver())
+            stages = parser.parse()
+            parallel = [stage for stage in stages if stage.mode == 'parallel']
+            conflicts = {stage.stage_id: ConflictDetector.detect_conflicts(stage.tasks) for stage in parallel}
+
+            timings["detect_conflicts"] = best_of(
+                repeat, lambda: [ConflictDetector.detect_conflicts(stage.tasks) for stage in parallel])
+            timings["create_batches"] = best_of(
+                repeat, lambda: [ConflictDetector.create_batches(stage.tasks, conflicts[stage.stage_id])
+                                 for stage in parallel])
+
+            executor = DAGExecutor(str(entry), lambda task: True, use_state=False, use_plan_cache=False)
+            executor.stages = stages
+            executor.task_index = parser.task_index
+            for stage in parallel:
+                executor._get_stage_layout(stage)
+
+            def render():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    executor.print_plan()
+
+            timings["print_plan"] = best_of(repeat, render)
+        finally:
+            os.chdir(old_cwd)
+
+    total_tasks = sum(len(stage.tasks) for stage in stages)
+    return {
+        "tasks": total_tasks,
+        "stages": len(stages),
+        "conflicting_tasks": sum(len(c) for c in conflicts.values()),
+        "spec": spec.to_dict(),
+        "seconds": timings,
+        "us_per_task": {phase: timings[phase] / total_tasks * 1e6 for phase in PHASES},
+    }
+
+
+def git_commit() -> str:
+    """当前 commit（不在 git 仓库中时返回空字符串）"""
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BATCH_DIR,
+                                capture_output=True, text=True, timeout=10)
+        return result.stdout.strip() if result.returncode == 0 else ""
+    except Exception:
+        return ""
+
+
+def print_table(results: List[Dict]):
+    """打印结果表格（耗时 ms）"""
+    header = f"{'任务数':>8} {'阶段数':>7} " + " ".join(f"{phase:>17}" for phase in PHASES)
+    print(header)
+    print("─" * (len(header) + 8))
+    for result in results:
+        cells = " ".join(f"{result['seconds'][phase] * 1000:>14.1f} ms" for phase in PHASES)
+        print(f"{result['tasks']:>8} {result['stages']:>7} {cells}")
+    print()
+    print("每任务耗时（µs），各规模下应基本恒定：")
+    for result in results:
+        cells = " ".join(f"{result['us_per_task'][phase]:>17.2f}" for phase in PHASES)
+        print(f"{result['tasks']:>8} {'':>7} {cells}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DAG 规划器基准测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='总任务数列表 (默认: 10 100 1000 10000 100000)')
+    parser.add_argument('--repeat', type=int, default=3, help='每项重复次数，取最优 (默认: 3)')
+    parser.add_argument('--tasks-per-stage', type=int, default=50)
+    parser.add_argument('--globs-per-task', type=int, default=2)
+    parser.add_argument('--overlap-ratio', type=float, default=0.1)
+    parser.add_argument('--include-depth', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', metavar='PATH', help='结果写入 JSON 文件（供 bench.compare 对比）')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        spec = DAGSpec.for_task_count(
+            size,
+            tasks_per_stage=args.tasks_per_stage,
+            globs_per_task=args.globs_per_task,
+            overlap_ratio=args.overlap_ratio,
+            include_depth=args.include_depth,
+            seed=args.seed,
+        )
+        print(f"⏱️  {spec.total_tasks} 任务 ...", flush=True)
+        results.append(bench_size(spec, args.repeat))
+
+    print()
+    print_table(results)
+
+    if args.json:
+        report = {
+            "version": RESULT_FORMAT_VERSION,
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "results": results,
+        }
+        out_path = Path(args.json)
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        out_path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\n✅ 结果已写入: {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+冲突图着色 - 并行阶段的最少批次划分（ConflictDetector.create_batches 使用）
+
+任务是顶点，文件冲突是边，同一批次的任务两两不冲突，即一种颜色；
+每个批次都是一道屏障（要等最慢的任务），批次数越少越好：
+
+- 按连通分量分别着色：总批次数 = 各分量颜色数的最大值
+- 启发式：DSatur（每次选已着色邻居颜色最多的顶点，堆实现，O((V+E) log V)）
+- 小分量（≤ EXACT_LIMIT 个顶点）再用回溯求精确最少颜色数，超出搜索步数预算时保留 DSatur 结果
+- 颜色数确定后均衡批次：分量内顶点逐个放入可行的最轻批次（无权重时按任务数），
+  批次数不够放下时退回按颜色类整体放入当前最轻的批次
+- 结果只取决于任务顺序和冲突映射，与哈希顺序无关：批次按首个任务的位置排序，批次内按原顺序
+"""
+
+import heapq
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# 精确求解的分量规模上限和回溯步数预算
+EXACT_LIMIT = 40
+EXACT_BUDGET = 200_000
+
+
+def color_batches(task_ids: Sequence[int], conflicts: Dict[int, List[int]],
+                  weights: Optional[Dict[int, float]] = None) -> List[List[int]]:
+    """
+    按冲突关系划分批次
+
+    Args:
+        task_ids: 任务序号（按阶段内顺序）
+        conflicts: 冲突映射 {task_id: [冲突的task_id列表]}（单向记录即可，不在 task_ids 中的序号忽略）
+        weights: 任务权重（如预估耗时），用于均衡各批次；缺省为 1
+
+    Returns:
+        批次列表（每个批次为任务序号列表，批次内保持原顺序）
+    """
+    position = {task_id: i for i, task_id in enumerate(task_ids)}
+    neighbors: List[List[int]] = [[] for _ in task_ids]
+    for task_id, others in conflicts.items():
+        a = position.get(task_id)
+        if a is None:
+            continue
+        for other in others:
+            b = position.get(other)
+            if b is not None and b != a:
+                neighbors[a].append(b)
+                neighbors[b].append(a)
+    adjacency = [sorted(set(items)) for items in neighbors]
+
+    weight = [float(weights.get(task_id, 1.0)) if weights else 1.0 for task_id in task_ids]
+    colorings: List[Tuple[List[int], Dict[int, int]]] = []  # (分量, 着色；dict 按着色顺序)
+    for component in _components(adjacency):
+        coloring = _dsatur(component, adjacency)
+        if 2 < len(component) <= EXACT_LIMIT:
+            coloring = _exact(component, adjacency, coloring)
+        colorings.append((component, coloring))
+
+    # 均衡：分量按总权重从大到小放入批次。先逐个顶点放入可行的最轻批次（相当于限定颜色数的贪心着色），
+    # 颜色不够时退回按颜色类整体放入当前最轻的不同批次
+    batch_count = max(max(coloring.values()) + 1 for _, coloring in colorings) if colorings else 0
+    loads = [0.0] * batch_count
+    slot_of: Dict[int, int] = {}
+    colorings.sort(key=lambda item: (-sum(weight[v] for v in item[0]), item[0][0]))
+    for component, coloring in colorings:
+        placed = _place_balanced(coloring, adjacency, weight, loads)
+        if placed is None:
+            groups: Dict[int, List[int]] = {}
+            for vertex in component:
+                groups.setdefault(coloring[vertex], []).append(vertex)
+            ordered = sorted(groups.values(), key=lambda group: (-sum(weight[v] for v in group), group[0]))
+            slots = sorted(range(batch_count), key=lambda slot: (loads[slot], slot))
+            placed = {vertex: slot for group, slot in zip(ordered, slots) for vertex in group}
+        for vertex, slot in placed.items():
+            slot_of[vertex] = slot
+            loads[slot] += weight[vertex]
+
+    members: List[List[int]] = [[] for _ in range(batch_count)]
+    for vertex in range(len(task_ids)):
+        members[slot_of[vertex]].append(vertex)
+    batches = [items for items in members if items]
+    batches.sort(key=lambda items: items[0])
+    return [[task_ids[v] for v in items] for items in batches]
+
+
+def _place_balanced(coloring: Dict[int, int], adjacency: List[List[int]], weight: List[float],
+                    loads: List[float]) -> Optional[Dict[int, int]]:
+    """按着色顺序把顶点放入不与已放置邻居冲突的最轻批次；批次数不够时返回 None"""
+    local = list(loads)
+    placed: Dict[int, int] = {}
+    for vertex in coloring:
+        taken = {placed[other] for other in adjacency[vertex] if other in placed}
+        slot = min((slot for slot in range(len(local)) if slot not in taken),
+                   key=lambda slot: (local[slot], slot), default=None)
+        if slot is None:
+            return None
+        placed[vertex] = slot
+        local[slot] += weight[vertex]
+    return placed
+
+
+def _components(adjacency: List[List[int]]) -> List[List[int]]:
+    """连通分量（按最小顶点下标顺序，分量内顶点升序）"""
+    seen = [False] * len(adjacency)
+    components = []
+    for start in range(len(adjacency)):
+        if seen[start]:
+            continue
+        seen[start] = True
+        stack, component = [start], []
+        while stack:
+            vertex = stack.pop()
+            component.append(vertex)
+            for other in adjacency[vertex]:
+                if not seen[other]:
+                    seen[other] = True
+                    stack.append(other)
+        component.sort()
+        components.append(component)
+    return components
+
+
+def _dsatur(component: List[int], adjacency: List[List[int]]) -> Dict[int, int]:
+    """DSatur 启发式着色（饱和度相同时取度数大的，再取下标小的）"""
+    coloring: Dict[int, int] = {}
+    neighbor_colors: Dict[int, set] = {vertex: set() for vertex in component}
+    heap = [(0, -len(adjacency[vertex]), vertex) for vertex in component]
+    heapq.heapify(heap)
+    while heap:
+        saturation, degree, vertex = heapq.heappop(heap)
+        if vertex in coloring or -saturation != len(neighbor_colors[vertex]):
+            continue  # 已着色或过期条目
+        used = neighbor_colors[vertex]
+        color = 0
+        while color in used:
+            color += 1
+        coloring[vertex] = color
+        for other in adjacency[vertex]:
+            if other not in coloring and color not in neighbor_colors[other]:
+                neighbor_colors[other].add(color)
+                heapq.heappush(heap, (-len(neighbor_colors[other]), -len(adjacency[other]), other))
+    return coloring
+
+
+def _exact(component: List[int], adjacency: List[List[int]], upper: Dict[int, int]) -> Dict[int, int]:
+    """回溯求最少颜色数（从团的大小起逐个尝试，少于 DSatur 结果才替换）"""
+    best = max(upper.values()) + 1
+    lower = _greedy_clique(component, adjacency)
+    order = sorted(component, key=lambda vertex: (-len(adjacency[vertex]), vertex))
+    budget = [EXACT_BUDGET]
+
+    for colors in range(lower, best):
+        assignment: Dict[int, int] = {}
+        result = _backtrack(order, 0, colors, 0, assignment, adjacency, budget)
+        if result is None:  # 超出预算
+            break
+        if result:
+            return dict(assignment)
+    return upper
+
+
+def _backtrack(order: List[int], index: int, colors: int, used: int, assignment: Dict[int, int],
+               adjacency: List[List[int]], budget: List[int]) -> Optional[bool]:
+    """按 order 依次着色；新颜色只按编号顺序启用（消除颜色对称）。返回 None 表示预算用尽"""
+    if index == len(order):
+        return True
+    budget[0] -= 1
+    if budget[0] < 0:
+        return None
+    vertex = order[index]
+    taken = {assignment[other] for other in adjacency[vertex] if other in assignment}
+    for color in range(min(used + 1, colors)):
+        if color in taken:
+            continue
+        assignment[vertex] = color
+        result = _backtrack(order, index + 1, colors, max(used, color + 1), assignment, adjacency, budget)
+        if result is not False:
+            return result
+        del assignment[vertex]
+    return False
+
+
+def _greedy_clique(component: List[int], adjacency: List[List[int]]) -> int:
+    """贪心找一个团（颜色数下界）"""
+    clique: List[int] = []
+    for vertex in sorted(component, key=lambda v: (-len(adjacency[v]), v)):
+        if all(vertex in adjacency[member] for member in clique):
+            clique.append(vertex)
+    return max(1, len(clique))
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+DAG 编程构建接口 - 直接构建 StageNode/TaskNode，不经过 markdown 渲染和解析
+
+编排代码生成大量任务时，不必先渲染成 dag.md 再由 DAGParser 用正则解析回来：
+
+    builder = DAGBuilder(goal="把所有服务迁移到新框架")
+    builder.stage("init", "serial").task("生成脚手架", files=["tools/**"], id="scaffold")
+    builder.stage("port", "parallel", max_workers=8).tasks(
+        {"description": f"迁移 {name}", "files": [f"services/{name}/**"], "depends_on": "init.scaffold"}
+        for name in service_names)  # 流式：逐个消费迭代器，不生成中间文本
+
+    executor = DAGExecutor.from_builder(builder, run_task, state_manager=StateManager(".task-port/dag.md"))
+    executor.execute(...)
+
+构建结果与解析同等内容的 dag.md 一致：depends_on 写法相同（解析为 (stage_id, task_id) 并检查循环依赖），
+文件 glob / 验证命令同样 intern，matrix= / shard= 同样按需展开。断点续传要求每次运行构建出相同的计划。
+"""
+
+from typing import Iterable, List, Optional, Tuple, Union
+
+from dag_parser import StageNode, TaskNode, make_task_list, parse_priority, resolve_dependencies, _intern
+from plan_cache import CompiledPlan
+from task_matrix import parse_axes, TaskMatrix
+from task_shard import parse_shard, plan_shards
+from task_retry import parse_backoff, parse_retries
+from file_index import FileIndex
+
+# 任务参数：字符串按逗号分隔（与 文件: 行写法一致），或字符串列表
+PatternList = Union[str, Iterable[str]]
+
+
+class DAGBuilder:
+    """DAG 计划构建器（链式调用，每个方法返回构建器本身）"""
+
+    def __init__(self, goal: str = ""):
+        """
+        Args:
+            goal: 项目宏观目标（注入每个任务的 prompt，等同 dag.md 头部的目标）
+        """
+        self.global_goal = goal
+        self.stages: List[StageNode] = []
+        self._stage: Optional[StageNode] = None  # 正在添加任务的阶段
+        self._entries: List[TaskNode] = []  # 当前阶段的任务节点（矩阵任务只有模板）
+        self._task_count = 0  # 当前阶段展开后的任务数
+        self._pending_deps: List[Tuple[TaskNode, str]] = []  # (任务, 原始 depends_on)，build 时统一解析
+        self._file_index: Optional[FileIndex] = None  # 仓库文件索引（shard= 时才创建）
+
+    def stage(self, name: str, mode: str = 'parallel', max_workers: int = 2, description: str = "") -> 'DAGBuilder':
+        """
+        开始一个新阶段（之后添加的任务属于该阶段）
+
+        Args:
+            name: 阶段名称（depends_on 引用 name.task）
+            mode: serial 或 parallel（sequential 为 serial 的别名）
+            max_workers: 最大并发数（仅 parallel 模式）
+            description: 阶段描述（作为上下文传给阶段内任务）
+
+        Raises:
+            ValueError: mode 或 max_workers 不合法
+        """
+        if mode not in ('serial', 'parallel', 'sequential'):
+            raise ValueError(f"STAGE {name}: mode 必须是 'serial' 或 'parallel'，当前: {mode}")
+        if isinstance(max_workers, bool) or not isinstance(max_workers, int) or max_workers < 1:
+            raise ValueError(f"STAGE {name}: max_workers 必须是正整数，当前: {max_workers}")
+        self._finish_stage()
+        self._stage = StageNode(
+            stage_id=len(self.stages),
+            name=name,
+            mode='serial' if mode == 'sequential' else mode,
+            max_workers=max_workers,
+            tasks=[],
+            description=description
+        )
+        return self
+
+    def task(self, description: str, files: PatternList = (), excludes: PatternList = (), verify: str = "",
+             id: str = "", depends_on: PatternList = "", matrix: str = "", shard: Union[str, int] = "",
+             shard_by: str = "bytes", retries: Optional[int] = None, backoff: str = "",
+             priority: int = 0) -> 'DAGBuilder':
+        """
+        向当前阶段添加任务
+
+        Args:
+            description: 任务描述
+            files: 文件范围（glob，用于冲突检测）
+            excludes: 排除文件（glob）
+            verify: 验证命令
+            id: 任务标识（供 depends_on 引用）
+            depends_on: 前置任务，写法同 TASK 标记行（"stage.task,task"）或其列表
+            matrix: 矩阵参数，写法同 TASK 标记行（"module=a,b;lang=x,y"），描述等字段中的 {参数名} 按组合替换
+            shard: 分片方式，写法同 TASK 标记行（"dir" / "file" / 分片数），文件范围按仓库文件拆成并行子任务
+            shard_by: shard 为分片数时的均衡依据（bytes / files）
+            retries: 瞬时失败重试次数（None 取运行级默认值）
+            backoff: 重试退避，写法同 TASK 标记行（"30s..10m"；空取运行级默认值）
+            priority: 启动优先级（越大越先启动，默认 0）
+
+        Raises:
+            ValueError: 尚未调用 stage()，或 matrix / shard / retries / backoff / priority 参数错误
+        """
+        stage = self._stage
+        if stage is None:
+            raise ValueError("DAGBuilder: 添加任务前需要先调用 stage()")
+        task_id = self._task_count + 1
+        if shard != "" and matrix:
+            raise ValueError(f"Stage {stage.stage_id + 1} Task {task_id}: shard 不能与 matrix 同时使用")
+        try:
+            if retries is not None:
+                retries = parse_retries(str(retries))
+            if backoff:
+                parse_backoff(backoff)
+            priority = parse_priority(str(priority))
+        except ValueError as e:
+            raise ValueError(f"Stage {stage.stage_id + 1} Task {task_id}: {e}")
+        node = TaskNode(
+            task_id=task_id,
+            description=description or f"Task {task_id}",
+            files=_patterns(files),
+            excludes=_patterns(excludes),
+            verify_cmd=_intern(verify),
+            stage_id=stage.stage_id,
+            id=_intern(id),
+            matrix=self._matrix(matrix, stage, task_id) if matrix else None,
+            retries=retries,
+            backoff=_intern(backoff),
+            priority=priority
+        )
+        if shard != "":
+            node.matrix = self._shards(str(shard), shard_by, node, stage)
+        self._entries.append(node)
+        self._task_count += node.matrix.size if node.matrix is not None else 1
+
+        raw = depends_on if isinstance(depends_on, str) else ','.join(depends_on)
+        if raw.strip():
+            self._pending_deps.append((node, raw))
+        return self
+
+    def tasks(self, items: Iterable[Union[str, dict]]) -> 'DAGBuilder':
+        """
+        流式添加任务：逐个消费迭代器（可以是生成器），元素为任务描述字符串或 task() 的参数 dict
+
+        Returns:
+            构建器本身
+        """
+        for item in items:
+            if isinstance(item, str):
+                self.task(item)
+            else:
+                self.task(**item)
+        return self
+
+    def build(self) -> List[StageNode]:
+        """
+        结束构建：解析 depends_on 并检查循环依赖
+
+        Returns:
+            阶段列表（可直接交给 DAGExecutor / ConflictDetector / DAGScheduler）
+
+        Raises:
+            ValueError: 没有任何阶段、depends_on 引用不存在或存在循环依赖
+        """
+        self._finish_stage()
+        if not self.stages:
+            raise ValueError("未找到任何 STAGE 定义")
+        if self._pending_deps:
+            resolve_dependencies(self.stages, self._pending_deps)
+            self._pending_deps = []
+        return self.stages
+
+    def compile(self) -> CompiledPlan:
+        """构建为执行计划（DAGExecutor(plan=...) / export_plan 使用；冲突和批次由执行器按需计算）"""
+        return CompiledPlan(stages=self.build(), global_goal=self.global_goal, sources=[])
+
+    def _finish_stage(self):
+        if self._stage is None:
+            return
+        self._stage.tasks = make_task_list(self._entries)
+        self.stages.append(self._stage)
+        self._stage = None
+        self._entries = []
+        self._task_count = 0
+
+    @staticmethod
+    def _matrix(spec: str, stage: StageNode, task_id: int) -> TaskMatrix:
+        axes = parse_axes(spec, f"Stage {stage.stage_id + 1} Task {task_id}")
+        if not axes:
+            raise ValueError(f"Stage {stage.stage_id + 1} Task {task_id}: matrix 展开后没有任何子任务")
+        return TaskMatrix(axes=axes, source=spec)
+
+
+    def _shards(self, spec: str, by: str, node: TaskNode, stage: StageNode) -> TaskMatrix:
+        location = f"Stage {stage.stage_id + 1} Task {node.task_id}"
+        mode = parse_shard(spec, by, location)
+        if not node.files:
+            raise ValueError(f"{location}: shard 需要 文件: 范围")
+        if self._file_index is None:
+            self._file_index = FileIndex()
+        shards = plan_shards(self._file_index, node.files, node.excludes, mode, location, by)
+        return TaskMatrix(axes=[], shards=shards, source=f"shard={spec.strip()}")
+
+
+def _patterns(value: PatternList) -> List[str]:
+    """文件范围参数 → intern 后的 glob 列表（字符串按逗号分隔）"""
+    items = value.split(',') if isinstance(value, str) else value
+    return [_intern(item.strip()) for item in items if item.strip()]
@@ -1,39 +1,242 @@
 #!/usr/bin/env python3
 """
 DAG 执行引擎 - 简化版
-顺序执行 STAGE，STAGE 内根据 mode 选择串行或并行
+顺序执行 STAGE，STAGE 内根据 mode 选择串行或并行；
+任务声明了 depends_on 时改用任务级调度器（dag_scheduler.py），依赖满足即启动；
+barrier_free 模式下并行阶段也由调度器按文件范围锁执行，不再按批次等待；
+keep_going 模式下任务失败后继续执行不依赖它的任务，被阻塞的任务记为 skipped（断点续传时与失败任务一起重跑）；
+瞬时失败（限流/网络/服务端错误/超时）按重试策略退避后重新执行，重试用完才算失败（task_retry.py）；
+并行批次中的慢任务可在独立工作副本中对冲执行，先成功的一方胜出（task_hedge.py）；
+就绪任务按 priority= 和预计剩余关键路径排序后启动（task_priority.py）；
+任务结束后耗时与结果追加到运行历史，阶段标题按历史耗时显示预计剩余时间（run_history.py）；
+监视模式下执行过程中修改 dag.md，安全的修改会合并进正在执行的计划（plan_watcher.py）
 """
 
 import time
-from typing import List, Callable, Any, Optional
-from dag_parser import DAGParser, StageNode, TaskNode, ConflictDetector
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Callable, Any, Optional, Dict, Set, Tuple
+from dag_parser import (DAGParser, StageNode, TaskNode, TaskList, ConflictDetector, FragmentCache,
+                        build_task_index, has_task_dependencies, task_entries)
+from dag_scheduler import DAGScheduler, PathLocks
 from state_manager import StateManager
+from plan_cache import PlanCache, CompiledPlan
+from plan_watcher import PlanWatcher, merge_plan
+from file_index import FileIndex
+from adaptive_concurrency import AdaptiveConcurrency
+from task_retry import RetryPolicy, format_duration
+from task_hedge import HedgePolicy
+from task_priority import DurationEstimator, TaskPriority, heuristic_duration
+from run_history import DurationRange, RunHistory, expected_span, format_range
+from write_sets import WriteSetHistory, outside_scope
+from task_shard import shards_signature
+
+if TYPE_CHECKING:
+    from dag_builder import DAGBuilder
 
 
 class DAGExecutor:
     """DAG 执行引擎（简化版）"""
 
-    def __init__(self, file_path: str, task_executor: Callable[[TaskNode], bool], use_state: bool = True):
+    def __init__(self, file_path: str, task_executor: Callable[[TaskNode], bool], use_state: bool = True,
+                 use_plan_cache: bool = True, lazy_refs: bool = False, watch: bool = False,
+                 watch_interval: float = 2.0, plan: Optional[CompiledPlan] = None,
+                 state_manager: Optional[StateManager] = None, precise_conflicts: bool = False,
+                 barrier_free: bool = False, learned_conflicts: bool = False,
+                 concurrency: Optional[AdaptiveConcurrency] = None, keep_going: bool = False,
+                 retry_policy: Optional[RetryPolicy] = None, hedge_policy: Optional[HedgePolicy] = None,
+                 critical_path: bool = False, run_history: Optional[RunHistory] = None):
         """
         Args:
             file_path: DAG 任务文件路径
             task_executor: 任务执行函数，接受 TaskNode，返回是否成功
             use_state: 是否使用状态管理（断点续传）
+            use_plan_cache: 是否使用执行计划缓存（dag.md 及引用文件未变化时跳过解析和冲突检测）
+            lazy_refs: 延迟引用模式（@文件引用 解析时只记录句柄，分发任务构建 prompt 时才读取）
+            watch: 监视模式（执行期间轮询 dag.md 及引用文件，变化时重新解析并合并安全的修改）
+            watch_interval: 监视模式的轮询间隔（秒）
+            plan: 预先生成的执行计划（--from-plan）：直接使用，不解析 markdown，
+                  不读写执行计划缓存，也不支持监视模式
+            state_manager: 外部创建的状态管理器（优先于 use_state 自动创建的）
+            precise_conflicts: 精确冲突检测（glob 展开到仓库文件索引，触及同一文件才算冲突，见 file_index.py）
+            barrier_free: 并行阶段不分批：任务按文件范围加锁，有空闲并发且不与运行中任务冲突即启动
+                          （需要 execute 提供 task_runner，否则仍按批次执行）
+            learned_conflicts: 有历史记录的任务按实际修改过的文件检测冲突（写集合学习，见 write_sets.py）
+            concurrency: 自适应并发控制器（--adaptive / --launch-rate，见 adaptive_concurrency.py）：
+                         调度器按它的当前上限启动任务，阶段 max_workers 为各阶段的上限；
+                         批次执行由执行器共享同一个控制器（BaseBatchExecutor.concurrency）
+            keep_going: 任务失败后继续执行不被它阻塞的任务，而不是停止整个运行：
+                        按阶段屏障执行时跑完当前阶段（串行阶段的后续任务依赖失败任务，跳过），之后的阶段全部跳过；
+                        任务级调度时只跳过失败任务的下游
+            retry_policy: 瞬时失败重试策略（--retries / --backoff，任务级 retries= / backoff= 覆盖）：
+                          调度器退避后重新排队，批次/串行执行由执行器按同一策略重试（BaseBatchExecutor.retry_policy）；
+                          None 时不重试
+            hedge_policy: 慢任务对冲策略（--hedge）：由执行器在并行批次中使用（BaseBatchExecutor.hedge_policy），
+                          任务级调度 / 无批次屏障的阶段没有批次等待，不对冲；None 时不对冲
+            critical_path: 关键路径优先：就绪任务（调度器）和批次内任务（提交顺序）按预计剩余关键路径从长到短启动，
+                           耗时按指纹取以往状态文件中的记录，没有记录时按描述长度和文件范围估计（见 task_priority.py）；
+                           TASK 标记行的 priority= 始终优先生效
+            run_history: 运行历史（见 run_history.py）：每个阶段结束时（及清理状态文件之前）追加本次运行结束的任务，
+                         阶段标题显示按历史耗时估计的本阶段和整个运行的剩余时间，
+                         --critical-path 的耗时估计优先使用它；需要状态管理（耗时取自状态文件）；None 时不记录
         """
         self.file_path = file_path
         self.task_executor = task_executor
-        self.parser = DAGParser(file_path)
+        # 多文件布局（.task-xxx/stages/*.md）的逐文件解析缓存：监视模式重新解析时只解析被修改的文件
+        self.parser = DAGParser(file_path, lazy_refs=lazy_refs, fragment_cache=FragmentCache())
         self.stages: List[StageNode] = []
-        self.use_state = use_state
-        self.state_manager = StateManager(file_path) if use_state else None
+        self.use_state = use_state or state_manager is not None
+        self.state_manager = state_manager or (StateManager(file_path) if use_state else None)
+        self.preloaded_plan = plan
+        self.file_index: Optional[FileIndex] = FileIndex() if precise_conflicts else None
+        self.barrier_free = barrier_free
+        self.write_sets: Optional[WriteSetHistory] = WriteSetHistory() if learned_conflicts else None
+        self.concurrency = concurrency
+        self.keep_going = keep_going
+        self.retry_policy = retry_policy
+        self.hedge_policy = hedge_policy
+        self.run_history = run_history
+        self._recorded: Set[Tuple[int, int]] = set()  # 已追加到运行历史的任务
+        self.priority = TaskPriority(DurationEstimator.from_state_files(
+            history=run_history.durations() if run_history else None) if critical_path else None)
+        self._order: Optional[Dict[Tuple[int, int], Tuple[int, float]]] = None  # 排序键（计划变化时重新计算）
+        # 精确模式依赖的文件索引不可标识（不在 git 仓库中）时不使用执行计划缓存；
+        # 写集合历史变化后缓存的冲突映射同样失效
+        conflict_key = "" if self.file_index is None else self.file_index.signature
+        use_plan_cache = use_plan_cache and plan is None and (self.file_index is None or bool(conflict_key))
+        if self.write_sets is not None:
+            conflict_key += f"\0learned:{self.write_sets.signature}"
+        self.plan_cache = PlanCache(file_path, lazy_refs=lazy_refs, conflict_key=conflict_key) if use_plan_cache else None
         self.global_goal: str = ""  # 项目宏观目标（从 parser 获取）
+        self.global_refs: List[str] = []  # 文件头部的延迟引用句柄（仅 lazy_refs 模式）
+        self.task_index: Dict[Tuple[int, int], TaskNode] = {}  # (stage_id, task_id) → TaskNode
+        # 并行阶段的冲突映射和批次布局（按 stage_id，缓存命中时直接复用）
+        self.stage_conflicts: Dict[int, Dict[int, List[int]]] = {}
+        self.stage_batches: Dict[int, List[List[int]]] = {}
+        self.sources: List[str] = []  # 入口文件 + 所有传递引用文件（监视模式轮询）
+        # 监视模式
+        self.watch = watch and plan is None
+        self.watch_interval = watch_interval
+        self.watcher: Optional[PlanWatcher] = None
+        self._started_keys: Set[Tuple[int, int]] = set()  # 本次运行已分发的任务
+        self._closed_stages: Set[int] = set()  # 已结束的阶段（不能再追加任务）
+        # keep_going：本次运行失败的任务，及被其阻塞而跳过的任务 → 原因
+        self._failed_keys: List[Tuple[int, int]] = []
+        self._skipped: Dict[Tuple[int, int], str] = {}
+
+    @classmethod
+    def from_builder(cls, builder: 'DAGBuilder', task_executor: Callable[[TaskNode], bool],
+                     state_manager: Optional[StateManager] = None, **kwargs) -> 'DAGExecutor':
+        """
+        从 DAGBuilder 构建的计划创建执行器（不读取任何 markdown）
+
+        Args:
+            builder: 已添加阶段和任务的构建器
+            task_executor: 任务执行函数
+            state_manager: 状态管理器（断点续传；不提供则不记录状态）
+            **kwargs: 其他 DAGExecutor 参数（lazy_refs 等）
+
+        Returns:
+            DAGExecutor 实例
+        """
+        file_path = state_manager.task_file if state_manager else "<DAGBuilder>"
+        if state_manager:
+            Path(state_manager.state_file).parent.mkdir(parents=True, exist_ok=True)
+        kwargs.setdefault('use_state', False)
+        return cls(file_path, task_executor, plan=builder.compile(), state_manager=state_manager, **kwargs)
 
     def parse(self) -> List[StageNode]:
-        """解析 DAG 文件"""
+        """解析 DAG 文件（优先使用预先生成的执行计划，其次加载执行计划缓存）"""
+        if self.preloaded_plan is not None:
+            self._apply_plan(self.preloaded_plan)
+            return self.stages
+
+        if self.plan_cache:
+            plan = self.plan_cache.load()
+            if plan:
+                self._apply_plan(plan)
+                print(f"⚡ 已加载执行计划缓存: {self.plan_cache.cache_file}")
+                return self.stages
+
         self.stages = self.parser.parse()
         self.global_goal = self.parser.global_goal  # 获取项目宏观目标
+        self.global_refs = self.parser.global_refs
+        self.task_index = self.parser.task_index
+        self.sources = self.parser.sources
+        if self.parser.stage_files:
+            print(f"📂 多文件布局: {len(self.parser.stage_files)} 个阶段文件"
+                  f"（{self.parser.fragment_hits}/{self.parser.fragment_files} 个文件命中解析缓存）")
+
+        if self.plan_cache:
+            # 预先计算所有并行阶段的冲突和批次，随计划一起缓存
+            self.plan_cache.save(self.compile_plan())
         return self.stages
 
+    def _apply_plan(self, plan: CompiledPlan):
+        """使用已编译的执行计划（缓存或 --from-plan），跳过解析和冲突检测"""
+        self.stages = plan.stages
+        self.global_goal = plan.global_goal
+        self.global_refs = plan.global_refs
+        self.stage_conflicts = plan.conflicts
+        self.stage_batches = plan.batches
+        self.task_index = build_task_index(self.stages)
+        self.sources = plan.sources
+
+    def compile_plan(self) -> CompiledPlan:
+        """
+        编译执行计划：解析结果 + 所有并行阶段的冲突映射和批次（执行计划缓存、--emit-plan 共用）
+
+        Returns:
+            CompiledPlan
+        """
+        if not self.stages:
+            self.parse()
+        for stage in self.stages:
+            if stage.mode == 'parallel':
+                self._get_stage_layout(stage)
+        return CompiledPlan(
+            stages=self.stages,
+            global_goal=self.global_goal,
+            sources=self.sources,
+            conflicts=self.stage_conflicts,
+            batches=self.stage_batches,
+            global_refs=self.global_refs,
+            file_signature=shards_signature(self.stages)
+        )
+
+    def _get_stage_layout(self, stage: StageNode) -> Tuple[Dict[int, List[int]], List[List[TaskNode]]]:
+        """
+        获取并行阶段的冲突映射和批次（已计算或已缓存时直接复用）
+
+        Returns:
+            (冲突映射, 批次列表)
+        """
+        if stage.stage_id not in self.stage_batches:
+            conflicts = ConflictDetector.detect_conflicts(stage.tasks, self.file_index, self.write_sets)
+            batches = ConflictDetector.create_batches(stage.tasks, conflicts, self._batch_weights(stage.tasks))
+            self.stage_conflicts[stage.stage_id] = conflicts
+            self.stage_batches[stage.stage_id] = [[task.task_id for task in batch] for batch in batches]
+
+        stage_id = stage.stage_id
+        batches = [[self.get_task(stage_id, task_id) for task_id in batch] for batch in self.stage_batches[stage_id]]
+        return self.stage_conflicts.get(stage.stage_id, {}), batches
+
+    def _batch_weights(self, tasks: List[TaskNode]) -> Optional[Dict[int, float]]:
+        """
+        分批时均衡各批次用的任务权重（预计耗时）
+
+        --critical-path 的耗时估计优先，其次运行历史的中位数（没有记录的任务按有记录任务的中位数）；
+        都没有时返回 None（按任务数均衡）。权重只影响批次间的均衡，不影响冲突判断，
+        因此执行计划缓存中按旧权重分好的批次仍然可用，不随历史变化失效。
+        """
+        estimator = self.priority.estimator
+        if estimator is not None:
+            return {task.task_id: estimator.estimate(task) for task in tasks}
+        if self.run_history is not None:
+            ranges, known = self.run_history.estimates(tasks)
+            if known:
+                return {task.task_id: span[0] for task, span in zip(tasks, ranges)}
+        return None
+
     def print_plan(self):
         """打印执行计划（--dry-run）"""
         if not self.stages:
@@ -48,17 +251,55 @@ class DAGExecutor:
 
         total_tasks = sum(len(stage.tasks) for stage in self.stages)
         print(f"总任务数: {total_tasks}")
+        if has_task_dependencies(self.stages):
+            print("调度方式: 任务级依赖（depends_on 满足即启动，阶段可重叠执行）")
+        elif self.barrier_free:
+            print("调度方式: 并行阶段无批次屏障（不与运行中任务冲突即启动，批次仅供参考）")
+        if self.write_sets is not None:
+            learned = sum(1 for stage in self.stages for task in stage.tasks if self.write_sets.learned(task) is not None)
+            print(f"冲突检测: 按学到的写集合（{learned}/{total_tasks} 个任务有历史记录）")
+        if self.concurrency and self.concurrency.enabled:
+            print(f"并发控制: {self.concurrency.describe()}")
+        if self.keep_going:
+            print("失败处理: 继续执行不依赖失败任务的任务，被阻塞的任务标记为跳过（--keep-going）")
+        if self.retry_policy:
+            print(f"失败重试: {self.retry_policy.describe()}")
+            custom = [task for stage in self.stages for task in task_entries(stage.tasks)
+                      if task.retries is not None or task.backoff]
+            for task in custom[:5]:
+                retries, _, _ = self.retry_policy.limits(task)
+                print(f"   Stage {task.stage_id + 1} Task {task.task_id}: 重试 {retries} 次"
+                      f"{f'，退避 {task.backoff}' if task.backoff else ''}")
+            if len(custom) > 5:
+                print(f"   ... 另有 {len(custom) - 5} 个任务单独设置了重试")
+        if self.hedge_policy:
+            eligible = sum(1 for stage in self.stages if stage.mode == 'parallel'
+                           for task in stage.tasks if self.hedge_policy.eligible(task))
+            print(f"对冲执行: {self.hedge_policy.describe()}，{eligible} 个并行阶段任务可对冲")
+        if self.priority.estimator is not None or self._task_order():
+            print(f"任务排序: {self.priority.describe(self.stages)}")
+            self._print_priority_head()
+        eta = self._eta()
+        if eta:
+            print(f"预计耗时: {format_range(eta[1])}（{eta[2]}）")
         print()
 
         for stage in self.stages:
             print(f"{'─' * 80}")
             print(f"Stage {stage.stage_id + 1}: {stage.name} [{stage.mode.upper()}]")
+            if stage.location:
+                print(f"来源: {stage.location}")
             print(f"{'─' * 80}")
+            for template in task_entries(stage.tasks):
+                if template.matrix is not None:
+                    last = template.task_id + template.matrix.size - 1
+                    kind = "分片" if template.matrix.shards else "矩阵"
+                    print(f"{kind}: Task {template.task_id}-{last} 由模板展开（{template.matrix.source}，"
+                          f"{template.matrix.size} 个子任务）")
 
             if stage.mode == 'parallel':
                 # 检测冲突
-                conflicts = ConflictDetector.detect_conflicts(stage.tasks)
-                batches = ConflictDetector.create_batches(stage.tasks, conflicts)
+                conflicts, batches = self._get_stage_layout(stage)
 
                 print(f"模式: 并行执行（最大 {stage.max_workers} 并发）")
                 print(f"任务数: {len(stage.tasks)}")
@@ -68,9 +309,11 @@ class DAGExecutor:
                 if conflicts:
                     print("⚠️  检测到冲突:")
                     for task_id, conflict_ids in conflicts.items():
-                        task = next(t for t in stage.tasks if t.task_id == task_id)
+                        task = self.get_task(stage.stage_id, task_id)
                         print(f"   Task {task_id} 与 {conflict_ids} 冲突")
                         print(f"   → {task.description[:60]}")
+                        if task.location:
+                            print(f"     来源: {task.location}")
                     print()
 
                 # 显示批次
@@ -81,6 +324,11 @@ class DAGExecutor:
                         print(f"    - Task {task.task_id}: {task.description[:60]}")
                         if task.files:
                             print(f"      文件: {', '.join(task.files[:3])}")
+                        self._print_write_set(task, "      ")
+                        if task.depends_on:
+                            print(f"      依赖: {self._format_dependencies(task)}")
+                        if task.location:
+                            print(f"      来源: {task.location}")
                     if i < len(batches):
                         print(f"    ⬇️  等待批次 {i} 完成")
                     print()
@@ -94,6 +342,11 @@ class DAGExecutor:
                     print(f"  → Task {task.task_id}: {task.description[:60]}")
                     if task.files:
                         print(f"    文件: {', '.join(task.files[:3])}")
+                    self._print_write_set(task, "    ")
+                    if task.depends_on:
+                        print(f"    依赖: {self._format_dependencies(task)}")
+                    if task.location:
+                        print(f"    来源: {task.location}")
                 print()
 
         print(f"{'=' * 80}")
@@ -102,13 +355,117 @@ class DAGExecutor:
         print("  python batchcc.py <file>  # Claude 兼容入口")
         print(f"{'=' * 80}\n")
 
-    def execute(self, parallel_executor: Callable[[List[TaskNode], int], List[Any]] = None) -> bool:
+    def _task_order(self) -> Dict[Tuple[int, int], Tuple[int, float]]:
+        """各任务的启动排序键（首次使用时计算，计划热更新后重新计算）"""
+        if self._order is None:
+            self._order = self.priority.order(self.stages)
+        return self._order
+
+    def _print_priority_head(self, limit: int = 5):
+        """--dry-run：排在最前面的任务及其排序依据"""
+        order = self._task_order()
+        head = sorted(order, key=lambda key: (order[key], key))[:limit]
+        estimator = self.priority.estimator
+        for stage_id, task_id in head:
+            task = self.get_task(stage_id, task_id)
+            parts = []
+            if task.priority:
+                parts.append(f"priority={task.priority}")
+            if estimator is not None:
+                known = estimator.history(task)
+                source = f"历史 {format_duration(known)}" if known is not None else \
+                    f"估计 {format_duration(heuristic_duration(task))}"
+                parts.append(f"剩余关键路径 {format_duration(-order[(stage_id, task_id)][1])}（{source}）")
+            print(f"   Stage {stage_id + 1} Task {task_id}: {'，'.join(parts)}")
+
+    def _print_write_set(self, task: TaskNode, indent: str):
+        """--dry-run：显示学到的写集合和超出声明范围的文件"""
+        learned = self.write_sets.learned(task) if self.write_sets is not None else None
+        if learned is None:
+            return
+        print(f"{indent}实际写入: {', '.join(learned[:3]) or '（无）'}"
+              f"{f' 等 {len(learned)} 个文件' if len(learned) > 3 else ''}")
+        outside = outside_scope(task, learned)
+        if outside:
+            print(f"{indent}⚠️  超出声明范围: {', '.join(outside[:3])}"
+                  f"{f' 等 {len(outside)} 个文件' if len(outside) > 3 else ''}")
+
+    def _pending_tasks(self, stage: StageNode) -> List[TaskNode]:
+        """阶段中尚未执行的任务（本次运行已分发的和断点续传时已完成的不计）"""
+        state = self.state_manager if self.use_state else None
+        return [task for task in stage.tasks if (stage.stage_id, task.task_id) not in self._started_keys
+                and not (state and state.should_skip_task(stage.stage_id, task.task_id))]
+
+    def _stage_span(self, stage: StageNode, tasks: List[TaskNode], ranges: List[DurationRange]) -> DurationRange:
+        """阶段剩余任务的预计耗时：串行为总和，按批次执行时为各批次之和，否则按并发数摊分"""
+        if stage.mode == 'serial':
+            return expected_span(ranges, 1)
+        if self.barrier_free or has_task_dependencies(self.stages):
+            return expected_span(ranges, stage.max_workers)
+        by_id = {task.task_id: span for task, span in zip(tasks, ranges)}
+        _, batches = self._get_stage_layout(stage)
+        spans = [expected_span([by_id[task.task_id] for task in batch if task.task_id in by_id], stage.max_workers)
+                 for batch in batches]
+        return sum(span[0] for span in spans), sum(span[1] for span in spans)
+
+    def _eta(self) -> Optional[Tuple[Dict[int, DurationRange], DurationRange, str]]:
+        """
+        按运行历史估计剩余任务的耗时（没有运行历史或没有任何剩余任务有记录时返回 None）
+
+        没有记录的任务按有记录任务的中位数估计；整个运行为各阶段之和（任务级调度时阶段可重叠，偏保守）。
+
+        Returns:
+            ({stage_id: (中位数, P90)}, 整个运行的 (中位数, P90), 覆盖率说明)
+        """
+        if self.run_history is None or not self.run_history.records:
+            return None
+        pending = [(stage, self._pending_tasks(stage)) for stage in self.stages]
+        ranges, known = self.run_history.estimates([task for _, tasks in pending for task in tasks])
+        if not known:
+            return None
+        spans: Dict[int, DurationRange] = {}
+        offset = 0
+        for stage, tasks in pending:
+            spans[stage.stage_id] = self._stage_span(stage, tasks, ranges[offset:offset + len(tasks)])
+            offset += len(tasks)
+        run = (sum(span[0] for span in spans.values()), sum(span[1] for span in spans.values()))
+        return spans, run, f"{known}/{len(ranges)} 个剩余任务有历史耗时"
+
+    def _print_stage_eta(self, stage: StageNode):
+        """阶段标题：本阶段和整个运行的预计剩余时间"""
+        eta = self._eta()
+        if eta:
+            spans, run, coverage = eta
+            print(f"⏱️  预计: 本阶段 {format_range(spans[stage.stage_id])}，整个运行剩余 {format_range(run)}（{coverage}）")
+
+    def _record_history(self):
+        """本次运行已结束的任务追加到运行历史（耗时和重试次数取自状态文件，每个任务只记录一次）"""
+        if self.run_history is None or not (self.use_state and self.state_manager):
+            return
+        stage_states = self.state_manager.state.get('stages', [])
+        for stage_id, task_id in sorted(self._started_keys - self._recorded, key=lambda key: (key[0] or 0, key[1])):
+            if stage_id is None or stage_id >= len(stage_states):
+                continue
+            tasks = stage_states[stage_id].get('tasks', [])
+            entry = tasks[task_id - 1] if 1 <= task_id <= len(tasks) else {}
+            task = self.get_task(stage_id, task_id)
+            if entry.get('status') not in ('completed', 'failed') or entry.get('duration') is None or task is None:
+                continue
+            self._recorded.add((stage_id, task_id))
+            self.run_history.record(task, self.stages[stage_id].name, entry['status'], entry['duration'],
+                                    len(entry.get('attempts') or []))
+
+    def execute(self, parallel_executor: Callable[[List[TaskNode], int], List[Any]] = None,
+                task_runner: Callable[[TaskNode, str, str, List[str]], Any] = None) -> bool:
         """
         执行所有阶段和任务
 
         Args:
             parallel_executor: 并行执行函数（可选）
                              接受 (tasks, max_workers)，返回执行结果列表
+            task_runner: 线程安全的单任务执行函数（可选，depends_on 调度和 barrier_free 并行阶段使用）
+                         接受 (task, global_goal, stage_context, context_refs)，返回 TaskResult；
+                         未提供时调度器逐个调用 task_executor
 
         Returns:
             是否全部成功
@@ -139,23 +496,41 @@ class DAGExecutor:
         print(f"阶段数: {len(self.stages)}")
         if start_stage_id > 0:
             print(f"起始阶段: Stage {start_stage_id + 1}")
+        if self.watch:
+            self.watcher = PlanWatcher(self.sources, self.watch_interval)
+            print(f"👀 监视模式: 每 {self.watch_interval:g}s 检查 {len(self.sources)} 个源文件的变化")
+        eta = self._eta()
+        if eta:
+            print(f"⏱️  预计耗时: {format_range(eta[1])}（{eta[2]}）")
         print(f"{'=' * 80}\n")
 
         overall_start = time.time()
         all_success = True
 
-        for stage in self.stages:
+        # 监视模式下追加的阶段会直接出现在 self.stages 中，循环继续执行
+        stages_to_run = self.stages
+        if has_task_dependencies(self.stages):
+            all_success = self._execute_with_scheduler(task_runner)
+            self._record_history()
+            stages_to_run = []
+
+        for stage in stages_to_run:
+            self._poll_reload()
+
             # 跳过已完成的阶段
             if stage.stage_id < start_stage_id:
                 print(f"⏭️  跳过 Stage {stage.stage_id + 1}: {stage.name} (已完成)")
+                self._closed_stages.add(stage.stage_id)
                 continue
 
             # 状态管理：检查是否应该跳过整个阶段
             if self.use_state and self.state_manager and self.state_manager.should_skip_stage(stage.stage_id):
                 print(f"⏭️  跳过 Stage {stage.stage_id + 1}: {stage.name} (已完成)")
+                self._closed_stages.add(stage.stage_id)
                 continue
             print(f"\n{'─' * 80}")
             print(f"📋 Stage {stage.stage_id + 1}/{len(self.stages)}: {stage.name} [{stage.mode.upper()}]")
+            self._print_stage_eta(stage)
             print(f"{'─' * 80}\n")
 
             stage_start = time.time()
@@ -170,6 +545,9 @@ class DAGExecutor:
             if stage.mode == 'serial':
                 # 串行执行
                 success = self._execute_stage_serial(stage)
+            elif self.barrier_free and task_runner:
+                # 并行执行（无批次屏障）
+                success = self._execute_stage_dynamic(stage, task_runner)
             else:
                 # 并行执行
                 success = self._execute_stage_parallel(stage, parallel_executor)
@@ -179,12 +557,17 @@ class DAGExecutor:
             # 状态管理：标记阶段完成
             if self.use_state and self.state_manager:
                 self.state_manager.complete_stage(stage.stage_id, success)
+            self._record_history()
 
             if success:
+                self._closed_stages.add(stage.stage_id)
                 print(f"\n✅ Stage {stage.stage_id + 1} 完成 (耗时: {stage_duration:.1f}s)")
             else:
                 print(f"\n❌ Stage {stage.stage_id + 1} 失败 (耗时: {stage_duration:.1f}s)")
-                print(f"⛔ 停止执行（失败即停止策略）")
+                if self.keep_going:
+                    self._skip_later_stages(stage)
+                else:
+                    print(f"⛔ 停止执行（失败即停止策略）")
                 all_success = False
                 break
 
@@ -194,6 +577,9 @@ class DAGExecutor:
         if self.use_state and self.state_manager:
             self.state_manager.complete_all(all_success)
 
+        # 运行历史在清理之前记录（耗时取自状态文件）
+        self._record_history()
+
         # 成功后清理文件
         if all_success:
             self._cleanup()
@@ -203,16 +589,140 @@ class DAGExecutor:
             print(f"✅ 所有任务执行完成")
         else:
             print(f"❌ 任务执行失败")
+        if self.keep_going and (self._failed_keys or self._skipped):
+            self._print_keep_going_summary()
         print(f"总耗时: {overall_duration:.1f}s")
+        if self.concurrency:
+            for line in self.concurrency.report():
+                print(line)
+        if self.retry_policy:
+            for line in self.retry_policy.report():
+                print(line)
+        if self.hedge_policy:
+            for line in self.hedge_policy.report():
+                print(line)
+        if self._recorded:
+            print(f"📝 运行历史: 记录 {len(self._recorded)} 个任务的耗时与结果（{self.run_history.path}）")
         print(f"{'=' * 80}\n")
 
         return all_success
 
+    def _execute_with_scheduler(self, task_runner: Callable = None) -> bool:
+        """
+        任务级调度执行（存在 depends_on 时）
+
+        任务的前置条件完成即启动，不等待整个阶段屏障；
+        阶段 max_workers、文件冲突规则和失败即停止策略保持不变（keep_going 时只跳过失败任务的下游）。
+        提供 task_runner 时任务并发执行，任务状态由这里在主线程持久化；
+        否则逐个调用 task_executor（状态由执行器自行管理，与串行阶段一致）。
+        """
+        scheduler = DAGScheduler(self.stages, max_total_workers=None if task_runner else 1,
+                                 file_index=self.file_index, write_sets=self.write_sets,
+                                 concurrency=self.concurrency, keep_going=self.keep_going,
+                                 retry=self.retry_policy if task_runner else None, priority=self.priority)
+        print(f"🔀 检测到任务级依赖 (depends_on)：依赖满足即启动（最大 {scheduler.max_total_workers} 并发）\n")
+
+        state = self.state_manager if self.use_state else None
+        completed = set()
+        if state:
+            completed = {(stage.stage_id, task.task_id) for stage in self.stages for task in stage.tasks
+                         if state.should_skip_task(stage.stage_id, task.task_id)}
+            if completed:
+                print(f"⏭️  跳过 {len(completed)} 个已完成任务\n")
+
+        stage_remaining = {stage.stage_id: sum(1 for t in stage.tasks if (stage.stage_id, t.task_id) not in completed)
+                           for stage in self.stages}
+        stage_failed = set()
+        started_stages = set()
+        finished: Set[Tuple[int, int]] = set()
+        start_times: Dict[Tuple[int, int], float] = {}
+
+        for stage in self.stages:
+            if stage_remaining[stage.stage_id] == 0:
+                self._closed_stages.add(stage.stage_id)
+                if state and not state.should_skip_stage(stage.stage_id):
+                    state.complete_stage(stage.stage_id, True)
+
+        def label(task: TaskNode) -> str:
+            return f"Stage {task.stage_id + 1} Task {task.task_id}"
+
+        def on_start(task: TaskNode):
+            if task.stage_id not in started_stages:
+                started_stages.add(task.stage_id)
+                stage = self.stages[task.stage_id]
+                print(f"📋 Stage {stage.stage_id + 1}/{len(self.stages)} 开始: {stage.name} [{stage.mode.upper()}]")
+                self._print_stage_eta(stage)
+                if state:
+                    state.start_stage(stage.stage_id)
+            if state and task_runner:
+                state.start_task(task.stage_id, task.task_id)
+            self._started_keys.add((task.stage_id, task.task_id))
+            start_times[(task.stage_id, task.task_id)] = time.monotonic()
+            print(f"▶️  {label(task)}: {task.description[:60]}")
+
+        def on_finish(task: TaskNode, success: bool, result: Any):
+            duration = time.monotonic() - start_times.pop((task.stage_id, task.task_id), time.monotonic())
+            if success:
+                print(f"✅ {label(task)} 完成 (耗时: {duration:.1f}s)")
+            else:
+                location = f" ({task.location})" if task.location else ""
+                error = getattr(result, 'error_msg', None) or (str(result) if isinstance(result, Exception) else "")
+                print(f"❌ {label(task)} 失败{location}")
+                if error:
+                    print(f"   {error.strip()[:200]}")
+                stage_failed.add(task.stage_id)
+                self._failed_keys.append((task.stage_id, task.task_id))
+
+            if state and task_runner:
+                error_msg = None if success else (getattr(result, 'error_msg', None) or "任务执行失败")
+                state.complete_task(task.stage_id, task.task_id, success, error_msg, duration=duration)
+
+            finished.add((task.stage_id, task.task_id))
+            stage_remaining[task.stage_id] -= 1
+            if stage_remaining[task.stage_id] == 0 or not success:
+                stage = self.stages[task.stage_id]
+                if state:
+                    state.complete_stage(stage.stage_id, stage.stage_id not in stage_failed)
+                if stage.stage_id not in stage_failed:
+                    self._closed_stages.add(stage.stage_id)
+                    print(f"✅ Stage {stage.stage_id + 1} 完成: {stage.name}")
+
+        def on_tick() -> bool:
+            changed = self._poll_reload()
+            for stage_id in changed:
+                stage_remaining[stage_id] = sum(
+                    1 for t in self.stages[stage_id].tasks
+                    if (stage_id, t.task_id) not in completed and (stage_id, t.task_id) not in finished)
+            return bool(changed)
+
+        if task_runner:
+            def runner(task: TaskNode):
+                stage = self.stages[task.stage_id]
+                return task_runner(task, self.global_goal, self._stage_context(stage), self.global_refs + stage.refs)
+        else:
+            def runner(task: TaskNode):
+                self._inject_state_to_executor(task.stage_id)
+                return self.task_executor(task)
+
+        def on_skip(task: TaskNode, blocker: TaskNode):
+            self._skip_task(task.stage_id, task, (blocker.stage_id, blocker.task_id))
+
+        def on_retry(task: TaskNode, attempt: int, reason: str, delay: float, result: Any):
+            self._on_retry(task.stage_id, task, label(task), attempt, reason, delay, result)
+
+        success = scheduler.run(runner, completed=completed, on_start=on_start, on_finish=on_finish,
+                                on_tick=on_tick if self.watcher else None, tick_interval=self.watch_interval,
+                                on_skip=on_skip, on_retry=on_retry)
+        if not success and not self.keep_going:
+            print(f"⛔ 停止执行（失败即停止策略）")
+        return success
+
     def _execute_stage_serial(self, stage: StageNode) -> bool:
         """串行执行阶段"""
         print(f"模式: 串行执行 ({len(stage.tasks)} 任务)")
         print()
 
+        # 监视模式下追加到本阶段的任务会出现在 stage.tasks 末尾，循环继续执行
         for i, task in enumerate(stage.tasks, 1):
             # 状态管理：检查是否应该跳过任务
             if self.use_state and self.state_manager and self.state_manager.should_skip_task(stage.stage_id, task.task_id):
@@ -220,16 +730,24 @@ class DAGExecutor:
                 continue
 
             print(f"[{i}/{len(stage.tasks)}] 执行: {task.description[:60]}")
+            self._started_keys.add((stage.stage_id, task.task_id))
 
             # 任务执行器会自动管理状态（start_task 和 complete_task）
             success = self.task_executor(task)
 
             if not success:
-                print(f"❌ Task {task.task_id} 失败")
+                location = f" ({task.location})" if task.location else ""
+                print(f"❌ Task {task.task_id} 失败{location}")
+                self._failed_keys.append((stage.stage_id, task.task_id))
+                if self.keep_going:
+                    # 串行阶段的后续任务依赖前一个任务，全部被阻塞
+                    for later in stage.tasks[i:]:
+                        self._skip_task(stage.stage_id, later, (stage.stage_id, task.task_id))
                 return False
 
             print(f"✅ Task {task.task_id} 完成")
             print()
+            self._poll_reload()
 
         return True
 
@@ -238,8 +756,7 @@ class DAGExecutor:
         print(f"模式: 并行执行（最大 {stage.max_workers} 并发）")
 
         # 检测冲突
-        conflicts = ConflictDetector.detect_conflicts(stage.tasks)
-        batches = ConflictDetector.create_batches(stage.tasks, conflicts)
+        conflicts, batches = self._get_stage_layout(stage)
 
         print(f"任务数: {len(stage.tasks)}")
         print(f"并行批次: {len(batches)}")
@@ -249,8 +766,13 @@ class DAGExecutor:
 
         print()
 
-        # 逐批次执行
-        for batch_idx, batch in enumerate(batches, 1):
+        # 逐批次执行（keep_going 时批次失败后继续执行剩余批次）
+        dispatched: Set[int] = set()
+        stage_success = True
+        batch_idx = 0
+        while batch_idx < len(batches):
+            batch = batches[batch_idx]
+            batch_idx += 1
             if len(batches) > 1:
                 print(f"{'─' * 40}")
                 print(f"📦 Batch {batch_idx}/{len(batches)} ({len(batch)} 任务)")
@@ -265,15 +787,95 @@ class DAGExecutor:
                 success = self._execute_batch_serial(batch)
 
             if not success:
-                return False
+                if not self.keep_going:
+                    return False
+                stage_success = False
+
+            dispatched.update(task.task_id for task in batch)
+            if stage.stage_id in self._poll_reload():
+                # 本阶段有任务追加或修改：剩余任务重新检测冲突、重新分批
+                remaining = [task for task in stage.tasks if task.task_id not in dispatched]
+                batches = batches[:batch_idx] + ConflictDetector.create_batches(
+                    remaining, ConflictDetector.detect_conflicts(remaining, self.file_index, self.write_sets),
+                    self._batch_weights(remaining))
+                print(f"🔄 剩余 {len(remaining)} 个任务重新分为 {len(batches) - batch_idx} 个批次")
 
             if batch_idx < len(batches):
                 print(f"\n⬇️  继续下一批次...\n")
 
-        return True
+        return stage_success
+
+    def _execute_stage_dynamic(self, stage: StageNode, task_runner: Callable) -> bool:
+        """
+        并行执行阶段（无批次屏障）
+
+        冲突映射与分批执行相同，但不再按批次等待：每个运行中的任务锁住自己的文件范围，
+        有空闲并发且不与运行中任务冲突的任务立即启动（按任务顺序），并发始终尽量用满。
+        任务状态在主线程持久化（与 depends_on 调度一致）。
+        """
+        print(f"模式: 并行执行（最大 {stage.max_workers} 并发，无批次屏障）")
+        conflicts, _ = self._get_stage_layout(stage)
+        print(f"任务数: {len(stage.tasks)}")
+        if conflicts:
+            print(f"⚠️  检测到 {len(conflicts)} 个冲突，冲突任务不会同时运行")
+        print()
+
+        locks = PathLocks({stage.stage_id: conflicts})
+        scheduler = DAGScheduler([stage], max_total_workers=max(1, stage.max_workers), file_index=self.file_index,
+                                 locks=locks, write_sets=self.write_sets, concurrency=self.concurrency,
+                                 keep_going=self.keep_going, retry=self.retry_policy, priority=self.priority)
+        state = self.state_manager if self.use_state else None
+        completed = set()
+        if state:
+            completed = {(stage.stage_id, task.task_id) for task in stage.tasks
+                         if state.should_skip_task(stage.stage_id, task.task_id)}
+            if completed:
+                print(f"⏭️  跳过 {len(completed)} 个已完成任务\n")
+        start_times: Dict[int, float] = {}
+
+        def on_start(task: TaskNode):
+            if state:
+                state.start_task(stage.stage_id, task.task_id)
+            self._started_keys.add((stage.stage_id, task.task_id))
+            start_times[task.task_id] = time.monotonic()
+            print(f"▶️  Task {task.task_id}: {task.description[:60]}")
+
+        def on_finish(task: TaskNode, success: bool, result: Any):
+            duration = time.monotonic() - start_times.pop(task.task_id, time.monotonic())
+            error_msg = None
+            if success:
+                print(f"✅ Task {task.task_id} 完成 (耗时: {duration:.1f}s)")
+            else:
+                location = f" ({task.location})" if task.location else ""
+                error = getattr(result, 'error_msg', None) or (str(result) if isinstance(result, Exception) else "")
+                error_msg = error or "任务执行失败"
+                print(f"❌ Task {task.task_id} 失败{location}")
+                self._failed_keys.append((stage.stage_id, task.task_id))
+                if error:
+                    print(f"   {error.strip()[:200]}")
+            if state:
+                state.complete_task(stage.stage_id, task.task_id, success, error_msg, duration=duration)
+
+        def on_tick() -> bool:
+            if stage.stage_id not in self._poll_reload():
+                return False
+            # 本阶段有任务追加或修改：重新检测冲突，已持有的锁保留
+            locks.load({stage.stage_id: self._get_stage_layout(stage)[0]})
+            return True
+
+        def runner(task: TaskNode):
+            return task_runner(task, self.global_goal, self._stage_context(stage), self.global_refs + stage.refs)
+
+        def on_retry(task: TaskNode, attempt: int, reason: str, delay: float, result: Any):
+            self._on_retry(stage.stage_id, task, f"Task {task.task_id}", attempt, reason, delay, result)
+
+        return scheduler.run(runner, completed=completed, on_start=on_start, on_finish=on_finish,
+                             on_tick=on_tick if self.watcher else None, tick_interval=self.watch_interval,
+                             on_retry=on_retry)
 
     def _execute_batch_serial(self, batch: List[TaskNode]) -> bool:
-        """串行执行批次中的任务"""
+        """串行执行批次中的任务（keep_going 时失败后继续执行批次中的其余任务）"""
+        batch_success = True
         for task in batch:
             # 获取task所属的stage_id（从task中获取或通过遍历stages查找）
             stage_id = self._get_stage_id_for_task(task)
@@ -285,18 +887,24 @@ class DAGExecutor:
                     continue
 
             print(f"执行: {task.description[:60]}")
+            self._started_keys.add((stage_id, task.task_id))
 
             # 任务执行器会自动管理状态（start_task 和 complete_task）
             success = self.task_executor(task)
 
             if not success:
-                print(f"❌ Task {task.task_id} 失败")
-                return False
+                location = f" ({task.location})" if task.location else ""
+                print(f"❌ Task {task.task_id} 失败{location}")
+                self._failed_keys.append((stage_id, task.task_id))
+                if not self.keep_going:
+                    return False
+                batch_success = False
+                continue
 
             print(f"✅ Task {task.task_id} 完成")
             print()
 
-        return True
+        return batch_success
 
     def _execute_batch_parallel(self, batch: List[TaskNode], max_workers: int, parallel_executor: Callable) -> bool:
         """并行执行批次中的任务"""
@@ -318,6 +926,11 @@ class DAGExecutor:
         print(f"🚀 并行执行 {len(tasks_to_execute)} 个任务 (最大 {max_workers} 并发)")
         print()
 
+        # 提交顺序：priority= 覆盖，其次预计剩余关键路径较长的先启动
+        tasks_to_execute = self.priority.sort(tasks_to_execute, self._task_order())
+
+        self._started_keys.update((stage_id, task.task_id) for task in tasks_to_execute)
+
         # 并行执行器会自动管理状态（start_task 和 complete_task）
         results = parallel_executor(tasks_to_execute, max_workers)
 
@@ -333,8 +946,112 @@ class DAGExecutor:
             for result in results:
                 if not result.success:
                     print(f"   ❌ Task {result.task_id}: {result.error_msg}")
+                    self._failed_keys.append((stage_id, result.task_id))
             return False
 
+    def _on_retry(self, stage_id: int, task: TaskNode, label: str, attempt: int, reason: str, delay: float,
+                  result: Any):
+        """调度器执行的任务瞬时失败、即将退避重试：输出并记入状态文件（任务仍为 in_progress）"""
+        error = getattr(result, 'error_msg', None) or (str(result) if isinstance(result, Exception) else "")
+        print(f"🔁 {label} {reason}（第 {attempt} 次执行失败），{format_duration(delay)} 后重试")
+        if self.use_state and self.state_manager:
+            self.state_manager.record_attempt(stage_id, task.task_id, attempt, reason, error, delay)
+
+    def _skip_task(self, stage_id: int, task: TaskNode, blocker: Tuple[int, int]):
+        """
+        keep_going：标记任务因失败任务阻塞而跳过（状态文件记为 skipped，断点续传时重新执行）
+
+        Args:
+            stage_id: 任务所属阶段
+            task: 被跳过的任务
+            blocker: 阻塞它的失败任务 (stage_id, task_id)
+        """
+        if self.use_state and self.state_manager and self.state_manager.should_skip_task(stage_id, task.task_id):
+            return  # 断点续传时已完成的任务
+        reason = f"依赖的 Stage {blocker[0] + 1} Task {blocker[1]} 失败"
+        self._skipped[(stage_id, task.task_id)] = reason
+        if self.use_state and self.state_manager:
+            self.state_manager.skip_task(stage_id, task.task_id, reason)
+
+    def _skip_later_stages(self, failed_stage: StageNode):
+        """keep_going + 阶段屏障：失败阶段之后的阶段都依赖它整体完成，全部跳过"""
+        blocker = next((key for key in self._failed_keys if key[0] == failed_stage.stage_id),
+                       (failed_stage.stage_id, 0))
+        for stage in self.stages[failed_stage.stage_id + 1:]:
+            for task in stage.tasks:
+                self._skip_task(stage.stage_id, task, blocker)
+
+    def _print_keep_going_summary(self):
+        """keep_going：汇总失败和被跳过的任务"""
+        print(f"⚠️  继续执行模式（--keep-going）: {len(self._failed_keys)} 个任务失败，"
+              f"{len(self._skipped)} 个任务因依赖失败任务被跳过")
+        for stage_id, task_id in self._failed_keys[:10]:
+            print(f"   ❌ Stage {stage_id + 1} Task {task_id}")
+        for (stage_id, task_id), reason in list(self._skipped.items())[:10]:
+            print(f"   ⏭️  Stage {stage_id + 1} Task {task_id}: {reason}")
+        if len(self._skipped) > 10:
+            print(f"   ... 另有 {len(self._skipped) - 10} 个被跳过的任务")
+        if self.use_state and self.state_manager:
+            print("💡 再次运行将只重新执行失败和被跳过的任务")
+
+    def _poll_reload(self) -> Set[int]:
+        """
+        监视模式：源文件有变化时重新解析，把安全的修改合并进当前计划
+
+        只在主线程的调度间隙调用（阶段/批次/任务之间，或调度器每轮循环），
+        运行中的任务不受影响。
+
+        Returns:
+            内容有变化的 stage_id（未开启监视、文件未变化或解析失败时为空）
+        """
+        if not self.watcher or not self.watcher.poll():
+            return set()
+
+        print(f"\n🔄 检测到 DAG 文件变化，重新解析...")
+        parser = DAGParser(self.file_path, resolver=self.parser.resolver, lazy_refs=self.parser.lazy_refs,
+                           fragment_cache=self.parser.fragment_cache)
+        try:
+            new_stages = parser.parse()
+        except ValueError as e:
+            print(f"⚠️  重新解析失败，继续按原计划执行: {e}\n")
+            return set()
+        self.watcher.reset(parser.sources)
+
+        state = self.state_manager if self.use_state else None
+        started = set(self._started_keys)
+        if state:
+            started.update((stage.stage_id, task.task_id) for stage in self.stages for task in stage.tasks
+                           if state.should_skip_task(stage.stage_id, task.task_id))
+
+        had_dependencies = has_task_dependencies(self.stages)
+        merge = merge_plan(self.stages, new_stages, started, self._closed_stages)
+        if parser.global_goal != self.global_goal:
+            self.global_goal = parser.global_goal
+            merge.applied.append("项目宏观目标已更新")
+        if parser.global_refs != self.global_refs:
+            self.global_refs = parser.global_refs
+            merge.applied.append("全局 @文件引用 已更新")
+
+        if merge.changed_stages:
+            self.task_index = build_task_index(self.stages)
+            self._order = None
+            for stage_id in merge.changed_stages:
+                self.stage_conflicts.pop(stage_id, None)
+                self.stage_batches.pop(stage_id, None)
+            if state:
+                state.sync_stages(self.stages)
+
+        for message in merge.applied:
+            print(f"   ✅ {message}")
+        for message in merge.rejected:
+            print(f"   ⚠️  {message}")
+        if not had_dependencies and has_task_dependencies(self.stages):
+            print(f"   💡 本次运行按阶段屏障执行，新增的 depends_on 下次运行起按任务级调度")
+        if not merge.applied and not merge.rejected:
+            print(f"   计划无变化")
+        print()
+        return merge.changed_stages
+
     def _inject_state_to_executor(self, stage_id: int):
         """
         将状态管理器和上下文注入到任务执行器（如果执行器支持）
@@ -353,11 +1070,61 @@ class DAGExecutor:
             if hasattr(executor_obj, 'set_state_manager'):
                 executor_obj.set_state_manager(self.state_manager, stage_id)
 
+        # 共享自适应并发控制器（批次执行时执行器按它的当前上限并发）
+        if self.concurrency and hasattr(executor_obj, 'concurrency'):
+            executor_obj.concurrency = self.concurrency
+
+        # 共享重试策略（批次/串行执行时执行器按它重试瞬时失败）
+        if self.retry_policy and hasattr(executor_obj, 'retry_policy'):
+            executor_obj.retry_policy = self.retry_policy
+
+        # 共享对冲策略（并行批次中执行器按它对冲慢任务，统计汇总到同一个对象）
+        if self.hedge_policy and hasattr(executor_obj, 'hedge_policy'):
+            executor_obj.hedge_policy = self.hedge_policy
+
+        # 共享运行历史（并行批次的进度行按它显示预计剩余时间）
+        if self.run_history and hasattr(executor_obj, 'run_history'):
+            executor_obj.run_history = self.run_history
+
         # 注入上下文（global_goal + stage 信息）
         if hasattr(executor_obj, 'set_context'):
             stage = self.stages[stage_id] if stage_id < len(self.stages) else None
-            stage_context = f"Stage: {stage.name}\n{stage.description}" if stage else ""
-            executor_obj.set_context(self.global_goal, stage_context)
+            stage_context = self._stage_context(stage) if stage else ""
+            context_refs = self.global_refs + (stage.refs if stage else [])
+            if context_refs:
+                executor_obj.set_context(self.global_goal, stage_context, context_refs=context_refs)
+            else:
+                executor_obj.set_context(self.global_goal, stage_context)
+
+    def _format_dependencies(self, task: TaskNode) -> str:
+        """依赖展示：stage名.任务id（无 id 时用序号）"""
+        names = []
+        for stage_id, task_id in task.depends_on:
+            target = self.get_task(stage_id, task_id)
+            task_ref = target.id if target and target.id else str(task_id)
+            names.append(f"{self.stages[stage_id].name}.{task_ref}")
+        return ", ".join(names)
+
+    @staticmethod
+    def _stage_context(stage: StageNode) -> str:
+        """阶段上下文（注入到任务 prompt）"""
+        return f"Stage: {stage.name}\n{stage.description}"
+
+    def get_task(self, stage_id: int, task_id: int) -> Optional[TaskNode]:
+        """
+        按 (stage_id, task_id) 查找任务（O(1)；矩阵子任务按需生成）
+
+        Returns:
+            任务节点，不存在时返回 None
+        """
+        if not self.task_index and self.stages:
+            self.task_index = build_task_index(self.stages)
+        task = self.task_index.get((stage_id, task_id))
+        if task is None and stage_id < len(self.stages):
+            tasks = self.stages[stage_id].tasks
+            if isinstance(tasks, TaskList) and 1 <= task_id <= len(tasks):
+                return tasks[task_id - 1]
+        return task
 
     def _get_stage_id_for_task(self, task: TaskNode) -> Optional[int]:
         """
@@ -369,6 +1136,11 @@ class DAGExecutor:
         Returns:
             阶段ID，如果找不到返回None
         """
+        # 解析时已回填 stage_id，O(1)
+        if task.stage_id is not None:
+            return task.stage_id
+
+        # 兼容外部手工构造、未回填 stage_id 的任务
         for stage in self.stages:
             for stage_task in stage.tasks:
                 if stage_task.task_id == task.task_id and stage_task.description == task.description:
@@ -400,6 +1172,9 @@ class DAGExecutor:
             return
 
         # 旧格式兼容：分别清理
+        if self.plan_cache:
+            self.plan_cache.clear()
+
         if self.state_manager and os.path.exists(self.state_manager.state_file):
             try:
                 os.remove(self.state_manager.state_file)
@@ -9,16 +9,84 @@ DAG 任务文件解析器 - 简化版
   - `## TASK ##` (标准格式)
   - `## TASK ##:` (带冒号)
   - `## TASK:` (简化格式，兼容)
+
+解析方式：单遍逐行扫描（含 @文件引用 的递归展开），直接构建 StageNode/TaskNode，
+每个节点记录来源文件和行号范围，便于报错和执行计划回溯到源文件。
+节点使用 __slots__ 紧凑存储，文件 glob / 验证命令等高重复字符串做 intern，
+解析后建立 (stage_id, task_id) → TaskNode 全局索引，10 万任务规模下查找为 O(1)。
+
+任务级依赖（可选）：TASK 标记行可带 id="..." depends_on="stage.task,..."，
+解析时解析为 (stage_id, task_id) 并做循环检测，调度见 dag_scheduler.py。
+矩阵任务（可选）：TASK 标记行可带 matrix="..." / matrix_file="..."，模板只存一份，
+所在阶段的 tasks 为 TaskList，子任务在索引/迭代时按需生成（见 task_matrix.py）。
+分片任务（可选）：TASK 标记行可带 shard="dir|file|N"，文件: 展开到仓库文件后拆成互不重叠的子任务，
+同样以矩阵模板表示（见 task_shard.py）。
+失败重试（可选）：TASK 标记行可带 retries="N" / backoff="30s..10m"，覆盖运行级的瞬时失败重试配置（见 task_retry.py）。
+启动优先级（可选）：TASK 标记行可带 priority="N"，就绪任务中优先级高的先启动（见 task_priority.py）。
+多文件布局（.task-xxx/stages/*.md）：每个文件独立解析（线程池并发，进程内按文件缓存），
+再按文件名顺序合并为一个阶段列表，depends_on 在合并后统一解析。
+@文件引用 的读取见 ref_resolver.py（共享内容缓存、大文件 mmap、并行预读）。
 """
 
+import os
 import re
-from dataclasses import dataclass
-from typing import List, Dict, Set
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
+from typing import TYPE_CHECKING, Any, Callable, List, Dict, Set, Optional, Tuple
 from pathlib import Path
 import fnmatch
+from bisect import bisect_right
 
+from ref_resolver import RefResolver, get_shared_resolver, ref_target, file_signature
+from task_matrix import TaskMatrix, parse_axes, load_rows, substitute, format_params
+from task_shard import parse_shard, plan_shards
+from task_retry import parse_backoff, parse_retries
+from file_index import FileIndex
+from conflict_coloring import color_batches
 
-@dataclass
+if TYPE_CHECKING:
+    from write_sets import WriteSetHistory
+
+
+STAGE_MARKER = '## STAGE ##'
+# TASK 标记（行首匹配）：## TASK ## / ## TASK ##: / ## TASK:
+TASK_MARKER_RE = re.compile(r'## TASK\s*##\s*:?|## TASK\s*:')
+# TASK 标记行参数：id="..." / depends_on="..." / matrix="..." / matrix_file="..." / shard="..." / shard_by="..." /
+# retries="..." / backoff="..." / priority="..."
+TASK_PARAM_RE = re.compile(r'\b(id|depends_on|matrix|matrix_file|shard_by|shard|retries|backoff|priority)="([^"]*)"')
+_PRIORITY_RE = re.compile(r'^\s*[+-]?\d+\s*$')
+# 多文件布局：.task-xxx/stages/*.md
+STAGES_DIR = 'stages'
+_DIGITS_RE = re.compile(r'(\d+)')
+
+
+_intern = sys.intern
+
+
+def parse_priority(text: str) -> int:
+    """
+    解析启动优先级（整数，可为负）
+
+    Raises:
+        ValueError: 不是整数
+    """
+    if not _PRIORITY_RE.match(text):
+        raise ValueError(f"priority 应为整数，当前: {text}")
+    return int(text)
+
+
+def format_location(source_file: str, line_start: int, line_end: int = 0) -> str:
+    """格式化源码位置：file:12 或 file:12-20"""
+    if not source_file:
+        return ""
+    if line_end and line_end > line_start:
+        return f"{source_file}:{line_start}-{line_end}"
+    return f"{source_file}:{line_start}"
+
+
+@dataclass(slots=True)
 class TaskNode:
     """任务节点（简化版）"""
     task_id: int  # 任务序号（自动生成）
@@ -26,12 +94,166 @@ class TaskNode:
     files: List[str]  # 文件范围（glob 模式）
     excludes: List[str]  # 排除文件（glob 模式）
     verify_cmd: str  # 验证命令
+    source_file: str = ""  # 来源文件（TASK 标记所在文件）
+    line_start: int = 0  # TASK 标记所在行（从1开始）
+    line_end: int = 0  # 任务最后一个非空行（同一来源文件内）
+    refs: List[str] = field(default_factory=list)  # 延迟引用句柄（被引用文件路径，构建 prompt 时才展开）
+    stage_id: Optional[int] = None  # 所属阶段序号（解析时回填）
+    id: str = ""  # 任务标识（TASK 标记行 id="..."，供 depends_on 引用）
+    depends_on: List[Tuple[int, int]] = field(default_factory=list)  # 显式前置任务 [(stage_id, task_id)]
+    matrix: Optional[TaskMatrix] = None  # 矩阵模板的参数（只出现在 TaskList.entries 中）
+    params: str = ""  # 矩阵子任务的参数组合（module=a, lang=x），普通任务为空
+    retries: Optional[int] = None  # 瞬时失败重试次数（TASK 标记行 retries="N"；None 取运行级默认值）
+    backoff: str = ""  # 重试退避（TASK 标记行 backoff="30s..10m"；空取运行级默认值）
+    priority: int = 0  # 启动优先级（TASK 标记行 priority="N"，越大越先启动）
+
+    @property
+    def location(self) -> str:
+        """源码位置（file:start-end）"""
+        return format_location(self.source_file, self.line_start, self.line_end)
+
+    def to_dict(self) -> Dict:
+        """转换为字典（用于执行计划缓存）"""
+        data = {f.name: getattr(self, f.name) for f in fields(self)}
+        if self.matrix is not None:
+            data['matrix'] = self.matrix.to_dict()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'TaskNode':
+        """从字典恢复（高重复字符串重新 intern，与解析结果一样紧凑）"""
+        task = cls(**data)
+        if task.matrix is not None:
+            task.matrix = TaskMatrix.from_dict(task.matrix)
+        task.depends_on = [tuple(dep) for dep in task.depends_on]  # JSON 中为列表
+        task.files = [_intern(f) for f in task.files]
+        task.excludes = [_intern(e) for e in task.excludes]
+        task.verify_cmd = _intern(task.verify_cmd)
+        task.source_file = _intern(task.source_file)
+        return task
 
     def __repr__(self):
         return f"Task#{self.task_id}: {self.description[:50]}"
 
 
-@dataclass
+def expand_matrix_task(template: TaskNode, index: int) -> TaskNode:
+    """
+    生成矩阵模板的第 index 个子任务（从0开始）
+
+    描述、文件:、排除:、验证:、@引用 中的 {参数名} 替换为该组合的取值；
+    描述没有引用任何参数时在末尾附加参数组合，避免子任务描述完全相同。
+    分片任务的 文件: 取该分片收窄后的范围。
+    """
+    params = template.matrix.params(index)
+    label = format_params(params)
+    description = substitute(template.description, params)
+    if description == template.description:
+        description = f"{description}（{label}）"
+    shards = template.matrix.shards
+    files = shards[index] if shards else [substitute(f, params) for f in template.files]
+    return TaskNode(
+        task_id=template.task_id + index,
+        description=description,
+        files=[_intern(f) for f in files],
+        excludes=[_intern(substitute(e, params)) for e in template.excludes],
+        verify_cmd=_intern(substitute(template.verify_cmd, params)),
+        source_file=template.source_file,
+        line_start=template.line_start,
+        line_end=template.line_end,
+        refs=[substitute(ref, params) for ref in template.refs],
+        stage_id=template.stage_id,
+        depends_on=list(template.depends_on),
+        params=label,
+        retries=template.retries,
+        backoff=template.backoff,
+        priority=template.priority
+    )
+
+
+class TaskList:
+    """
+    含矩阵模板的阶段任务序列（StageNode.tasks 的惰性替身）
+
+    entries 保存普通任务和矩阵模板（模板只存一份），按展开后的位置索引/迭代时才生成子任务，
+    1 万个组合的矩阵在计划、执行计划缓存中都只占一个模板。
+    支持 len / 下标 / 切片 / 迭代 / append / extend，与 List[TaskNode] 的用法一致；
+    子任务每次访问都是新对象，需要修改节点（回填 stage_id 等）时应操作 entries。
+    """
+
+    __slots__ = ('entries', '_offsets', '_total')
+
+    def __init__(self, entries: List[TaskNode]):
+        self.entries = list(entries)
+        self._reindex()
+
+    def _reindex(self):
+        self._offsets: List[int] = []
+        total = 0
+        for entry in self.entries:
+            self._offsets.append(total)
+            total += entry.matrix.size if entry.matrix is not None else 1
+        self._total = total
+
+    def entry_index(self, index: int) -> int:
+        """展开后下标 → entries 下标"""
+        return bisect_right(self._offsets, index) - 1
+
+    def __len__(self) -> int:
+        return self._total
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._total))]
+        if index < 0:
+            index += self._total
+        if not 0 <= index < self._total:
+            raise IndexError("task index out of range")
+        position = self.entry_index(index)
+        entry = self.entries[position]
+        if entry.matrix is None:
+            return entry
+        return expand_matrix_task(entry, index - self._offsets[position])
+
+    def __iter__(self):
+        for entry in self.entries:
+            if entry.matrix is None:
+                yield entry
+            else:
+                for index in range(entry.matrix.size):
+                    yield expand_matrix_task(entry, index)
+
+    def append(self, task: TaskNode):
+        self.entries.append(task)
+        self._reindex()
+
+    def extend(self, tasks):
+        self.entries.extend(tasks)
+        self._reindex()
+
+    def __repr__(self):
+        return f"TaskList({len(self.entries)} entries, {self._total} tasks)"
+
+
+def make_task_list(entries: List[TaskNode]):
+    """有矩阵模板时包装为 TaskList，否则原样返回列表（普通 DAG 没有任何额外开销）"""
+    if any(entry.matrix is not None for entry in entries):
+        return TaskList(entries)
+    return entries
+
+
+def _entry_position(stage: 'StageNode', task: TaskNode) -> int:
+    """任务节点在 task_entries(stage.tasks) 中的下标"""
+    if isinstance(stage.tasks, TaskList):
+        return stage.tasks.entry_index(task.task_id - 1)
+    return task.task_id - 1
+
+
+def task_entries(tasks) -> List[TaskNode]:
+    """阶段的任务节点本体（TaskList 返回 entries：模板而非生成的子任务）"""
+    return tasks.entries if isinstance(tasks, TaskList) else tasks
+
+
+@dataclass(slots=True)
 class StageNode:
     """阶段节点（简化版）"""
     stage_id: int  # 阶段序号（自动生成）
@@ -40,247 +262,811 @@ class StageNode:
     max_workers: int  # 最大并发数（仅 parallel 模式）
     tasks: List[TaskNode]  # 任务列表
     description: str = ""  # 阶段描述（可选，用于上下文传递）
+    source_file: str = ""  # 来源文件（STAGE 标记所在文件）
+    line_start: int = 0  # STAGE 标记所在行（从1开始）
+    line_end: int = 0  # 阶段最后一个非空行（同一来源文件内）
+    refs: List[str] = field(default_factory=list)  # 延迟引用句柄（阶段描述中的 @文件引用）
+
+    @property
+    def location(self) -> str:
+        """源码位置（file:start-end）"""
+        return format_location(self.source_file, self.line_start, self.line_end)
+
+    def to_dict(self) -> Dict:
+        """转换为字典（用于执行计划缓存）"""
+        data = {f.name: getattr(self, f.name) for f in fields(self) if f.name != 'tasks'}
+        data['tasks'] = [task.to_dict() for task in task_entries(self.tasks)]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'StageNode':
+        """从字典恢复"""
+        data = dict(data)
+        data['tasks'] = make_task_list([TaskNode.from_dict(t) for t in data.get('tasks', [])])
+        return cls(**data)
 
     def __repr__(self):
         return f"Stage#{self.stage_id}: {self.name} [{self.mode}] ({len(self.tasks)} tasks)"
 
 
-class DAGParser:
-    """DAG 任务文件解析器"""
-
-    def __init__(self, file_path: str):
-        self.file_path = file_path
-        self.stages: List[StageNode] = []
-        self.global_goal: str = ""  # 项目宏观目标（从文件头部解析）
-        # 文件引用的基准目录（使用当前工作目录，而非文件所在目录）
-        self.base_dir = Path.cwd()
-
-    def parse(self) -> List[StageNode]:
+@dataclass
+class DAGFragment:
+    """单个文件的独立解析结果（多文件布局下合并前的单元，可按文件缓存）"""
+    stages: List[StageNode]  # stage_id 为文件内序号，合并时重新编号
+    global_goal: str = ""  # 文件头部（第一个 STAGE 之前）的目标
+    global_refs: List[str] = field(default_factory=list)  # 文件头部的延迟引用句柄
+    pending_deps: List[Tuple[int, int, str]] = field(default_factory=list)  # (文件内阶段序号, 任务节点下标, 原始 depends_on)
+    sources: List[str] = field(default_factory=list)  # 该文件 + 其传递引用文件
+
+    def copy(self) -> 'DAGFragment':
+        """复制节点（合并时会改写 stage_id / refs / depends_on，缓存中的原件需保持不变）"""
+        stages = []
+        for stage in self.stages:
+            tasks = [TaskNode(*[getattr(task, name) for name in _TASK_FIELDS]) for task in task_entries(stage.tasks)]
+            values = {name: getattr(stage, name) for name in _STAGE_FIELDS}
+            stages.append(StageNode(tasks=make_task_list(tasks), **values))
+        return DAGFragment(stages, self.global_goal, self.global_refs, self.pending_deps, self.sources)
+
+
+_TASK_FIELDS = tuple(f.name for f in fields(TaskNode))
+_STAGE_FIELDS = tuple(f.name for f in fields(StageNode) if f.name != 'tasks')
+
+
+class FragmentCache:
+    """
+    多文件布局的逐文件解析缓存（进程内，线程安全）
+
+    按文件绝对路径缓存 DAGFragment，并记录该文件及其传递引用文件的签名，任一文件变化即失效。
+    监视模式重新解析、同一进程内多次解析时，只有被修改的阶段文件需要重新解析。
+    不落盘：解析结果的反序列化并不比重新解析快，跨进程复用交给执行计划缓存（plan.json）。
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Dict[str, Optional[Tuple[int, int, int]]], DAGFragment]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> Optional[DAGFragment]:
         """
-        解析 DAG 任务文件
-
         Returns:
-            阶段列表（按顺序）
+            解析结果的副本；未缓存或该文件/其引用文件已变化时返回 None
         """
-        try:
-            with open(self.file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-        except FileNotFoundError:
-            raise ValueError(f"文件不存在: {self.file_path}")
-        except Exception as e:
-            raise ValueError(f"读取文件失败: {e}")
-
-        # 处理文件引用（@文件路径）
-        content = self._resolve_file_references(content)
-
-        # 按 ## STAGE ## 分割
-        stage_sections = re.split(r'^## STAGE ##', content, flags=re.MULTILINE)
-
-        # 解析文件头部的项目目标（第一个 STAGE 之前的内容）
-        if stage_sections:
-            self.global_goal = self._extract_global_goal(stage_sections[0])
-
-        stage_id = 0
-        # 跳过第一段（文件头）
-        for section in stage_sections[1:]:
-            section = section.strip()
-            if not section:
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is None:
+            return None
+        signatures, fragment = entry
+        for source, signature in signatures.items():
+            if file_signature(source) != signature:
+                return None
+        return fragment.copy()
+
+    def put(self, path: str, fragment: DAGFragment, signatures: Dict[str, Optional[Tuple[int, int, int]]]):
+        """记录解析结果（fragment 需是合并前的原件副本）"""
+        with self._lock:
+            self._entries[path] = (signatures, fragment)
+
+    def prune(self, paths: List[str]):
+        """删除不在 paths 中的条目（阶段文件被删除）"""
+        keep = set(paths)
+        with self._lock:
+            for stale in [path for path in self._entries if path not in keep]:
+                del self._entries[stale]
+
+
+def find_stage_files(file_path: str) -> List[Path]:
+    """
+    多文件布局：入口所在的 .task-xxx/ 目录下存在 stages/*.md 时返回这些文件
+
+    按文件名自然排序（01-init.md < 2-dev.md < 10-review.md），即阶段执行顺序。
+
+    Returns:
+        阶段文件列表；不是多文件布局时为空
+    """
+    task_dir = Path(file_path).parent
+    stages_dir = task_dir / STAGES_DIR
+    if not task_dir.name.startswith('.task-') or not stages_dir.is_dir():
+        return []
+    files = [path for path in stages_dir.glob('*.md') if path.is_file()]
+    return sorted(files, key=lambda path: [int(part) if part.isdigit() else part
+                                           for part in _DIGITS_RE.split(path.name)])
+
+
+def task_predecessors(stage: StageNode, index: int) -> Tuple[List[Tuple[int, int]], Optional[int]]:
+    """
+    计算任务的前置条件（显式 depends_on + 隐式阶段顺序）
+
+    隐式规则与阶段屏障执行一致：
+    - 串行阶段内，任务依赖同阶段的上一个任务
+    - 没有 depends_on 的任务（并行阶段的任务、串行阶段的第一个任务）依赖上一阶段整体完成
+      （阶段整体完成 = 阶段内任务全部完成且之前所有阶段整体完成）
+    - 声明了 depends_on 的任务不再等待上一阶段整体完成，只等待列出的任务
+
+    Args:
+        stage: 任务所属阶段
+        index: 任务在阶段内的下标
+
+    Returns:
+        (前置任务列表 [(stage_id, task_id)], 需等待整体完成的阶段 stage_id 或 None)
+    """
+    task = stage.tasks[index]
+    predecessors = list(task.depends_on)
+    if stage.mode == 'serial' and index > 0:
+        previous = stage.tasks[index - 1]
+        predecessors.append((stage.stage_id, previous.task_id))
+        return predecessors, None
+    if task.depends_on or stage.stage_id == 0:
+        return predecessors, None
+    return predecessors, stage.stage_id - 1
+
+
+def has_task_dependencies(stages: List[StageNode]) -> bool:
+    """是否有任务声明了 depends_on（有则使用任务级调度器，否则按阶段屏障执行）"""
+    return any(task.depends_on for stage in stages for task in task_entries(stage.tasks))
+
+
+def build_task_index(stages: List[StageNode]) -> Dict[Tuple[int, int], TaskNode]:
+    """
+    建立全局任务索引（解析或加载执行计划缓存后调用一次）
+
+    矩阵子任务不进索引（按需生成），查找时回退到 stage.tasks[task_id - 1]。
+
+    Returns:
+        {(stage_id, task_id): TaskNode}
+    """
+    return {(stage.stage_id, task.task_id): task for stage in stages for task in task_entries(stage.tasks)
+            if task.matrix is None}
+
+
+def _task_label(task: TaskNode) -> str:
+    """报错用的任务位置：源码位置，没有时（编程方式构建）用阶段/任务序号"""
+    return task.location or f"Stage {task.stage_id + 1} Task {task.task_id}"
+
+
+def resolve_dependencies(stages: List[StageNode], pending_deps: List[Tuple[TaskNode, str]]):
+    """
+    把原始 depends_on 解析为 (stage_id, task_id) 并检查循环依赖（解析器和 DAGBuilder 共用）
+
+    引用写法（逗号分隔）：
+    - stage.task：stage 为阶段 name 或序号（从1开始），task 为任务 id 或序号（从1开始）
+    - task：同一阶段内的任务
+    - 引用矩阵模板的 id 即依赖它展开的全部子任务；模板自身的 depends_on 由每个子任务继承
+
+    Args:
+        stages: 阶段列表（stage_id 即下标）
+        pending_deps: [(任务节点, 原始 depends_on)]
+
+    Raises:
+        ValueError: 引用不存在、依赖自身或存在循环依赖（信息带 file:line）
+    """
+    stages_by_name: Dict[str, StageNode] = {}
+    for stage in stages:
+        stages_by_name.setdefault(stage.name, stage)
+
+    for task, raw in pending_deps:
+        owner = stages[task.stage_id]
+        deps: List[Tuple[int, int]] = []
+        for item in raw.split(','):
+            item = item.strip()
+            if not item:
                 continue
-
-            # 解析 STAGE
-            stage_node = self._parse_stage(section, stage_id)
-            if stage_node:
-                self.stages.append(stage_node)
-                stage_id += 1
-
-        if not self.stages:
-            raise ValueError("未找到任何 STAGE 定义")
-
-        return self.stages
-
-    def _extract_global_goal(self, header_section: str) -> str:
+            stage_ref, _, task_ref = item.rpartition('.')
+            target_stage = owner if not stage_ref else _find_stage(stages, stages_by_name, stage_ref)
+            found = _find_task(target_stage, task_ref) if target_stage else None
+            if found is None:
+                raise ValueError(f"{_task_label(task)}: depends_on 引用的任务不存在: {item}")
+            target, keys = found
+            if target is task:
+                raise ValueError(f"{_task_label(task)}: depends_on 不能依赖自身: {item}")
+            for key in keys:
+                if key not in deps:
+                    deps.append(key)
+        task.depends_on = deps
+
+    check_dependency_cycles(stages)
+
+
+def _find_stage(stages: List[StageNode], stages_by_name: Dict[str, StageNode], ref: str) -> Optional[StageNode]:
+    """按 name 或序号（从1开始）查找阶段"""
+    stage = stages_by_name.get(ref)
+    if stage is None and ref.isdigit() and 1 <= int(ref) <= len(stages):
+        stage = stages[int(ref) - 1]
+    return stage
+
+
+def _find_task(stage: StageNode, ref: str) -> Optional[Tuple[TaskNode, List[Tuple[int, int]]]]:
+    """
+    按 id 或序号（从1开始，按展开后的位置）查找阶段内任务
+
+    Returns:
+        (任务节点, 对应的 (stage_id, task_id) 列表)；id 匹配矩阵模板时为全部子任务，
+        序号落在矩阵模板上时为该子任务。不存在时返回 None
+    """
+    entries = task_entries(stage.tasks)
+    for task in entries:
+        if task.id == ref:
+            if task.matrix is None:
+                return task, [(stage.stage_id, task.task_id)]
+            return task, [(stage.stage_id, task.task_id + i) for i in range(task.matrix.size)]
+    if ref.isdigit() and 1 <= int(ref) <= len(stage.tasks):
+        index = int(ref) - 1
+        task = entries[stage.tasks.entry_index(index)] if isinstance(stage.tasks, TaskList) else entries[index]
+        return task, [(stage.stage_id, index + 1)]
+    return None
+
+
+def check_dependency_cycles(stages: List[StageNode]):
+    """拓扑排序检查循环依赖（显式 depends_on 与隐式阶段顺序合并后必须无环）"""
+    # 节点：任务 (stage_id, task_id) + 阶段完成屏障 (stage_id, 0)
+    indegree: Dict[Tuple[int, int], int] = {}
+    dependents: Dict[Tuple[int, int], List[Tuple[int, int]]] = {}
+    for stage in stages:
+        # 阶段整体完成 = 阶段内任务全部完成 且 上一阶段整体完成
+        barrier = (stage.stage_id, 0)
+        indegree[barrier] = len(stage.tasks)
+        if stage.stage_id > 0:
+            indegree[barrier] += 1
+            dependents.setdefault((stage.stage_id - 1, 0), []).append(barrier)
+        for index, task in enumerate(stage.tasks):
+            key = (stage.stage_id, task.task_id)
+            predecessors, wait_stage = task_predecessors(stage, index)
+            if wait_stage is not None:
+                predecessors = predecessors + [(wait_stage, 0)]
+            indegree[key] = len(predecessors)
+            for pred in predecessors:
+                dependents.setdefault(pred, []).append(key)
+            dependents.setdefault(key, []).append(barrier)
+
+    queue = [key for key, degree in indegree.items() if degree == 0]
+    visited = 0
+    while queue:
+        key = queue.pop()
+        visited += 1
+        for dependent in dependents.get(key, ()):
+            indegree[dependent] -= 1
+            if indegree[dependent] == 0:
+                queue.append(dependent)
+
+    if visited < len(indegree):
+        blocked = [stages[key[0]].tasks[key[1] - 1] for key, degree in indegree.items()
+                   if degree > 0 and key[1] > 0]
+        names = ", ".join(f"Stage {t.stage_id + 1} Task {t.task_id}" + (f" ({t.location})" if t.location else "")
+                          for t in blocked[:5])
+        raise ValueError(f"depends_on 存在循环依赖，以下任务无法调度: {names}")
+
+
+class _TaskBuilder:
+    """逐行累积单个 TASK 的字段（解析器内部使用）"""
+
+    __slots__ = ('source_file', 'line_start', 'line_end', 'description',
+                 'files', 'excludes', 'verify_cmd', 'refs', 'id', 'depends_on', 'matrix_spec', 'matrix_file',
+                 'matrix', 'shard', 'shard_by', 'retries', 'backoff', 'priority', 'has_content')
+
+    def __init__(self, source_file: str, line_start: int):
+        self.source_file = source_file
+        self.line_start = line_start
+        self.line_end = line_start
+        self.description = ""
+        self.files: List[str] = []
+        self.excludes: List[str] = []
+        self.verify_cmd = ""
+        self.refs: List[str] = []
+        self.id = ""
+        self.depends_on = ""  # 原始 depends_on 值，整个文件解析完后再解析引用
+        self.matrix_spec = ""  # 原始 matrix 值
+        self.matrix_file = ""  # 原始 matrix_file 值
+        self.matrix: Optional[TaskMatrix] = None
+        self.shard = ""  # 原始 shard 值（任务内容全部读完后才能展开）
+        self.shard_by = "bytes"
+        self.retries: Optional[int] = None
+        self.backoff = ""
+        self.priority = 0
+        self.has_content = False
+
+    def set_params(self, marker_rest: str) -> str:
         """
-        从文件头部提取项目宏观目标
-
-        支持的格式：
-        - # 项目目标：xxx
-        - # 宏观目标：xxx
-        - 文件的第一个 # 标题作为目标
-
-        Args:
-            header_section: 文件头部内容（第一个 STAGE 之前）
+        提取 TASK 标记行上的 id/depends_on/matrix/matrix_file/shard/shard_by/retries/backoff/priority 参数
 
         Returns:
-            项目目标描述
+            去掉参数后的剩余内容（属于任务正文）
+
+        Raises:
+            ValueError: retries / backoff / priority 取值不合法（信息带 file:line）
         """
-        lines = header_section.strip().split('\n')
-        goal_lines = []
+        for name, value in TASK_PARAM_RE.findall(marker_rest):
+            if name == 'id':
+                self.id = _intern(value.strip())
+            elif name == 'depends_on':
+                self.depends_on = value
+            elif name == 'matrix':
+                self.matrix_spec = value
+            elif name == 'matrix_file':
+                self.matrix_file = value.strip()
+            elif name == 'shard':
+                self.shard = value
+            elif name == 'retries':
+                self.retries = self._parse_param(parse_retries, value)
+            elif name == 'backoff':
+                self._parse_param(parse_backoff, value)
+                self.backoff = _intern(value.strip())
+            elif name == 'priority':
+                self.priority = self._parse_param(parse_priority, value)
+            else:
+                self.shard_by = value.strip()
+        self.has_content = True
+        return TASK_PARAM_RE.sub('', marker_rest).strip()
 
-        for line in lines:
-            stripped = line.strip()
-            # 跳过空行
-            if not stripped:
-                continue
-            # 跳过纯注释行（但保留有内容的行）
-            if stripped.startswith('#') and len(stripped) <= 1:
-                continue
-            # 收集非空内容行（最多 5 行）
-            if len(goal_lines) < 5:
-                # 移除 markdown 标题符号
-                if stripped.startswith('#'):
-                    stripped = stripped.lstrip('#').strip()
-                goal_lines.append(stripped)
-
-        return '\n'.join(goal_lines) if goal_lines else ""
-
-    def _parse_stage(self, section: str, stage_id: int) -> StageNode:
-        """解析单个 STAGE"""
-        lines = section.split('\n')
-        if not lines:
-            return None
+    def _parse_param(self, parse: Callable[[str], Any], value: str) -> Any:
+        try:
+            return parse(value)
+        except ValueError as e:
+            raise ValueError(f"{format_location(self.source_file, self.line_start)}: {e}")
+
+    def feed(self, line: str, source_file: str, lineno: int):
+        """处理一行任务内容（line 已 strip 且非空）"""
+        self.has_content = True
+        if source_file == self.source_file:
+            self.line_end = lineno
+        if line[0] == '#':
+            return
+
+        # 提取字段
+        # glob 和验证命令在大 DAG 中高度重复（公共目录、同一测试命令），intern 后共享同一对象
+        if line.startswith('文件:'):
+            file_list = line[3:].strip()
+            self.files.extend([_intern(f.strip()) for f in file_list.split(',') if f.strip()])
+        elif line.startswith('排除:'):
+            exclude_list = line[3:].strip()
+            self.excludes.extend([_intern(e.strip()) for e in exclude_list.split(',') if e.strip()])
+        elif line.startswith('验证:'):
+            self.verify_cmd = _intern(line[3:].strip())
+        elif not self.description:
+            # 第一行非字段内容作为描述
+            self.description = line
+
+    def build(self, task_id: int) -> TaskNode:
+        return TaskNode(
+            task_id=task_id,
+            description=self.description or f"Task {task_id}",
+            files=self.files,
+            excludes=self.excludes,
+            verify_cmd=self.verify_cmd,
+            source_file=self.source_file,
+            line_start=self.line_start,
+            line_end=self.line_end,
+            refs=self.refs,
+            id=self.id,
+            matrix=self.matrix,
+            retries=self.retries,
+            backoff=self.backoff,
+            priority=self.priority
+        )
 
-        # 第一行是 STAGE 参数（可能包含前导空格）
-        # 因为 split('## STAGE ##') 后，参数在同一行
-        first_line = section.split('\n')[0].strip()
 
-        # 如果第一行为空，可能是分割后的空白
-        if not first_line:
+class _StageBuilder:
+    """逐行累积单个 STAGE 的参数、描述和任务（解析器内部使用）"""
+
+    _MAX_DESC_LINES = 10
+
+    def __init__(self, source_file: str, line_start: int, marker_rest: str,
+                 sharder: Optional[Callable[['_TaskBuilder'], TaskMatrix]] = None):
+        self.source_file = source_file
+        self.sharder = sharder  # 展开 shard="..."（DAGParser._build_shards）
+        self.line_start = line_start
+        self.line_end = line_start
+        # 参数行：STAGE 标记后的剩余内容；为空时取下一个非空行
+        self.params_line = marker_rest.strip() or None
+        self.params_location = format_location(source_file, line_start)
+        self.desc_lines: List[str] = []
+        self.tasks: List[TaskNode] = []  # 任务节点（矩阵任务只有模板）
+        self.task_count = 0  # 展开后的任务数（下一个任务的序号 - 1）
+        self.refs: List[str] = []
+        self.pending_deps: List[Tuple[TaskNode, str]] = []  # (任务, 原始 depends_on)，待全部解析后处理
+        self.current_task: Optional[_TaskBuilder] = None
+
+    def add_description(self, line: str):
+        """STAGE 描述：参数行和第一个 TASK 之间的内容（line 已 strip 且非空）"""
+        if line == '#' or len(self.desc_lines) >= self._MAX_DESC_LINES:
+            return
+        # 移除 markdown 标题符号但保留内容
+        if line[0] == '#':
+            line = line.lstrip('#').strip()
+        self.desc_lines.append(line)
+
+    def start_task(self, source_file: str, lineno: int) -> _TaskBuilder:
+        self._finish_task()
+        self.current_task = _TaskBuilder(source_file, lineno)
+        return self.current_task
+
+    def _finish_task(self):
+        task = self.current_task
+        self.current_task = None
+        # 空 TASK（标记后没有任何内容）忽略，不占用序号
+        if task is not None and task.has_content:
+            if task.shard and self.sharder:
+                task.matrix = self.sharder(task)
+            node = task.build(self.task_count + 1)
+            self.tasks.append(node)
+            self.task_count += node.matrix.size if node.matrix is not None else 1
+            if task.depends_on:
+                self.pending_deps.append((node, task.depends_on))
+
+    def build(self, parser: 'DAGParser', stage_id: int) -> Optional[StageNode]:
+        self._finish_task()
+        if self.params_line is None:
+            # STAGE 标记后没有任何内容，忽略
             return None
 
+        first_line = self.params_line
+        location = self.params_location
+
         # 提取参数
-        name = self._extract_param(first_line, 'name', required=True)
-        mode = self._extract_param(first_line, 'mode', required=True)
-        max_workers = int(self._extract_param(first_line, 'max_workers', default='2'))
+        name = parser._extract_param(first_line, 'name', required=True, location=location)
+        mode = parser._extract_param(first_line, 'mode', required=True, location=location)
+        max_workers_raw = parser._extract_param(first_line, 'max_workers', default='2')
+        try:
+            max_workers = int(max_workers_raw)
+        except ValueError:
+            raise ValueError(f"{location}: STAGE max_workers 必须是整数，当前: {max_workers_raw}")
 
         # 验证 mode（兼容 sequential 作为 serial 的别名）
         if mode not in ['serial', 'parallel', 'sequential']:
-            raise ValueError(f"STAGE mode 必须是 'serial' 或 'parallel'，当前: {mode}")
+            raise ValueError(f"{location}: STAGE mode 必须是 'serial' 或 'parallel'，当前: {mode}")
         if mode == 'sequential':
             mode = 'serial'  # 别名转换
 
-        # 提取 STAGE 描述（参数行和第一个 TASK 之间的内容）
-        description = self._extract_stage_description(section)
-
-        # 解析 TASK
-        tasks = self._parse_tasks(section)
+        for task in self.tasks:
+            task.stage_id = stage_id
+        parser._pending_deps.extend(self.pending_deps)
 
         return StageNode(
             stage_id=stage_id,
             name=name,
             mode=mode,
             max_workers=max_workers,
-            tasks=tasks,
-            description=description
+            tasks=make_task_list(self.tasks),
+            description='\n'.join(self.desc_lines),
+            source_file=self.source_file,
+            line_start=self.line_start,
+            line_end=self.line_end,
+            refs=self.refs
         )
 
-    def _extract_stage_description(self, section: str) -> str:
-        """
-        提取 STAGE 描述（参数行和第一个 TASK 之间的内容）
 
+class _ScanState:
+    """跨文件扫描状态（@文件引用 递归扫描时共享）"""
+
+    __slots__ = ('goal_lines', 'stage', 'task')
+
+    def __init__(self):
+        self.goal_lines: List[str] = []
+        self.stage: Optional[_StageBuilder] = None
+        self.task: Optional[_TaskBuilder] = None
+
+
+class DAGParser:
+    """DAG 任务文件解析器"""
+
+    _MAX_GOAL_LINES = 5
+
+    def __init__(self, file_path: str, resolver: Optional[RefResolver] = None, lazy_refs: bool = False,
+                 fragment_cache=None):
+        """
         Args:
-            section: STAGE 内容
+            file_path: DAG 任务文件路径（多文件布局下为 .task-xxx/dag.md，可不存在）
+            resolver: 引用文件读取器（默认进程内共享）
+            lazy_refs: 延迟引用模式 —— @文件引用 不在解析时读取展开，而是记录为句柄
+                       （TaskNode.refs / StageNode.refs / global_refs），构建任务 prompt 时才读取。
+                       解析耗时和内存与被引用文件大小无关；代价是被引用文件中的
+                       STAGE/TASK/文件: 等结构不参与解析，只适合引用说明文档类内容。
+            fragment_cache: 多文件布局的逐文件解析缓存（FragmentCache，可跨多次解析共享）；
+                            为 None 时每次全部解析
+        """
+        self.file_path = file_path
+        self.lazy_refs = lazy_refs
+        self.fragment_cache = fragment_cache
+        self.stage_files: List[Path] = []  # 多文件布局的阶段文件（按执行顺序）
+        self.fragment_files = 0  # 多文件布局下解析的文件数（含 dag.md）
+        self.fragment_hits = 0  # 其中命中逐文件解析缓存的文件数
+        self.stages: List[StageNode] = []
+        self.global_goal: str = ""  # 项目宏观目标（从文件头部解析）
+        self.global_refs: List[str] = []  # 文件头部的延迟引用句柄（仅 lazy_refs 模式）
+        self.task_index: Dict[Tuple[int, int], TaskNode] = {}  # (stage_id, task_id) → TaskNode
+        self._pending_deps: List[Tuple[TaskNode, str]] = []
+        # 文件引用的基准目录（使用当前工作目录，而非文件所在目录）
+        self.base_dir = Path.cwd()
+        # 本次解析读取过的源文件（入口文件 + 所有传递引用，含不存在的引用路径，去重保序）
+        self.sources: List[str] = []
+        self._sources: Dict[str, None] = {}
+        # 文件读取器（默认进程内共享，跨多次解析复用内容缓存）
+        self.resolver = resolver or get_shared_resolver()
+        self._file_index: Optional[FileIndex] = None  # 仓库文件索引（遇到 shard="..." 时才创建）
+
+    def parse(self) -> List[StageNode]:
+        """
+        解析 DAG 任务文件
+
+        单遍扫描：逐行处理，@文件引用 在扫描到时递归展开，
+        遇到 STAGE/TASK 标记即切换当前节点，不再对整段内容做多次 split。
+        文件读取经由共享的 RefResolver（内容缓存 + 并行预读）。
 
         Returns:
-            STAGE 描述
+            阶段列表（按顺序）
+        """
+        entry_path = Path(self.file_path).resolve()
+        self.stage_files = find_stage_files(entry_path)
+        if self.stage_files:
+            self._parse_stage_files(entry_path)
+        else:
+            self._scan_entry(entry_path)
+
+        if not self.stages:
+            raise ValueError("未找到任何 STAGE 定义")
+
+        self.task_index = build_task_index(self.stages)
+        if self._pending_deps:
+            self._resolve_dependencies()
+        return self.stages
+
+    def _scan_entry(self, entry_path: Path):
+        """扫描入口文件（及其 @文件引用），构建 stages / global_goal / sources"""
+        try:
+            lines = self.resolver.read_lines(entry_path)
+        except FileNotFoundError:
+            raise ValueError(f"文件不存在: {self.file_path}")
+        except Exception as e:
+            raise ValueError(f"读取文件失败: {e}")
+
+        self._sources = {str(entry_path): None}
+        self.global_refs = []
+        state = _ScanState()
+        self._scan(lines, self.file_path, self.base_dir, 0, {str(entry_path)}, state)
+        self.sources = list(self._sources)
+
+        self._finish_stage(state.stage)
+        self.global_goal = '\n'.join(state.goal_lines)
+
+    def _parse_fragment(self, path: Path, display: str) -> DAGFragment:
+        """独立解析单个文件（不解析 depends_on，可在线程池中并发执行）"""
+        parser = DAGParser(display, resolver=self.resolver, lazy_refs=self.lazy_refs)
+        parser.base_dir = self.base_dir
+        parser._scan_entry(path)
+        return DAGFragment(
+            stages=parser.stages,
+            global_goal=parser.global_goal,
+            global_refs=parser.global_refs,
+            pending_deps=[(task.stage_id, _entry_position(parser.stages[task.stage_id], task), raw)
+                          for task, raw in parser._pending_deps],
+            sources=parser.sources,
+        )
+
+    def _load_fragment(self, path: Path) -> Tuple[DAGFragment, bool]:
+        """优先从逐文件缓存加载，返回 (解析结果, 是否命中缓存)"""
+        if self.fragment_cache is not None:
+            fragment = self.fragment_cache.get(str(path))
+            if fragment is not None:
+                return fragment, True
+        if path.parent.name == STAGES_DIR:
+            display = os.path.join(os.path.dirname(self.file_path), STAGES_DIR, path.name)
+        else:
+            display = self.file_path
+
+        # 先取本文件签名再解析：解析期间被修改时，下次按签名不一致重新解析
+        own_signature = file_signature(str(path))
+        fragment = self._parse_fragment(path, display)
+        if self.fragment_cache is not None:
+            signatures = {source: file_signature(source) for source in fragment.sources}
+            signatures[str(path)] = own_signature
+            self.fragment_cache.put(str(path), fragment.copy(), signatures)
+        return fragment, False
+
+    def _parse_stage_files(self, entry_path: Path):
         """
-        # 找到第一个 TASK 标记的位置
-        task_match = re.search(r'^## TASK\s*##\s*:?|^## TASK\s*:', section, flags=re.MULTILINE)
+        多文件布局：dag.md（可选，提供项目宏观目标和排在最前的 STAGE）+ stages/*.md
 
-        if task_match:
-            # 取 TASK 之前的内容
-            before_task = section[:task_match.start()]
+        各文件独立解析（未命中缓存的文件在线程池中并发解析），按顺序合并：
+        阶段重新编号，项目宏观目标取 dag.md（没有 dag.md 时取第一个阶段文件）的头部，
+        其余文件头部的延迟引用归入该文件的各个阶段。
+        """
+        paths = ([entry_path] if entry_path.is_file() else []) + self.stage_files
+        if len(paths) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(paths), self.resolver.max_workers)) as pool:
+                results = list(pool.map(self._load_fragment, paths))
         else:
-            # 没有 TASK，取全部内容
-            before_task = section
+            results = [self._load_fragment(path) for path in paths]
+
+        # 目录本身也是源：新增/删除阶段文件使执行计划缓存失效、触发监视模式重新解析
+        self._sources = {str(entry_path): None, str(entry_path.parent / STAGES_DIR): None}
+        self.fragment_files = len(paths)
+        self.fragment_hits = 0
+        for index, (fragment, hit) in enumerate(results):
+            self.fragment_hits += hit
+            offset = len(self.stages)
+            for stage in fragment.stages:
+                stage.stage_id += offset
+                for task in task_entries(stage.tasks):
+                    task.stage_id = stage.stage_id
+                if index > 0:
+                    stage.refs = fragment.global_refs + stage.refs
+                self.stages.append(stage)
+            for stage_index, task_index, raw in fragment.pending_deps:
+                self._pending_deps.append((task_entries(self.stages[offset + stage_index].tasks)[task_index], raw))
+            for source in fragment.sources:
+                self._sources[source] = None
+
+        if results:
+            self.global_goal = results[0][0].global_goal
+            self.global_refs = results[0][0].global_refs
+        self.sources = list(self._sources)
+        if self.fragment_cache is not None:
+            self.fragment_cache.prune([str(path) for path in paths])
+
+    def _scan(self, lines: List[str], source_file: str, base_dir: Path, depth: int, ancestors: Set[str],
+              state: '_ScanState', resolve_refs: bool = True, first_lineno: int = 1):
+        """
+        逐行扫描并构建节点（@文件引用 行递归扫描被引用文件）
 
-        # 分割成行，跳过第一行（参数行）
-        lines = before_task.split('\n')[1:]
-        desc_lines = []
+        Args:
+            lines: 行列表
+            source_file: 当前文件（用于记录来源位置）
+            base_dir: 引用的基准目录
+            depth: 当前引用深度
+            ancestors: 当前引用链上的文件绝对路径（用于循环检测）
+            state: 扫描状态（跨文件共享）
+            resolve_refs: 是否展开 @文件引用（引用失败时保留的原始行不再展开）
+            first_lineno: 第一行的行号
+        """
+        if resolve_refs and not self.lazy_refs:
+            # 先并行预读本文件引用的所有文件，再逐行扫描
+            self._prefetch_refs(lines, base_dir)
+
+        stage = state.stage
+        task = state.task
+        goal_lines = state.goal_lines
+        lineno = first_lineno - 1
 
         for line in lines:
+            lineno += 1
             stripped = line.strip()
-            # 跳过空行和纯注释
-            if not stripped or stripped == '#':
+            if not stripped:
                 continue
-            # 收集描述行（最多 10 行）
-            if len(desc_lines) < 10:
-                # 移除 markdown 标题符号但保留内容
-                if stripped.startswith('#'):
-                    stripped = stripped.lstrip('#').strip()
-                desc_lines.append(stripped)
-
-        return '\n'.join(desc_lines) if desc_lines else ""
 
-    def _parse_tasks(self, stage_section: str) -> List[TaskNode]:
-        """解析 STAGE 中的所有 TASK
+            first_char = stripped[0]
+            if first_char == '#' and line.startswith(STAGE_MARKER):
+                self._finish_stage(stage)
+                stage = _StageBuilder(source_file, lineno, line[len(STAGE_MARKER):], self._build_shards)
+                task = None
+                continue
 
-        支持多种 TASK 标记格式（容错设计）：
-        - `## TASK ##` (标准格式，推荐)
-        - `## TASK ##:` (带冒号)
-        - `## TASK:` (简化格式，兼容旧版)
+            if first_char == '@' and resolve_refs:
+                # 引用行本身计入当前节点的行范围
+                if stage is not None and source_file == stage.source_file:
+                    stage.line_end = lineno
+                if task is not None and source_file == task.source_file:
+                    task.line_end = lineno
+                if self.lazy_refs:
+                    self._add_ref_handle(stripped, base_dir, stage, task)
+                    continue
+                # 展开引用：被引用文件可能切换当前 STAGE/TASK，需同步扫描状态
+                state.stage, state.task = stage, task
+                self._scan_ref(stripped, line, lineno, source_file, base_dir, depth, ancestors, state)
+                stage, task = state.stage, state.task
+                continue
 
-        注意：只匹配行首的标记，避免误匹配文本中的内容
-        """
-        # 使用正则支持多种 TASK 格式
-        # 匹配行首: ## TASK ## 或 ## TASK ##: 或 ## TASK:
-        # ^表示行首（配合 MULTILINE 标志）
-        task_sections = re.split(r'^## TASK\s*##\s*:?|^## TASK\s*:', stage_section, flags=re.MULTILINE)
+            if stage is None:
+                # 文件头部（第一个 STAGE 之前）：项目宏观目标
+                if len(goal_lines) < self._MAX_GOAL_LINES:
+                    self._collect_goal_line(stripped, goal_lines)
+                continue
 
-        tasks = []
-        task_id = 1
+            if source_file == stage.source_file:
+                stage.line_end = lineno
 
-        for section in task_sections[1:]:  # 跳过第一段（STAGE 参数）
-            section = section.strip()
-            if not section:
+            if stage.params_line is None:
+                stage.params_line = stripped
+                stage.params_location = format_location(source_file, lineno)
                 continue
 
-            task_node = self._parse_task(section, task_id)
-            if task_node:
-                tasks.append(task_node)
-                task_id += 1
+            if first_char == '#' and line.startswith('## TASK'):
+                match = TASK_MARKER_RE.match(line)
+                if match:
+                    task = stage.start_task(source_file, lineno)
+                    # 标记行剩余内容属于任务正文（先取出 id/depends_on 参数）
+                    stripped = line[match.end():].strip()
+                    if '="' in stripped:
+                        stripped = task.set_params(stripped)
+                        if task.matrix_spec or task.matrix_file:
+                            task.matrix = self._build_matrix(task, base_dir)
+                    if not stripped:
+                        continue
+
+            if task is not None:
+                task.feed(stripped, source_file, lineno)
+            else:
+                stage.add_description(stripped)
 
-        return tasks
+        state.stage, state.task = stage, task
 
-    def _parse_task(self, section: str, task_id: int) -> TaskNode:
-        """解析单个 TASK"""
-        lines = section.split('\n')
+    def _build_matrix(self, task: _TaskBuilder, base_dir: Path) -> TaskMatrix:
+        """
+        解析 TASK 标记行的 matrix / matrix_file 参数
 
-        # 提取任务描述（第一行非空内容）
-        description = ""
-        files = []
-        excludes = []
-        verify_cmd = ""
+        matrix_file 相对于引用基准目录（与 @文件引用 相同），计入 sources：
+        修改它使执行计划缓存失效、触发监视模式重新解析。
 
-        for line in lines:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
+        Raises:
+            ValueError: 参数格式错误、文件不存在或展开后没有子任务（信息带 file:line）
+        """
+        location = format_location(task.source_file, task.line_start)
+        axes = parse_axes(task.matrix_spec, location)
+        rows: List[str] = []
+        source = task.matrix_spec
+        if task.matrix_file:
+            full_path = (base_dir / task.matrix_file).resolve()
+            self._sources[str(full_path)] = None
+            try:
+                lines = self.resolver.read_lines(full_path)
+            except FileNotFoundError:
+                raise ValueError(f"{location}: matrix_file 不存在: {task.matrix_file}")
+            except Exception as e:
+                raise ValueError(f"{location}: 读取 matrix_file 失败: {e}")
+            rows = load_rows(lines, self._display_path(full_path))
+            source = '; '.join(filter(None, [f"matrix_file={task.matrix_file}", source]))
+
+        if not axes and not rows:
+            raise ValueError(f"{location}: matrix 展开后没有任何子任务")
+        return TaskMatrix(axes=axes, rows=rows, source=source)
+
+    def _build_shards(self, task: _TaskBuilder) -> TaskMatrix:
+        """
+        展开 TASK 标记行的 shard / shard_by 参数：文件: 按仓库文件列表拆成互不重叠的分组
 
-            # 提取字段
-            if line.startswith('文件:'):
-                file_list = line[3:].strip()
-                files.extend([f.strip() for f in file_list.split(',') if f.strip()])
-            elif line.startswith('排除:'):
-                exclude_list = line[3:].strip()
-                excludes.extend([e.strip() for e in exclude_list.split(',') if e.strip()])
-            elif line.startswith('验证:'):
-                verify_cmd = line[3:].strip()
-            elif not description:
-                # 第一行非字段内容作为描述
-                description = line
-
-        if not description:
-            description = f"Task {task_id}"
+        Raises:
+            ValueError: 取值不合法、与 matrix 同时使用、没有 文件: 或文件范围没有匹配的文件（信息带 file:line）
+        """
+        location = format_location(task.source_file, task.line_start)
+        mode = parse_shard(task.shard, task.shard_by, location)
+        if task.matrix is not None:
+            raise ValueError(f"{location}: shard 不能与 matrix / matrix_file 同时使用")
+        if not task.files:
+            raise ValueError(f"{location}: shard 需要 文件: 范围")
+        if self._file_index is None:
+            self._file_index = FileIndex(str(self.base_dir))
+        shards = plan_shards(self._file_index, task.files, task.excludes, mode, location, task.shard_by)
+        return TaskMatrix(axes=[], shards=shards, source=f"shard={task.shard.strip()}")
+
+    def _resolve_dependencies(self):
+        """把原始 depends_on 解析为 (stage_id, task_id) 并检查循环依赖（见 resolve_dependencies）"""
+        resolve_dependencies(self.stages, self._pending_deps)
+        self._pending_deps = []
+
+    def _finish_stage(self, builder: Optional[_StageBuilder]):
+        """构建并追加 STAGE（空 STAGE 忽略，不占用序号）"""
+        if builder is None:
+            return
+        stage_node = builder.build(self, len(self.stages))
+        if stage_node:
+            self.stages.append(stage_node)
 
-        return TaskNode(
-            task_id=task_id,
-            description=description,
-            files=files,
-            excludes=excludes,
-            verify_cmd=verify_cmd
-        )
+    @staticmethod
+    def _collect_goal_line(line: str, goal_lines: List[str]):
+        """
+        收集文件头部的项目宏观目标（line 已 strip 且非空）
 
-    def _extract_param(self, line: str, param_name: str, required: bool = False, default: str = "") -> str:
+        支持的格式：
+        - # 项目目标：xxx
+        - # 宏观目标：xxx
+        - 文件的第一个 # 标题作为目标
+        """
+        # 跳过纯注释行（但保留有内容的行）
+        if line == '#':
+            return
+        # 移除 markdown 标题符号
+        if line[0] == '#':
+            line = line.lstrip('#').strip()
+        goal_lines.append(line)
+
+    def _extract_param(self, line: str, param_name: str, required: bool = False, default: str = "",
+                       location: str = "") -> str:
         """提取参数值"""
         pattern = rf'{param_name}="([^"]*)"'
         match = re.search(pattern, line)
@@ -288,102 +1074,236 @@ class DAGParser:
         if match:
             return match.group(1)
         elif required:
-            raise ValueError(f"缺少必需参数: {param_name}")
+            prefix = f"{location}: " if location else ""
+            raise ValueError(f"{prefix}缺少必需参数: {param_name}")
         else:
             return default
 
     # Maximum recursion depth for file references
     _MAX_REF_DEPTH = 10
 
-    def _resolve_file_references(self, content: str) -> str:
+    def _add_ref_handle(self, stripped: str, base_dir: Path, stage: Optional[_StageBuilder],
+                        task: Optional[_TaskBuilder]):
         """
-        解析文件引用（@文件路径）
+        延迟引用模式：把 @文件引用 记录为句柄挂到当前节点（不读取、不 stat 文件）
 
-        将 @文件路径 替换为文件的实际内容。
-        防止循环引用：使用已访问文件集合 + 最大深度限制。
+        归属：TASK 正文 → TaskNode.refs；STAGE 描述 → StageNode.refs；文件头部 → global_refs
         """
-        return self._resolve_refs(content, self.base_dir, depth=0, visited=set())
+        handle = os.path.normpath(os.path.join(base_dir, stripped[1:].strip()))
+        if task is not None:
+            task.refs.append(handle)
+            task.has_content = True
+        elif stage is not None:
+            stage.refs.append(handle)
+        else:
+            self.global_refs.append(handle)
 
-    def _resolve_refs(self, content: str, base_dir: Path, depth: int, visited: set) -> str:
+    def _prefetch_refs(self, lines: List[str], base_dir: Path):
+        """把一个文件中的所有引用提交给 RefResolver 并行预读"""
+        paths = []
+        for line in lines:
+            target = ref_target(line)
+            if target:
+                paths.append((base_dir / target).resolve())
+        if len(paths) > 1:
+            self.resolver.prefetch(paths)
+
+    def _scan_ref(self, stripped: str, line: str, lineno: int, source_file: str, base_dir: Path,
+                  depth: int, ancestors: Set[str], state: '_ScanState'):
         """
-        递归解析文件引用（带循环保护）
+        展开单个文件引用（@文件路径，带循环保护）
 
-        Args:
-            content: 文件内容
-            base_dir: 基准目录
-            depth: 当前递归深度
-            visited: 已访问的文件绝对路径集合
+        将 @文件路径 行替换为文件的实际内容。
+        - 循环引用：只拦截引用链上已出现的文件（A → B → A）
+        - 菱形引用：同一文件被多处引用时每处都展开，内容由 RefResolver 缓存只读一次
+        - 最大深度限制
+        引用失败时插入警告注释并原样保留引用行。
         """
-        if depth > self._MAX_REF_DEPTH:
-            return f"# ⚠️ 文件引用超过最大深度 ({self._MAX_REF_DEPTH})，停止解析\n" + content
+        ref_path = stripped[1:].strip()
+        full_path = (base_dir / ref_path).resolve()
+        key = str(full_path)
 
-        lines = content.split('\n')
-        result_lines = []
+        # 循环引用检测
+        if key in ancestors:
+            self._scan([f"# ⚠️ 跳过循环引用: {ref_path}"], source_file, base_dir, depth, ancestors,
+                       state, resolve_refs=False, first_lineno=lineno)
+            return
 
-        for line in lines:
-            stripped = line.strip()
+        self._sources[key] = None
+        try:
+            # 引用文件整体读取：读取失败时原样保留引用行，不会只展开一半
+            ref_lines = self.resolver.read_lines(full_path)
+        except Exception as e:
+            reason = "文件不存在" if isinstance(e, FileNotFoundError) else f"错误: {e}"
+            self._scan([f"# ⚠️ 文件引用失败: {ref_path} ({reason})"], source_file, base_dir, depth,
+                       ancestors, state, resolve_refs=False, first_lineno=lineno)
+            self._scan([line], source_file, base_dir, depth, ancestors, state,
+                       resolve_refs=False, first_lineno=lineno)
+            return
+
+        ref_depth = depth + 1
+        ref_source = self._display_path(full_path)
+
+        if ref_depth > self._MAX_REF_DEPTH:
+            self._scan([f"# ⚠️ 文件引用超过最大深度 ({self._MAX_REF_DEPTH})，停止解析"], ref_source,
+                       full_path.parent, ref_depth, ancestors, state, resolve_refs=False, first_lineno=0)
+            self._scan(ref_lines, ref_source, full_path.parent, ref_depth, ancestors, state,
+                       resolve_refs=False)
+            return
+
+        ancestors.add(key)
+        try:
+            self._scan(ref_lines, ref_source, full_path.parent, ref_depth, ancestors, state)
+        finally:
+            ancestors.discard(key)
 
-            if stripped.startswith('@'):
-                ref_path = stripped[1:].strip()
-                full_path = (base_dir / ref_path).resolve()
+    def _display_path(self, path: Path) -> str:
+        """引用文件的展示路径（优先相对基准目录）"""
+        try:
+            return str(path.relative_to(self.base_dir))
+        except ValueError:
+            return str(path)
 
-                # 循环引用检测
-                if str(full_path) in visited:
-                    result_lines.append(f"# ⚠️ 跳过循环引用: {ref_path}")
-                    continue
 
-                try:
-                    with open(full_path, 'r', encoding='utf-8') as f:
-                        ref_content = f.read()
-                    visited.add(str(full_path))
-                    ref_content = self._resolve_refs(ref_content, full_path.parent, depth + 1, visited)
-                    result_lines.append(ref_content)
-                except FileNotFoundError:
-                    result_lines.append(f"# ⚠️ 文件引用失败: {ref_path} (文件不存在)")
-                    result_lines.append(line)
-                except Exception as e:
-                    result_lines.append(f"# ⚠️ 文件引用失败: {ref_path} (错误: {e})")
-                    result_lines.append(line)
-            else:
-                result_lines.append(line)
+class _PathTrieNode:
+    """路径前缀树节点（按 / 分隔的目录分量）"""
+    __slots__ = ('children', 'entries', 'wild')
 
-        return '\n'.join(result_lines)
+    def __init__(self):
+        self.children: Dict[str, '_PathTrieNode'] = {}
+        self.entries: List[int] = []  # 以该目录为前缀的模式所属任务下标（含通配符和精确路径）
+        self.wild: List[int] = []  # 其中带通配符的模式所属任务下标
 
 
 class ConflictDetector:
     """文件冲突检测器"""
 
     @staticmethod
-    def detect_conflicts(tasks: List[TaskNode]) -> Dict[int, List[int]]:
+    def detect_conflicts(tasks: List[TaskNode], file_index: 'FileIndex' = None,
+                         write_sets: 'WriteSetHistory' = None) -> Dict[int, List[int]]:
         """
         检测任务间的文件冲突
 
+        结果与逐对调用 _has_conflict 完全一致，但不做 O(n²) 的任务两两比较：
+        每个有效模式按目录前缀（通配符之前的部分）插入路径前缀树一次，
+        冲突只可能发生在同一节点或祖先/后代节点之间（且至少一方带通配符），
+        以及字面完全相同的精确路径之间。每个模式只需沿祖先链向上查找，
+        耗时与模式数 × 路径深度 + 冲突对数成正比。
+
         Args:
             tasks: 任务列表
+            file_index: 仓库文件索引（精确模式：glob 展开为文件位集，相交才算冲突，见 file_index.py）
+            write_sets: 任务写集合历史（有记录的任务按实际修改过的文件检测，见 write_sets.py）
 
         Returns:
             冲突映射 {task_id: [冲突的task_id列表]}
         """
-        conflicts = {}
+        tasks = list(tasks)  # TaskList 的矩阵子任务只展开一次
+        if write_sets is not None:
+            tasks = [write_sets.effective(task) for task in tasks]
+        if file_index is not None:
+            return ConflictDetector._detect_precise(tasks, file_index)
+        root = _PathTrieNode()
+        placed: List[Tuple[int, bool, List[_PathTrieNode]]] = []  # (任务下标, 是否通配, 根到节点的路径)
+        exact: Dict[str, List[int]] = {}  # 精确路径（无通配符）→ 任务下标
+
+        for index, task in enumerate(tasks):
+            for pattern in ConflictDetector._get_effective_files(task):
+                path = pattern.rstrip('/')
+                wild = '*' in path
+                if not wild:
+                    exact.setdefault(pattern, []).append(index)
+                node = root
+                chain = []
+                for part in path.split('*')[0].rstrip('/').split('/'):
+                    node = node.children.setdefault(part, _PathTrieNode())
+                    chain.append(node)
+                node.entries.append(index)
+                if wild:
+                    node.wild.append(index)
+                placed.append((index, wild, chain))
+
+        related: Dict[int, Set[int]] = {}
+
+        def link(a: int, b: int):
+            if a != b:
+                related.setdefault(min(a, b), set()).add(max(a, b))
+
+        # 同节点或祖先节点：通配模式与其上任意模式冲突，精确路径只与其上的通配模式冲突
+        for index, wild, chain in placed:
+            for node in chain:
+                for other in (node.entries if wild else node.wild):
+                    link(index, other)
+        # 字面完全相同的精确路径
+        for indexes in exact.values():
+            for i, a in enumerate(indexes):
+                for b in indexes[i + 1:]:
+                    link(a, b)
+
+        return {tasks[i].task_id: [tasks[j].task_id for j in sorted(related[i])] for i in sorted(related)}
 
-        for i, task_a in enumerate(tasks):
-            conflicting_tasks = []
+    @staticmethod
+    def _detect_precise(tasks: List[TaskNode], file_index: 'FileIndex') -> Dict[int, List[int]]:
+        """
+        精确模式：位集相交即冲突
 
-            for j, task_b in enumerate(tasks):
-                if i >= j:  # 避免重复检测
+        先用两次 OR 扫描求出被两个以上任务触及的文件（共享位集），只对含共享文件的任务
+        枚举其共享位、按文件归组，不做任务两两比较；无法展开的模式按启发式规则补充比较。
+        """
+        task_bits = [file_index.task_bits(task.files, task.excludes) for task in tasks]
+        seen = shared = 0
+        for bits, _ in task_bits:
+            shared |= bits & seen
+            seen |= bits
+
+        owners: Dict[int, List[int]] = {}  # 共享文件位号 → 触及该文件的任务下标
+        if shared:
+            for index, (bits, _) in enumerate(task_bits):
+                common = bits & shared
+                if not common:
                     continue
+                digits = bin(common)
+                top = len(digits) - 1
+                position = digits.find('1', 2)
+                while position != -1:
+                    owners.setdefault(top - position, []).append(index)
+                    position = digits.find('1', position + 1)
+
+        related: Dict[int, Set[int]] = {}
+        for group in set(tuple(indexes) for indexes in owners.values()):
+            for i, a in enumerate(group):
+                related.setdefault(a, set()).update(group[i + 1:])
+
+        # 无法展开的模式（新建文件等）：与其他任务的所有有效模式按启发式规则比较
+        for index, (_, unresolved) in enumerate(task_bits):
+            if not unresolved:
+                continue
+            for other, task in enumerate(tasks):
+                if other == index:
+                    continue
+                patterns = ConflictDetector._get_effective_files(task)
+                if any(ConflictDetector._patterns_overlap(pattern, other_pattern)
+                       for pattern in unresolved for other_pattern in patterns):
+                    related.setdefault(min(index, other), set()).add(max(index, other))
 
-                if ConflictDetector._has_conflict(task_a, task_b):
-                    conflicting_tasks.append(task_b.task_id)
-
-            if conflicting_tasks:
-                conflicts[task_a.task_id] = conflicting_tasks
-
-        return conflicts
+        return {tasks[i].task_id: [tasks[j].task_id for j in sorted(related[i])]
+                for i in sorted(related) if related[i]}
 
     @staticmethod
-    def _has_conflict(task_a: TaskNode, task_b: TaskNode) -> bool:
-        """检查两个任务是否有文件冲突"""
+    def _has_conflict(task_a: TaskNode, task_b: TaskNode, file_index: 'FileIndex' = None,
+                      write_sets: 'WriteSetHistory' = None) -> bool:
+        """检查两个任务是否有文件冲突（提供 file_index 时按精确模式，提供 write_sets 时按学到的写集合）"""
+        if write_sets is not None:
+            task_a, task_b = write_sets.effective(task_a), write_sets.effective(task_b)
+        if file_index is not None:
+            bits_a, unresolved_a = file_index.task_bits(task_a.files, task_a.excludes)
+            bits_b, unresolved_b = file_index.task_bits(task_b.files, task_b.excludes)
+            if bits_a & bits_b:
+                return True
+            return any(ConflictDetector._patterns_overlap(pattern, other)
+                       for unresolved, task in ((unresolved_a, task_b), (unresolved_b, task_a))
+                       for pattern in unresolved for other in ConflictDetector._get_effective_files(task))
+
         # 获取有效文件范围（排除 excludes）
         files_a = ConflictDetector._get_effective_files(task_a)
         files_b = ConflictDetector._get_effective_files(task_b)
@@ -467,13 +1387,22 @@ class ConflictDetector:
         return False
 
     @staticmethod
-    def create_batches(tasks: List[TaskNode], conflicts: Dict[int, List[int]]) -> List[List[TaskNode]]:
+    def create_batches(tasks: List[TaskNode], conflicts: Dict[int, List[int]],
+                       weights: Optional[Dict[int, float]] = None) -> List[List[TaskNode]]:
         """
         根据冲突关系创建并行批次
 
         无冲突的任务可以在同一批次并行执行
         有冲突的任务必须在不同批次
 
+        按冲突图着色求最少批次（DSatur，小分量精确求解），再按权重均衡各批次，
+        结果与哈希顺序无关（见 conflict_coloring.py）
+
+        Args:
+            tasks: 任务列表
+            conflicts: 冲突映射
+            weights: 任务权重 {task_id: 权重}（如预估耗时），缺省时按任务数均衡
+
         Returns:
             批次列表，每个批次是一组可并行的任务
         """
@@ -482,46 +1411,12 @@ class ConflictDetector:
 
         # 如果没有冲突，所有任务可以并行
         if not conflicts:
-            return [tasks]
+            return [list(tasks)]
 
-        batches = []
-        remaining_tasks = set(task.task_id for task in tasks)
+        tasks = list(tasks)
         task_map = {task.task_id: task for task in tasks}
-
-        while remaining_tasks:
-            # 当前批次：选择没有冲突的任务
-            current_batch = []
-            current_batch_ids = set()
-
-            for task_id in list(remaining_tasks):
-                # 检查是否与当前批次中的任务冲突
-                has_conflict = False
-
-                if task_id in conflicts:
-                    for conflict_id in conflicts[task_id]:
-                        if conflict_id in current_batch_ids:
-                            has_conflict = True
-                            break
-
-                # 反向检查
-                for batch_task_id in current_batch_ids:
-                    if batch_task_id in conflicts and task_id in conflicts[batch_task_id]:
-                        has_conflict = True
-                        break
-
-                if not has_conflict:
-                    current_batch.append(task_map[task_id])
-                    current_batch_ids.add(task_id)
-                    remaining_tasks.remove(task_id)
-
-            if current_batch:
-                batches.append(current_batch)
-            else:
-                # 防止死循环：强制添加一个任务
-                task_id = remaining_tasks.pop()
-                batches.append([task_map[task_id]])
-
-        return batches
+        return [[task_map[task_id] for task_id in batch]
+                for batch in color_batches([task.task_id for task in tasks], conflicts, weights)]
 
 
 if __name__ == "__main__":
@@ -542,9 +1437,9 @@ if __name__ == "__main__":
         print()
 
         for stage in stages:
-            print(f"📋 {stage}")
+            print(f"📋 {stage}  [{stage.location}]")
             for task in stage.tasks:
-                print(f"   - {task}")
+                print(f"   - {task}  [{task.location}]")
                 if task.files:
                     print(f"     文件: {', '.join(task.files)}")
                 if task.excludes:
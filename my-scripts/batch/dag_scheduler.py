@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+任务级 DAG 调度器 - 就绪队列
+任务的前置条件全部完成即启动，不再等待整个阶段屏障
+
+- 前置条件：显式 depends_on + 隐式阶段顺序（见 dag_parser.task_predecessors）
+- 并发限制：每个阶段同时运行的任务数不超过该阶段 max_workers（串行阶段为 1），
+  全局同时运行的任务数不超过 max_total_workers；
+  传入 concurrency（AdaptiveConcurrency）时两者再受其自适应上限约束，启动前按其令牌桶等待
+- 文件冲突：与运行中任务存在文件冲突（ConflictDetector 规则，可选精确模式）的任务延后启动
+  （或按预先计算的冲突映射加锁：PathLocks，用于并行阶段的无屏障执行）
+- 失败即停止：任一任务失败后不再启动新任务，等待运行中的任务结束；
+  keep_going 时继续执行不依赖失败任务的任务，下游任务（直接或间接依赖失败任务）结束时报告为跳过
+- 瞬时失败重试：传入 retry（RetryPolicy）时，限流/网络/服务端错误/超时失败的任务不算失败，
+  释放并发槽位和文件锁，退避到期后重新排队（不再次回调 on_start），重试用完才按失败处理
+- 启动顺序：就绪队列按 (排序键, stage_id, task_id) 取任务；传入 priority（TaskPriority）时
+  排序键为 priority= 覆盖和预计剩余关键路径（见 task_priority.py），否则按任务顺序
+- 回调（on_start / on_finish）都在调用方线程执行，状态持久化和输出无需加锁
+"""
+
+import heapq
+import time
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from dag_parser import StageNode, TaskNode, ConflictDetector, task_predecessors
+
+if TYPE_CHECKING:
+    from adaptive_concurrency import AdaptiveConcurrency
+    from file_index import FileIndex
+    from task_priority import TaskPriority
+    from task_retry import RetryPolicy
+    from write_sets import WriteSetHistory
+
+TaskKey = Tuple[int, int]  # (stage_id, task_id)
+# 就绪队列的默认排序键（未传入 priority 或任务没有排序键时）
+_DEFAULT_ORDER = (0, 0.0)
+
+
+class DAGScheduler:
+    """任务级 DAG 调度器"""
+
+    def __init__(self, stages: List[StageNode], max_total_workers: int = None, file_index: 'FileIndex' = None,
+                 locks: 'PathLocks' = None, write_sets: 'WriteSetHistory' = None,
+                 concurrency: 'AdaptiveConcurrency' = None, keep_going: bool = False,
+                 retry: 'RetryPolicy' = None, priority: 'TaskPriority' = None):
+        """
+        Args:
+            stages: 阶段列表（depends_on 已解析，且已通过循环检测）；可以只是部分阶段，
+                    不在其中的阶段视为已整体完成
+            max_total_workers: 全局最大并发（默认取各阶段并发上限的最大值，
+                               即不超过按阶段屏障执行时的峰值并发）
+            file_index: 仓库文件索引（精确冲突检测，见 file_index.py）
+            write_sets: 任务写集合历史（按学到的写集合检测冲突，见 write_sets.py）
+            locks: 文件范围锁表（按预先计算的冲突映射加锁，代替与运行中任务逐个比较文件范围；
+                   只覆盖表中的冲突，适用于阶段不重叠执行的场景）
+            concurrency: 自适应并发控制器（整个运行共享，见 adaptive_concurrency.py）；
+                         全局和各阶段的并发上限都不超过它的当前上限，任务结果交给它调整上限
+            keep_going: 任务失败后继续执行不受影响的任务（只跳过其下游），而不是停止启动新任务
+            retry: 瞬时失败重试策略（见 task_retry.py；None 时不重试）
+            priority: 就绪任务的启动顺序（priority= 覆盖 + 关键路径优先，见 task_priority.py；None 时按任务顺序）
+        """
+        self.stages = stages
+        self.file_index = file_index
+        self.locks = locks
+        self.write_sets = write_sets
+        self.concurrency = concurrency
+        self.keep_going = keep_going
+        self.retry = retry
+        self.priority = priority
+        self.order: Dict[TaskKey, Tuple[int, float]] = {}  # 就绪队列排序键（依赖图建立时计算）
+        self.attempts: Dict[TaskKey, int] = {}  # 已失败（并重试）的次数
+        self.launched_at: Dict[TaskKey, float] = {}  # 任务启动时间（结果不带耗时时交给 concurrency）
+        self.stage_caps: Dict[int, int] = {}
+        self.max_total_workers = max_total_workers or max(
+            (max(1, stage.max_workers) if stage.mode == 'parallel' else 1 for stage in stages), default=1)
+
+        self.tasks: Dict[TaskKey, TaskNode] = {}
+        self.waiting: Dict[TaskKey, int] = {}  # 未满足的前置条件数
+        self.dependents: Dict[TaskKey, List[TaskKey]] = {}  # 任务完成后需通知的任务
+        self.stage_waiters: Dict[int, List[TaskKey]] = {}  # 阶段整体完成后需通知的任务
+        # 阶段整体完成前还需满足的条件数：未完成任务数 + 1（上一阶段尚未整体完成时）
+        self.stage_remaining: Dict[int, int] = {}
+        self.finished_stages: Set[int] = set()  # 已整体完成的阶段
+        self.done: Set[TaskKey] = set()
+
+    def _build_graph(self):
+        """按当前 stages 和已完成任务（self.done）建立依赖计数（首次运行和计划热更新时调用）"""
+        self.stage_caps = {
+            stage.stage_id: max(1, stage.max_workers) if stage.mode == 'parallel' else 1
+            for stage in self.stages
+        }
+        self.tasks, self.waiting, self.dependents, self.stage_waiters = {}, {}, {}, {}
+        self.stage_remaining, self.finished_stages = {}, set()
+        self.order = self.priority.order(self.stages) if self.priority else {}
+
+        previous_finished = True
+        for stage in self.stages:
+            pending = 0
+            for task in stage.tasks:
+                key = (stage.stage_id, task.task_id)
+                self.tasks[key] = task
+                if key not in self.done:
+                    pending += 1
+            self.stage_remaining[stage.stage_id] = pending + (0 if previous_finished else 1)
+            previous_finished = previous_finished and pending == 0
+            if previous_finished:
+                self.finished_stages.add(stage.stage_id)
+
+        for stage in self.stages:
+            for index, task in enumerate(stage.tasks):
+                key = (stage.stage_id, task.task_id)
+                if key in self.done:
+                    continue
+                predecessors, wait_stage = task_predecessors(stage, index)
+                waiting = 0
+                for pred in predecessors:
+                    if pred not in self.done:
+                        self.dependents.setdefault(pred, []).append(key)
+                        waiting += 1
+                if (wait_stage is not None and wait_stage in self.stage_remaining
+                        and wait_stage not in self.finished_stages):
+                    self.stage_waiters.setdefault(wait_stage, []).append(key)
+                    waiting += 1
+                self.waiting[key] = waiting
+
+    def _entry(self, key: TaskKey) -> Tuple[Tuple[int, float], TaskKey]:
+        """就绪队列（堆）中的条目：(排序键, key)"""
+        return self.order.get(key, _DEFAULT_ORDER), key
+
+    def _ready_keys(self, exclude: Iterable[TaskKey] = ()) -> List[Tuple[Tuple[int, float], TaskKey]]:
+        exclude = set(exclude)
+        ready = [self._entry(key) for key, count in self.waiting.items() if count == 0 and key not in exclude]
+        heapq.heapify(ready)
+        return ready
+
+    def run(self, runner: Callable[[TaskNode], Any], completed: Iterable[TaskKey] = (),
+            on_start: Callable[[TaskNode], None] = None,
+            on_finish: Callable[[TaskNode, bool, Any], None] = None,
+            on_tick: Callable[[], bool] = None, tick_interval: float = 2.0,
+            on_skip: Callable[[TaskNode, TaskNode], None] = None,
+            on_retry: Callable[[TaskNode, int, str, float, Any], None] = None) -> bool:
+        """
+        执行全部任务
+
+        Args:
+            runner: 执行单个任务，返回 bool 或带 success 属性的结果（如 TaskResult）；
+                    max_total_workers > 1 时在线程池中调用，必须线程安全
+            completed: 已完成的任务（断点续传），视为前置条件已满足
+            on_start: 任务启动前回调
+            on_finish: 任务结束回调 (task, success, result)；runner 抛异常时 result 为异常对象
+            on_tick: 每轮调度前（及等待满 tick_interval 秒时）回调；返回 True 表示 stages 已被修改
+                     （新增任务/阶段、未开始任务被编辑），调度器据此重建依赖图
+            on_skip: keep_going 时在结束前对每个被阻塞的任务回调 (task, 阻塞它的失败任务)
+            on_retry: 瞬时失败、即将退避重试时回调 (task, 第几次执行失败, 原因, 退避秒数, result)，
+                      代替 on_finish（任务仍在执行中）
+
+        Returns:
+            是否全部成功
+        """
+        self.done = set(completed)
+        self._build_graph()
+        ready = self._ready_keys()
+
+        running: Dict[Future, TaskKey] = {}
+        stage_running: Dict[int, int] = {stage_id: 0 for stage_id in self.stage_caps}
+        # 并发为 1 时直接在调用方线程执行（runner 无需线程安全，行为与串行执行一致）
+        pool = ThreadPoolExecutor(max_workers=self.max_total_workers, thread_name_prefix='dag-task') \
+            if self.max_total_workers > 1 else None
+        failed: Set[TaskKey] = set()
+        # 退避中的任务：(重新就绪的时间, key)，不占用并发槽位；retrying 保存其最近一次的失败结果
+        backoff: List[Tuple[float, TaskKey]] = []
+        retrying: Dict[TaskKey, Any] = {}
+        self.attempts = {}
+
+        try:
+            while True:
+                halted = bool(failed) and not self.keep_going
+                if on_tick and not halted and on_tick():
+                    # 计划热更新：按合并后的 stages 重建依赖图，运行中和退避中的任务不受影响
+                    self._build_graph()
+                    ready = self._ready_keys(exclude=list(running.values()) + list(retrying))
+                    for stage_id in self.stage_caps:
+                        stage_running.setdefault(stage_id, 0)
+                if halted and backoff:
+                    # 失败即停止：不再重试，退避中的任务按最近一次失败结束
+                    for _, key in sorted(backoff):
+                        failed.add(key)
+                        if on_finish:
+                            on_finish(self.tasks[key], False, retrying.pop(key))
+                    backoff.clear()
+                while backoff and backoff[0][0] <= time.monotonic():
+                    key = heapq.heappop(backoff)[1]
+                    retrying.pop(key)
+                    heapq.heappush(ready, self._entry(key))
+                if not halted:
+                    self._launch(ready, running, stage_running, runner, pool, on_start)
+                if not running and not backoff:
+                    break
+
+                timeout = tick_interval if on_tick else None
+                if backoff:
+                    due = max(0.0, backoff[0][0] - time.monotonic())
+                    timeout = due if timeout is None else min(timeout, due)
+                if not running:
+                    time.sleep(timeout)
+                    continue
+                finished, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    key = running.pop(future)
+                    stage_running[key[0]] -= 1
+                    if self.locks:
+                        self.locks.release(key)
+                    try:
+                        result = future.result()
+                        success = result if isinstance(result, bool) else bool(getattr(result, 'success', False))
+                    except Exception as e:
+                        result, success = e, False
+
+                    if self.concurrency:
+                        self.concurrency.record_result(result, time.monotonic() - self.launched_at.pop(key))
+                    if not success and self.retry:
+                        attempt = self.attempts.get(key, 0) + 1
+                        decision = self.retry.next_retry(attempt, result, self.tasks[key])
+                        if decision:
+                            reason, delay = decision
+                            self.attempts[key] = attempt
+                            retrying[key] = result
+                            heapq.heappush(backoff, (time.monotonic() + delay, key))
+                            if on_retry:
+                                on_retry(self.tasks[key], attempt, reason, delay, result)
+                            continue
+                    if on_finish:
+                        on_finish(self.tasks[key], success, result)
+                    if success:
+                        self._complete(key, ready)
+                    else:
+                        failed.add(key)
+        except KeyboardInterrupt:
+            if pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = None
+            raise
+        finally:
+            if pool:
+                pool.shutdown(wait=True)
+
+        if failed:
+            if self.keep_going and on_skip:
+                for key, blocker in self._blockers(failed).items():
+                    on_skip(self.tasks[key], self.tasks[blocker])
+            return False
+        if len(self.done) < len(self.tasks):
+            # 循环依赖已在解析时拦截，正常不会发生
+            print(f"⚠️  调度停滞：{len(self.tasks) - len(self.done)} 个任务的前置条件无法满足")
+            return False
+        return True
+
+    def _launch(self, ready: List[tuple], running: Dict[Future, TaskKey], stage_running: Dict[int, int],
+                runner: Callable, pool: Optional[ThreadPoolExecutor], on_start: Optional[Callable]):
+        """按就绪队列顺序（排序键，其次 (stage_id, task_id)）启动就绪任务，直到并发用满"""
+        deferred = []
+        while ready and len(running) < self._cap(self.max_total_workers):
+            key = heapq.heappop(ready)[1]
+            task = self.tasks[key]
+            if stage_running[key[0]] >= self._cap(self.stage_caps[key[0]]) or \
+                    self._conflicts_with_running(key, running):
+                deferred.append(key)
+                continue
+
+            if on_start and key not in self.attempts:
+                on_start(task)  # 重试不再回调：任务仍在执行中
+            if self.locks:
+                self.locks.acquire(key)
+            stage_running[key[0]] += 1
+            delay = 0
+            if self.concurrency:
+                delay = self.concurrency.on_launch()
+                self.launched_at[key] = time.monotonic()
+            running[self._submit(pool, self._delayed(runner, delay) if delay > 0 else runner, task)] = key
+        for key in deferred:
+            heapq.heappush(ready, self._entry(key))
+
+    def _blockers(self, failed: Set[TaskKey]) -> Dict[TaskKey, TaskKey]:
+        """
+        未完成任务 → 阻塞它的失败任务（沿前置条件向上查找，按 (stage_id, task_id) 顺序取第一个）
+
+        Args:
+            failed: 失败的任务
+
+        Returns:
+            {被阻塞的任务: 失败任务}；前置条件都已完成的任务不在其中
+        """
+        stages = {stage.stage_id: stage for stage in self.stages}
+        positions = {(stage.stage_id, task.task_id): index
+                     for stage in self.stages for index, task in enumerate(stage.tasks)}
+        blockers: Dict[TaskKey, Optional[TaskKey]] = {key: key for key in failed}
+        stage_blockers: Dict[int, Optional[TaskKey]] = {}  # 阶段整体未完成的原因（含之前的阶段）
+
+        def stage_blocker(stage_id: int) -> Optional[TaskKey]:
+            if stage_id not in stage_blockers:
+                stage_blockers[stage_id] = None  # 递归保护
+                earlier = stage_blocker(stage_id - 1) if stage_id - 1 in stages else None
+                stage = stages[stage_id]
+                stage_blockers[stage_id] = earlier or next(
+                    (found for task in stage.tasks for found in [blocker((stage_id, task.task_id))] if found), None)
+            return stage_blockers[stage_id]
+
+        def blocker(key: TaskKey) -> Optional[TaskKey]:
+            if key in self.done or key not in self.tasks:
+                return None
+            if key not in blockers:
+                blockers[key] = None  # 递归保护
+                predecessors, wait_stage = task_predecessors(stages[key[0]], positions[key])
+                found = next((found for pred in sorted(predecessors) for found in [blocker(pred)] if found), None)
+                if found is None and wait_stage is not None and wait_stage in stages:
+                    found = stage_blocker(wait_stage)
+                blockers[key] = found
+            return blockers[key]
+
+        pending = [key for key in sorted(self.tasks) if key not in self.done and key not in failed]
+        return {key: blocker(key) for key in pending if blocker(key)}
+
+    def _cap(self, limit: int) -> int:
+        """并发上限（受自适应并发控制器的当前上限约束）"""
+        return self.concurrency.limit(limit) if self.concurrency else limit
+
+    @staticmethod
+    def _delayed(runner: Callable, delay: float) -> Callable:
+        """启动限速：在工作线程中等待 delay 秒后再执行（不阻塞调度）"""
+        def run(task: TaskNode):
+            time.sleep(delay)
+            return runner(task)
+        return run
+
+    def _conflicts_with_running(self, key: TaskKey, running: Dict[Future, TaskKey]) -> bool:
+        """是否与运行中的任务存在文件冲突"""
+        if self.locks:
+            return not self.locks.available(key)
+        task = self.tasks[key]
+        scope = self.write_sets.effective(task) if self.write_sets is not None else task
+        if not scope.files:
+            return False
+        return any(ConflictDetector._has_conflict(task, self.tasks[key], self.file_index, self.write_sets)
+                   for key in running.values())
+
+    @staticmethod
+    def _submit(pool: Optional[ThreadPoolExecutor], runner: Callable, task: TaskNode) -> Future:
+        if pool:
+            return pool.submit(runner, task)
+        future = Future()
+        try:
+            future.set_result(runner(task))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _complete(self, key: TaskKey, ready: List[tuple]):
+        """标记任务完成，释放依赖它的任务"""
+        if key in self.done:
+            return
+        self.done.add(key)
+        for dependent in self.dependents.get(key, ()):
+            self._release(dependent, ready)
+
+        self._advance_stage(key[0], ready)
+
+    def _advance_stage(self, stage_id: int, ready: List[tuple]):
+        """
+        阶段的一个完成条件满足（阶段内任务完成，或上一阶段整体完成）
+
+        阶段整体完成 = 阶段内任务全部完成 且 之前所有阶段整体完成（空阶段也能正确传递），
+        随后释放等待该阶段的任务，并推进下一阶段
+        """
+        self.stage_remaining[stage_id] -= 1
+        while self.stage_remaining.get(stage_id) == 0 and stage_id not in self.finished_stages:
+            self.finished_stages.add(stage_id)
+            for dependent in self.stage_waiters.get(stage_id, ()):
+                self._release(dependent, ready)
+            stage_id += 1
+            if stage_id not in self.stage_remaining:
+                break
+            self.stage_remaining[stage_id] -= 1
+
+    def _release(self, key: TaskKey, ready: List[tuple]):
+        self.waiting[key] -= 1
+        if self.waiting[key] == 0 and key not in self.done:
+            heapq.heappush(ready, self._entry(key))
+
+
+class PathLocks:
+    """
+    文件范围锁表
+
+    运行中的任务持有自己的文件范围，与之冲突（按阶段冲突映射）的任务在其释放前不能启动。
+    每个任务记录被多少个运行中的冲突任务阻塞，加锁/释放为 O(冲突数)，判断为 O(1)。
+    """
+
+    def __init__(self, conflicts: Dict[int, Dict[int, List[int]]]):
+        """
+        Args:
+            conflicts: {stage_id: 冲突映射 {task_id: [冲突的task_id列表]}}
+        """
+        self.held: Set[TaskKey] = set()
+        self.neighbors: Dict[TaskKey, List[TaskKey]] = {}
+        self.blocked: Dict[TaskKey, int] = {}
+        self.load(conflicts)
+
+    def load(self, conflicts: Dict[int, Dict[int, List[int]]]):
+        """（重新）加载冲突映射，已持有的锁保留（计划热更新时调用）"""
+        neighbors: Dict[TaskKey, Set[TaskKey]] = {}
+        for stage_id, mapping in conflicts.items():
+            for task_id, others in mapping.items():
+                for other in others:
+                    a, b = (stage_id, task_id), (stage_id, other)
+                    if a != b:
+                        neighbors.setdefault(a, set()).add(b)
+                        neighbors.setdefault(b, set()).add(a)
+        self.neighbors = {key: sorted(keys) for key, keys in neighbors.items()}
+        self.blocked = {}
+        for key in self.held:
+            self._block(key, 1)
+
+    def available(self, key: TaskKey) -> bool:
+        """没有运行中的任务持有冲突的文件范围"""
+        return not self.blocked.get(key)
+
+    def acquire(self, key: TaskKey):
+        self.held.add(key)
+        self._block(key, 1)
+
+    def release(self, key: TaskKey):
+        if key in self.held:
+            self.held.discard(key)
+            self._block(key, -1)
+
+    def _block(self, key: TaskKey, delta: int):
+        for other in self.neighbors.get(key, ()):
+            self.blocked[other] = self.blocked.get(other, 0) + delta
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+仓库文件索引 - 精确冲突检测（--precise-conflicts）
+
+默认的冲突检测（ConflictDetector._patterns_overlap）只比较第一个 * 之前的目录前缀，
+src/**/*.ts 和 src/**/*.py 会被判为冲突而串行执行。精确模式把 文件:/排除: 的 glob
+展开到仓库的真实文件列表上，用位集表示每个任务触及的文件，位集相交才算冲突。
+
+- 文件列表：git ls-files（已跟踪 + 未忽略的未跟踪文件），相对当前工作目录；
+  按 HEAD + .git/index 的 mtime 缓存在 .git/batch-file-index.json，HEAD 和暂存区不变时不再调用 ls-files；
+  不在 git 仓库中时遍历当前目录（跳过隐藏目录）
+- 位集：文件按路径排序后的下标即位号，每个 glob 只在其字面目录前缀对应的连续区间内匹配，结果按模式缓存
+- 索引中还不存在的路径（任务要新建的文件、匹配不到任何文件的 glob）无法展开，
+  这些模式仍按默认启发式规则与其他任务的模式比较，保证不会漏报
+"""
+
+import json
+import os
+import re
+import shutil
+import subprocess
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+# 缓存格式版本（结构变化时递增）
+FILE_INDEX_VERSION = 1
+CACHE_FILE_NAME = 'batch-file-index.json'
+_WILDCARD_RE = re.compile(r'[*?\[]')
+
+
+class FileIndex:
+    """仓库文件索引（一次运行构建一次）"""
+
+    def __init__(self, root: str = None):
+        """
+        Args:
+            root: 文件范围的基准目录（默认当前工作目录）
+        """
+        self.root = os.path.abspath(root or os.getcwd())
+        self._git_dir, head = self._git_info()
+        index_mtime = 0
+        if self._git_dir:
+            try:
+                index_mtime = os.stat(os.path.join(self._git_dir, 'index')).st_mtime_ns
+            except OSError:
+                pass
+        # 索引内容的标识（git 仓库外为空：每次运行重新遍历，不参与执行计划缓存）
+        self.signature = f"{head}:{index_mtime}" if self._git_dir else ""
+        self._files: Optional[List[str]] = None
+        self._pattern_bits: Dict[str, Tuple[int, bool]] = {}  # glob → (位集, 是否展开到了文件)
+
+    @property
+    def files(self) -> List[str]:
+        """排序后的文件列表（首次访问时加载）"""
+        if self._files is None:
+            self._files = self._load()
+        return self._files
+
+    def pattern_bits(self, pattern: str) -> Tuple[int, bool]:
+        """
+        展开单个 glob
+
+        规则：无通配符的路径匹配该文件或该目录下的所有文件；通配符中 ** 跨目录，* / ? 不跨目录；
+        匹配到目录时包含目录下的所有文件。
+
+        Returns:
+            (位集, 是否匹配到文件)；未匹配到任何文件时位集为 0
+        """
+        cached = self._pattern_bits.get(pattern)
+        if cached is not None:
+            return cached
+
+        files = self.files
+        path = pattern.strip()
+        if path.startswith('./'):
+            path = path[2:]
+        path = path.rstrip('/')
+        wildcard = _WILDCARD_RE.search(path)
+        if wildcard:
+            # 只在字面目录前缀（含末尾 /）对应的连续区间内匹配；'0' 是 '/' 的下一个字符
+            prefix = path[:path.rfind('/', 0, wildcard.start()) + 1]
+            start = bisect_left(files, prefix) if prefix else 0
+            end = bisect_left(files, prefix[:-1] + '0') if prefix else len(files)
+            regex = re.compile(_glob_to_regex(path))
+            matched = [i - start for i in range(start, end) if regex.match(files[i])]
+        else:
+            # 文件本身 + 目录下的所有文件（[path/, path0) 区间）
+            start = bisect_left(files, path)
+            matched = [0] if start < len(files) and files[start] == path else []
+            child_start, child_end = bisect_left(files, path + '/'), bisect_left(files, path + '0')
+            matched.extend(range(child_start - start, child_end - start))
+
+        bits = 0
+        if matched:
+            mask = bytearray((matched[-1] >> 3) + 1)
+            for offset in matched:
+                mask[offset >> 3] |= 1 << (offset & 7)
+            bits = int.from_bytes(mask, 'little') << start
+        result = (bits, bool(matched))
+        self._pattern_bits[pattern] = result
+        return result
+
+    def task_bits(self, files: List[str], excludes: List[str]) -> Tuple[int, List[str]]:
+        """
+        任务触及的文件位集
+
+        Returns:
+            (文件: 展开后减去 排除: 展开结果的位集, 无法展开的模式列表)
+        """
+        bits = 0
+        unresolved = []
+        for pattern in files:
+            pattern_bits, resolved = self.pattern_bits(pattern)
+            if resolved:
+                bits |= pattern_bits
+            else:
+                unresolved.append(pattern)
+        for pattern in excludes:
+            bits &= ~self.pattern_bits(pattern)[0]
+        return bits, unresolved
+
+    def _git_info(self) -> Tuple[str, str]:
+        """(git 目录绝对路径, HEAD)；不在 git 仓库中时 git 目录为空"""
+        git_dir = _git(self.root, 'rev-parse', '--absolute-git-dir')
+        if not git_dir:
+            return "", ""
+        return git_dir.strip(), (_git(self.root, 'rev-parse', '-q', '--verify', 'HEAD') or "").strip()
+
+    def _load(self) -> List[str]:
+        if not self._git_dir:
+            return self._walk()
+
+        cache_file = os.path.join(self._git_dir, CACHE_FILE_NAME)
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if (data.get('version') == FILE_INDEX_VERSION and data.get('root') == self.root
+                    and data.get('signature') == self.signature):
+                return data['files']
+        except (OSError, ValueError, KeyError):
+            pass
+
+        output = _git(self.root, 'ls-files', '-z', '--cached', '--others', '--exclude-standard')
+        if output is None:
+            return self._walk()
+        files = sorted(set(path for path in output.split('\0') if path))
+
+        temp_file = cache_file + ".tmp"
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump({'version': FILE_INDEX_VERSION, 'root': self.root, 'signature': self.signature,
+                           'files': files}, f, ensure_ascii=False, separators=(',', ':'))
+            shutil.move(temp_file, cache_file)
+        except OSError as e:
+            print(f"⚠️  保存文件索引缓存失败: {e}")
+        return files
+
+    def _walk(self) -> List[str]:
+        """不在 git 仓库中：遍历基准目录（跳过隐藏目录，如 .git / .task-xxx）"""
+        files = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            rel_dir = os.path.relpath(dirpath, self.root)
+            for name in filenames:
+                files.append(name if rel_dir == '.' else f"{rel_dir}/{name}".replace(os.sep, '/'))
+        files.sort()
+        return files
+
+
+def pattern_matches(pattern: str, path: str) -> bool:
+    """单个文件是否在 glob 范围内（规则与 FileIndex.pattern_bits 相同）"""
+    pattern = pattern.strip()
+    if pattern.startswith('./'):
+        pattern = pattern[2:]
+    pattern = pattern.rstrip('/')
+    if _WILDCARD_RE.search(pattern):
+        return re.match(_glob_to_regex(pattern), path) is not None
+    return path == pattern or path.startswith(pattern + '/')
+
+
+def _git(cwd: str, *args: str) -> Optional[str]:
+    """执行 git 命令，失败返回 None"""
+    try:
+        result = subprocess.run(['git', *args], cwd=cwd, capture_output=True, text=True, timeout=60)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout if result.returncode == 0 else None
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """glob → 正则（** 跨目录，* / ? 不跨目录，[...] 字符集；匹配到目录时包含其下所有文件）"""
+    parts = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+        elif char == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif char == '?':
+            parts.append('[^/]')
+            i += 1
+        elif char == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            body = pattern[i + 1:end]
+            parts.append('[' + ('^' + body[1:] if body.startswith('!') else body) + ']')
+            i = end + 1
+        else:
+            parts.append(re.escape(char))
+            i += 1
+    return ''.join(parts) + '(?:/.*)?$'
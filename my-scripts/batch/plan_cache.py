@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+DAG 执行计划缓存
+将解析后的阶段、项目目标、冲突映射和批次布局编译后持久化，
+断点续传和 --dry-run 时直接加载，跳过解析和冲突检测
+（含分片任务的计划还依赖仓库文件列表，文件列表变化时同样失效）
+"""
+
+import functools
+import hashlib
+import json
+import os
+import shutil
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import conflict_coloring
+import dag_parser
+import file_index
+import task_shard
+from dag_parser import StageNode
+from file_index import FileIndex
+
+# 缓存格式版本（结构变化时递增，旧缓存自动失效）
+PLAN_FORMAT_VERSION = 1
+
+
+@dataclass
+class CompiledPlan:
+    """编译后的执行计划"""
+    stages: List[StageNode]
+    global_goal: str
+    sources: List[str]  # 入口文件 + 所有传递引用文件（绝对路径）
+    conflicts: Dict[int, Dict[int, List[int]]] = field(default_factory=dict)  # {stage_id: 冲突映射}
+    batches: Dict[int, List[List[int]]] = field(default_factory=dict)  # {stage_id: [[task_id, ...], ...]}
+    global_refs: List[str] = field(default_factory=list)  # 文件头部的延迟引用句柄（仅 lazy_refs 模式）
+    file_signature: str = ""  # 含分片任务时为仓库文件列表的标识（task_shard.shards_signature）
+
+    def to_dict(self) -> Dict:
+        """转换为字典"""
+        return {
+            'global_goal': self.global_goal,
+            'global_refs': self.global_refs,
+            'sources': self.sources,
+            'stages': [stage.to_dict() for stage in self.stages],
+            'conflicts': {str(sid): {str(tid): ids for tid, ids in conflicts.items()}
+                          for sid, conflicts in self.conflicts.items()},
+            'batches': {str(sid): batches for sid, batches in self.batches.items()},
+            'file_signature': self.file_signature,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'CompiledPlan':
+        """从字典恢复（JSON 的 key 只能是字符串，需转回 int）"""
+        return cls(
+            stages=[StageNode.from_dict(s) for s in data['stages']],
+            global_goal=data.get('global_goal', ''),
+            sources=data.get('sources', []),
+            conflicts={int(sid): {int(tid): ids for tid, ids in conflicts.items()}
+                       for sid, conflicts in data.get('conflicts', {}).items()},
+            batches={int(sid): batches for sid, batches in data.get('batches', {}).items()},
+            global_refs=data.get('global_refs', []),
+            file_signature=data.get('file_signature', ""),
+        )
+
+
+class PlanCache:
+    """执行计划缓存管理器"""
+
+    def __init__(self, task_file: str, base_dir: Path = None, lazy_refs: bool = False, conflict_key: str = ""):
+        """
+        Args:
+            task_file: 任务文件路径（新格式下为 .task-xxx/dag.md）
+            base_dir: 文件引用的基准目录（默认当前工作目录，参与缓存 key）
+            lazy_refs: 是否为延迟引用模式（两种模式的计划结构不同，参与缓存 key）
+            conflict_key: 冲突检测依据的标识（精确模式为文件索引的 HEAD + index mtime，参与缓存 key）
+
+        缓存文件位置约定（与 state 文件一致）：
+        - 新格式（.task-xxx/dag.md）→ .task-xxx/plan.json（随目录聚合清理）
+        - 旧格式（裸文件）→ <task_file>.plan.json
+        """
+        self.task_file = task_file
+        self.base_dir = base_dir or Path.cwd()
+        self.lazy_refs = lazy_refs
+        self.conflict_key = conflict_key
+        parent_dir = Path(task_file).parent
+        if parent_dir.name.startswith('.task-'):
+            self.cache_file = str(parent_dir / "plan.json")
+        else:
+            self.cache_file = f"{task_file}.plan.json"
+
+    def compute_key(self, sources: List[str]) -> str:
+        """
+        计算缓存 key：dag.md + 所有传递引用文件的内容哈希
+        （延迟引用模式下 sources 只有 dag.md：被引用文件在构建 prompt 时才读取，修改它不影响计划）
+
+        同时纳入格式版本、解析器源码和引用基准目录（精确冲突模式下还有文件索引标识），
+        解析规则变化、换目录执行或仓库文件变化时缓存自动失效。
+        不存在的引用文件也参与计算，之后创建该文件同样会使缓存失效。
+        """
+        digest = hashlib.sha256()
+        digest.update(f"v{PLAN_FORMAT_VERSION}\0{self.base_dir}\0{int(self.lazy_refs)}\0".encode('utf-8'))
+        digest.update(_parser_digest().encode('utf-8'))
+        if self.conflict_key:
+            digest.update(f"\0conflicts\0{self.conflict_key}".encode('utf-8'))
+        for source in sources:
+            digest.update(f"\0{source}\0{self._file_digest(source)}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def load(self) -> Optional[CompiledPlan]:
+        """
+        加载缓存的执行计划
+
+        Returns:
+            CompiledPlan；缓存不存在、损坏、任一源文件已变化或（含分片任务时）仓库文件列表已变化时返回 None
+        """
+        if not os.path.exists(self.cache_file):
+            return None
+
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != PLAN_FORMAT_VERSION:
+                return None
+            plan_data = data['plan']
+            if data.get('key') != self.compute_key(plan_data.get('sources', [])):
+                return None
+            plan = CompiledPlan.from_dict(plan_data)
+            if plan.file_signature and plan.file_signature != FileIndex(str(self.base_dir)).signature:
+                return None
+            return plan
+        except Exception as e:
+            print(f"⚠️  加载执行计划缓存失败，将重新解析: {e}")
+            return None
+
+    def save(self, plan: CompiledPlan):
+        """保存执行计划缓存（原子写入，失败不影响执行）"""
+        temp_file = self.cache_file + ".tmp"
+        try:
+            data = {
+                'version': PLAN_FORMAT_VERSION,
+                'key': self.compute_key(plan.sources),
+                'plan': plan.to_dict(),
+            }
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            shutil.move(temp_file, self.cache_file)
+        except Exception as e:
+            print(f"⚠️  保存执行计划缓存失败: {e}")
+            if os.path.exists(temp_file):
+                try:
+                    os.remove(temp_file)
+                except OSError:
+                    pass
+
+    def clear(self):
+        """删除缓存文件"""
+        if os.path.exists(self.cache_file):
+            try:
+                os.remove(self.cache_file)
+            except OSError as e:
+                print(f"⚠️  清理执行计划缓存失败: {e}")
+
+    @staticmethod
+    def _file_digest(path: str) -> str:
+        """文件内容哈希（目录取文件名列表的哈希）；文件不存在或不可读时返回占位标记"""
+        digest = hashlib.sha256()
+        if os.path.isdir(path):
+            digest.update("\0".join(sorted(os.listdir(path))).encode('utf-8'))
+            return "dir:" + digest.hexdigest()
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+        except OSError:
+            return "missing"
+        return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _parser_digest() -> str:
+    """解析器源码哈希（含冲突检测、批次划分和任务分片，进程内只计算一次）"""
+    return ''.join(PlanCache._file_digest(module.__file__)
+                   for module in (dag_parser, conflict_coloring, file_index, task_shard))
+
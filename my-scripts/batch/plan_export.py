@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+执行计划导出/导入 - 供外部调度器预先生成计划、执行器直接启动
+
+--emit-plan 把解析后的完整计划写成文件：阶段（mode / max_workers）、任务（展开后的文件范围、
+排除、验证命令、depends_on）、冲突映射和批次布局；--from-plan 直接加载，不再解析任何 markdown。
+
+两种格式内容相同：
+- json：便于查看和其他语言读取
+- binary：MessagePack 编码（本模块自带编码/解码，不依赖第三方库；任何 msgpack 库都能读取），
+  体积更小、加载更快
+
+与执行计划缓存（plan.json）的区别：缓存按源文件哈希自动失效、矩阵任务只存模板；
+导出文件是自包含的快照，矩阵子任务已全部展开，外部调度器无需理解模板语法。
+"""
+
+import json
+import os
+import shutil
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from dag_parser import StageNode
+from plan_cache import CompiledPlan
+
+# 导出格式版本（结构变化时递增）
+PLAN_EXPORT_VERSION = 1
+PLAN_EXPORT_MAGIC = 'batch-plan'
+EXPORT_FORMATS = ('json', 'binary')
+_EXTENSIONS = {'json': '.json', 'binary': '.msgpack'}
+
+
+@dataclass
+class PlanExport:
+    """导入的执行计划"""
+    plan: CompiledPlan
+    task_file: str  # 导出时的任务文件（决定状态文件位置）
+    base_dir: str  # 导出时的工作目录（@引用、文件范围都相对于它）
+    format: str  # json 或 binary
+
+
+def default_export_path(task_file: str, fmt: str) -> str:
+    """
+    默认导出路径（与 state / plan 缓存的位置约定一致）：
+    - 新格式（.task-xxx/dag.md）→ .task-xxx/plan.export.json|.msgpack
+    - 旧格式（裸文件）→ <task_file>.plan.export.json|.msgpack
+    """
+    parent_dir = Path(task_file).parent
+    if parent_dir.name.startswith('.task-'):
+        return str(parent_dir / f"plan.export{_EXTENSIONS[fmt]}")
+    return f"{task_file}.plan.export{_EXTENSIONS[fmt]}"
+
+
+def resolve_plan(plan: CompiledPlan) -> CompiledPlan:
+    """展开矩阵子任务（导出文件自包含，不依赖模板语法）"""
+    stages = [StageNode(**{name: getattr(stage, name) for name in _STAGE_FIELDS}, tasks=list(stage.tasks))
+              for stage in plan.stages]
+    return CompiledPlan(stages=stages, global_goal=plan.global_goal, sources=plan.sources,
+                        conflicts=plan.conflicts, batches=plan.batches, global_refs=plan.global_refs)
+
+
+def export_plan(plan: CompiledPlan, task_file: str, path: str, fmt: str) -> int:
+    """
+    写出执行计划（原子写入）
+
+    Args:
+        plan: 编译后的执行计划（需已计算所有并行阶段的冲突和批次）
+        task_file: 任务文件路径
+        path: 输出路径
+        fmt: json 或 binary
+
+    Returns:
+        写入的字节数
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}（可选: {', '.join(EXPORT_FORMATS)}）")
+    document = {
+        'format': PLAN_EXPORT_MAGIC,
+        'version': PLAN_EXPORT_VERSION,
+        'task_file': str(task_file),
+        'base_dir': os.getcwd(),
+        'plan': resolve_plan(plan).to_dict(),
+    }
+    if fmt == 'json':
+        data = json.dumps(document, ensure_ascii=False, indent=1).encode('utf-8')
+    else:
+        data = packb(document)
+
+    temp_file = path + ".tmp"
+    with open(temp_file, 'wb') as f:
+        f.write(data)
+    shutil.move(temp_file, path)
+    return len(data)
+
+
+def load_plan_export(path: str) -> PlanExport:
+    """
+    加载导出的执行计划（按文件内容自动识别 json / binary）
+
+    Raises:
+        ValueError: 文件不存在、格式无法识别或版本不匹配
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        raise ValueError(f"读取执行计划失败: {path} ({e})")
+
+    try:
+        if data.lstrip()[:1] == b'{':
+            fmt, document = 'json', json.loads(data.decode('utf-8'))
+        else:
+            fmt, document = 'binary', unpackb(data)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"无法识别的执行计划文件: {path} ({e})")
+
+    if not isinstance(document, dict) or document.get('format') != PLAN_EXPORT_MAGIC:
+        raise ValueError(f"不是导出的执行计划文件: {path}")
+    if document.get('version') != PLAN_EXPORT_VERSION:
+        raise ValueError(f"执行计划版本不匹配: {document.get('version')}（当前支持 {PLAN_EXPORT_VERSION}），请重新导出")
+    return PlanExport(
+        plan=CompiledPlan.from_dict(document['plan']),
+        task_file=document.get('task_file', ''),
+        base_dir=document.get('base_dir', ''),
+        format=fmt,
+    )
+
+
+_STAGE_FIELDS = tuple(name for name in StageNode.__slots__ if name != 'tasks')
+
+
+# ---------------------------------------------------------------------------
+# MessagePack 编码/解码（None / bool / int / float / str / list / tuple / dict）
+# ---------------------------------------------------------------------------
+
+def packb(obj: Any) -> bytes:
+    """编码为 MessagePack"""
+    out = bytearray()
+    _pack(obj, out)
+    return bytes(out)
+
+
+def _pack(obj: Any, out: bytearray):
+    if obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif isinstance(obj, int):
+        _pack_int(obj, out)
+    elif isinstance(obj, float):
+        out.append(0xcb)
+        out += struct.pack('>d', obj)
+    elif isinstance(obj, str):
+        raw = obj.encode('utf-8')
+        size = len(raw)
+        if size < 32:
+            out.append(0xa0 | size)
+        elif size < 0x100:
+            out += bytes((0xd9, size))
+        elif size < 0x10000:
+            out.append(0xda)
+            out += struct.pack('>H', size)
+        else:
+            out.append(0xdb)
+            out += struct.pack('>I', size)
+        out += raw
+    elif isinstance(obj, (list, tuple)):
+        _pack_header(len(obj), 0x90, 0xdc, 0xdd, out)
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        _pack_header(len(obj), 0x80, 0xde, 0xdf, out)
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    else:
+        raise TypeError(f"无法编码的类型: {type(obj).__name__}")
+
+
+def _pack_int(value: int, out: bytearray):
+    if 0 <= value < 0x80:
+        out.append(value)
+    elif -32 <= value < 0:
+        out.append(value & 0xff)
+    elif value >= 0:
+        for code, fmt, limit in ((0xcc, '>B', 0x100), (0xcd, '>H', 0x10000), (0xce, '>I', 1 << 32),
+                                 (0xcf, '>Q', 1 << 64)):
+            if value < limit:
+                out.append(code)
+                out += struct.pack(fmt, value)
+                return
+        raise OverflowError(f"整数超出 MessagePack 范围: {value}")
+    else:
+        for code, fmt, limit in ((0xd0, '>b', 1 << 7), (0xd1, '>h', 1 << 15), (0xd2, '>i', 1 << 31),
+                                 (0xd3, '>q', 1 << 63)):
+            if value >= -limit:
+                out.append(code)
+                out += struct.pack(fmt, value)
+                return
+        raise OverflowError(f"整数超出 MessagePack 范围: {value}")
+
+
+def _pack_header(size: int, fix: int, code16: int, code32: int, out: bytearray):
+    if size < 16:
+        out.append(fix | size)
+    elif size < 0x10000:
+        out.append(code16)
+        out += struct.pack('>H', size)
+    else:
+        out.append(code32)
+        out += struct.pack('>I', size)
+
+
+def unpackb(data: bytes) -> Any:
+    """解码 MessagePack（只支持 packb 会产生的类型）"""
+    obj, pos = _unpack(memoryview(data), 0)
+    if pos != len(data):
+        raise ValueError(f"MessagePack 数据末尾有多余的 {len(data) - pos} 字节")
+    return obj
+
+
+_FIXED = {
+    0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+    0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+    0xca: ('>f', 4), 0xcb: ('>d', 8),
+}
+_LENGTHS = {0xd9: ('>B', 1), 0xda: ('>H', 2), 0xdb: ('>I', 4),
+            0xdc: ('>H', 2), 0xdd: ('>I', 4), 0xde: ('>H', 2), 0xdf: ('>I', 4)}
+
+
+def _unpack(buf: memoryview, pos: int) -> Tuple[Any, int]:
+    try:
+        code = buf[pos]
+    except IndexError:
+        raise ValueError("MessagePack 数据被截断")
+    pos += 1
+    if code < 0x80:
+        return code, pos
+    if code >= 0xe0:
+        return code - 0x100, pos
+    if 0xa0 <= code <= 0xbf:
+        return _unpack_str(buf, pos, code & 0x1f)
+    if 0x90 <= code <= 0x9f:
+        return _unpack_array(buf, pos, code & 0x0f)
+    if 0x80 <= code <= 0x8f:
+        return _unpack_map(buf, pos, code & 0x0f)
+    if code == 0xc0:
+        return None, pos
+    if code == 0xc2:
+        return False, pos
+    if code == 0xc3:
+        return True, pos
+    if code in _FIXED:
+        fmt, size = _FIXED[code]
+        return _read(buf, pos, fmt, size), pos + size
+    if code in _LENGTHS:
+        fmt, size = _LENGTHS[code]
+        length = _read(buf, pos, fmt, size)
+        pos += size
+        if code <= 0xdb:
+            return _unpack_str(buf, pos, length)
+        if code <= 0xdd:
+            return _unpack_array(buf, pos, length)
+        return _unpack_map(buf, pos, length)
+    raise ValueError(f"不支持的 MessagePack 类型: 0x{code:02x}")
+
+
+def _read(buf: memoryview, pos: int, fmt: str, size: int):
+    if pos + size > len(buf):
+        raise ValueError("MessagePack 数据被截断")
+    return struct.unpack_from(fmt, buf, pos)[0]
+
+
+def _unpack_str(buf: memoryview, pos: int, length: int) -> Tuple[str, int]:
+    end = pos + length
+    if end > len(buf):
+        raise ValueError("MessagePack 数据被截断")
+    return str(buf[pos:end], 'utf-8'), end
+
+
+def _unpack_array(buf: memoryview, pos: int, length: int) -> Tuple[List, int]:
+    items = []
+    for _ in range(length):
+        item, pos = _unpack(buf, pos)
+        items.append(item)
+    return items, pos
+
+
+def _unpack_map(buf: memoryview, pos: int, length: int) -> Tuple[Dict, int]:
+    result = {}
+    for _ in range(length):
+        key, pos = _unpack(buf, pos)
+        result[key], pos = _unpack(buf, pos)
+    return result, pos
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+执行计划热更新 - 监视 dag.md 及引用文件，把安全的修改合并进正在执行的计划
+
+- PlanWatcher: 轮询源文件的 (mtime, inode, size)，发现变化后由执行器重新解析
+  （未变化的引用文件命中 RefResolver 内容缓存，只有改动过的文件重新读盘）
+- merge_plan: 新旧计划按 (stage_id, task_id) 位置对齐后逐项比较，原地合并：
+  - 应用：新增阶段、阶段末尾追加的任务、未开始任务的修改、未开始阶段的参数修改
+  - 只报告不应用：已开始/已完成任务的修改、删除任务或阶段、向已结束阶段追加任务
+  - 含矩阵任务的阶段按任务节点（模板）整体比较：阶段未开始时整体替换，已开始则只报告
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from dag_parser import StageNode, TaskList, task_entries
+from ref_resolver import file_signature
+
+# 参与比较的内容字段（行号等位置信息变化不算修改）
+TASK_CONTENT_FIELDS = ('description', 'files', 'excludes', 'verify_cmd', 'refs', 'id', 'depends_on')
+STAGE_CONTENT_FIELDS = ('name', 'mode', 'max_workers', 'description', 'refs')
+_LOCATION_FIELDS = ('source_file', 'line_start', 'line_end')
+
+
+@dataclass
+class PlanMerge:
+    """一次热更新的合并结果"""
+    applied: List[str] = field(default_factory=list)  # 已应用的修改
+    rejected: List[str] = field(default_factory=list)  # 冲突、未应用的修改
+    changed_stages: Set[int] = field(default_factory=set)  # 内容有变化的 stage_id
+
+
+class PlanWatcher:
+    """DAG 源文件轮询器"""
+
+    def __init__(self, sources: List[str], interval: float = 2.0):
+        """
+        Args:
+            sources: 入口文件 + 所有传递引用文件
+            interval: 轮询间隔（秒）
+        """
+        self.interval = interval
+        self._last_poll = time.monotonic()
+        self._snapshot: Dict[str, Optional[Tuple[int, int, int]]] = {}
+        self.reset(sources)
+
+    def reset(self, sources: List[str]):
+        """重新解析后更新监视列表（引用关系可能已变化）"""
+        old = self._snapshot
+        self._snapshot = {path: old[path] if path in old else file_signature(path) for path in sources}
+
+    def poll(self) -> bool:
+        """
+        到达轮询间隔时检查源文件
+
+        Returns:
+            是否有文件新增、删除或修改（同一变化只报告一次）
+        """
+        now = time.monotonic()
+        if now - self._last_poll < self.interval:
+            return False
+        self._last_poll = now
+
+        snapshot = {path: file_signature(path) for path in self._snapshot}
+        if snapshot == self._snapshot:
+            return False
+        self._snapshot = snapshot
+        return True
+
+
+def merge_plan(stages: List[StageNode], new_stages: List[StageNode],
+               started: Set[Tuple[int, int]], closed_stages: Set[int]) -> PlanMerge:
+    """
+    把重新解析得到的计划合并进当前计划（原地修改 stages，执行循环可直接看到新增内容）
+
+    Args:
+        stages: 当前执行中的阶段列表
+        new_stages: 重新解析得到的阶段列表
+        started: 已开始或已完成的任务 (stage_id, task_id)
+        closed_stages: 已结束的阶段（后续阶段可能已开始，不能再追加任务）
+
+    Returns:
+        PlanMerge
+    """
+    merge = PlanMerge()
+    for old_stage, new_stage in zip(stages, new_stages):
+        _merge_stage(old_stage, new_stage, started, closed_stages, merge)
+
+    for old_stage in stages[len(new_stages):]:
+        merge.rejected.append(f"Stage {old_stage.stage_id + 1} ({old_stage.name}) 已从文件中删除，未应用")
+
+    for new_stage in new_stages[len(stages):]:
+        stages.append(new_stage)
+        merge.applied.append(f"新增 Stage {new_stage.stage_id + 1}: {new_stage.name} ({len(new_stage.tasks)} 任务)")
+        merge.changed_stages.add(new_stage.stage_id)
+
+    return merge
+
+
+def _merge_stage(old: StageNode, new: StageNode, started: Set[Tuple[int, int]], closed_stages: Set[int],
+                 merge: PlanMerge):
+    stage_id = old.stage_id
+    label = f"Stage {stage_id + 1} ({old.name})"
+    _copy_fields(old, new, _LOCATION_FIELDS)
+
+    changed = [name for name in STAGE_CONTENT_FIELDS if getattr(old, name) != getattr(new, name)]
+    if changed:
+        if stage_id in closed_stages or any((stage_id, task.task_id) in started for task in old.tasks):
+            merge.rejected.append(f"{label} 已开始，阶段参数修改未应用: {', '.join(changed)}")
+        else:
+            _copy_fields(old, new, changed)
+            merge.applied.append(f"{label} 参数已更新: {', '.join(changed)}")
+            merge.changed_stages.add(stage_id)
+
+    if isinstance(old.tasks, TaskList) or isinstance(new.tasks, TaskList):
+        _merge_matrix_tasks(old, new, started, closed_stages, merge, label)
+        return
+
+    for old_task, new_task in zip(old.tasks, new.tasks):
+        changed = [name for name in TASK_CONTENT_FIELDS if getattr(old_task, name) != getattr(new_task, name)]
+        if not changed:
+            _copy_fields(old_task, new_task, _LOCATION_FIELDS)
+            continue
+        task_label = f"{label} Task {old_task.task_id}"
+        if (stage_id, old_task.task_id) in started:
+            location = f" ({new_task.location})" if new_task.location else ""
+            merge.rejected.append(f"{task_label} 已开始或已完成，修改未应用: {', '.join(changed)}{location}")
+        else:
+            _copy_fields(old_task, new_task, TASK_CONTENT_FIELDS + _LOCATION_FIELDS)
+            merge.applied.append(f"{task_label} 已更新: {', '.join(changed)}")
+            merge.changed_stages.add(stage_id)
+
+    appended = new.tasks[len(old.tasks):]
+    if appended:
+        if stage_id in closed_stages:
+            merge.rejected.append(f"{label} 已结束，新增的 {len(appended)} 个任务未应用")
+        else:
+            old.tasks.extend(appended)
+            merge.applied.append(f"{label} 追加 {len(appended)} 个任务")
+            merge.changed_stages.add(stage_id)
+
+    removed = len(old.tasks) - len(new.tasks)
+    if removed > 0:
+        merge.rejected.append(f"{label} 删除了 {removed} 个任务，未应用")
+
+
+def _merge_matrix_tasks(old: StageNode, new: StageNode, started: Set[Tuple[int, int]], closed_stages: Set[int],
+                        merge: PlanMerge, label: str):
+    """含矩阵任务的阶段：子任务按需生成、无法逐个原地修改，按任务节点整体比较"""
+    old_entries, new_entries = task_entries(old.tasks), task_entries(new.tasks)
+    if [_task_content(t) for t in old_entries] == [_task_content(t) for t in new_entries]:
+        for old_task, new_task in zip(old_entries, new_entries):
+            _copy_fields(old_task, new_task, _LOCATION_FIELDS)
+        return
+
+    stage_id = old.stage_id
+    if stage_id in closed_stages or any(key[0] == stage_id for key in started):
+        merge.rejected.append(f"{label} 已开始，矩阵任务所在阶段的修改未应用")
+        return
+    old.tasks = new.tasks
+    merge.applied.append(f"{label} 任务已更新（{len(new.tasks)} 任务）")
+    merge.changed_stages.add(stage_id)
+
+
+def _task_content(task) -> Tuple:
+    matrix = task.matrix.to_dict() if task.matrix is not None else None
+    return tuple(getattr(task, name) for name in TASK_CONTENT_FIELDS) + (matrix,)
+
+
+def _copy_fields(target, source, names):
+    for name in names:
+        setattr(target, name, getattr(source, name))
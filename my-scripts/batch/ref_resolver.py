@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+@文件引用 读取器 - 共享内容缓存 + 并行预读
+
+- 内容缓存：按 解析后路径 + (mtime, inode, size) 缓存，跨多次解析复用，文件变化自动失效
+- 大文件：超过阈值时使用 mmap 读取，直接从映射的缓冲区解码，避免额外的 bytes 拷贝
+- 并行预读：扫描一个文件前，先把它引用的所有文件提交到线程池读取
+- 同一文件被多处引用（菱形引用）时只读一次，但每处都会展开
+"""
+
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def ref_target(line: str) -> Optional[str]:
+    """
+    判断一行是否是文件引用（去除首尾空白后以 @ 开头）
+
+    Returns:
+        引用路径（@ 之后的内容）；不是引用行时返回 None
+    """
+    if '@' not in line:
+        return None
+    stripped = line.strip()
+    if not stripped.startswith('@'):
+        return None
+    return stripped[1:].strip()
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """
+    文件签名 (mtime_ns, inode, size)，用于判断文件是否变化（目录新增/删除文件时 mtime 同样变化）
+
+    Returns:
+        签名；文件不存在或不可访问时返回 None
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_ino, stat.st_size
+
+
+class RefResolver:
+    """引用文件读取器（线程安全）"""
+
+    def __init__(self, max_workers: int = 8, mmap_threshold: int = 1 << 20, cache_bytes: int = 256 << 20):
+        """
+        Args:
+            max_workers: 预读线程数
+            mmap_threshold: 超过该字节数的文件使用 mmap 读取
+            cache_bytes: 内容缓存上限（按文件大小累计，超出时淘汰最久未用的文件）
+        """
+        self.max_workers = max_workers
+        self.mmap_threshold = mmap_threshold
+        self.cache_bytes = cache_bytes
+        self._cache: 'OrderedDict[str, Tuple[Tuple[int, int, int], List[str]]]' = OrderedDict()
+        self._cached_bytes = 0
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self.disk_reads = 0  # 实际读盘次数（统计用）
+
+    def read_lines(self, path: Path) -> List[str]:
+        """
+        读取文件并按行拆分（优先命中缓存 / 等待进行中的预读）
+
+        Raises:
+            OSError: 文件不存在或不可读
+            UnicodeDecodeError: 非 UTF-8 文件
+        """
+        key = str(path)
+        with self._lock:
+            future = self._inflight.get(key)
+        if future is not None:
+            future.result()
+
+        stat = os.stat(key)
+        stat_key = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == stat_key:
+                self._cache.move_to_end(key)
+                return cached[1]
+
+        lines = self._read_from_disk(key, stat.st_size)
+        self._store(key, stat_key, stat.st_size, lines)
+        return lines
+
+    def prefetch(self, paths: Iterable[Path]):
+        """把尚未缓存的文件提交到线程池并行读取（不阻塞，读取失败留给 read_lines 处理）"""
+        pending = []
+        with self._lock:
+            for path in paths:
+                key = str(path)
+                if key in self._inflight or key in pending:
+                    continue
+                if key in self._cache:
+                    # 已缓存：read_lines 时再用 stat 校验是否过期
+                    continue
+                pending.append(key)
+
+            # 只有一个文件时直接在调用方线程读取，不值得调度线程池
+            if len(pending) < 2:
+                return
+
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix='ref-prefetch')
+            for key in pending:
+                future = self._pool.submit(self._prefetch_one, key)
+                self._inflight[key] = future
+
+    def expand(self, path: str, max_depth: int = 10) -> str:
+        """
+        读取引用文件并递归展开其中的 @文件引用，返回纯文本（延迟引用模式下构建 prompt 时调用）
+
+        规则与 DAGParser 解析时展开一致：嵌套引用相对被引用文件所在目录；
+        只拦截引用链上的循环（菱形引用每处都展开）；超过最大深度时停止展开。
+
+        Raises:
+            OSError: 顶层文件不存在或不可读（嵌套引用失败时插入警告注释并保留原引用行）
+            UnicodeDecodeError: 非 UTF-8 文件
+        """
+        full_path = Path(path).resolve()
+        out: List[str] = []
+        self._expand_into(full_path, 0, max_depth, {str(full_path)}, out)
+        return '\n'.join(out)
+
+    def _expand_into(self, full_path: Path, depth: int, max_depth: int, ancestors: set, out: List[str]):
+        lines = self.read_lines(full_path)
+        if depth >= max_depth:
+            out.append(f"# ⚠️ 文件引用超过最大深度 ({max_depth})，停止解析")
+            out.extend(lines)
+            return
+
+        base_dir = full_path.parent
+        for line in lines:
+            target = ref_target(line)
+            if not target:
+                out.append(line)
+                continue
+            ref_path = (base_dir / target).resolve()
+            key = str(ref_path)
+            if key in ancestors:
+                out.append(f"# ⚠️ 跳过循环引用: {target}")
+                continue
+            ancestors.add(key)
+            try:
+                self._expand_into(ref_path, depth + 1, max_depth, ancestors, out)
+            except Exception as e:
+                reason = "文件不存在" if isinstance(e, FileNotFoundError) else f"错误: {e}"
+                out.append(f"# ⚠️ 文件引用失败: {target} ({reason})")
+                out.append(line)
+            finally:
+                ancestors.discard(key)
+
+    def clear(self):
+        """清空内容缓存"""
+        with self._lock:
+            self._cache.clear()
+            self._cached_bytes = 0
+
+    def _prefetch_one(self, key: str):
+        try:
+            stat = os.stat(key)
+            lines = self._read_from_disk(key, stat.st_size)
+            self._store(key, (stat.st_mtime_ns, stat.st_ino, stat.st_size), stat.st_size, lines)
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _read_from_disk(self, key: str, size: int) -> List[str]:
+        """读取文件内容（大文件走 mmap），统一换行符后按行拆分"""
+        with open(key, 'rb') as f:
+            if size >= self.mmap_threshold:
+                # 直接从映射的缓冲区解码（mm[:] 会先拷贝出一份 bytes）；视图须在 mmap 关闭前释放
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                    text = str(view, 'utf-8')
+            else:
+                text = f.read().decode('utf-8')
+        with self._lock:
+            self.disk_reads += 1
+        # 与文本模式读取一致：\r\n、\r 统一为 \n
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        return text.split('\n')
+
+    def _store(self, key: str, stat_key: Tuple[int, int, int], size: int, lines: List[str]):
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._cached_bytes -= old[0][2]
+            self._cache[key] = (stat_key, lines)
+            self._cached_bytes += size
+            while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+                _, (evicted_stat, _) = self._cache.popitem(last=False)
+                self._cached_bytes -= evicted_stat[2]
+
+
+# 进程内共享的读取器：多次解析（如 dry-run 后执行、批量解析多个 DAG）复用同一缓存
+_shared_resolver: Optional[RefResolver] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_resolver() -> RefResolver:
+    """获取进程内共享的 RefResolver"""
+    global _shared_resolver
+    with _shared_lock:
+        if _shared_resolver is None:
+            _shared_resolver = RefResolver()
+        return _shared_resolver
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+运行历史 - 跨运行记录每个任务的耗时与结果，用于预计剩余时间（ETA）和耗时估计
+
+DAG 运行成功后 .task-xxx/（含 state.json）整个被清理，状态文件里的耗时随之丢失。
+运行历史在每个阶段结束时（以及清理之前）把本次运行结束的任务追加到
+~/.claude/batch-history/tasks.jsonl（默认开启，--no-history 关闭；追加写入，一行一条记录，多个运行同时写入互不覆盖）：
+
+- 记录：任务指纹（write_sets.task_fingerprint）、描述摘要、阶段名、后端（batchcc / batchcx）、
+  耗时、结果（completed / failed）、重试次数、时间和工作目录
+- 统计：每个任务取最近 MAX_SAMPLES 次记录，成功运行耗时的中位数和 P90
+- 用途：阶段标题与并行批次进度显示预计剩余时间；--critical-path 的耗时估计（task_priority.py）；
+  --hedge 同批次样本不足时的对冲阈值（task_hedge.py）
+- 查询：python run_history.py 列出最慢和最不稳定（失败或重试过）的任务
+- 上限：文件超过 MAX_RECORDS + TRIM_SLACK 条记录时删去最旧的记录，只保留最近 MAX_RECORDS 条
+  （裁剪时整个文件重写，其他运行恰好在此刻追加的记录可能丢失，只影响统计）
+
+耗时取自状态文件，只有开启状态管理时记录（batchcc / batchcx 的 DAG 模式始终开启）；
+简单模式（## TASK ## 列表）没有阶段和任务指纹，不记录。
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from task_hedge import percentile
+from task_retry import format_duration
+from write_sets import task_fingerprint
+
+HISTORY_DIR = os.path.join(os.path.expanduser('~'), '.claude', 'batch-history')
+HISTORY_FILE_NAME = 'tasks.jsonl'
+# 统计取每个任务最近几次记录（任务改变行为后旧记录逐渐淘汰）
+MAX_SAMPLES = 20
+# 查询默认列出的任务数
+DEFAULT_LIMIT = 10
+# 历史文件最多保留的记录数；超出 TRIM_SLACK 条后裁剪（不必每次写入都重写文件）
+MAX_RECORDS = 10000
+TRIM_SLACK = 1000
+
+DurationRange = Tuple[float, float]  # (中位数, P90) 秒
+
+
+def expected_span(ranges: Sequence[DurationRange], workers: int) -> DurationRange:
+    """
+    workers 个并发槽位跑完这些任务的预计耗时：max(最长的任务, 总耗时 / 槽位数)
+
+    Returns:
+        (中位数估计, P90 估计)；没有任务时为 (0, 0)
+    """
+    if not ranges:
+        return 0.0, 0.0
+    workers = max(1, workers)
+    return tuple(max(max(values), sum(values) / workers) for values in zip(*ranges))
+
+
+def format_range(span: DurationRange) -> str:
+    """预计耗时显示：12m（P90 15m）"""
+    return f"{format_duration(span[0])}（P90 {format_duration(span[1])}）"
+
+
+@dataclass
+class TaskStats:
+    """一个任务（按指纹）的历史统计"""
+    fingerprint: str
+    description: str
+    stage: str
+    backend: str
+    runs: int  # 记录数（最近 MAX_SAMPLES 次）
+    failures: int  # 失败次数
+    retried: int  # 发生过重试的运行次数
+    median: Optional[float]  # 成功运行耗时中位数（没有成功记录时为 None）
+    p90: Optional[float]
+
+    @property
+    def flakiness(self) -> float:
+        """不稳定程度：失败或重试过的运行占比"""
+        return (self.failures + self.retried) / self.runs if self.runs else 0.0
+
+
+class RunHistory:
+    """运行历史（只追加的 JSONL 文件；记录与查询，线程安全）"""
+
+    def __init__(self, path: str = None, backend: str = ""):
+        """
+        Args:
+            path: 历史文件路径（默认 ~/.claude/batch-history/tasks.jsonl）
+            backend: 记录的后端名（batchcc / batchcx）
+        """
+        self.path = path or os.path.join(HISTORY_DIR, HISTORY_FILE_NAME)
+        self.backend = backend
+        self._records: Optional[Dict[str, List[Dict]]] = None
+        self._count = 0  # 历史文件中的记录数（裁剪判断）
+        self._lock = threading.Lock()
+
+    @property
+    def records(self) -> Dict[str, List[Dict]]:
+        """{指纹: [记录, ...]}（按写入顺序；首次访问时加载）"""
+        if self._records is None:
+            self._records = self._load()
+            self._count = sum(len(entries) for entries in self._records.values())
+        return self._records
+
+    def record(self, task, stage: str, outcome: str, duration: float, retries: int = 0):
+        """
+        追加一条任务记录（写入失败只提示，不影响执行）
+
+        Args:
+            task: 任务节点
+            stage: 阶段名
+            outcome: 'completed' / 'failed'
+            duration: 耗时（秒）
+            retries: 重试次数（瞬时失败后重新执行的次数）
+        """
+        entry = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'fingerprint': task_fingerprint(task),
+            'description': task.description.replace("\n", " ")[:80],
+            'stage': stage,
+            'backend': self.backend,
+            'duration': round(duration, 1),
+            'outcome': outcome,
+            'retries': retries,
+            'cwd': os.getcwd(),
+        }
+        with self._lock:
+            self.records.setdefault(entry['fingerprint'], []).append(entry)
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n")
+            except OSError as e:
+                print(f"⚠️  写入运行历史失败: {e}")
+                return
+            self._count += 1
+            if self._count > MAX_RECORDS + TRIM_SLACK:
+                self._trim()
+
+    def durations(self) -> Dict[str, List[float]]:
+        """{指纹: [最近成功运行的耗时, ...]}（DurationEstimator 的样本格式）"""
+        samples = {}
+        for fingerprint in self.records:
+            values = self._durations(fingerprint)
+            if values:
+                samples[fingerprint] = values
+        return samples
+
+    def duration_range(self, task) -> Optional[DurationRange]:
+        """任务耗时的 (中位数, P90)；没有成功记录时返回 None"""
+        values = self._durations(task_fingerprint(task))
+        if not values:
+            return None
+        return statistics.median(values), percentile(values, 90)
+
+    def p90(self, task) -> Optional[float]:
+        """任务耗时的 P90（HedgePolicy.estimate：运行时间超过自身历史 P90 即视为慢任务）"""
+        known = self.duration_range(task)
+        return known[1] if known else None
+
+    def estimates(self, tasks: Sequence) -> Tuple[List[DurationRange], int]:
+        """
+        各任务的预计耗时（ETA 用）
+
+        没有记录的任务按有记录任务的中位数补齐（同一次运行中的任务规模大多相近）。
+
+        Returns:
+            ([(中位数, P90), ...] 与 tasks 一一对应, 有记录的任务数)；没有任何任务有记录时为 ([], 0)
+        """
+        known = [self.duration_range(task) for task in tasks]
+        ranges = [item for item in known if item is not None]
+        if not ranges:
+            return [], 0
+        fallback = (statistics.median(r[0] for r in ranges), statistics.median(r[1] for r in ranges))
+        return [item or fallback for item in known], len(ranges)
+
+    def summary(self, backend: str = None) -> List[TaskStats]:
+        """每个任务最近 MAX_SAMPLES 次记录的统计（backend 指定时只统计该后端的记录）"""
+        stats = []
+        for fingerprint, entries in self.records.items():
+            if backend:
+                entries = [entry for entry in entries if entry.get('backend') == backend]
+            entries = entries[-MAX_SAMPLES:]
+            if not entries:
+                continue
+            values = [entry['duration'] for entry in entries if entry.get('outcome') == 'completed']
+            latest = entries[-1]
+            stats.append(TaskStats(
+                fingerprint=fingerprint,
+                description=latest.get('description', ''),
+                stage=latest.get('stage', ''),
+                backend=latest.get('backend', ''),
+                runs=len(entries),
+                failures=sum(1 for entry in entries if entry.get('outcome') != 'completed'),
+                retried=sum(1 for entry in entries if entry.get('outcome') == 'completed' and entry.get('retries')),
+                median=statistics.median(values) if values else None,
+                p90=percentile(values, 90) if values else None,
+            ))
+        return stats
+
+    def _durations(self, fingerprint: str) -> List[float]:
+        """最近 MAX_SAMPLES 次记录中成功运行的耗时"""
+        entries = self.records.get(fingerprint, [])[-MAX_SAMPLES:]
+        return [entry['duration'] for entry in entries if entry.get('outcome') == 'completed']
+
+    def _trim(self):
+        """删去最旧的记录，只保留最近 MAX_RECORDS 行（写入临时文件后替换，失败只提示）"""
+        temp_file = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                lines = f.readlines()
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                f.writelines(lines[-MAX_RECORDS:])
+            os.replace(temp_file, self.path)
+        except OSError as e:
+            print(f"⚠️  裁剪运行历史失败: {e}")
+            return
+        self._records = None  # 下次访问时按裁剪后的文件重新加载
+
+    def _load(self) -> Dict[str, List[Dict]]:
+        """读取历史文件（损坏的行跳过：并发追加被中断时最多损坏最后一行）"""
+        records: Dict[str, List[Dict]] = {}
+        if not os.path.exists(self.path):
+            return records
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if (isinstance(entry, dict) and entry.get('fingerprint')
+                            and isinstance(entry.get('duration'), (int, float))):
+                        records.setdefault(entry['fingerprint'], []).append(entry)
+        except OSError as e:
+            print(f"⚠️  加载运行历史失败: {e}")
+        return records
+
+
+def print_report(history: RunHistory, limit: int = DEFAULT_LIMIT, backend: str = None):
+    """打印最慢和最不稳定的任务"""
+    stats = history.summary(backend)
+    total = sum(item.runs for item in stats)
+    print(f"📊 运行历史: {history.path}（{len(stats)} 个任务，最近 {total} 次运行记录）")
+    if not stats:
+        return
+
+    slowest = sorted((item for item in stats if item.median is not None), key=lambda item: -item.median)[:limit]
+    print(f"\n🐢 最慢的任务（成功运行耗时中位数）:")
+    for item in slowest:
+        print(f"   {format_range((item.median, item.p90)):<20} {item.runs:>3} 次  "
+              f"[{item.backend or '-'}] {item.stage}: {item.description[:60]}")
+
+    flaky = sorted((item for item in stats if item.flakiness > 0),
+                   key=lambda item: (-item.flakiness, -item.failures, -item.runs))[:limit]
+    print(f"\n🎲 最不稳定的任务（失败或重试过的运行占比）:")
+    if not flaky:
+        print("   （无）")
+    for item in flaky:
+        print(f"   {item.flakiness:>4.0%}  失败 {item.failures}/{item.runs}，重试过 {item.retried} 次  "
+              f"[{item.backend or '-'}] {item.stage}: {item.description[:60]}")
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='查询 DAG 任务运行历史：最慢和最不稳定的任务')
+    parser.add_argument('-n', '--limit', type=int, default=DEFAULT_LIMIT,
+                        help=f'每类列出的任务数 (默认: {DEFAULT_LIMIT})')
+    parser.add_argument('--backend', choices=['batchcc', 'batchcx'], help='只统计指定后端的记录')
+    parser.add_argument('--path', help=f'历史文件路径 (默认: {os.path.join(HISTORY_DIR, HISTORY_FILE_NAME)})')
+    args = parser.parse_args(argv)
+    print_report(RunHistory(args.path), args.limit, args.backend)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,6 +2,10 @@
 """
 DAG 任务状态管理器
 支持断点续传和状态持久化
+
+矩阵子任务只记录参数组合（params），不重复保存模板描述，1 万个子任务的状态文件仍然紧凑。
+普通任务记录指纹（write_sets.task_fingerprint），以往运行的耗时按指纹匹配用于估计（见 task_priority.py）；
+矩阵子任务同样为保持紧凑不记录指纹。
 """
 
 import json
@@ -12,17 +16,31 @@ from pathlib import Path
 from typing import Dict, List, Optional, Any
 from dataclasses import dataclass, asdict
 
+from write_sets import task_fingerprint
+
 
 @dataclass
 class TaskState:
     """任务状态"""
     task_id: int
-    description: str
+    description: Optional[str]  # 矩阵子任务为 None（描述由模板 + params 得到）
     status: str  # pending, in_progress, completed, failed, skipped
     start_time: Optional[str] = None
     end_time: Optional[str] = None
     error: Optional[str] = None
     duration: Optional[float] = None
+    params: Optional[str] = None  # 矩阵子任务的参数组合（module=a, lang=x）
+    skip_reason: Optional[str] = None  # skipped：被哪个失败任务阻塞（--keep-going）
+    attempts: Optional[List[Dict]] = None  # 瞬时失败重试记录（见 record_attempt）
+    fingerprint: Optional[str] = None  # 任务指纹（描述 + 文件范围，跨运行匹配耗时；矩阵子任务不记录）
+
+    @classmethod
+    def pending(cls, task: Any) -> 'TaskState':
+        """TaskNode 的初始状态"""
+        if task.params:
+            return cls(task_id=task.task_id, description=None, status='pending', params=task.params)
+        return cls(task_id=task.task_id, description=task.description, status='pending',
+                   fingerprint=task_fingerprint(task))
 
     def to_dict(self) -> Dict:
         """转换为字典"""
@@ -170,17 +188,43 @@ class StateManager:
             )
 
             for task in stage.tasks:
-                task_state = TaskState(
-                    task_id=task.task_id,
-                    description=task.description,
-                    status='pending'
-                )
-                stage_state.tasks.append(task_state)
+                stage_state.tasks.append(TaskState.pending(task))
 
             self.state['stages'].append(stage_state.to_dict())
 
         self.save_state()
 
+    def sync_stages(self, stages: List[Any]):
+        """
+        同步热更新后的执行计划（追加新阶段/新任务，刷新未开始任务的描述）
+
+        已有条目按 stage_id / task_id 位置对应，状态和耗时保持不变。
+
+        Args:
+            stages: 合并后的 StageNode 列表
+        """
+        stage_states = self.state.setdefault('stages', [])
+        for stage in stages:
+            if stage.stage_id >= len(stage_states):
+                stage_states.append(StageState(
+                    stage_id=stage.stage_id, name=stage.name, mode=stage.mode, status='pending', tasks=[]
+                ).to_dict())
+            stage_state = stage_states[stage.stage_id]
+            if stage_state.get('status') == 'pending':
+                stage_state['name'] = stage.name
+                stage_state['mode'] = stage.mode
+
+            tasks = stage_state.setdefault('tasks', [])
+            for task in stage.tasks:
+                task_index = task.task_id - 1
+                if task_index >= len(tasks):
+                    tasks.append(TaskState.pending(task).to_dict())
+                elif tasks[task_index].get('status') == 'pending':
+                    tasks[task_index].pop('description' if task.params else 'params', None)
+                    tasks[task_index].update(TaskState.pending(task).to_dict())
+
+        self.save_state()
+
     def should_skip_stage(self, stage_id: int) -> bool:
         """
         判断是否应该跳过某个阶段
@@ -252,10 +296,22 @@ class StateManager:
             if task_index < len(tasks):
                 tasks[task_index]['status'] = 'in_progress'
                 tasks[task_index]['start_time'] = self._now()
+                tasks[task_index].pop('skip_reason', None)
+                tasks[task_index].pop('attempts', None)  # 只保留本次运行的重试记录
                 self.save_state()
 
-    def complete_task(self, stage_id: int, task_id: int, success: bool, error: str = None):
-        """标记任务完成"""
+    def complete_task(self, stage_id: int, task_id: int, success: bool, error: str = None,
+                      duration: float = None):
+        """
+        标记任务完成
+
+        Args:
+            stage_id: 阶段ID
+            task_id: 任务ID
+            success: 是否成功
+            error: 错误信息
+            duration: 执行器按单调时钟测得的耗时（秒）；未提供时按开始/结束时间戳计算（精确到秒）
+        """
         if stage_id < len(self.state['stages']):
             tasks = self.state['stages'][stage_id].get('tasks', [])
             task_index = task_id - 1
@@ -268,14 +324,62 @@ class StateManager:
                 if error:
                     task['error'] = error
 
-                # 计算耗时
-                if task.get('start_time'):
+                # 计算耗时（并行批次不写 start_time，耗时由执行器传入）
+                if duration is not None:
+                    task['duration'] = round(duration, 3)
+                elif task.get('start_time'):
                     start = datetime.fromisoformat(task['start_time'])
                     end = datetime.fromisoformat(task['end_time'])
                     task['duration'] = (end - start).total_seconds()
 
                 self.save_state()
 
+    def skip_task(self, stage_id: int, task_id: int, reason: str):
+        """
+        标记任务被跳过（--keep-going 下被失败任务阻塞；断点续传时与失败任务一起重新执行）
+
+        Args:
+            stage_id: 阶段ID
+            task_id: 任务ID（从1开始）
+            reason: 跳过原因（阻塞它的失败任务）
+        """
+        if stage_id < len(self.state['stages']):
+            tasks = self.state['stages'][stage_id].get('tasks', [])
+            task_index = task_id - 1
+
+            if task_index < len(tasks):
+                tasks[task_index]['status'] = 'skipped'
+                tasks[task_index]['skip_reason'] = reason
+                self.save_state()
+
+    def record_attempt(self, stage_id: int, task_id: int, attempt: int, reason: str, error: str, delay: float):
+        """
+        记录一次瞬时失败重试（任务保持 in_progress，退避后重新执行）
+
+        Args:
+            stage_id: 阶段ID
+            task_id: 任务ID（从1开始）
+            attempt: 失败的是第几次执行（从1开始）
+            reason: 瞬时失败原因（限流 / 网络 / 服务端错误 / 超时 / 被终止）
+            error: 错误信息（只保留末尾）
+            delay: 退避秒数
+        """
+        if stage_id < len(self.state['stages']):
+            tasks = self.state['stages'][stage_id].get('tasks', [])
+            task_index = task_id - 1
+
+            if task_index < len(tasks):
+                task = tasks[task_index]
+                task['status'] = 'in_progress'
+                task.setdefault('attempts', []).append({
+                    'attempt': attempt,
+                    'time': self._now(),
+                    'reason': reason,
+                    'error': error.strip()[-500:],
+                    'backoff': round(delay, 1)
+                })
+                self.save_state()
+
     def complete_all(self, success: bool):
         """标记整体完成"""
         self.state['overall_status'] = 'completed' if success else 'failed'
@@ -306,12 +410,18 @@ class StateManager:
             completed_tasks = sum(1 for t in tasks if t.get('status') == 'completed')
             print(f"   任务进度: {completed_tasks}/{len(tasks)}")
 
-            # 显示失败的任务
+            # 显示失败和被跳过的任务
             for task in tasks:
                 if task.get('status') == 'failed':
-                    print(f"   ❌ Task {task['task_id']}: {task['description'][:50]}")
+                    print(f"   ❌ Task {task['task_id']}: {(task.get('description') or task.get('params', ''))[:50]}")
                     if task.get('error'):
                         print(f"      错误: {task['error']}")
+                    if task.get('attempts'):
+                        reasons = "、".join(sorted({a['reason'] for a in task['attempts']}))
+                        print(f"      已重试: {len(task['attempts'])} 次（{reasons}）")
+                elif task.get('status') == 'skipped':
+                    print(f"   ⏭️  Task {task['task_id']}: {(task.get('description') or task.get('params', ''))[:50]}")
+                    print(f"      原因: {task.get('skip_reason', '')}")
 
         print(f"{'=' * 80}\n")
 
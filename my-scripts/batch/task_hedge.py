@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+对冲执行 - 并行批次中的慢任务在独立工作副本中再启动一份，先成功的一方胜出
+
+批次执行要等最慢的任务结束才能进入下一批次；agent 偶尔会卡在一次很慢的请求或绕远路，
+同一个任务重新跑一次往往很快完成。开启 --hedge 后：
+
+- 阈值：同一批次已成功完成的任务不少于 min_peers 个时，取它们耗时的 P{percentile}；
+  不足时取历史估计（estimate 钩子：batchcc / batchcx 传入运行历史中该任务的 P90，见 run_history.py；
+  没有历史时不对冲）；阈值不低于 min_runtime
+- 触发：任务运行时间超过阈值、有空闲并发槽位且没有排队中的任务时（async_engine.run_bounded 检查），
+  在 `git worktree add --detach` 创建的独立工作副本中运行同一个命令；每次执行至多对冲一次，副本占用一个槽位
+- 胜出：先成功的一方胜出，另一方的进程组被终止；都失败时按原任务的结果处理（之后照常走重试/失败流程）
+- 合并：副本胜出时，声明范围（文件: 减去 排除:）内的文件同步为副本的版本
+  （原任务已写入的改动被覆盖或删除），再由完成回调照常自动提交；原任务胜出时直接丢弃副本。
+  副本在范围外的改动不合并（给出提示）；原任务在范围外的改动还原为基准提交的版本，不随副本的结果提交
+- 归属：主工作区由同批次任务共享，原任务独占运行时（writes 钩子：batchcc / batchcx 传入任务开始时的
+  工作区快照，见 write_sets.WriteTracker）范围外的改动都属于它；有其他任务同时运行时，落在其他任务
+  声明范围内的改动归其他任务，其余改动无法确定归属 —— 此时不采用副本，继续等待原任务的结果
+- 只对声明了 文件: 的任务对冲（否则无法确定要回滚原任务的哪些改动），且工作目录需在 git 仓库中
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import replace
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from async_engine import run_process
+from file_index import _git
+from task_retry import format_duration
+from write_sets import outside_scope
+
+# 默认阈值：同批次已完成任务耗时的百分位
+DEFAULT_PERCENTILE = 90
+# 计算百分位至少需要的已完成任务数
+DEFAULT_MIN_PEERS = 3
+# 运行时间低于该秒数的任务不对冲（短任务重跑收益小于创建工作副本的开销）
+DEFAULT_MIN_RUNTIME = 60.0
+# 创建/删除工作副本的超时秒数
+GIT_TIMEOUT = 120
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """最近秩百分位（values 非空）"""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+class HedgePolicy:
+    """对冲策略与统计（整个运行共享，线程安全）"""
+
+    def __init__(self, percentile: float = DEFAULT_PERCENTILE, min_peers: int = DEFAULT_MIN_PEERS,
+                 min_runtime: float = DEFAULT_MIN_RUNTIME,
+                 estimate: Callable[[object], Optional[float]] = None):
+        """
+        Args:
+            percentile: 阈值百分位（1-100）
+            min_peers: 按同批次耗时计算阈值至少需要的已完成任务数
+            min_runtime: 阈值下限（秒）
+            estimate: 历史耗时估计 (任务节点) → 秒数或 None；同批次样本不足时使用
+
+        Raises:
+            ValueError: percentile 不在 1-100 之间
+        """
+        if not 1 <= percentile <= 100:
+            raise ValueError(f"百分位应在 1-100 之间，当前: {percentile}")
+        self.percentile = percentile
+        self.min_peers = max(1, min_peers)
+        self.min_runtime = max(0.0, min_runtime)
+        self.estimate = estimate
+        self._lock = threading.Lock()
+        # 统计
+        self.launched = 0  # 启动的副本数
+        self.hedge_won = 0  # 副本先成功
+        self.original_won = 0  # 原任务先成功
+        self.both_failed = 0  # 双方都失败
+        self.duplicate_seconds = 0.0  # 副本累计运行时间
+
+    def eligible(self, task) -> bool:
+        """任务是否可以对冲（声明了 文件: 范围）"""
+        return bool(getattr(task, 'files', None))
+
+    def threshold(self, task, durations: Sequence[float]) -> Optional[float]:
+        """
+        任务运行多久后对冲
+
+        Args:
+            task: 任务节点
+            durations: 同一批次已成功完成的任务耗时（秒）
+
+        Returns:
+            阈值秒数；不可对冲或没有足够的参照时返回 None
+        """
+        if not self.eligible(task):
+            return None
+        if len(durations) >= self.min_peers:
+            limit = percentile(durations, self.percentile)
+        elif self.estimate is not None:
+            limit = self.estimate(task)
+            if limit is None:
+                return None
+        else:
+            return None
+        return max(self.min_runtime, limit)
+
+    def record_launch(self):
+        with self._lock:
+            self.launched += 1
+
+    def record(self, winner: Optional[str], duplicate_seconds: float):
+        """
+        记录一次对冲的结果
+
+        Args:
+            winner: 'hedge' / 'original' / None（都失败）
+            duplicate_seconds: 副本运行时间
+        """
+        with self._lock:
+            if winner == 'hedge':
+                self.hedge_won += 1
+            elif winner == 'original':
+                self.original_won += 1
+            else:
+                self.both_failed += 1
+            self.duplicate_seconds += duplicate_seconds
+
+    def describe(self) -> str:
+        """--dry-run 显示的对冲策略"""
+        return (f"并行批次中运行时间超过同批任务 P{self.percentile:g}（至少 {self.min_peers} 个样本，"
+                f"不低于 {format_duration(self.min_runtime)}）的任务在独立工作副本中再启动一份，先成功者胜出"
+                f"（仅声明了 文件: 的任务）")
+
+    def report(self) -> List[str]:
+        """运行结束时的对冲统计（没有对冲时为空）"""
+        if not self.launched:
+            return []
+        line = (f"🏁 对冲执行: 启动 {self.launched} 个副本，副本胜出 {self.hedge_won} 次，"
+                f"原任务胜出 {self.original_won} 次")
+        if self.both_failed:
+            line += f"，双方都失败 {self.both_failed} 次"
+        return [line + f"（副本共运行 {format_duration(self.duplicate_seconds)}）"]
+
+
+class WorktreeHedger:
+    """run_bounded 的对冲实现：副本在独立 git worktree 中运行，胜出时把声明范围内的改动同步回主工作区"""
+
+    def __init__(self, policy: HedgePolicy, tasks: Sequence, run: Callable[[int, str], Awaitable],
+                 cwd: str = None, writes: Callable[[int], Tuple[Optional[List[str]], bool]] = None):
+        """
+        Args:
+            policy: 对冲策略（阈值 + 统计）
+            tasks: 与 run_bounded jobs 一一对应的任务节点
+            run: 在指定工作目录运行第 index 个任务 (序号, 工作目录) → TaskResult 协程
+            cwd: 主工作目录（默认当前工作目录；任务的 文件: 范围相对于它）
+            writes: 第 index 个任务开始以来主工作区内容变化的文件（相对 cwd）及是否独占运行
+                    (序号) → (文件列表或 None, 是否独占)；未提供时按相对基准提交的改动、视为有其他任务
+        """
+        self.policy = policy
+        self.tasks = tasks
+        self._run = run
+        self._writes = writes
+        self.cwd = os.path.abspath(cwd or os.getcwd())
+        root = _git(self.cwd, 'rev-parse', '--show-toplevel')
+        self.root = os.path.abspath(root.strip()) if root else None
+        self.copies: Dict[int, Tuple[str, str]] = {}  # 序号 → (工作副本路径, 基准提交)
+        self.started: Dict[int, float] = {}  # 序号 → 副本启动时间
+
+    def threshold(self, index: int, durations: Sequence[float]) -> Optional[float]:
+        """第 index 个任务的对冲阈值（不在 git 仓库中时不对冲）"""
+        if self.root is None:
+            return None
+        return self.policy.threshold(self.tasks[index], durations)
+
+    async def run(self, index: int, elapsed: float):
+        """
+        创建工作副本并在其中运行第 index 个任务
+
+        Raises:
+            RuntimeError: 无法创建工作副本（副本按失败处理，原任务继续）
+        """
+        task = self.tasks[index]
+        self.policy.record_launch()
+        self.started[index] = time.time()
+        print(f"\n🏁 [{task.task_id}] 已运行 {format_duration(elapsed)}，超过对冲阈值，在独立工作副本中启动副本",
+              flush=True)
+        base = (_git(self.root, 'rev-parse', 'HEAD') or '').strip()
+        if not base:
+            raise RuntimeError("仓库没有提交，无法创建工作副本")
+        path = tempfile.mkdtemp(prefix='batch-hedge-')
+        self.copies[index] = (path, base)
+        output = await run_process(['git', 'worktree', 'add', '--detach', path, base], self.root, timeout=GIT_TIMEOUT)
+        if output.returncode != 0:
+            raise RuntimeError(f"创建工作副本失败: {output.stderr.strip()[:200]}")
+        return await self._run(index, os.path.join(path, os.path.relpath(self.cwd, self.root)))
+
+    def accept(self, index: int) -> bool:
+        """副本先成功时能否采用：原任务在范围外的改动无法确定归属时不采用（继续等待原任务）"""
+        _, base = self.copies.get(index, ("", ""))
+        if self._strays(index, base) is not None:
+            return True
+        print(f"\n🏁 [{self.tasks[index].task_id}] 副本先完成，但主工作区有无法确定归属的声明范围外改动"
+              f"（有其他任务同时运行），不采用副本，继续等待原任务", flush=True)
+        return False
+
+    def settle(self, index: int, winner: Optional[str], result):
+        """
+        对冲结束（在完成回调之前调用）：副本胜出时同步改动，然后删除工作副本
+
+        Args:
+            index: 任务序号
+            winner: 'hedge' / 'original' / None（都失败）
+            result: 胜出方的结果
+
+        Returns:
+            交给完成回调的结果（同步失败时改为失败结果）
+        """
+        task = self.tasks[index]
+        path, base = self.copies.pop(index, ("", ""))
+        self.policy.record(winner, time.time() - self.started.pop(index, time.time()))
+        if winner == 'hedge':
+            print(f"\n🏁 [{task.task_id}] 副本先完成，终止原任务并采用副本的改动", flush=True)
+            try:
+                self._adopt(index, path, base)
+            except OSError as e:
+                result = replace(result, success=False, error_msg=f"同步对冲副本的改动失败: {e}")
+        elif winner == 'original':
+            print(f"\n🏁 [{task.task_id}] 原任务先完成，丢弃对冲副本", flush=True)
+        self._remove(path)
+        return result
+
+    def close(self):
+        """删除未结算的工作副本（中断时）"""
+        for index in list(self.copies):
+            path, _ = self.copies.pop(index)
+            self._remove(path)
+
+    def _adopt(self, index: int, path: str, base: str):
+        """
+        声明范围内的文件同步为副本的版本（原任务的改动 ∪ 副本的改动），
+        原任务在范围外的改动还原为基准提交的版本
+        """
+        task = self.tasks[index]
+        copy_cwd = os.path.join(path, os.path.relpath(self.cwd, self.root))
+        copy_changed = self._changed(copy_cwd, base)
+        main_changed = self._changed(self.cwd, base)
+        strays = self._strays(index, base)
+        if copy_changed is None or main_changed is None:
+            raise OSError("无法读取 git 改动列表")
+        if strays is None:
+            raise OSError("原任务在声明范围外的改动无法确定归属")
+        dropped = outside_scope(task, copy_changed)
+        if dropped:
+            more = f" 等 {len(dropped)} 个文件" if len(dropped) > 5 else ""
+            print(f"⚠️ Task {task.task_id} 的副本修改了声明范围外的文件，未合并: {', '.join(dropped[:5])}{more}")
+        paths = set(copy_changed) | set(main_changed)
+        for rel in sorted(paths - set(outside_scope(task, sorted(paths)))):
+            source = os.path.join(copy_cwd, rel)
+            target = os.path.join(self.cwd, rel)
+            if os.path.lexists(source):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if os.path.lexists(target) and not os.path.isdir(target):
+                    os.remove(target)
+                shutil.copy2(source, target, follow_symlinks=False)
+            elif os.path.lexists(target):
+                os.remove(target)
+        if strays:
+            self._restore(strays, base)
+            more = f" 等 {len(strays)} 个文件" if len(strays) > 5 else ""
+            print(f"↩️ Task {task.task_id} 的原任务修改了声明范围外的文件，已还原: {', '.join(strays[:5])}{more}")
+
+    def _strays(self, index: int, base: str) -> Optional[List[str]]:
+        """
+        原任务在声明范围外的改动（相对 cwd）
+
+        Returns:
+            需要还原的文件；有其他任务同时运行时不含其他任务声明范围内的文件，
+            还有其余范围外改动（无法确定归属）时返回 None
+        """
+        task = self.tasks[index]
+        paths, alone = self._writes(index) if self._writes else (None, False)
+        if paths is None:
+            paths = self._changed(self.cwd, base) if base else None
+            if paths is None:
+                return None
+        strays = outside_scope(task, paths)
+        if alone:
+            return strays
+        peers = [peer for peer in self.tasks if peer is not task and peer.files]
+        unclaimed = [rel for rel in strays if all(outside_scope(peer, [rel]) for peer in peers)]
+        return None if unclaimed else []
+
+    def _restore(self, paths: List[str], base: str):
+        """文件还原为基准提交的版本（基准提交中不存在的删除）"""
+        listed = _git(self.cwd, 'ls-tree', '-r', '--name-only', '-z', base, '--', *paths)
+        if listed is None:
+            raise OSError("无法读取基准提交的文件列表")
+        existing = {rel for rel in listed.split('\0') if rel}
+        if existing and _git(self.cwd, 'checkout', base, '--', *sorted(existing)) is None:
+            raise OSError("还原声明范围外的文件失败")
+        for rel in paths:
+            target = os.path.join(self.cwd, rel)
+            if rel not in existing and os.path.lexists(target) and not os.path.isdir(target):
+                os.remove(target)
+
+    @staticmethod
+    def _changed(cwd: str, base: str) -> Optional[List[str]]:
+        """相对基准提交变化的文件（含已提交、未暂存和未跟踪的文件，相对 cwd；排除 .task-*/ 任务目录）"""
+        tracked = _git(cwd, 'diff', '--name-only', '--no-renames', '--relative', '-z', base)
+        untracked = _git(cwd, 'ls-files', '--others', '--exclude-standard', '-z')
+        if tracked is None or untracked is None:
+            return None
+        paths = {path for path in (tracked + untracked).split('\0') if path}
+        return sorted(path for path in paths if not path.split('/', 1)[0].startswith('.task-'))
+
+    def _remove(self, path: str):
+        """删除工作副本（git worktree remove，失败时直接删除目录再 prune）"""
+        if not path:
+            return
+        if self.root is None or _git(self.root, 'worktree', 'remove', '--force', path) is None:
+            shutil.rmtree(path, ignore_errors=True)
+            if self.root is not None:
+                _git(self.root, 'worktree', 'prune')
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+矩阵任务（参数化 TASK）- 一个任务模板按参数组合展开为多个子任务
+
+写法（TASK 标记行参数）：
+- matrix="module=a,b,c;lang=x,y"：各维度取值的笛卡尔积（最后一维变化最快），共 3×2 个子任务
+- matrix_file="list.txt"：每个非空行一个组合，`module=a;lang=x` 或单个值（绑定为 {item}）；
+  # 开头的行为注释。与 matrix= 同时使用时，文件的行作为最外层维度
+
+模板的描述、文件:、排除:、验证: 以及 @引用 中的 {参数名} 在展开时替换。
+TaskMatrix 只保存各维度取值（或文件行），第 i 个组合按需计算，不预先生成全部组合。
+分片任务（shard="..."，见 task_shard.py）同样以 TaskMatrix 表示：shards 保存各子任务收窄后的文件范围。
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+# {参数名} 占位符（未定义的参数名原样保留，不影响描述中的普通花括号）
+PLACEHOLDER_RE = re.compile(r'\{(\w+)\}')
+_NAME_RE = re.compile(r'\w+')
+# matrix_file 单值行绑定的参数名
+ITEM_PARAM = 'item'
+
+
+@dataclass(slots=True)
+class TaskMatrix:
+    """矩阵参数（笛卡尔积维度 + 可选的文件行）"""
+    axes: List[Tuple[str, List[str]]]  # [(参数名, 取值列表)]，最后一维变化最快
+    rows: List[str] = field(default_factory=list)  # matrix_file 的有效行（原样保存，取用时解析）
+    source: str = ""  # 原始写法（用于展示）
+    shards: List[List[str]] = field(default_factory=list)  # 分片任务：各子任务的 文件: 范围（与 axes/rows 互斥）
+
+    @property
+    def size(self) -> int:
+        """子任务数"""
+        if self.shards:
+            return len(self.shards)
+        size = len(self.rows) if self.rows else 1
+        for _, values in self.axes:
+            size *= len(values)
+        return size
+
+    def params(self, index: int) -> Dict[str, str]:
+        """
+        第 index 个组合（从0开始）
+
+        Returns:
+            {参数名: 取值}，文件行的参数在前；分片任务为 {'shard': '序号/总数'}
+        """
+        if self.shards:
+            return {'shard': f"{index + 1}/{len(self.shards)}"}
+        positions = []
+        for _, values in reversed(self.axes):
+            index, position = divmod(index, len(values))
+            positions.append(position)
+        params = parse_row(self.rows[index]) if self.rows else {}
+        for (name, values), position in zip(self.axes, reversed(positions)):
+            params[name] = values[position]
+        return params
+
+    def to_dict(self) -> Dict:
+        """转换为字典（用于执行计划缓存）"""
+        data = {'axes': [[name, values] for name, values in self.axes], 'rows': self.rows, 'source': self.source}
+        if self.shards:
+            data['shards'] = self.shards
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'TaskMatrix':
+        """从字典恢复"""
+        return cls(axes=[(name, values) for name, values in data.get('axes', [])],
+                   rows=data.get('rows', []), source=data.get('source', ""), shards=data.get('shards', []))
+
+
+def parse_axes(spec: str, location: str) -> List[Tuple[str, List[str]]]:
+    """
+    解析 matrix="module=a,b,c;lang=x,y"
+
+    Raises:
+        ValueError: 维度格式错误、参数名重复或取值为空（信息带 file:line）
+    """
+    axes: List[Tuple[str, List[str]]] = []
+    for part in spec.split(';'):
+        if not part.strip():
+            continue
+        name, sep, raw_values = part.partition('=')
+        name = name.strip()
+        values = [value.strip() for value in raw_values.split(',') if value.strip()]
+        if not sep or not _NAME_RE.fullmatch(name):
+            raise ValueError(f"{location}: matrix 维度格式应为 参数名=值1,值2，当前: {part.strip()}")
+        if not values:
+            raise ValueError(f"{location}: matrix 维度 {name} 没有取值")
+        if any(name == existing for existing, _ in axes):
+            raise ValueError(f"{location}: matrix 参数名重复: {name}")
+        axes.append((name, values))
+    return axes
+
+
+def parse_row(row: str) -> Dict[str, str]:
+    """解析 matrix_file 的一行：module=a;lang=x 或单个值（绑定为 {item}）"""
+    if '=' not in row:
+        return {ITEM_PARAM: row}
+    params = {}
+    for part in row.split(';'):
+        name, _, value = part.partition('=')
+        if name.strip():
+            params[name.strip()] = value.strip()
+    return params
+
+
+def load_rows(lines: List[str], display: str) -> List[str]:
+    """
+    读取 matrix_file 的有效行（跳过空行和 # 注释行），并检查每行格式
+
+    Raises:
+        ValueError: 行内参数格式错误（信息带 file:line）
+    """
+    rows = []
+    for lineno, line in enumerate(lines, 1):
+        row = line.strip()
+        if not row or row[0] == '#':
+            continue
+        if '=' in row:
+            for part in row.split(';'):
+                name, sep, _ = part.partition('=')
+                if part.strip() and (not sep or not _NAME_RE.fullmatch(name.strip())):
+                    raise ValueError(f"{display}:{lineno}: matrix_file 行格式应为 参数名=值;参数名=值 或单个值，"
+                                     f"当前: {row}")
+        rows.append(row)
+    return rows
+
+
+def substitute(text: str, params: Dict[str, str]) -> str:
+    """替换 text 中的 {参数名}（未定义的参数名原样保留）"""
+    if '{' not in text:
+        return text
+    return PLACEHOLDER_RE.sub(lambda m: params.get(m.group(1), m.group(0)), text)
+
+
+def format_params(params: Dict[str, str]) -> str:
+    """参数组合的展示形式：module=a, lang=x"""
+    return ', '.join(f"{name}={value}" for name, value in params.items())
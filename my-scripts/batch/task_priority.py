@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+关键路径优先 - 按预计剩余关键路径长度排列就绪任务（最长处理时间优先）
+
+并行批次原先按文件顺序提交任务，恰好排在最后的长任务最后才启动，拉长整个批次；
+任务级调度（depends_on / --no-barrier）的就绪队列同样按 (stage_id, task_id) 取任务。
+开启 --critical-path 后：
+
+- 耗时估计（DurationEstimator）：运行历史（run_history.py）和以往运行的状态文件（.task-*/state.json、
+  旧格式 *.state.json）中已完成任务的 duration，按任务指纹（write_sets.task_fingerprint：描述 + 文件范围）匹配，取中位数；
+  没有记录时按描述长度和 文件: 范围的宽度估计（heuristic_duration，只用于排序，不是真实耗时）
+- 剩余关键路径（critical_path）：任务自身估计 + 所有后继（显式 depends_on、串行阶段的下一个任务、
+  等待本阶段整体完成的后续阶段）中最长的剩余关键路径；阶段屏障下同阶段任务的后继相同，
+  排序退化为最长处理时间优先（LPT）
+- 显式覆盖：TASK 标记行 priority="N"（整数，越大越先启动，默认 0）先于估计值比较；
+  不开启 --critical-path 时也生效，此时同优先级的任务保持原顺序
+"""
+
+import glob
+import json
+import os
+import statistics
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from dag_parser import StageNode, TaskNode, task_predecessors
+from write_sets import task_fingerprint
+
+TaskKey = Tuple[int, int]  # (stage_id, task_id)
+# 排序键：(-priority, -剩余关键路径秒数)，越小越先启动
+OrderKey = Tuple[int, float]
+DEFAULT_ORDER: OrderKey = (0, 0.0)
+
+# 启发式估计：基础耗时 + 描述每字符 + 文件范围每单位宽度（秒）
+HEURISTIC_BASE = 120.0
+HEURISTIC_PER_CHAR = 0.5
+HEURISTIC_PER_SCOPE = 30.0
+# 文件范围宽度：递归通配 / 通配或目录 / 单个文件；未声明 文件: 的任务按一个目录计
+_SCOPE_RECURSIVE = 8
+_SCOPE_WILDCARD = 3
+_SCOPE_FILE = 1
+
+
+def scope_breadth(task: TaskNode) -> int:
+    """文件范围的宽度（** 最宽，* / ? / [...] 和目录次之，单个文件最窄）"""
+    if not task.files:
+        return _SCOPE_WILDCARD
+    breadth = 0
+    for pattern in task.files:
+        if '**' in pattern:
+            breadth += _SCOPE_RECURSIVE
+        elif any(char in pattern for char in '*?[') or pattern.endswith('/') or pattern.strip() in ('.', './'):
+            breadth += _SCOPE_WILDCARD
+        else:
+            breadth += _SCOPE_FILE
+    return breadth
+
+
+def heuristic_duration(task: TaskNode) -> float:
+    """没有历史记录时的耗时估计（秒）：描述越长、文件范围越宽，预计越久"""
+    return HEURISTIC_BASE + HEURISTIC_PER_CHAR * len(task.description) + HEURISTIC_PER_SCOPE * scope_breadth(task)
+
+
+def state_files(root: str = None) -> List[str]:
+    """工作目录下的任务状态文件（.task-*/state.json 与旧格式 *.state.json）"""
+    root = root or os.getcwd()
+    return sorted(glob.glob(os.path.join(root, '.task-*', 'state.json')) +
+                  glob.glob(os.path.join(root, '*.state.json')))
+
+
+def load_durations(paths: Iterable[str]) -> Dict[str, List[float]]:
+    """
+    从状态文件读取已完成任务的耗时（串行和并行批次的任务都有：耗时由执行器写入，见 StateManager.complete_task）
+
+    Returns:
+        {任务指纹: [耗时秒数, ...]}（没有记录指纹的旧状态文件不参与匹配）
+    """
+    samples: Dict[str, List[float]] = {}
+    for path in paths:
+        try:
+            with open(path, encoding='utf-8') as f:
+                stages = json.load(f).get('stages', [])
+        except (OSError, ValueError, AttributeError):
+            continue
+        for stage in stages:
+            for task in stage.get('tasks', []):
+                fingerprint, duration = task.get('fingerprint'), task.get('duration')
+                if task.get('status') == 'completed' and fingerprint and isinstance(duration, (int, float)):
+                    samples.setdefault(fingerprint, []).append(float(duration))
+    return samples
+
+
+class DurationEstimator:
+    """任务耗时估计：历史记录的中位数，没有记录时用启发式估计"""
+
+    def __init__(self, samples: Dict[str, List[float]] = None):
+        """
+        Args:
+            samples: {任务指纹: [耗时秒数, ...]}
+        """
+        self.samples: Dict[str, List[float]] = samples or {}
+
+    @classmethod
+    def from_state_files(cls, paths: Sequence[str] = None,
+                         history: Dict[str, List[float]] = None) -> 'DurationEstimator':
+        """
+        从状态文件加载（默认当前工作目录下的全部状态文件）
+
+        Args:
+            paths: 状态文件路径
+            history: 运行历史中的耗时 {任务指纹: [秒数, ...]}（RunHistory.durations()）；
+                     有记录的任务优先使用，状态文件只补充运行历史中没有的任务（避免同一次运行重复计入）
+        """
+        samples = dict(history or {})
+        for fingerprint, durations in load_durations(state_files() if paths is None else paths).items():
+            samples.setdefault(fingerprint, durations)
+        return cls(samples)
+
+    def history(self, task: TaskNode) -> Optional[float]:
+        """历史耗时中位数；没有记录时返回 None"""
+        durations = self.samples.get(task_fingerprint(task))
+        return statistics.median(durations) if durations else None
+
+    def estimate(self, task: TaskNode) -> float:
+        """预计耗时（秒）"""
+        known = self.history(task)
+        return heuristic_duration(task) if known is None else known
+
+
+def critical_path(stages: Sequence[StageNode], weight: Callable[[TaskNode], float]) -> Dict[TaskKey, float]:
+    """
+    每个任务的剩余关键路径长度（自身耗时 + 后继中最长的剩余关键路径）
+
+    前置关系与调度器一致（dag_parser.task_predecessors）；"阶段整体完成" 作为零耗时的虚拟节点，
+    它的前置是阶段内全部任务和上一阶段的整体完成。按逆拓扑序计算，不递归（万级串行链也不会爆栈）。
+
+    Args:
+        stages: 阶段列表（依赖已通过循环检测）
+        weight: 任务耗时估计
+
+    Returns:
+        {(stage_id, task_id): 剩余关键路径秒数}
+    """
+    weights: Dict[tuple, float] = {}
+    edges: List[Tuple[tuple, tuple]] = []
+    for stage in stages:
+        done = ('stage', stage.stage_id)
+        weights[done] = 0.0
+        edges.append((('stage', stage.stage_id - 1), done))
+        for index, task in enumerate(stage.tasks):
+            key = (stage.stage_id, task.task_id)
+            weights[key] = weight(task)
+            predecessors, wait_stage = task_predecessors(stage, index)
+            edges.extend((pred, key) for pred in predecessors)
+            if wait_stage is not None:
+                edges.append((('stage', wait_stage), key))
+            edges.append((key, done))
+
+    successors_left: Dict[tuple, int] = dict.fromkeys(weights, 0)
+    predecessors_of: Dict[tuple, List[tuple]] = {}
+    for pred, succ in edges:
+        if pred in weights and succ in weights:
+            successors_left[pred] += 1
+            predecessors_of.setdefault(succ, []).append(pred)
+
+    longest_tail: Dict[tuple, float] = {}
+    ranks: Dict[tuple, float] = {}
+    queue = [node for node, count in successors_left.items() if count == 0]
+    while queue:
+        node = queue.pop()
+        ranks[node] = weights[node] + longest_tail.get(node, 0.0)
+        for pred in predecessors_of.get(node, ()):
+            longest_tail[pred] = max(longest_tail.get(pred, 0.0), ranks[node])
+            successors_left[pred] -= 1
+            if successors_left[pred] == 0:
+                queue.append(pred)
+    return {node: rank for node, rank in ranks.items() if node[0] != 'stage'}
+
+
+class TaskPriority:
+    """就绪任务的启动顺序：priority= 覆盖优先，其次剩余关键路径（estimator 为 None 时只按 priority=）"""
+
+    def __init__(self, estimator: Optional[DurationEstimator] = None):
+        """
+        Args:
+            estimator: 耗时估计（--critical-path）；None 时同优先级的任务保持原顺序
+        """
+        self.estimator = estimator
+
+    def order(self, stages: Sequence[StageNode]) -> Dict[TaskKey, OrderKey]:
+        """
+        各任务的排序键（越小越先启动；相同时调用方按 (stage_id, task_id) 排序）
+
+        Returns:
+            {(stage_id, task_id): (-priority, -剩余关键路径秒数)}；没有任务需要调整顺序时为空
+        """
+        if self.estimator is None:
+            return {(stage.stage_id, task.task_id): (-task.priority, 0.0)
+                    for stage in stages for task in stage.tasks if task.priority}
+        ranks = critical_path(stages, self.estimator.estimate)
+        return {(stage.stage_id, task.task_id): (-task.priority, -ranks.get((stage.stage_id, task.task_id), 0.0))
+                for stage in stages for task in stage.tasks}
+
+    def sort(self, tasks: Sequence[TaskNode], order: Dict[TaskKey, OrderKey]) -> List[TaskNode]:
+        """按排序键排列任务（批次执行时的提交顺序；排序键相同的任务保持原顺序）"""
+        return sorted(tasks, key=lambda task: order.get((task.stage_id, task.task_id), DEFAULT_ORDER))
+
+    def describe(self, stages: Sequence[StageNode]) -> str:
+        """--dry-run 显示的排序方式"""
+        if self.estimator is None:
+            return "priority= 较大的任务先启动，其余按任务顺序"
+        tasks = [task for stage in stages for task in stage.tasks]
+        known = sum(1 for task in tasks if self.estimator.history(task) is not None)
+        return (f"关键路径优先（priority= 覆盖；{known}/{len(tasks)} 个任务有历史耗时，"
+                f"其余按描述长度和文件范围估计）")
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+瞬时失败重试 - 按 stderr / 退出码识别可恢复的失败，指数退避后重新执行任务
+
+agent CLI 的非零退出并不都是任务本身的问题：限流、网络中断、服务端 5xx、超时被终止，
+过一会儿重新执行通常就能成功。这些失败不再直接记为任务失败：
+
+- classify：按 stderr（以及 stdout，CLI 的错误提示可能输出在 stdout）匹配 TRANSIENT_PATTERNS，
+  超时（TaskResult.timed_out）和被信号终止的退出码（TRANSIENT_EXIT_CODES）同样视为瞬时失败；
+  其余失败（编译错误、测试失败、验证命令不通过等）为永久失败，不重试
+- 退避：第 n 次重试前等待 min(最大值, 基数 × 2^(n-1)) × [0.5, 1) 的随机比例（抖动，避免同一轮失败的任务同时重试）；
+  等待期间不占用并发槽位（async_engine.run_bounded / DAGScheduler 释放槽位后再排队）
+- 配置：运行级默认值（--retries / --backoff），任务级覆盖（TASK 标记行 retries="N" backoff="30s..10m"）；
+  默认不重试（失败一次即失败）：重新执行会重复任务已产生的副作用，需显式用 --retries N 或 retries="N" 开启
+- 记录：每次重试记入状态文件该任务的 attempts（StateManager.record_attempt），
+  重试耗尽仍失败时才按原有失败流程处理，重试中的任务不会让阶段进入失败路径
+"""
+
+import random
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from adaptive_concurrency import RATE_LIMIT_RE
+
+# 默认重试次数（不含首次执行）：0，重试需显式开启
+DEFAULT_RETRIES = 0
+# 默认退避：基数..最大值
+DEFAULT_BACKOFF = "30s..10m"
+# 单独写基数时，最大值为基数的倍数
+DEFAULT_MAX_FACTOR = 20
+# 退避时长单位
+_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600}
+_DURATION_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([smh]?)\s*$')
+# 瞬时失败特征（按顺序匹配，取第一个）：(原因, 模式)
+TRANSIENT_PATTERNS: List[Tuple[str, 're.Pattern']] = [
+    ("限流", RATE_LIMIT_RE),
+    ("网络", re.compile(
+        r'ECONNRESET|ECONNREFUSED|ETIMEDOUT|EAI_AGAIN|ENETUNREACH|EPIPE|socket hang up|'
+        r'connection (?:reset|refused|aborted|closed|error)|network (?:error|is unreachable)|'
+        r'temporary failure in name resolution|fetch failed|timed? ?out while|read timeout', re.IGNORECASE)),
+    ("服务端错误", re.compile(
+        r'\b(?:status(?: code)?|HTTP(?:/[\d.]+)?|API Error|error)[:= ]+50[0234]\b|internal server error|'
+        r'bad gateway|service unavailable|gateway timeout|\bapi_error\b', re.IGNORECASE)),
+]
+# 识别瞬时失败时检查的 stdout 末尾字符数
+OUTPUT_TAIL = 2000
+# 被信号终止（OOM killer / 外部 kill）的退出码：124 为 timeout(1) 超时
+TRANSIENT_EXIT_CODES = {124, 137, 143, -9, -15}
+
+
+def classify(text: str, exit_code: Optional[int] = None, timed_out: bool = False) -> Optional[str]:
+    """
+    失败是否为瞬时失败
+
+    Args:
+        text: stderr / 错误信息（可拼接 stdout）
+        exit_code: 进程退出码（未知时为 None）
+        timed_out: 是否因超时被终止
+
+    Returns:
+        瞬时失败的原因（限流 / 网络 / 服务端错误 / 超时 / 被终止）；永久失败返回 None
+    """
+    if text:
+        for reason, pattern in TRANSIENT_PATTERNS:
+            if pattern.search(text):
+                return reason
+    if timed_out:
+        return "超时"
+    if exit_code in TRANSIENT_EXIT_CODES:
+        return "被终止"
+    return None
+
+
+def classify_result(result) -> Optional[str]:
+    """
+    classify 的便捷形式：result 为 TaskResult、异常对象或 bool
+
+    Returns:
+        瞬时失败的原因；成功、永久失败或 bool 结果（没有错误信息可判断）返回 None
+    """
+    if isinstance(result, bool) or result is None:
+        return None
+    if isinstance(result, Exception):
+        return classify(str(result))
+    if getattr(result, 'success', False):
+        return None
+    # stdout 只看末尾：agent 的正文可能恰好提到这些词，CLI 的错误提示在最后
+    output = (getattr(result, 'output', None) or "")[-OUTPUT_TAIL:]
+    text = "\n".join(part for part in (getattr(result, 'error_msg', None), output) if part)
+    return classify(text, getattr(result, 'exit_code', None), getattr(result, 'timed_out', False))
+
+
+def parse_duration(text: str) -> float:
+    """
+    解析时长：30 / 30s / 5m / 1.5h
+
+    Raises:
+        ValueError: 格式不合法
+    """
+    match = _DURATION_RE.match(text)
+    if not match:
+        raise ValueError(f"时长格式应为数字加 s/m/h（如 30s、5m），当前: {text}")
+    return float(match.group(1)) * _UNITS[match.group(2)]
+
+
+def parse_backoff(spec: str) -> Tuple[float, float]:
+    """
+    解析退避参数："30s"（最大值为基数的 DEFAULT_MAX_FACTOR 倍）或 "30s..10m"
+
+    Returns:
+        (基数秒数, 最大秒数)
+
+    Raises:
+        ValueError: 格式不合法或最大值小于基数
+    """
+    base_text, sep, max_text = spec.partition('..')
+    base = parse_duration(base_text)
+    max_delay = parse_duration(max_text) if sep else base * DEFAULT_MAX_FACTOR
+    if max_delay < base:
+        raise ValueError(f"退避最大值不能小于基数，当前: {spec}")
+    return base, max_delay
+
+
+def parse_retries(text: str) -> int:
+    """
+    解析重试次数（非负整数）
+
+    Raises:
+        ValueError: 不是非负整数
+    """
+    text = text.strip()
+    if not text.isdigit():
+        raise ValueError(f"重试次数应为非负整数，当前: {text}")
+    return int(text)
+
+
+def format_duration(seconds: float) -> str:
+    """退避时长显示：45s / 2m30s"""
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, rest = divmod(seconds, 60)
+    return f"{minutes}m{rest}s" if rest else f"{minutes}m"
+
+
+class RetryPolicy:
+    """瞬时失败重试策略（运行级默认值 + 任务级覆盖；整个运行共享，线程安全）"""
+
+    def __init__(self, retries: int = DEFAULT_RETRIES, backoff: str = DEFAULT_BACKOFF,
+                 rng: Callable[[], float] = random.random):
+        """
+        Args:
+            retries: 默认重试次数（0 不重试）
+            backoff: 默认退避参数（见 parse_backoff）
+            rng: [0, 1) 随机数（测试注入）
+
+        Raises:
+            ValueError: backoff 格式不合法
+        """
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self._backoffs: Dict[str, Tuple[float, float]] = {backoff: parse_backoff(backoff)}
+        self._rng = rng
+        self._lock = threading.Lock()
+        # 统计
+        self.reasons: Dict[str, int] = {}  # 原因 → 重试次数
+        self.exhausted = 0  # 重试次数用完仍失败的任务数
+
+    def limits(self, task=None) -> Tuple[int, float, float]:
+        """
+        任务的重试次数和退避参数（任务未设置时取运行级默认值）
+
+        Returns:
+            (重试次数, 基数秒数, 最大秒数)
+        """
+        retries = getattr(task, 'retries', None)
+        spec = getattr(task, 'backoff', '') or self.backoff
+        with self._lock:
+            if spec not in self._backoffs:
+                self._backoffs[spec] = parse_backoff(spec)
+            base, max_delay = self._backoffs[spec]
+        return (self.retries if retries is None else retries), base, max_delay
+
+    def delay(self, attempt: int, base: float, max_delay: float) -> float:
+        """第 attempt 次执行失败后、下一次执行前的等待秒数（带抖动）"""
+        ceiling = min(max_delay, base * 2 ** (attempt - 1))
+        return ceiling * (0.5 + 0.5 * self._rng())
+
+    def next_retry(self, attempt: int, result, task=None) -> Optional[Tuple[str, float]]:
+        """
+        第 attempt 次执行（从 1 开始）失败后是否重试
+
+        Args:
+            attempt: 刚结束的是第几次执行
+            result: 执行结果（TaskResult / 异常对象 / bool）
+            task: 任务节点（读取任务级 retries / backoff；None 时用默认值）
+
+        Returns:
+            (原因, 等待秒数)；永久失败或重试次数已用完时返回 None
+        """
+        reason = classify_result(result)
+        if reason is None:
+            return None
+        retries, base, max_delay = self.limits(task)
+        with self._lock:
+            if attempt > retries:
+                if retries:
+                    self.exhausted += 1
+                return None
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        return reason, self.delay(attempt, base, max_delay)
+
+    def describe(self) -> str:
+        """--dry-run 显示的重试策略"""
+        if not self.retries:
+            return "瞬时失败不重试（任务可用 retries=\"N\" 单独开启）"
+        return (f"瞬时失败（限流/网络/服务端错误/超时）最多重试 {self.retries} 次，"
+                f"指数退避 {self.backoff}（任务可用 retries= / backoff= 覆盖）")
+
+    def report(self) -> List[str]:
+        """运行结束时的重试统计（没有重试时为空）"""
+        total = sum(self.reasons.values())
+        if not total:
+            return []
+        reasons = "，".join(f"{reason} {count}" for reason, count in sorted(self.reasons.items(), key=lambda x: -x[1]))
+        line = f"🔁 瞬时失败重试: {total} 次（{reasons}）"
+        if self.exhausted:
+            line += f"，{self.exhausted} 个任务重试用完仍失败"
+        return [line]
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+任务分片 - 大范围任务按目录/文件拆成并行子任务
+
+写法（TASK 标记行参数）：
+- shard="dir"：文件: 展开到仓库文件后，按公共目录下的第一级子目录分组（公共目录下的散落文件合为一组）
+- shard="file"：每个文件一个子任务
+- shard="N"：N 个子任务，按字节数均衡（shard_by="files" 时按文件数）；
+  过大的目录逐级拆开，再按从大到小放入当前最轻的分组
+
+子任务的 文件: 收窄为各自的分组（目录下的文件全在范围内时写作 目录/，否则逐个列出），互不重叠，
+同一阶段内可以并行；分组写入子任务的 prompt（shard_prompt），描述末尾附加分片序号。
+分组保存在 TaskMatrix.shards 中，子任务与矩阵任务一样按需生成。
+展开依赖仓库文件列表（FileIndex），执行计划缓存随文件列表变化失效（shards_signature）；
+仓库中还不存在的路径（任务要新建的文件）无法分组，归入第一个分片。
+"""
+
+import os
+import posixpath
+from typing import Dict, List, Union
+
+from file_index import FileIndex
+
+SHARD_MODES = ('dir', 'file')
+SHARD_BY = ('bytes', 'files')
+# 分片数上限（shard="file" 匹配到大量文件时改用 shard="N"）
+MAX_SHARDS = 256
+# 子任务参数名（TaskNode.params 为 shard=2/5）
+SHARD_PARAM = 'shard'
+# 不在 git 仓库中时的计划标识：文件列表无法标识，含分片的计划不复用缓存
+UNSTABLE_SIGNATURE = '-'
+
+
+def parse_shard(spec: str, by: str, location: str) -> Union[str, int]:
+    """
+    解析 shard="dir|file|N" 和 shard_by="bytes|files"
+
+    Raises:
+        ValueError: 取值不合法（信息带 file:line）
+    """
+    spec = spec.strip()
+    if by not in SHARD_BY:
+        raise ValueError(f"{location}: shard_by 应为 bytes 或 files，当前: {by}")
+    if spec in SHARD_MODES:
+        return spec
+    if spec.isdigit() and int(spec) >= 1:
+        return int(spec)
+    raise ValueError(f"{location}: shard 应为 dir、file 或正整数，当前: {spec}")
+
+
+def plan_shards(index: FileIndex, files: List[str], excludes: List[str], mode: Union[str, int],
+                location: str, by: str = 'bytes') -> List[List[str]]:
+    """
+    把任务的文件范围拆成互不重叠的分组
+
+    Args:
+        index: 仓库文件索引
+        files: 文件: 模式
+        excludes: 排除: 模式
+        mode: 'dir' / 'file' / 分片数
+        location: 任务位置（错误信息用）
+        by: shard=N 时的均衡依据（bytes / files）
+
+    Returns:
+        分组列表（每组为收窄后的 文件: 模式列表，按首个路径排序）
+
+    Raises:
+        ValueError: 文件范围在仓库中没有匹配的文件，或分片数超过 MAX_SHARDS
+    """
+    bits, unresolved = index.task_bits(files, excludes)
+    paths = [index.files[i] for i, bit in enumerate(bin(bits)[:1:-1]) if bit == '1']
+    if not paths:
+        raise ValueError(f"{location}: shard 无法展开，文件范围在仓库中没有匹配的文件: {', '.join(files)}")
+
+    common = posixpath.commonpath([posixpath.dirname(path) for path in paths])
+    units = _children(common, paths)
+    if mode == 'file':
+        groups = [[path] for path in paths]
+    elif mode == 'dir':
+        loose = [path for key in units if not key.endswith('/') for path in units[key]]
+        groups = [units[key] for key in units if key.endswith('/')] + ([loose] if loose else [])
+    else:
+        groups = _balance(index, units, mode, by)
+    if len(groups) > MAX_SHARDS:
+        raise ValueError(f"{location}: shard 展开为 {len(groups)} 个子任务，超过上限 {MAX_SHARDS}，"
+                         f"请改用 shard=\"N\"")
+
+    narrowed = sorted((_narrow(index, sorted(group)) for group in groups), key=lambda group: group[0])
+    if unresolved:
+        narrowed[0] = narrowed[0] + unresolved
+    return narrowed
+
+
+def shards_signature(stages) -> str:
+    """含分片任务时返回仓库文件列表的标识（执行计划缓存据此失效），否则为空"""
+    from dag_parser import task_entries
+    if not any(entry.matrix is not None and entry.matrix.shards
+               for stage in stages for entry in task_entries(stage.tasks)):
+        return ""
+    return FileIndex().signature or UNSTABLE_SIGNATURE
+
+
+def is_shard(task) -> bool:
+    """是否为分片子任务"""
+    return getattr(task, 'params', '').startswith(f"{SHARD_PARAM}=")
+
+
+def shard_prompt(task) -> str:
+    """分片子任务的范围说明（追加到 prompt 末尾）"""
+    lines = [f"## 分片范围（{task.params}）",
+             "本任务已按文件范围拆分为多个并行子任务，本子任务只处理以下文件/目录，范围外的部分由其他子任务负责，不要修改："]
+    lines.extend(f"- {path}" for path in task.files)
+    return '\n'.join(lines)
+
+
+def _children(dir_path: str, paths: List[str]) -> Dict[str, List[str]]:
+    """按 dir_path 下的第一级路径分组：子目录为 '目录/'，文件为文件路径本身（按路径排序）"""
+    groups: Dict[str, List[str]] = {}
+    offset = len(dir_path) + 1 if dir_path else 0
+    for path in paths:
+        head, sep, _ = path[offset:].partition('/')
+        key = path[:offset] + head + ('/' if sep else '')
+        groups.setdefault(key, []).append(path)
+    return dict(sorted(groups.items()))
+
+
+def _balance(index: FileIndex, units: Dict[str, List[str]], count: int, by: str) -> List[List[str]]:
+    """shard=N：超过平均值的目录逐级拆开，再按权重从大到小放入当前最轻的分组"""
+    def weight(paths: List[str]) -> int:
+        if by == 'files':
+            return len(paths)
+        total = 0
+        for path in paths:
+            try:
+                total += max(1, os.path.getsize(os.path.join(index.root, path)))
+            except OSError:
+                total += 1
+        return total
+
+    weights = {key: weight(paths) for key, paths in units.items()}
+    target = sum(weights.values()) / count
+    while True:
+        splittable = [key for key in units if key.endswith('/') and len(units[key]) > 1]
+        if not splittable:
+            break
+        largest = max(splittable, key=lambda key: (weights[key], key))
+        if len(units) >= count and weights[largest] <= target:
+            break
+        for key, paths in _children(largest.rstrip('/'), units.pop(largest)).items():
+            units[key] = paths
+            weights[key] = weight(paths)
+        del weights[largest]
+
+    bins: List[List[str]] = [[] for _ in range(count)]
+    loads = [0] * count
+    for key in sorted(units, key=lambda key: (-weights[key], key)):
+        slot = min(range(count), key=lambda slot: (loads[slot], slot))
+        bins[slot].extend(units[key])
+        loads[slot] += weights[key]
+    return [group for group in bins if group]
+
+
+def _narrow(index: FileIndex, paths: List[str]) -> List[str]:
+    """分组 → 文件: 模式：某目录下的仓库文件全部在组内时合并为 目录/，否则列出文件"""
+    patterns: List[str] = []
+    i = 0
+    while i < len(paths):
+        # 从最上层的目录开始尝试合并（路径已排序，同一目录下的文件连续）
+        parts = paths[i].split('/')
+        for depth in range(1, len(parts)):
+            directory = '/'.join(parts[:depth]) + '/'
+            end = i
+            while end < len(paths) and paths[end].startswith(directory):
+                end += 1
+            if bin(index.pattern_bits(directory)[0]).count('1') == end - i:
+                patterns.append(directory)
+                i = end
+                break
+        else:
+            patterns.append(paths[i])
+            i += 1
+    return patterns
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+任务写集合学习 - 用历史运行中任务实际修改的文件细化冲突检测（--learned-conflicts）
+
+文件: 的 glob 只是预估：任务实际改动的文件往往更少，有时也会超出声明的范围。
+每个 DAG 任务开始时为工作区拍快照（WriteTracker），自动提交时（_auto_commit_if_needed）与快照比较，
+得到任务运行期间内容变化的文件，按任务指纹保存在 .git/batch-write-sets.json；再次运行同一任务（重复执行 DAG 模板）时：
+
+- 冲突检测用学到的写集合（最近 MAX_RUNS 次运行改动文件的并集）代替声明的文件范围，消除误报的冲突
+- 写到声明范围之外的文件在记录时和 --dry-run 时提示
+
+- 指纹：任务描述 + 文件/排除，任一变化即视为新任务，不沿用旧记录；没有记录的任务仍按声明范围检测
+- 并行任务共享工作区：先完成的任务会把其他任务正在写的文件一起暂存提交，暂存区不能代表任务自己的改动。
+  快照比较的是文件内容（blob id），不受其他任务先行提交影响，任务自己的改动不会漏记；
+  同时运行的其他任务在此期间的改动也会计入，只会让写集合偏大（冲突更多）。
+  与其他任务同时运行过的记录无法区分归属，不提示超出声明范围（只在任务独占工作区运行时提示）
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from dataclasses import replace
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Set, Tuple
+
+from dag_parser import TaskNode
+from file_index import _git, pattern_matches
+
+# 历史文件格式版本（结构变化时递增）
+WRITE_SETS_VERSION = 1
+HISTORY_FILE_NAME = 'batch-write-sets.json'
+# 写集合取最近几次运行的并集
+MAX_RUNS = 5
+# 空树（仓库还没有提交时作为快照基准）
+EMPTY_TREE = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+# 每次 git 调用传入的路径数上限（避免命令行过长）
+_PATH_CHUNK = 500
+
+
+def task_fingerprint(task: TaskNode) -> str:
+    """任务指纹：描述 + 文件/排除（与阶段、序号无关，模板重新生成后仍能对上）"""
+    digest = hashlib.sha256()
+    for part in [task.description, *task.files, '\0', *task.excludes]:
+        digest.update(part.encode('utf-8') + b'\0')
+    return digest.hexdigest()[:32]
+
+
+def outside_scope(task: TaskNode, paths: List[str]) -> List[str]:
+    """不在任务声明范围（文件: 减去 排除:）内的文件（未声明 文件: 的任务不受限制）"""
+    if not task.files:
+        return []
+    return [path for path in paths
+            if not any(pattern_matches(pattern, path) for pattern in task.files)
+            or any(pattern_matches(pattern, path) for pattern in task.excludes)]
+
+
+def staged_paths(cwd: str = None) -> Optional[List[str]]:
+    """暂存区中的文件（相对 cwd）；不在 git 仓库中时返回 None"""
+    output = _git(cwd or os.getcwd(), 'diff', '--cached', '--name-only', '--relative', '-z')
+    if output is None:
+        return None
+    return sorted(path for path in output.split('\0') if path)
+
+
+def _chunks(paths: Sequence[str]) -> Iterable[List[str]]:
+    for start in range(0, len(paths), _PATH_CHUNK):
+        yield list(paths[start:start + _PATH_CHUNK])
+
+
+def _worktree_ids(root: str, paths: Iterable[str]) -> Optional[Dict[str, Optional[str]]]:
+    """工作区文件内容的 blob id（相对仓库根目录；不存在或不是文件时为 None）"""
+    ids: Dict[str, Optional[str]] = {}
+    files = []
+    for path in paths:
+        full = os.path.join(root, path)
+        if os.path.islink(full):
+            # 符号链接的 blob 是链接目标文本（与 git 记录的一致）
+            target = os.readlink(full).encode('utf-8')
+            ids[path] = hashlib.sha1(b'blob %d\0' % len(target) + target).hexdigest()
+        elif os.path.isfile(full):
+            files.append(path)
+        else:
+            ids[path] = None
+    for part in _chunks(files):
+        output = _git(root, 'hash-object', '--', *part)
+        if output is None:
+            return None
+        ids.update(zip(part, output.split()))
+    return ids
+
+
+def _tree_ids(root: str, commit: str, paths: Iterable[str]) -> Dict[str, Optional[str]]:
+    """提交中文件的 blob id（相对仓库根目录；不存在时为 None）"""
+    paths = sorted(paths)
+    ids: Dict[str, Optional[str]] = dict.fromkeys(paths)
+    for part in _chunks(paths):
+        output = _git(root, 'ls-tree', '-r', '-z', '--full-tree', commit, '--', *part) or ''
+        for line in output.split('\0'):
+            meta, _, path = line.partition('\t')
+            if path in ids:
+                ids[path] = meta.split(' ')[2]
+    return ids
+
+
+class WorktreeSnapshot:
+    """工作区快照：HEAD + 未提交改动文件的内容（之后与当前工作区比较得到这段时间内容变化的文件）"""
+
+    def __init__(self, cwd: str, root: str, prefix: str, head: str, dirty: Dict[str, Optional[str]],
+                 pathspecs: Sequence[str]):
+        self.cwd = cwd
+        self.root = root
+        self.prefix = prefix  # cwd 相对仓库根目录的前缀（"sub/" 或 ""）
+        self.head = head
+        self.dirty = dirty  # 拍快照时未提交改动的文件 → blob id
+        self.pathspecs = list(pathspecs)
+
+    @classmethod
+    def take(cls, cwd: str = None, pathspecs: Sequence[str] = ()) -> Optional['WorktreeSnapshot']:
+        """
+        为 cwd 下的工作区拍快照
+
+        Args:
+            cwd: 工作目录（默认当前工作目录）
+            pathspecs: 额外的 git 路径规则（排除任务过程产物，如 ':!.task-*'）
+
+        Returns:
+            快照；不在 git 仓库中时返回 None
+        """
+        cwd = os.path.abspath(cwd or os.getcwd())
+        root = _git(cwd, 'rev-parse', '--show-toplevel')
+        prefix = _git(cwd, 'rev-parse', '--show-prefix')
+        if root is None or prefix is None:
+            return None
+        root = root.strip()
+        head = (_git(cwd, 'rev-parse', '-q', '--verify', 'HEAD') or '').strip() or EMPTY_TREE
+        snapshot = cls(cwd, root, prefix.strip(), head, {}, pathspecs)
+        dirty = snapshot._dirty()
+        ids = _worktree_ids(root, dirty) if dirty is not None else None
+        if ids is None:
+            return None
+        snapshot.dirty = ids
+        return snapshot
+
+    def changed(self) -> Optional[List[str]]:
+        """
+        拍快照以来内容变化的文件（相对 cwd；包括已被提交的改动）
+
+        Returns:
+            文件列表；git 命令失败时返回 None
+        """
+        head = (_git(self.cwd, 'rev-parse', '-q', '--verify', 'HEAD') or '').strip() or EMPTY_TREE
+        dirty = self._dirty()
+        committed = _git(self.cwd, 'diff', '--name-only', '-z', '--no-renames', self.head, head, '--', '.',
+                         *self.pathspecs) if head != self.head else ''
+        if dirty is None or committed is None:
+            return None
+        candidates = set(dirty) | set(self.dirty) | {path for path in committed.split('\0') if path}
+        now = _worktree_ids(self.root, candidates)
+        if now is None:
+            return None
+        before = dict(self.dirty)
+        before.update(_tree_ids(self.root, self.head, candidates - set(self.dirty)))
+        return sorted(path[len(self.prefix):] for path in candidates
+                      if now[path] != before.get(path) and path.startswith(self.prefix))
+
+    def _dirty(self) -> Optional[List[str]]:
+        """未提交改动的文件（含未跟踪文件，相对仓库根目录）"""
+        output = _git(self.cwd, 'status', '--porcelain', '-z', '--untracked-files=all', '--no-renames',
+                      '--', '.', *self.pathspecs)
+        if output is None:
+            return None
+        return [entry[3:] for entry in output.split('\0') if len(entry) > 3]
+
+
+class WriteTracker:
+    """
+    任务运行期间的写集合（线程安全）
+
+    任务开始时 start 拍快照，完成时 finish 与快照比较；同时记录任务运行期间是否有其他任务也在运行，
+    有则写集合可能含其他任务的改动（只会偏大），不能据此判断任务是否越界。
+    """
+
+    def __init__(self, cwd: str = None, pathspecs: Sequence[str] = ()):
+        """
+        Args:
+            cwd: 工作目录（默认当前工作目录）
+            pathspecs: 额外的 git 路径规则（排除任务过程产物）
+        """
+        self.cwd = cwd
+        self.pathspecs = list(pathspecs)
+        self._snapshots: Dict[Hashable, Optional[WorktreeSnapshot]] = {}
+        self._shared: Set[Hashable] = set()  # 运行期间与其他任务重叠过的任务
+        self._lock = threading.Lock()
+
+    def start(self, key: Hashable):
+        """任务开始（同一任务重试时保留第一次的快照）"""
+        with self._lock:
+            if key in self._snapshots:
+                return
+        snapshot = WorktreeSnapshot.take(self.cwd, self.pathspecs)
+        with self._lock:
+            if key in self._snapshots:
+                return
+            if self._snapshots:
+                self._shared.update(self._snapshots)
+                self._shared.add(key)
+            self._snapshots[key] = snapshot
+
+    def finish(self, key: Hashable) -> Tuple[Optional[List[str]], bool]:
+        """
+        任务完成：返回运行期间内容变化的文件
+
+        Returns:
+            (文件列表, 是否独占工作区运行)；没有快照（未调用 start 或不在 git 仓库中）时文件列表为 None
+        """
+        with self._lock:
+            if key not in self._snapshots:
+                return None, False
+            snapshot = self._snapshots.pop(key)
+            alone = key not in self._shared
+            self._shared.discard(key)
+        return (snapshot.changed() if snapshot is not None else None), alone
+
+    def peek(self, key: Hashable) -> Tuple[Optional[List[str]], bool]:
+        """任务运行中查询开始以来内容变化的文件（不结束跟踪；返回值同 finish）"""
+        with self._lock:
+            if key not in self._snapshots:
+                return None, False
+            snapshot = self._snapshots[key]
+            alone = key not in self._shared
+        return (snapshot.changed() if snapshot is not None else None), alone
+
+    def discard(self, key: Hashable):
+        """任务结束但不记录（失败，或已由 finish 处理）"""
+        with self._lock:
+            self._snapshots.pop(key, None)
+            self._shared.discard(key)
+
+
+class WriteSetHistory:
+    """任务写集合历史（记录与查询，线程安全）"""
+
+    def __init__(self, path: str = None, root: str = None):
+        """
+        Args:
+            path: 历史文件路径（默认 <git 目录>/batch-write-sets.json；不在 git 仓库中时不记录）
+            root: 文件范围的基准目录（默认当前工作目录）
+        """
+        self.root = os.path.abspath(root or os.getcwd())
+        if path is None:
+            git_dir = _git(self.root, 'rev-parse', '--absolute-git-dir')
+            path = os.path.join(git_dir.strip(), HISTORY_FILE_NAME) if git_dir else ""
+        self.path = path
+        self._entries: Optional[Dict[str, Dict]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def entries(self) -> Dict[str, Dict]:
+        """{指纹: {'description', 'runs': [[path, ...], ...], 'outside': [...]}}（首次访问时加载）"""
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    @property
+    def signature(self) -> str:
+        """历史内容的标识（参与执行计划缓存 key，记录变化后缓存的冲突映射失效）"""
+        data = json.dumps(self.entries, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()[:16]
+
+    def learned(self, task: TaskNode) -> Optional[List[str]]:
+        """学到的写集合（最近几次运行的并集）；没有记录时返回 None"""
+        entry = self.entries.get(task_fingerprint(task))
+        if not entry:
+            return None
+        return sorted({path for run in entry['runs'] for path in run})
+
+    def effective(self, task: TaskNode) -> TaskNode:
+        """冲突检测使用的任务：有记录时文件范围替换为学到的写集合，否则原样返回"""
+        learned = self.learned(task)
+        if learned is None:
+            return task
+        return replace(task, files=learned, excludes=[])
+
+    def record(self, task: TaskNode, paths: List[str]) -> List[str]:
+        """
+        记录任务一次运行实际修改的文件
+
+        Args:
+            task: 任务节点
+            paths: 修改的文件（相对基准目录）
+
+        Returns:
+            超出声明范围的文件
+        """
+        paths = sorted(set(paths))
+        outside = outside_scope(task, paths)
+        if not self.path:
+            return outside
+        with self._lock:
+            entry = self.entries.setdefault(task_fingerprint(task), {'runs': []})
+            entry['description'] = task.description.replace("\n", " ")[:80]
+            entry['runs'] = (entry['runs'] + [paths])[-MAX_RUNS:]
+            entry['outside'] = outside
+            self._save()
+        return outside
+
+    def _load(self) -> Dict[str, Dict]:
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == WRITE_SETS_VERSION and data.get('root') == self.root:
+                return data['tasks']
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️  加载任务写集合历史失败，将重新记录: {e}")
+        return {}
+
+    def _save(self):
+        """原子写入，失败不影响执行"""
+        temp_file = self.path + ".tmp"
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump({'version': WRITE_SETS_VERSION, 'root': self.root, 'tasks': self._entries}, f,
+                          ensure_ascii=False, separators=(',', ':'))
+            shutil.move(temp_file, self.path)
+        except OSError as e:
+            print(f"⚠️  保存任务写集合历史失败: {e}")